@@ -14,3 +14,8 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'contabiliza_backend.settings')
 
 application = get_wsgi_application()
+
+# DANFE resources are loaded once per web process, before the first request
+from invoices.services.danfe_recursos import precarregar_processo  # noqa: E402
+
+precarregar_processo()
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Invoice, InvoiceItem
+from .models import Invoice, InvoiceItem, SefazReceipt, IssuanceJob, IdempotencyRecord, NumberSequence, NumberGap, DFeSyncState, DFePendingDocument, FiscalEvent
 
 
 class InvoiceItemInline(admin.TabularInline):
@@ -50,3 +50,65 @@ class InvoiceItemAdmin(admin.ModelAdmin):
     list_display = ('code', 'description', 'invoice', 'quantity', 'unit_value', 'total_value')
     list_filter = ('item_type', 'created_at')
     search_fields = ('code', 'description', 'invoice__number')
+
+
+@admin.register(SefazReceipt)
+class SefazReceiptAdmin(admin.ModelAdmin):
+    list_display = ('number', 'lot_id', 'state', 'emission_type', 'status', 'attempts', 'next_poll_at', 'last_code')
+    list_filter = ('status', 'state', 'environment')
+    search_fields = ('number', 'lot_id')
+    readonly_fields = ('created_at', 'updated_at')
+
+
+@admin.register(IssuanceJob)
+class IssuanceJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'invoice', 'status', 'stage', 'authorize', 'attempts', 'run_after', 'leased_by')
+    list_filter = ('status', 'stage', 'authorize')
+    search_fields = ('invoice__number', 'invoice__access_key', 'leased_by')
+    readonly_fields = ('created_at', 'updated_at', 'finished_at')
+
+
+@admin.register(IdempotencyRecord)
+class IdempotencyRecordAdmin(admin.ModelAdmin):
+    list_display = ('scope', 'key', 'invoice', 'status', 'response_status', 'expires_at')
+    list_filter = ('scope', 'status')
+    search_fields = ('key', 'invoice__access_key')
+    readonly_fields = ('created_at', 'updated_at')
+
+
+@admin.register(NumberSequence)
+class NumberSequenceAdmin(admin.ModelAdmin):
+    list_display = ('issuer_tax_id', 'model_code', 'series', 'next_number', 'updated_at')
+    list_filter = ('model_code',)
+    search_fields = ('issuer_tax_id',)
+
+
+@admin.register(NumberGap)
+class NumberGapAdmin(admin.ModelAdmin):
+    list_display = ('issuer_tax_id', 'model_code', 'series', 'start_number', 'end_number', 'status', 'protocol')
+    list_filter = ('status', 'model_code')
+    search_fields = ('issuer_tax_id', 'protocol')
+    readonly_fields = ('created_at',)
+
+
+@admin.register(DFeSyncState)
+class DFeSyncStateAdmin(admin.ModelAdmin):
+    list_display = ('tax_id', 'environment', 'state', 'last_nsu', 'max_nsu', 'documents_received', 'next_sync_at', 'last_code')
+    list_filter = ('environment', 'state')
+    search_fields = ('tax_id',)
+    readonly_fields = ('created_at', 'updated_at')
+
+
+@admin.register(DFePendingDocument)
+class DFePendingDocumentAdmin(admin.ModelAdmin):
+    list_display = ('sync_state', 'nsu', 'schema', 'reason', 'attempts', 'updated_at')
+    search_fields = ('sync_state__tax_id', 'reason')
+    readonly_fields = ('created_at', 'updated_at')
+
+
+@admin.register(FiscalEvent)
+class FiscalEventAdmin(admin.ModelAdmin):
+    list_display = ('invoice', 'event_type', 'sequence', 'status', 'lot_id', 'protocol', 'last_code', 'registered_at')
+    list_filter = ('event_type', 'status')
+    search_fields = ('invoice__number', 'invoice__access_key', 'protocol', 'lot_id')
+    readonly_fields = ('created_at', 'updated_at')
@@ -0,0 +1,139 @@
+"""
+Utilitários compartilhados pelos comandos de benchmark de NF-e
+Criam notas sintéticas com o perfil das notas de produtor rural do PR
+"""
+from decimal import Decimal
+from django.utils import timezone
+
+from clients.models import Client
+from invoices.models import Invoice, InvoiceItem
+
+BENCHMARK_SERIES = '999'
+BENCHMARK_FIRST_NUMBER = 900000000
+BENCHMARK_CLIENT_TAX_ID = '00.000.000/0001-91'
+
+
+def get_benchmark_client():
+    """Retorna (ou cria) o cliente usado como destinatário nas notas de benchmark"""
+    client, _ = Client.objects.get_or_create(
+        tax_id=BENCHMARK_CLIENT_TAX_ID,
+        defaults={
+            'person_type': 'PJ',
+            'name': 'COOPERATIVA BENCHMARK',
+            'state_registration': '4010717170',
+            'email': 'benchmark@contabiliza.ia',
+            'phone': '42999999999',
+            'zip_code': '85031-350',
+            'street': 'Rodovia BR-277',
+            'number': '01',
+            'neighborhood': 'Entre Rios',
+            'city': 'Guarapuava',
+            'state': 'PR',
+        }
+    )
+    return client
+
+
+def build_item(invoice, index):
+    """Monta (sem salvar) um item de grão com valores determinísticos"""
+    quantity = Decimal('1000.0000') + index
+    unit_value = Decimal('2.26')
+    return InvoiceItem(
+        invoice=invoice,
+        item_type='product',
+        code=f'0115.{index:04d}.00',
+        description=f'SOJA EM GRAO LOTE {index}',
+        ncm='12019000',
+        cfop='5101',
+        unit='kg',
+        quantity=quantity,
+        unit_value=unit_value,
+        total_value=quantity * unit_value,
+        icms_origin='0',
+        icms_cst='90',
+        pis_cst='08',
+        cofins_cst='08',
+    )
+
+
+def create_benchmark_invoice(client, sequence, items=1):
+    """Cria uma nota de benchmark com `items` itens (via bulk_create)"""
+    invoice = Invoice.objects.create(
+        number=str(BENCHMARK_FIRST_NUMBER + sequence),
+        series=BENCHMARK_SERIES,
+        operation_nature='venda_soja',
+        cfop='5101',
+        issuer_name='PRODUTOR RURAL BENCHMARK',
+        issuer_tax_id='532.134.679-87',
+        issuer_state_registration='9534062092',
+        issuer_address='Lagoa Seca',
+        issuer_number='S/N',
+        issuer_district='Lagoa Seca',
+        issuer_city='Candoi',
+        issuer_city_code='4104428',
+        issuer_state='PR',
+        issuer_zip_code='85140-000',
+        client=client,
+        receiver_name=client.name,
+        receiver_tax_id=client.tax_id,
+        receiver_city_code='4109401',
+        issue_date=timezone.now(),
+        total_value=Decimal('0'),
+        freight_mode='1',
+        payment_method='99',
+        payment_description='Nota de Produtor',
+        receiver_ie_indicator='1',
+    )
+
+    rows = [build_item(invoice, index) for index in range(1, items + 1)]
+    InvoiceItem.objects.bulk_create(rows, batch_size=500)
+
+    total = sum((row.total_value for row in rows), Decimal('0'))
+    Invoice.objects.filter(pk=invoice.pk).update(total_products=total, total_value=total)
+    invoice.total_products = total
+    invoice.total_value = total
+    return invoice
+
+
+def delete_benchmark_invoices():
+    """Remove as notas de benchmark e seus arquivos gerados"""
+    removed = 0
+    for invoice in Invoice.objects.filter(
+        series=BENCHMARK_SERIES, client__tax_id=BENCHMARK_CLIENT_TAX_ID
+    ).iterator():
+        for field in (invoice.xml_file, invoice.pdf_file):
+            if field and field.name:
+                field.delete(save=False)
+        invoice.delete()
+        removed += 1
+    return removed
+
+
+def create_self_signed_pfx(path, password, common_name='PRODUTOR RURAL BENCHMARK:53213467987'):
+    """Grava um PFX autoassinado (RSA 2048, validade de 1 dia) para testes de assinatura"""
+    from datetime import timedelta
+    from cryptography import x509
+    from cryptography.x509.oid import NameOID
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.asymmetric import rsa
+    from cryptography.hazmat.primitives.serialization import BestAvailableEncryption, pkcs12
+
+    key = rsa.generate_private_key(public_exponent=65537, key_size=2048)
+    name = x509.Name([x509.NameAttribute(NameOID.COMMON_NAME, common_name)])
+    now = timezone.now()
+    certificate = (
+        x509.CertificateBuilder()
+        .subject_name(name)
+        .issuer_name(name)
+        .public_key(key.public_key())
+        .serial_number(x509.random_serial_number())
+        .not_valid_before(now - timedelta(minutes=5))
+        .not_valid_after(now + timedelta(days=1))
+        .sign(key, hashes.SHA256())
+    )
+    pfx = pkcs12.serialize_key_and_certificates(
+        b'benchmark', key, certificate, None, BestAvailableEncryption(password.encode('utf-8'))
+    )
+    with open(path, 'wb') as output:
+        output.write(pfx)
+    return path
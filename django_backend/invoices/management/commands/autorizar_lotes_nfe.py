@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+from invoices.models import Invoice
+from invoices.services.sefaz_lote import autorizar_pendentes, MAX_NOTAS_LOTE
+
+
+class Command(BaseCommand):
+    help = 'Send pending NF-e to SEFAZ in enviNFe lots (up to 50 notes per issuer/UF per call)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lot-size', type=int, default=None, help=f'Notes per lot (max {MAX_NOTAS_LOTE})')
+        parser.add_argument('--limit', type=int, default=None, help='Maximum number of notes sent in this run')
+
+    def handle(self, *args, **options):
+        queryset = Invoice.objects.filter(status='pending').exclude(xml_file='').exclude(xml_file__isnull=True)
+        if options['limit']:
+            queryset = Invoice.objects.filter(pk__in=list(queryset.order_by('pk').values_list('pk', flat=True)[:options['limit']]))
+
+        res = autorizar_pendentes(queryset, options['lot_size'])
+
+        for resultado in res['resultados']:
+            if resultado['status'] != 'authorized':
+                self.stdout.write(self.style.WARNING(
+                    f'#{resultado["invoice_id"]} {resultado["status"]}: {resultado["codigo"]} - {resultado["mensagem"]}'
+                ))
+        self.stdout.write(self.style.SUCCESS(
+            f'{res["notas"]} note(s) in {res["lotes"]} lot(s): {res["autorizadas"]} authorized, '
+            f'{res["denegadas"]} denied, {res["pendentes"]} still pending ({res["tempo_total"]:.2f}s)'
+        ))
+        if res['contingencia']:
+            self.stdout.write(self.style.WARNING(
+                f'{res["contingencia"]} note(s) re-issued in contingency and sent to the SVC authorizer'
+            ))
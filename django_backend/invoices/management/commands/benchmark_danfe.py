@@ -0,0 +1,119 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test.utils import override_settings
+from invoices.services import danfe_backends
+from ._benchmark_utils import get_benchmark_client, create_benchmark_invoice
+from contextlib import redirect_stdout
+from pathlib import Path
+import statistics
+import tempfile
+import tracemalloc
+import shutil
+import json
+import time
+import io
+
+BASELINE_FILE = Path(__file__).resolve().parent.parent.parent / 'benchmarks' / 'danfe_baseline.json'
+
+# CSC de homologação para o QR Code da NFC-e quando o settings não define um
+BENCHMARK_CSC = {'NFE_NFCE_CSC': '0123456789ABCDEF0123456789ABCDEF', 'NFE_NFCE_CSC_ID': '1'}
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Render a fixed invoice corpus through every DANFE backend and record time, peak memory and PDF size'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, nargs='+', default=[1, 10, 100, 1000],
+                            help='Item counts of the corpus invoices')
+        parser.add_argument('--iterations', type=int, default=5, help='Timed renders per backend and invoice')
+        parser.add_argument('--backends', nargs='+', help='Backends to run (default: every registered backend)')
+        parser.add_argument('--save-baseline', action='store_true', help=f'Write results to {BASELINE_FILE.name}')
+
+    def _render(self, backend, invoice):
+        # Os geradores imprimem progresso; fica fora da saída do comando
+        with redirect_stdout(io.StringIO()):
+            return danfe_backends.renderizar(invoice, backend=backend)
+
+    def _measure(self, backend, invoice, iterations):
+        size = len(self._render(backend, invoice))  # warm-up (imports, shared resources)
+
+        times = []
+        for _ in range(iterations):
+            inicio = time.perf_counter()
+            self._render(backend, invoice)
+            times.append((time.perf_counter() - inicio) * 1000)
+
+        tracemalloc.start()
+        self._render(backend, invoice)
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+        return {'ms': round(statistics.median(times), 2), 'pico_kb': round(peak / 1024), 'bytes': size}
+
+    def handle(self, *args, **options):
+        backends = options['backends'] or list(danfe_backends.get_backends())
+        iterations = options['iterations']
+        media_root = tempfile.mkdtemp()
+        results = {}
+        csc = {} if getattr(settings, 'NFE_NFCE_CSC', None) else BENCHMARK_CSC
+
+        try:
+            # Synthetic data lives only inside a transaction that is rolled back
+            with override_settings(MEDIA_ROOT=media_root, **csc), transaction.atomic():
+                client = get_benchmark_client()
+                corpus = {
+                    items: create_benchmark_invoice(client, sequence, items)
+                    for sequence, items in enumerate(options['items'], start=1)
+                }
+                for backend in backends:
+                    try:
+                        danfe_backends.carregar(backend)
+                    except ImportError as e:
+                        results[backend] = {'erro': f'not installed: {e}'}
+                        continue
+
+                    results[backend] = {}
+                    for items, invoice in corpus.items():
+                        try:
+                            results[backend][str(items)] = self._measure(backend, invoice, iterations)
+                        except Exception as e:
+                            results[backend][str(items)] = {'erro': str(e)}
+                raise _Rollback
+        except _Rollback:
+            pass
+        finally:
+            shutil.rmtree(media_root, ignore_errors=True)
+
+        baseline = {}
+        if BASELINE_FILE.exists():
+            baseline = json.loads(BASELINE_FILE.read_text()).get('resultados', {})
+
+        self.stdout.write(f'{"backend":<14} {"items":>6} {"ms":>10} {"peak":>10} {"bytes":>10} {"baseline ms":>12}')
+        for backend, by_items in results.items():
+            if 'erro' in by_items:
+                self.stdout.write(self.style.WARNING(f'{backend:<14} skipped ({by_items["erro"]})'))
+                continue
+            for items, result in by_items.items():
+                if 'erro' in result:
+                    self.stdout.write(self.style.ERROR(f'{backend:<14} {items:>6} failed: {result["erro"]}'))
+                    continue
+                line = f'{backend:<14} {items:>6} {result["ms"]:>10.2f} {result["pico_kb"]:>8}KB {result["bytes"]:>10}'
+                anterior = baseline.get(backend, {}).get(items, {})
+                if anterior.get('ms'):
+                    line += f' {anterior["ms"]:>12.2f}   speedup {anterior["ms"] / result["ms"]:.2f}x'
+                self.stdout.write(line)
+
+        if options['save_baseline']:
+            BASELINE_FILE.parent.mkdir(parents=True, exist_ok=True)
+            BASELINE_FILE.write_text(json.dumps({
+                'items': options['items'],
+                'iterations': iterations,
+                'backend_por_layout': danfe_backends.get_backend_por_layout(),
+                'resultados': results,
+            }, indent=2, ensure_ascii=False) + '\n')
+            self.stdout.write(self.style.SUCCESS(f'Baseline saved to {BASELINE_FILE}'))
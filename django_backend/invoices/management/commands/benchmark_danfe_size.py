@@ -0,0 +1,111 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test.utils import override_settings
+from invoices.services import danfe_backends, saida_pdf
+from ._benchmark_utils import get_benchmark_client, create_benchmark_invoice
+from .benchmark_danfe import BENCHMARK_CSC
+from contextlib import redirect_stdout
+import tempfile
+import shutil
+import time
+import io
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Render a sample of invoices and report average DANFE bytes per note before and after the PDF output stage'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--invoices', type=int, default=1000, help='Invoices in the sample')
+        parser.add_argument('--items', type=int, nargs='+', default=[1, 2, 5, 10, 30],
+                            help='Item counts, assigned to the sample invoices in rotation')
+        parser.add_argument('--backends', nargs='+',
+                            help='Backends to run (default: the backends configured for the layouts)')
+        parser.add_argument('--pdfa', action='store_true', help='Also measure the PDF/A-2b archive mode')
+
+    def _generate(self, backend, invoice):
+        # Saída bruta do gerador, sem o estágio de saída do renderizar()
+        with redirect_stdout(io.StringIO()):
+            return bytes(danfe_backends.carregar(backend)(invoice).generate())
+
+    def _sample(self, backend, invoices, pdfa):
+        totals = {'original': 0, 'compacto': 0, 'pdfa': 0, 'ms': 0.0, 'ms_pdfa': 0.0}
+        erro_pdfa = None
+        for invoice in invoices:
+            pdf = self._generate(backend, invoice)
+            totals['original'] += len(pdf)
+
+            inicio = time.perf_counter()
+            totals['compacto'] += len(saida_pdf.otimizar(pdf))
+            totals['ms'] += (time.perf_counter() - inicio) * 1000
+
+            if pdfa and not erro_pdfa:
+                inicio = time.perf_counter()
+                try:
+                    totals['pdfa'] += len(saida_pdf.otimizar(pdf, arquivo=True))
+                except ValueError as e:
+                    erro_pdfa = str(e)
+                totals['ms_pdfa'] += (time.perf_counter() - inicio) * 1000
+        result = {key: value / len(invoices) for key, value in totals.items()}
+        if erro_pdfa:
+            result['erro_pdfa'] = erro_pdfa
+        return result
+
+    def handle(self, *args, **options):
+        backends = options['backends'] or sorted(set(danfe_backends.get_backend_por_layout().values()))
+        item_counts = options['items']
+        media_root = tempfile.mkdtemp()
+        results = {}
+        csc = {} if getattr(settings, 'NFE_NFCE_CSC', None) else BENCHMARK_CSC
+
+        try:
+            # Synthetic data lives only inside a transaction that is rolled back
+            with override_settings(MEDIA_ROOT=media_root, **csc), transaction.atomic():
+                client = get_benchmark_client()
+                invoices = [
+                    create_benchmark_invoice(client, sequence, item_counts[sequence % len(item_counts)])
+                    for sequence in range(1, options['invoices'] + 1)
+                ]
+                for backend in backends:
+                    try:
+                        danfe_backends.carregar(backend)
+                        results[backend] = self._sample(backend, invoices, options['pdfa'])
+                    except ImportError as e:
+                        results[backend] = {'erro': f'not installed: {e}'}
+                    except Exception as e:
+                        results[backend] = {'erro': str(e)}
+                raise _Rollback
+        except _Rollback:
+            pass
+        finally:
+            shutil.rmtree(media_root, ignore_errors=True)
+
+        self.stdout.write(f'{options["invoices"]} invoices, items {item_counts}; average bytes per note')
+        header = f'{"backend":<14} {"original":>10} {"compact":>10} {"reduction":>10} {"stage ms":>10}'
+        if options['pdfa']:
+            header += f' {"pdf/a":>10} {"pdf/a ms":>10}'
+        self.stdout.write(header)
+
+        overall = {'original': 0, 'compacto': 0}
+        for backend, result in results.items():
+            if 'erro' in result:
+                self.stdout.write(self.style.WARNING(f'{backend:<14} skipped ({result["erro"]})'))
+                continue
+            overall['original'] += result['original']
+            overall['compacto'] += result['compacto']
+            reduction = 100 * (1 - result['compacto'] / result['original'])
+            line = (f'{backend:<14} {result["original"]:>10.0f} {result["compacto"]:>10.0f} '
+                    f'{reduction:>9.1f}% {result["ms"]:>10.2f}')
+            if options['pdfa'] and 'erro_pdfa' not in result:
+                line += f' {result["pdfa"]:>10.0f} {result["ms_pdfa"]:>10.2f}'
+            self.stdout.write(line)
+            if 'erro_pdfa' in result:
+                self.stdout.write(self.style.WARNING(f'{"":<14} pdf/a skipped ({result["erro_pdfa"]})'))
+
+        if overall['original']:
+            reduction = 100 * (1 - overall['compacto'] / overall['original'])
+            self.stdout.write(self.style.SUCCESS(f'Average reduction across backends: {reduction:.1f}%'))
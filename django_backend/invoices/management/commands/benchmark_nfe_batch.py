@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand
+from invoices.services.batch_issuance import emitir_lote
+from ._benchmark_utils import get_benchmark_client, create_benchmark_invoice, delete_benchmark_invoices
+
+
+class Command(BaseCommand):
+    help = 'Benchmark batch NF-e issuance (XML + validation + DANFE + backup) with different worker counts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--invoices', type=int, default=40, help='Synthetic invoices issued per run')
+        parser.add_argument('--items', type=int, default=1, help='Items per synthetic invoice')
+        parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 8], help='Worker counts to compare')
+        parser.add_argument('--keep', action='store_true', help='Keep the synthetic invoices and files after the run')
+
+    def handle(self, *args, **options):
+        total = options['invoices']
+        client = get_benchmark_client()
+        delete_benchmark_invoices()
+
+        self.stdout.write(self.style.WARNING(f'Issuing {total} invoices x {options["items"]} item(s) per run...'))
+        rows = []
+        sequence = 0
+        try:
+            for workers in options['workers']:
+                ids = []
+                for _ in range(total):
+                    sequence += 1
+                    ids.append(create_benchmark_invoice(client, sequence, options['items']).pk)
+
+                res = emitir_lote(ids, workers=workers)
+                rows.append((workers, res))
+                self.stdout.write(
+                    f'requested={workers:<3} used={res["workers"]:<3} ok={res["sucesso"]:<5} '
+                    f'fail={res["falhas"]:<4} time={res["tempo_total"]:>8.2f}s '
+                    f'rate={res["notas_por_segundo"]:>8.2f} NF-e/s'
+                )
+        finally:
+            if not options['keep']:
+                delete_benchmark_invoices()
+                client.delete()
+
+        if rows:
+            base = rows[0][1]['notas_por_segundo'] or 0
+            for workers, res in rows[1:]:
+                if base:
+                    self.stdout.write(f'speedup {workers} vs {rows[0][0]} worker(s): {res["notas_por_segundo"] / base:.2f}x')
+        self.stdout.write(self.style.SUCCESS('Done.'))
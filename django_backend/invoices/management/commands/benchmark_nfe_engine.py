@@ -0,0 +1,71 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test.utils import override_settings
+from invoices.services.xml_generator import NFeGenerator
+from invoices.services.nfe_xml_generator import NFeXMLGenerator
+from ._benchmark_utils import get_benchmark_client, create_benchmark_invoice
+from pathlib import Path
+import tempfile
+import shutil
+import json
+import time
+
+BASELINE_FILE = Path(__file__).resolve().parent.parent.parent / 'benchmarks' / 'nfe_xml_baseline.json'
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Measure NF-e XML throughput of both view entry points against the checked-in baseline'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, default=50, help='Items in the benchmark invoice')
+        parser.add_argument('--iterations', type=int, default=200, help='Notes generated per entry point')
+        parser.add_argument('--save-baseline', action='store_true', help=f'Write results to {BASELINE_FILE.name}')
+
+    def _rate(self, func, iterations):
+        func()  # warm-up (caches, imports)
+        inicio = time.perf_counter()
+        for _ in range(iterations):
+            func()
+        return iterations / (time.perf_counter() - inicio)
+
+    def handle(self, *args, **options):
+        items, iterations = options['items'], options['iterations']
+        media_root = tempfile.mkdtemp()
+        results = {}
+
+        try:
+            with override_settings(MEDIA_ROOT=media_root), transaction.atomic():
+                invoice = create_benchmark_invoice(get_benchmark_client(), 1, items)
+                NFeGenerator(invoice).generate_xml()  # access key persisted once, as in production
+
+                results['generate_xml'] = self._rate(lambda: NFeGenerator(invoice).generate_xml(), iterations)
+                results['generate_nfe_complete'] = self._rate(lambda: NFeXMLGenerator(invoice).generate(), iterations)
+                raise _Rollback
+        except _Rollback:
+            pass
+        finally:
+            shutil.rmtree(media_root, ignore_errors=True)
+
+        baseline = {}
+        if BASELINE_FILE.exists():
+            baseline = json.loads(BASELINE_FILE.read_text()).get('notas_por_segundo', {})
+
+        self.stdout.write(f'{items} items, {iterations} notes per entry point')
+        for name, rate in results.items():
+            line = f'{name:<24} {rate:>9.1f} NF-e/s'
+            if baseline.get(name):
+                line += f'   baseline {baseline[name]:>9.1f}   speedup {rate / baseline[name]:.2f}x'
+            self.stdout.write(line)
+
+        if options['save_baseline']:
+            BASELINE_FILE.parent.mkdir(parents=True, exist_ok=True)
+            BASELINE_FILE.write_text(json.dumps({
+                'items': items,
+                'iterations': iterations,
+                'notas_por_segundo': {name: round(rate, 1) for name, rate in results.items()},
+            }, indent=2) + '\n')
+            self.stdout.write(self.style.SUCCESS(f'Baseline saved to {BASELINE_FILE}'))
@@ -0,0 +1,62 @@
+from django.core.management.base import BaseCommand
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.test.utils import override_settings
+from invoices.models import Invoice
+from invoices.services.nfe_xml_generator import NFeXMLGenerator
+from invoices.services.sefaz_lote import autorizar_pendentes
+from invoices.services.sefaz_mock import SefazMockServer
+from ._benchmark_utils import get_benchmark_client, create_benchmark_invoice
+import tempfile
+import shutil
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Compare SEFAZ round-trips and time for one-note calls vs enviNFe lots against the local SOAP mock'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--invoices', type=int, default=200, help='Pending notes sent per run')
+        parser.add_argument('--lot-sizes', type=int, nargs='+', default=[1, 50], help='Notes per lot to compare')
+
+    def handle(self, *args, **options):
+        media_root = tempfile.mkdtemp()
+        try:
+            with override_settings(MEDIA_ROOT=media_root), SefazMockServer() as sefaz, \
+                    override_settings(NFE_SEFAZ_WEBSERVICES=sefaz.webservices(), NFE_LOTE_INTERVALO_CONSULTA=0), \
+                    transaction.atomic():
+                client = get_benchmark_client()
+                ids = []
+                for sequence in range(1, options['invoices'] + 1):
+                    invoice = create_benchmark_invoice(client, sequence)
+                    generator = NFeXMLGenerator(invoice)
+                    xml = generator.generate()
+                    invoice.access_key = generator.chave_acesso
+                    invoice.status = 'pending'
+                    invoice.xml_file.save(f'{invoice.access_key}-nfe.xml', ContentFile(xml.encode('utf-8')))
+                    ids.append(invoice.pk)
+
+                base = None
+                for lot_size in options['lot_sizes']:
+                    Invoice.objects.filter(pk__in=ids).update(status='pending', protocol=None)
+                    sefaz.requisicoes.clear()
+
+                    res = autorizar_pendentes(Invoice.objects.filter(pk__in=ids), lot_size)
+                    calls = sum(sefaz.requisicoes.values())
+                    base = base or (calls, res['tempo_total'])
+                    self.stdout.write(
+                        f'lot={lot_size:<3} lots={res["lotes"]:<5} calls={calls:<5} '
+                        f'calls/note={calls / res["notas"]:.3f} authorized={res["autorizadas"]:<5} '
+                        f'time={res["tempo_total"]:.2f}s   {base[0] / calls:.1f}x fewer calls, '
+                        f'{base[1] / res["tempo_total"]:.1f}x faster'
+                    )
+                raise _Rollback
+        except _Rollback:
+            pass
+        finally:
+            shutil.rmtree(media_root, ignore_errors=True)
+
+        self.stdout.write(self.style.SUCCESS('Done.'))
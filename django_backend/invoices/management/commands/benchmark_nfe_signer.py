@@ -0,0 +1,60 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from invoices.services.nfe_xml_generator import NFeXMLGenerator
+from invoices.services import nfe_signer
+from ._benchmark_utils import get_benchmark_client, create_benchmark_invoice, create_self_signed_pfx
+import tempfile
+import time
+import os
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Measure XMLDSig signing throughput (signatures per second) with different worker counts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--notes', type=int, default=500, help='XML documents signed per run')
+        parser.add_argument('--items', type=int, default=10, help='Items per synthetic invoice')
+        parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4], help='Worker counts to compare')
+        parser.add_argument('--pfx', help='A1 certificate to use (default: a self-signed one is generated)')
+        parser.add_argument('--password', default='benchmark', help='Password of the --pfx file')
+
+    def handle(self, *args, **options):
+        # One real XML, signed N times: the cost being measured is C14N + RSA only
+        try:
+            with transaction.atomic():
+                invoice = create_benchmark_invoice(get_benchmark_client(), 1, options['items'])
+                xml = NFeXMLGenerator(invoice).generate()
+                raise _Rollback
+        except _Rollback:
+            pass
+
+        workdir = tempfile.mkdtemp()
+        pfx = options['pfx'] or create_self_signed_pfx(os.path.join(workdir, 'benchmark.pfx'), options['password'])
+
+        try:
+            inicio = time.perf_counter()
+            nfe_signer.carregar_certificado(pfx, options['password'])
+            self.stdout.write(f'PFX load+decrypt: {(time.perf_counter() - inicio) * 1000:.1f} ms (once per process)')
+
+            xmls = [xml] * options['notes']
+            self.stdout.write(f'{options["notes"]} notes x {options["items"]} item(s), {len(xml)} bytes each')
+            base = None
+            for workers in options['workers']:
+                inicio = time.perf_counter()
+                assinados = nfe_signer.assinar_lote(xmls, workers=workers, caminho=pfx, senha=options['password'])
+                rate = len(assinados) / (time.perf_counter() - inicio)
+                base = base or rate
+
+                if not nfe_signer.verificar_assinatura(assinados[-1])['valida']:
+                    self.stdout.write(self.style.ERROR(f'Invalid signature produced with {workers} worker(s)'))
+                self.stdout.write(f'workers={workers:<3} rate={rate:>9.1f} signatures/s   speedup {rate / base:.2f}x')
+        finally:
+            if not options['pfx']:
+                os.remove(pfx)
+            os.rmdir(workdir)
+
+        self.stdout.write(self.style.SUCCESS('Done.'))
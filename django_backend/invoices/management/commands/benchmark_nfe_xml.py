@@ -0,0 +1,63 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from invoices.services.nfe_xml_generator import NFeXMLGenerator
+from ._benchmark_utils import get_benchmark_client, create_benchmark_invoice
+import tempfile
+import tracemalloc
+import time
+
+
+class _Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Compare peak memory and time of the in-memory and streaming NF-e XML writers'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--items', type=int, nargs='+', default=[100, 1000, 5000, 20000],
+                            help='Item counts to benchmark')
+
+    def _measure(self, func):
+        tracemalloc.start()
+        inicio = time.perf_counter()
+        size = func()
+        elapsed = time.perf_counter() - inicio
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        return size, elapsed, peak
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'{"items":>8} {"bytes":>12} {"memory peak":>12} {"memory s":>8} {"stream peak":>12} {"stream s":>8}')
+
+        # Synthetic data lives only inside a transaction that is rolled back
+        try:
+            with transaction.atomic():
+                client = get_benchmark_client()
+                for sequence, items in enumerate(options['items'], start=1):
+                    invoice = create_benchmark_invoice(client, sequence, items)
+                    generator = NFeXMLGenerator(invoice)
+
+                    def tree():
+                        return len(generator.generate().encode('utf-8'))
+
+                    def stream():
+                        with tempfile.TemporaryFile() as output:
+                            generator.generate_to_file(output)
+                            return output.tell()
+
+                    tree_size, tree_time, tree_peak = self._measure(tree)
+                    stream_size, stream_time, stream_peak = self._measure(stream)
+
+                    if tree_size != stream_size:
+                        self.stdout.write(self.style.ERROR(f'Size mismatch for {items} items: {tree_size} != {stream_size}'))
+
+                    self.stdout.write(
+                        f'{items:>8} {stream_size:>12} {tree_peak / 1024:>10.0f}KB {tree_time:>8.2f} '
+                        f'{stream_peak / 1024:>10.0f}KB {stream_time:>8.2f}'
+                    )
+                raise _Rollback
+        except _Rollback:
+            pass
+
+        self.stdout.write(self.style.SUCCESS('Done.'))
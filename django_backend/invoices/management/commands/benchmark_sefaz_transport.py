@@ -0,0 +1,63 @@
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+from invoices.services import nfe_signer
+from invoices.services.sefaz_integration import SefazIntegration
+from invoices.services.sefaz_mock import SefazMockServer
+from invoices.services.sefaz_async import executar, fechar_conexoes
+from ._benchmark_utils import create_self_signed_pfx
+import tempfile
+import asyncio
+import shutil
+import time
+import os
+
+
+class Command(BaseCommand):
+    help = 'Measure SEFAZ call latency over mutual TLS with and without pooled keep-alive connections (local mock)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--calls', type=int, default=200, help='Status calls per mode')
+        parser.add_argument('--concurrency', type=int, default=4, help='Simultaneous calls per endpoint')
+
+    def _rodar(self, calls, concurrency):
+        async def lote():
+            sefaz = SefazIntegration(uf='PR')
+            for _ in range(calls // concurrency):
+                await asyncio.gather(*(sefaz.aconsultar_status_servico() for _ in range(concurrency)))
+
+        inicio = time.perf_counter()
+        executar(lote())
+        return (time.perf_counter() - inicio) / calls * 1000
+
+    def handle(self, *args, **options):
+        workdir = tempfile.mkdtemp()
+        try:
+            cliente = create_self_signed_pfx(os.path.join(workdir, 'cliente.pfx'), 'benchmark')
+            servidor = create_self_signed_pfx(os.path.join(workdir, 'servidor.pfx'), 'benchmark', 'SEFAZ MOCK')
+            servidor_a1 = nfe_signer.carregar_certificado(servidor, 'benchmark')
+            cliente_a1 = nfe_signer.carregar_certificado(cliente, 'benchmark')
+
+            with SefazMockServer(tls=servidor_a1, ca_clientes=cliente_a1) as sefaz:
+                base = dict(
+                    NFE_SEFAZ_WEBSERVICES=sefaz.webservices(), NFE_SEFAZ_CA_BUNDLE=False,
+                    NFE_CERTIFICADO_PATH=cliente, NFE_CERTIFICADO_SENHA='benchmark',
+                    NFE_SEFAZ_MAX_CONEXOES=options['concurrency'],
+                )
+                resultados = {}
+                for modo, keepalive in (('new connection per call', 0), ('pooled keep-alive', 30)):
+                    fechar_conexoes()
+                    conexoes = sefaz.conexoes
+                    with override_settings(NFE_SEFAZ_KEEPALIVE=keepalive, **base):
+                        resultados[modo] = self._rodar(options['calls'], options['concurrency'])
+                    self.stdout.write(
+                        f'{modo:<24} {resultados[modo]:>8.2f} ms/call   TLS handshakes={sefaz.conexoes - conexoes}'
+                    )
+                fechar_conexoes()
+
+            antes, depois = resultados.values()
+            self.stdout.write(f'latency reduction: {antes / depois:.1f}x')
+        finally:
+            nfe_signer.limpar_cache()
+            shutil.rmtree(workdir, ignore_errors=True)
+
+        self.stdout.write(self.style.SUCCESS('Done.'))
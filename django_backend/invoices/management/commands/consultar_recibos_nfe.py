@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand
+from invoices.services.sefaz_recibos import consultar_recibos, executar_agendador
+
+
+class Command(BaseCommand):
+    help = 'Poll SEFAZ receipts of asynchronous NF-e lots (exponential backoff) and apply the returned protocols'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Poll the receipts that are due and exit')
+        parser.add_argument('--limit', type=int, default=None, help='Maximum receipts polled per round')
+        parser.add_argument('--idle', type=float, default=None, help='Maximum sleep between rounds in seconds')
+
+    def handle(self, *args, **options):
+        if not options['once']:
+            self.stdout.write('Receipt scheduler running (Ctrl+C to stop)')
+            try:
+                executar_agendador(options['idle'], limite=options['limit'])
+            except KeyboardInterrupt:
+                pass
+            return
+
+        res = consultar_recibos(limite=options['limit'])
+        self.stdout.write(self.style.SUCCESS(
+            f'{res["consultados"]} receipt(s) polled: {res["processados"]} processed, {res["aguardando"]} waiting, '
+            f'{res["expirados"]} expired, {res["erros"]} error(s); '
+            f'{res["autorizadas"]} NF-e authorized, {res["denegadas"]} denied'
+        ))
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand, CommandError
+from clients.models import Client
+from invoices.services.importacao_nfe import importar_nfes
+import time
+
+
+class Command(BaseCommand):
+    help = 'Import received supplier NF-e XMLs (nfeProc) from directories, ZIP files or XML files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='+', help='Directories (recursive), .zip or .xml files')
+        parser.add_argument('--client-id', type=int, default=None,
+                            help='Client that receives every invoice (default: matched by receiver CPF/CNPJ)')
+        parser.add_argument('--batch-size', type=int, default=None, help='Invoices per bulk insert')
+
+    def handle(self, *args, **options):
+        cliente = None
+        if options['client_id']:
+            cliente = Client.objects.filter(pk=options['client_id']).first()
+            if cliente is None:
+                raise CommandError(f'Client {options["client_id"]} not found')
+
+        inicio = time.perf_counter()
+        res = importar_nfes(options['paths'], cliente=cliente, tamanho_lote=options['batch_size'])
+        elapsed = time.perf_counter() - inicio
+
+        for erro in res['detalhes_erros']:
+            self.stdout.write(self.style.ERROR(f'{erro["arquivo"]}: {erro["erro"]}'))
+        rate = res['arquivos'] / elapsed * 60 if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f'{res["arquivos"]} file(s) read in {elapsed:.2f}s ({rate:.0f}/min): {res["importadas"]} imported '
+            f'({res["itens"]} items), {res["duplicadas"]} duplicate(s), {res["sem_cliente"]} without client, '
+            f'{res["erros"]} error(s)'
+        ))
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from invoices.services.danfe_recursos import precarregar_processo
+from invoices.services.fila_emissao import executar_worker, identificador_worker
+
+
+class Command(BaseCommand):
+    help = 'Run an NF-e issuance worker: lease queued jobs and run their pipeline stages (XML, validation, DANFE, backup, SEFAZ)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--worker-id', default=None, help='Worker identifier (default: host:pid:thread)')
+        parser.add_argument('--once', action='store_true', help='Exit when the queue is empty')
+        parser.add_argument('--idle', type=float, default=2.0, help='Seconds to sleep when the queue is empty')
+        parser.add_argument('--max-jobs', type=int, default=None, help='Exit after processing this many jobs')
+
+    def handle(self, *args, **options):
+        worker = options['worker_id'] or identificador_worker()
+        precarregar_processo()
+        self.stdout.write(f'Issuance worker {worker} started')
+
+        try:
+            contagem = executar_worker(
+                worker, intervalo_ocioso=None if options['once'] else options['idle'], max_jobs=options['max_jobs'],
+            )
+        except KeyboardInterrupt:
+            return
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{contagem["done"]} job(s) done, {contagem["queued"]} requeued for retry, '
+            f'{contagem["failed"]} failed, {contagem["lost"]} lease(s) lost'
+        ))
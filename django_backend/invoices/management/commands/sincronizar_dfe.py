@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand, CommandError
+from invoices.models import DFeSyncState
+from invoices.services.distribuicao_dfe import sincronizar
+
+
+class Command(BaseCommand):
+    help = 'Pull new DF-e documents (NFeDistribuicaoDFe) since the last NSU and import the received NF-e'
+
+    def add_arguments(self, parser):
+        parser.add_argument('tax_ids', nargs='*', help='Interested CNPJ/CPF (default: every CNPJ/CPF already synced)')
+        parser.add_argument('--uf', default=None, help='UF of the interested party (default: stored UF or PR)')
+        parser.add_argument('--environment', choices=['homologacao', 'producao'], default='homologacao')
+        parser.add_argument('--force', action='store_true', help='Query even before the minimum wait between queries')
+
+    def handle(self, *args, **options):
+        ambiente = options['environment']
+        if options['tax_ids']:
+            alvos = [(tax_id, options['uf'] or 'PR') for tax_id in options['tax_ids']]
+        else:
+            alvos = list(DFeSyncState.objects.filter(environment='2' if ambiente == 'homologacao' else '1')
+                         .values_list('tax_id', 'state'))
+            if not alvos:
+                raise CommandError('No CNPJ/CPF to sync. Pass the interested CNPJ/CPF')
+
+        for tax_id, uf in alvos:
+            res = sincronizar(tax_id, uf=options['uf'] or uf, ambiente=ambiente, forcar=options['force'])
+            imp = res['importacao']
+            self.stdout.write(self.style.SUCCESS(
+                f'{tax_id}: {res["consultas"]} query(ies), {res["documentos"]} document(s) up to NSU {res["ult_nsu"]} '
+                f'(max {res["max_nsu"]}): {imp["importadas"]} NF-e imported, {imp["duplicadas"]} duplicate(s), '
+                f'{res["resumos"]} summary(ies), {res["eventos"]} event(s), {res["pendentes"]} NF-e pending import - '
+                f'{res["codigo"]} {res["mensagem"]}'
+            ))
+            for erro in imp['detalhes_erros']:
+                self.stdout.write(self.style.ERROR(f'{tax_id} {erro["arquivo"]}: {erro["erro"]}'))
@@ -0,0 +1,28 @@
+# Generated by Django 5.1.2 on 2026-10-17 23:58
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0004_alter_invoiceitem_icms_origin'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoice',
+            name='contingency_date',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Entrada em Contingência'),
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='contingency_reason',
+            field=models.CharField(blank=True, max_length=256, null=True, verbose_name='Justificativa da Contingência'),
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='emission_type',
+            field=models.CharField(choices=[('1', '1-Normal'), ('6', '6-Contingência SVC-AN'), ('7', '7-Contingência SVC-RS')], default='1', max_length=1, verbose_name='Tipo de Emissão'),
+        ),
+    ]
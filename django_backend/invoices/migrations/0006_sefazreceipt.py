@@ -0,0 +1,43 @@
+# Generated by Django 5.1.2 on 2026-10-18 00:03
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0005_invoice_emission_type'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SefazReceipt',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.CharField(max_length=15, unique=True, verbose_name='Número do Recibo')),
+                ('lot_id', models.CharField(max_length=15, verbose_name='Identificador do Lote')),
+                ('state', models.CharField(max_length=2, verbose_name='UF')),
+                ('environment', models.CharField(choices=[('1', '1-Produção'), ('2', '2-Homologação')], default='2', max_length=1, verbose_name='Ambiente')),
+                ('emission_type', models.CharField(choices=[('1', '1-Normal'), ('6', '6-Contingência SVC-AN'), ('7', '7-Contingência SVC-RS')], default='1', max_length=1, verbose_name='Tipo de Emissão')),
+                ('status', models.CharField(choices=[('waiting', 'Aguardando Processamento'), ('processed', 'Processado'), ('expired', 'Sem Resposta')], default='waiting', max_length=10)),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='Consultas Realizadas')),
+                ('next_poll_at', models.DateTimeField(verbose_name='Próxima Consulta')),
+                ('last_code', models.CharField(blank=True, max_length=3, null=True, verbose_name='Último cStat')),
+                ('last_message', models.CharField(blank=True, max_length=255, null=True, verbose_name='Último xMotivo')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Recibo SEFAZ',
+                'verbose_name_plural': 'Recibos SEFAZ',
+                'ordering': ['next_poll_at'],
+                'indexes': [models.Index(fields=['status', 'next_poll_at'], name='invoices_se_status_d8db0e_idx')],
+            },
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='receipt',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='invoices', to='invoices.sefazreceipt', verbose_name='Recibo do Lote'),
+        ),
+    ]
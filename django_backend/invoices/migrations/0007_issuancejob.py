@@ -0,0 +1,42 @@
+# Generated by Django 5.1.2 on 2026-10-18 00:06
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0006_sefazreceipt'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IssuanceJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('authorize', models.BooleanField(default=False, verbose_name='Autorizar na SEFAZ')),
+                ('stage', models.CharField(choices=[('xml', 'Geração do XML'), ('validation', 'Validação'), ('danfe', 'Geração do DANFE'), ('backup', 'Backup'), ('authorization', 'Autorização SEFAZ'), ('done', 'Concluída')], default='xml', max_length=15, verbose_name='Etapa')),
+                ('status', models.CharField(choices=[('queued', 'Na Fila'), ('running', 'Em Execução'), ('done', 'Concluída'), ('failed', 'Falhou')], default='queued', max_length=10)),
+                ('attempts', models.PositiveIntegerField(default=0, verbose_name='Tentativas')),
+                ('run_after', models.DateTimeField(verbose_name='Executar a Partir de')),
+                ('leased_by', models.CharField(blank=True, max_length=100, null=True, verbose_name='Worker')),
+                ('lease_expires_at', models.DateTimeField(blank=True, null=True, verbose_name='Reserva Válida Até')),
+                ('last_error', models.TextField(blank=True, null=True, verbose_name='Último Erro')),
+                ('result', models.JSONField(blank=True, default=dict, verbose_name='Resultado')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Concluída em')),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='issuance_jobs', to=settings.AUTH_USER_MODEL)),
+                ('invoice', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='issuance_jobs', to='invoices.invoice')),
+            ],
+            options={
+                'verbose_name': 'Emissão em Fila',
+                'verbose_name_plural': 'Emissões em Fila',
+                'ordering': ['run_after'],
+                'indexes': [models.Index(fields=['status', 'run_after'], name='invoices_is_status_f4e076_idx')],
+            },
+        ),
+    ]
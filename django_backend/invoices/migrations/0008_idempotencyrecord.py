@@ -0,0 +1,36 @@
+# Generated by Django 5.1.2 on 2026-10-18 00:09
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0007_issuancejob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='IdempotencyRecord',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('scope', models.CharField(max_length=50, verbose_name='Operação')),
+                ('key', models.CharField(max_length=255, verbose_name='Chave de Idempotência')),
+                ('fingerprint', models.CharField(max_length=64, verbose_name='Impressão da Requisição')),
+                ('status', models.CharField(choices=[('in_progress', 'Em Andamento'), ('completed', 'Concluída')], default='in_progress', max_length=15)),
+                ('response_status', models.PositiveSmallIntegerField(blank=True, null=True, verbose_name='Status HTTP')),
+                ('response_body', models.JSONField(blank=True, null=True, verbose_name='Resposta')),
+                ('locked_until', models.DateTimeField(blank=True, null=True, verbose_name='Em Execução Até')),
+                ('expires_at', models.DateTimeField(verbose_name='Expira em')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('invoice', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='idempotency_records', to='invoices.invoice')),
+            ],
+            options={
+                'verbose_name': 'Registro de Idempotência',
+                'verbose_name_plural': 'Registros de Idempotência',
+                'constraints': [models.UniqueConstraint(fields=('scope', 'key'), name='unique_idempotency_key')],
+            },
+        ),
+    ]
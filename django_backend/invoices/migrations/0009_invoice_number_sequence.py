@@ -0,0 +1,68 @@
+# Generated by Django 5.1.2 on 2026-10-18 00:10
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('clients', '0003_farm'),
+        ('invoices', '0008_idempotencyrecord'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NumberGap',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('issuer_tax_id', models.CharField(max_length=14, verbose_name='CNPJ/CPF Emitente')),
+                ('model_code', models.CharField(default='55', max_length=2, verbose_name='Código do Modelo')),
+                ('series', models.CharField(default='1', max_length=10, verbose_name='Série')),
+                ('start_number', models.PositiveBigIntegerField(verbose_name='Número Inicial')),
+                ('end_number', models.PositiveBigIntegerField(verbose_name='Número Final')),
+                ('reason', models.CharField(blank=True, max_length=255, null=True, verbose_name='Motivo')),
+                ('status', models.CharField(choices=[('open', 'Pendente'), ('voided', 'Inutilizada')], default='open', max_length=10)),
+                ('protocol', models.CharField(blank=True, max_length=50, null=True, verbose_name='Protocolo de Inutilização')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'verbose_name': 'Lacuna de Numeração',
+                'verbose_name_plural': 'Lacunas de Numeração',
+                'ordering': ['issuer_tax_id', 'model_code', 'series', 'start_number'],
+            },
+        ),
+        migrations.CreateModel(
+            name='NumberSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('issuer_tax_id', models.CharField(max_length=14, verbose_name='CNPJ/CPF Emitente')),
+                ('model_code', models.CharField(default='55', max_length=2, verbose_name='Código do Modelo')),
+                ('series', models.CharField(default='1', max_length=10, verbose_name='Série')),
+                ('next_number', models.PositiveBigIntegerField(default=1, verbose_name='Próximo Número')),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Sequência de Numeração',
+                'verbose_name_plural': 'Sequências de Numeração',
+            },
+        ),
+        migrations.AlterField(
+            model_name='invoice',
+            name='number',
+            field=models.CharField(max_length=20, verbose_name='Número'),
+        ),
+        migrations.AddConstraint(
+            model_name='invoice',
+            constraint=models.UniqueConstraint(fields=('issuer_tax_id', 'model_code', 'series', 'number'), name='unique_invoice_number'),
+        ),
+        migrations.AddConstraint(
+            model_name='numbergap',
+            constraint=models.UniqueConstraint(fields=('issuer_tax_id', 'model_code', 'series', 'start_number'), name='unique_number_gap'),
+        ),
+        migrations.AddConstraint(
+            model_name='numbersequence',
+            constraint=models.UniqueConstraint(fields=('issuer_tax_id', 'model_code', 'series'), name='unique_number_sequence'),
+        ),
+    ]
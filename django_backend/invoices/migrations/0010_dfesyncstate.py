@@ -0,0 +1,35 @@
+# Generated by Django 5.1.2 on 2026-10-18 00:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0009_invoice_number_sequence'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DFeSyncState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('tax_id', models.CharField(max_length=14, verbose_name='CNPJ/CPF Interessado')),
+                ('environment', models.CharField(choices=[('1', '1-Produção'), ('2', '2-Homologação')], default='2', max_length=1, verbose_name='Ambiente')),
+                ('state', models.CharField(default='PR', max_length=2, verbose_name='UF do Interessado')),
+                ('last_nsu', models.PositiveBigIntegerField(default=0, verbose_name='Último NSU')),
+                ('max_nsu', models.PositiveBigIntegerField(default=0, verbose_name='Maior NSU')),
+                ('documents_received', models.PositiveIntegerField(default=0, verbose_name='Documentos Recebidos')),
+                ('next_sync_at', models.DateTimeField(blank=True, null=True, verbose_name='Próxima Consulta')),
+                ('last_code', models.CharField(blank=True, max_length=3, null=True, verbose_name='Último cStat')),
+                ('last_message', models.CharField(blank=True, max_length=255, null=True, verbose_name='Última Mensagem')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'verbose_name': 'Sincronização de DF-e',
+                'verbose_name_plural': 'Sincronizações de DF-e',
+                'constraints': [models.UniqueConstraint(fields=('tax_id', 'environment'), name='unique_dfe_sync_state')],
+            },
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.1.2 on 2026-10-18 00:30
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0010_dfesyncstate'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FiscalEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('event_type', models.CharField(choices=[('110111', 'Cancelamento'), ('110110', 'Carta de Correção')], max_length=6, verbose_name='Tipo de Evento')),
+                ('sequence', models.PositiveSmallIntegerField(default=1, verbose_name='Sequencial do Evento')),
+                ('text', models.TextField(verbose_name='Justificativa/Correção')),
+                ('status', models.CharField(choices=[('pending', 'Pendente'), ('registered', 'Registrado'), ('rejected', 'Rejeitado'), ('error', 'Erro no Envio')], default='pending', max_length=10)),
+                ('lot_id', models.CharField(blank=True, max_length=15, null=True, verbose_name='Identificador do Lote')),
+                ('protocol', models.CharField(blank=True, max_length=50, null=True, verbose_name='Protocolo do Evento')),
+                ('registered_at', models.DateTimeField(blank=True, null=True, verbose_name='Data de Registro')),
+                ('last_code', models.CharField(blank=True, max_length=3, null=True, verbose_name='Último cStat')),
+                ('last_message', models.CharField(blank=True, max_length=255, null=True, verbose_name='Último xMotivo')),
+                ('xml', models.TextField(blank=True, null=True, verbose_name='XML do Evento')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='fiscal_events', to=settings.AUTH_USER_MODEL)),
+                ('invoice', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='events', to='invoices.invoice')),
+            ],
+            options={
+                'verbose_name': 'Evento Fiscal',
+                'verbose_name_plural': 'Eventos Fiscais',
+                'ordering': ['invoice', 'event_type', 'sequence'],
+                'indexes': [models.Index(fields=['invoice', 'event_type', 'status'], name='invoices_fi_invoice_9e04e7_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.1.2 on 2026-10-18 00:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0011_fiscalevent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoice',
+            name='danfe_hash',
+            field=models.CharField(blank=True, max_length=64, null=True, verbose_name='Hash do DANFE'),
+        ),
+    ]
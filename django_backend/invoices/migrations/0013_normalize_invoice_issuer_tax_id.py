@@ -0,0 +1,38 @@
+from django.db import migrations
+from invoices.services.nfe_engine import clean_digits
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def normalizar_emitente(apps, schema_editor):
+    """CNPJ/CPF do emitente limpo com clean_digits(), como em Invoice.save() e nas sequências de numeração"""
+    Invoice = apps.get_model('invoices', 'Invoice')
+    colidentes = []
+    for invoice in Invoice.objects.exclude(issuer_tax_id__regex=r'^[0-9]*$').iterator():
+        limpo = clean_digits(invoice.issuer_tax_id)
+        if limpo == invoice.issuer_tax_id:
+            continue
+        duplicada = Invoice.objects.filter(
+            issuer_tax_id=limpo, model_code=invoice.model_code, series=invoice.series, number=invoice.number,
+        ).exists()
+        if duplicada:
+            # Mesmo número gravado com as duas grafias: fica como está (Invoice.save() só limpa na inclusão)
+            colidentes.append(invoice.pk)
+        else:
+            Invoice.objects.filter(pk=invoice.pk).update(issuer_tax_id=limpo)
+    if colidentes:
+        logger.warning(
+            f"Notas com numeração repetida entre CNPJ/CPF formatado e limpo, mantidas para conferência: {colidentes}"
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0012_invoice_danfe_hash'),
+    ]
+
+    operations = [
+        migrations.RunPython(normalizar_emitente, migrations.RunPython.noop),
+    ]
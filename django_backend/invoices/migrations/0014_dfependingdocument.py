@@ -0,0 +1,34 @@
+# Generated by Django 5.1.2 on 2026-10-18 02:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0013_normalize_invoice_issuer_tax_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DFePendingDocument',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('nsu', models.PositiveBigIntegerField(verbose_name='NSU')),
+                ('schema', models.CharField(max_length=50, verbose_name='Schema')),
+                ('content', models.TextField(verbose_name='docZip')),
+                ('reason', models.CharField(max_length=255, verbose_name='Motivo')),
+                ('attempts', models.PositiveIntegerField(default=1, verbose_name='Tentativas')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('sync_state', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='pending_documents', to='invoices.dfesyncstate')),
+            ],
+            options={
+                'verbose_name': 'DF-e Pendente de Importação',
+                'verbose_name_plural': 'DF-e Pendentes de Importação',
+                'ordering': ['nsu'],
+                'constraints': [models.UniqueConstraint(fields=('sync_state', 'nsu'), name='unique_dfe_pending_document')],
+            },
+        ),
+    ]
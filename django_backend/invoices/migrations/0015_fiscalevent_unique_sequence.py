@@ -0,0 +1,36 @@
+# Generated by Django 5.1.2 on 2026-10-18 02:23
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+def rejeitar_sequencias_repetidas(apps, schema_editor):
+    """Mesmo nSeqEvento fora de 'rejected': fica o registrado (ou o mais recente), os demais viram rejeitados"""
+    FiscalEvent = apps.get_model('invoices', 'FiscalEvent')
+    vistos = set()
+    ativos = FiscalEvent.objects.exclude(status='rejected').annotate(
+        registrado=models.Case(models.When(status='registered', then=1), default=0, output_field=models.IntegerField()),
+    )
+    for evento in ativos.order_by('invoice_id', 'event_type', 'sequence', '-registrado', '-created_at', '-pk').iterator():
+        chave = (evento.invoice_id, evento.event_type, evento.sequence)
+        if chave in vistos:
+            FiscalEvent.objects.filter(pk=evento.pk).update(
+                status='rejected', last_message='nSeqEvento repetido: substituído por outro evento da nota',
+            )
+        vistos.add(chave)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0014_dfependingdocument'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(rejeitar_sequencias_repetidas, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='fiscalevent',
+            constraint=models.UniqueConstraint(condition=models.Q(('status', 'rejected'), _negated=True), fields=('invoice', 'event_type', 'sequence'), name='unique_fiscal_event_sequence'),
+        ),
+    ]
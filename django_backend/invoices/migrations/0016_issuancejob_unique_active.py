@@ -0,0 +1,34 @@
+# Generated by Django 5.1.2 on 2026-10-18 02:25
+
+from django.conf import settings
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def encerrar_jobs_repetidos(apps, schema_editor):
+    """Mais de um job ativo da mesma nota: fica o mais antigo, os demais saem da fila como falhos"""
+    IssuanceJob = apps.get_model('invoices', 'IssuanceJob')
+    vistas = set()
+    for job in IssuanceJob.objects.filter(status__in=['queued', 'running']).order_by('invoice_id', 'created_at', 'pk').iterator():
+        if job.invoice_id in vistas:
+            IssuanceJob.objects.filter(pk=job.pk).update(
+                status='failed', leased_by=None, lease_expires_at=None, finished_at=timezone.now(),
+                last_error='Job repetido da mesma nota encerrado (outro job ativo segue na fila)',
+            )
+        vistas.add(job.invoice_id)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('invoices', '0015_fiscalevent_unique_sequence'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.RunPython(encerrar_jobs_repetidos, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='issuancejob',
+            constraint=models.UniqueConstraint(condition=models.Q(('status__in', ['queued', 'running'])), fields=('invoice',), name='unique_active_issuance_job'),
+        ),
+    ]
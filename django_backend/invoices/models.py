@@ -101,9 +101,15 @@ class Invoice(models.Model):
         ('1', '1-Produção'),
         ('2', '2-Homologação'),
     ]
+    
+    EMISSION_TYPE_CHOICES = [
+        ('1', '1-Normal'),
+        ('6', '6-Contingência SVC-AN'),
+        ('7', '7-Contingência SVC-RS'),
+    ]
 
     # Identification
-    number = models.CharField(max_length=20, unique=True, verbose_name='Número')
+    number = models.CharField(max_length=20, verbose_name='Número')
     series = models.CharField(max_length=10, default='1', verbose_name='Série')
     invoice_type = models.CharField(max_length=10, choices=INVOICE_TYPE_CHOICES, default='nfe')
     model_code = models.CharField(max_length=2, default='55', verbose_name='Código do Modelo')  # 55=NFe, 65=NFCe
@@ -186,6 +192,9 @@ class Invoice(models.Model):
     receiver_ie_indicator = models.CharField(max_length=1, choices=IE_INDICATOR_CHOICES, default='9', verbose_name='Indicador IE Destinatário')
     tax_regime = models.CharField(max_length=1, choices=TAX_REGIME_CHOICES, default='3', verbose_name='Código Regime Tributário')
     environment = models.CharField(max_length=1, choices=ENVIRONMENT_CHOICES, default='2', verbose_name='Ambiente')
+    emission_type = models.CharField(max_length=1, choices=EMISSION_TYPE_CHOICES, default='1', verbose_name='Tipo de Emissão')
+    contingency_date = models.DateTimeField(null=True, blank=True, verbose_name='Entrada em Contingência')
+    contingency_reason = models.CharField(max_length=256, blank=True, null=True, verbose_name='Justificativa da Contingência')
     
     # Technical Responsible (Optional)
     tech_cnpj = models.CharField(max_length=14, blank=True, null=True, verbose_name='CNPJ Resp. Técnico')
@@ -193,9 +202,13 @@ class Invoice(models.Model):
     tech_email = models.EmailField(blank=True, null=True, verbose_name='Email Resp. Técnico')
     tech_phone = models.CharField(max_length=14, blank=True, null=True, verbose_name='Fone Resp. Técnico')
     
+    # SEFAZ
+    receipt = models.ForeignKey('SefazReceipt', on_delete=models.SET_NULL, blank=True, null=True, related_name='invoices', verbose_name='Recibo do Lote')
+    
     # Files
     xml_file = models.FileField(upload_to='invoices/xml/%Y/%m/', blank=True, null=True)
     pdf_file = models.FileField(upload_to='invoices/pdf/%Y/%m/', blank=True, null=True)
+    danfe_hash = models.CharField(max_length=64, blank=True, null=True, verbose_name='Hash do DANFE')  # conteúdo renderizado em pdf_file
     
     # Metadata
     created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, related_name='invoices_created')
@@ -204,6 +217,10 @@ class Invoice(models.Model):
 
     class Meta:
         ordering = ['-issue_date', '-number']
+        constraints = [
+            # Numeração é sequencial por emitente, modelo e série
+            models.UniqueConstraint(fields=['issuer_tax_id', 'model_code', 'series', 'number'], name='unique_invoice_number'),
+        ]
         verbose_name = 'Nota Fiscal'
         verbose_name_plural = 'Notas Fiscais'
 
@@ -211,6 +228,13 @@ class Invoice(models.Model):
         return f"NF {self.number}/{self.series} - {self.client.name}"
     
     def save(self, *args, **kwargs):
+        from .services.nfe_engine import clean_digits
+
+        # Same key as the numbering sequences: formatted and clean CNPJ/CPF cannot repeat a number.
+        # Only on insert: rows kept formatted by migration 0013 (number repeated under the clean
+        # CNPJ/CPF) must still save; the serializer cleans values sent on update.
+        if self._state.adding or self.pk is None:
+            self.issuer_tax_id = clean_digits(self.issuer_tax_id)
         # Do not auto-generate access key - use NFeGenerator
         super().save(*args, **kwargs)
     
@@ -285,3 +309,248 @@ class InvoiceItem(models.Model):
         # Calcular total
         self.total_value = (self.quantity * self.unit_value) - self.discount
         super().save(*args, **kwargs)
+
+
+class SefazReceipt(models.Model):
+    """Recibo de um lote enviNFe assíncrono, consultado até a SEFAZ processar o lote"""
+    STATUS_CHOICES = [
+        ('waiting', 'Aguardando Processamento'),
+        ('processed', 'Processado'),
+        ('expired', 'Sem Resposta'),
+    ]
+    
+    number = models.CharField(max_length=15, unique=True, verbose_name='Número do Recibo')
+    lot_id = models.CharField(max_length=15, verbose_name='Identificador do Lote')
+    state = models.CharField(max_length=2, verbose_name='UF')
+    environment = models.CharField(max_length=1, choices=Invoice.ENVIRONMENT_CHOICES, default='2', verbose_name='Ambiente')
+    emission_type = models.CharField(max_length=1, choices=Invoice.EMISSION_TYPE_CHOICES, default='1', verbose_name='Tipo de Emissão')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='waiting')
+    attempts = models.PositiveIntegerField(default=0, verbose_name='Consultas Realizadas')
+    next_poll_at = models.DateTimeField(verbose_name='Próxima Consulta')
+    last_code = models.CharField(max_length=3, blank=True, null=True, verbose_name='Último cStat')
+    last_message = models.CharField(max_length=255, blank=True, null=True, verbose_name='Último xMotivo')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['next_poll_at']
+        indexes = [models.Index(fields=['status', 'next_poll_at'])]
+        verbose_name = 'Recibo SEFAZ'
+        verbose_name_plural = 'Recibos SEFAZ'
+
+    def __str__(self):
+        return f"Recibo {self.number} ({self.get_status_display()})"
+
+
+class IssuanceJob(models.Model):
+    """Emissão de uma NF-e executada em etapas por um worker (fila persistente)"""
+    STAGE_CHOICES = [
+        ('xml', 'Geração do XML'),
+        ('validation', 'Validação'),
+        ('danfe', 'Geração do DANFE'),
+        ('backup', 'Backup'),
+        ('authorization', 'Autorização SEFAZ'),
+        ('done', 'Concluída'),
+    ]
+    
+    STATUS_CHOICES = [
+        ('queued', 'Na Fila'),
+        ('running', 'Em Execução'),
+        ('done', 'Concluída'),
+        ('failed', 'Falhou'),
+    ]
+    
+    invoice = models.ForeignKey(Invoice, on_delete=models.CASCADE, related_name='issuance_jobs')
+    authorize = models.BooleanField(default=False, verbose_name='Autorizar na SEFAZ')
+    stage = models.CharField(max_length=15, choices=STAGE_CHOICES, default='xml', verbose_name='Etapa')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued')
+    attempts = models.PositiveIntegerField(default=0, verbose_name='Tentativas')
+    run_after = models.DateTimeField(verbose_name='Executar a Partir de')
+    leased_by = models.CharField(max_length=100, blank=True, null=True, verbose_name='Worker')
+    lease_expires_at = models.DateTimeField(blank=True, null=True, verbose_name='Reserva Válida Até')
+    last_error = models.TextField(blank=True, null=True, verbose_name='Último Erro')
+    result = models.JSONField(default=dict, blank=True, verbose_name='Resultado')
+    created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, related_name='issuance_jobs')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(blank=True, null=True, verbose_name='Concluída em')
+
+    class Meta:
+        ordering = ['run_after']
+        indexes = [models.Index(fields=['status', 'run_after'])]
+        # At most one active job per invoice (enfileirar() reuses it)
+        constraints = [
+            models.UniqueConstraint(
+                fields=['invoice'], condition=models.Q(status__in=['queued', 'running']),
+                name='unique_active_issuance_job',
+            ),
+        ]
+        verbose_name = 'Emissão em Fila'
+        verbose_name_plural = 'Emissões em Fila'
+
+    def __str__(self):
+        return f"Emissão #{self.pk} - NF {self.invoice_id} ({self.get_status_display()}, {self.get_stage_display()})"
+
+
+class IdempotencyRecord(models.Model):
+    """Resultado de uma requisição que não pode ser repetida (ex.: envio à SEFAZ), devolvido nas novas tentativas"""
+    STATUS_CHOICES = [
+        ('in_progress', 'Em Andamento'),
+        ('completed', 'Concluída'),
+    ]
+    
+    scope = models.CharField(max_length=50, verbose_name='Operação')
+    key = models.CharField(max_length=255, verbose_name='Chave de Idempotência')
+    fingerprint = models.CharField(max_length=64, verbose_name='Impressão da Requisição')
+    invoice = models.ForeignKey(Invoice, on_delete=models.CASCADE, blank=True, null=True, related_name='idempotency_records')
+    status = models.CharField(max_length=15, choices=STATUS_CHOICES, default='in_progress')
+    response_status = models.PositiveSmallIntegerField(blank=True, null=True, verbose_name='Status HTTP')
+    response_body = models.JSONField(blank=True, null=True, verbose_name='Resposta')
+    locked_until = models.DateTimeField(blank=True, null=True, verbose_name='Em Execução Até')
+    expires_at = models.DateTimeField(verbose_name='Expira em')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['scope', 'key'], name='unique_idempotency_key')]
+        verbose_name = 'Registro de Idempotência'
+        verbose_name_plural = 'Registros de Idempotência'
+
+    def __str__(self):
+        return f"{self.scope} {self.key} ({self.get_status_display()})"
+
+
+class NumberSequence(models.Model):
+    """Próximo número livre de NF-e/NFC-e por emitente, modelo e série"""
+    issuer_tax_id = models.CharField(max_length=14, verbose_name='CNPJ/CPF Emitente')
+    model_code = models.CharField(max_length=2, default='55', verbose_name='Código do Modelo')
+    series = models.CharField(max_length=10, default='1', verbose_name='Série')
+    next_number = models.PositiveBigIntegerField(default=1, verbose_name='Próximo Número')
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['issuer_tax_id', 'model_code', 'series'], name='unique_number_sequence')]
+        verbose_name = 'Sequência de Numeração'
+        verbose_name_plural = 'Sequências de Numeração'
+
+    def __str__(self):
+        return f"{self.issuer_tax_id} mod {self.model_code} série {self.series}: {self.next_number}"
+
+
+class NumberGap(models.Model):
+    """Faixa de números reservada e não usada, pendente de inutilização na SEFAZ"""
+    STATUS_CHOICES = [
+        ('open', 'Pendente'),
+        ('voided', 'Inutilizada'),
+    ]
+    
+    issuer_tax_id = models.CharField(max_length=14, verbose_name='CNPJ/CPF Emitente')
+    model_code = models.CharField(max_length=2, default='55', verbose_name='Código do Modelo')
+    series = models.CharField(max_length=10, default='1', verbose_name='Série')
+    start_number = models.PositiveBigIntegerField(verbose_name='Número Inicial')
+    end_number = models.PositiveBigIntegerField(verbose_name='Número Final')
+    reason = models.CharField(max_length=255, blank=True, null=True, verbose_name='Motivo')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='open')
+    protocol = models.CharField(max_length=50, blank=True, null=True, verbose_name='Protocolo de Inutilização')
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        ordering = ['issuer_tax_id', 'model_code', 'series', 'start_number']
+        constraints = [
+            models.UniqueConstraint(fields=['issuer_tax_id', 'model_code', 'series', 'start_number'], name='unique_number_gap'),
+        ]
+        verbose_name = 'Lacuna de Numeração'
+        verbose_name_plural = 'Lacunas de Numeração'
+
+    def __str__(self):
+        return f"{self.issuer_tax_id} mod {self.model_code} série {self.series}: {self.start_number}-{self.end_number}"
+
+
+class DFeSyncState(models.Model):
+    """Último NSU recebido da distribuição de DF-e (Ambiente Nacional) por CNPJ/CPF interessado"""
+    tax_id = models.CharField(max_length=14, verbose_name='CNPJ/CPF Interessado')
+    environment = models.CharField(max_length=1, choices=Invoice.ENVIRONMENT_CHOICES, default='2', verbose_name='Ambiente')
+    state = models.CharField(max_length=2, default='PR', verbose_name='UF do Interessado')
+    last_nsu = models.PositiveBigIntegerField(default=0, verbose_name='Último NSU')
+    max_nsu = models.PositiveBigIntegerField(default=0, verbose_name='Maior NSU')
+    documents_received = models.PositiveIntegerField(default=0, verbose_name='Documentos Recebidos')
+    next_sync_at = models.DateTimeField(null=True, blank=True, verbose_name='Próxima Consulta')
+    last_code = models.CharField(max_length=3, blank=True, null=True, verbose_name='Último cStat')
+    last_message = models.CharField(max_length=255, blank=True, null=True, verbose_name='Última Mensagem')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['tax_id', 'environment'], name='unique_dfe_sync_state')]
+        verbose_name = 'Sincronização de DF-e'
+        verbose_name_plural = 'Sincronizações de DF-e'
+
+    def __str__(self):
+        return f"{self.tax_id} NSU {self.last_nsu}/{self.max_nsu}"
+
+
+class DFePendingDocument(models.Model):
+    """procNFe recebida pela distribuição de DF-e e ainda não importada (sem cliente ou com erro)"""
+    sync_state = models.ForeignKey(DFeSyncState, on_delete=models.CASCADE, related_name='pending_documents')
+    nsu = models.PositiveBigIntegerField(verbose_name='NSU')
+    schema = models.CharField(max_length=50, verbose_name='Schema')
+    content = models.TextField(verbose_name='docZip')
+    reason = models.CharField(max_length=255, verbose_name='Motivo')
+    attempts = models.PositiveIntegerField(default=1, verbose_name='Tentativas')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['nsu']
+        constraints = [models.UniqueConstraint(fields=['sync_state', 'nsu'], name='unique_dfe_pending_document')]
+        verbose_name = 'DF-e Pendente de Importação'
+        verbose_name_plural = 'DF-e Pendentes de Importação'
+
+    def __str__(self):
+        return f"{self.sync_state.tax_id} NSU {self.nsu}: {self.reason}"
+
+
+class FiscalEvent(models.Model):
+    """Evento de uma NF-e (cancelamento, carta de correção) enviado em lote envEvento"""
+    EVENT_TYPE_CHOICES = [
+        ('110111', 'Cancelamento'),
+        ('110110', 'Carta de Correção'),
+    ]
+    
+    STATUS_CHOICES = [
+        ('pending', 'Pendente'),
+        ('registered', 'Registrado'),
+        ('rejected', 'Rejeitado'),
+        ('error', 'Erro no Envio'),
+    ]
+    
+    invoice = models.ForeignKey(Invoice, on_delete=models.CASCADE, related_name='events')
+    event_type = models.CharField(max_length=6, choices=EVENT_TYPE_CHOICES, verbose_name='Tipo de Evento')
+    sequence = models.PositiveSmallIntegerField(default=1, verbose_name='Sequencial do Evento')
+    text = models.TextField(verbose_name='Justificativa/Correção')
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    lot_id = models.CharField(max_length=15, blank=True, null=True, verbose_name='Identificador do Lote')
+    protocol = models.CharField(max_length=50, blank=True, null=True, verbose_name='Protocolo do Evento')
+    registered_at = models.DateTimeField(blank=True, null=True, verbose_name='Data de Registro')
+    last_code = models.CharField(max_length=3, blank=True, null=True, verbose_name='Último cStat')
+    last_message = models.CharField(max_length=255, blank=True, null=True, verbose_name='Último xMotivo')
+    xml = models.TextField(blank=True, null=True, verbose_name='XML do Evento')
+    created_by = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.SET_NULL, null=True, blank=True, related_name='fiscal_events')
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        ordering = ['invoice', 'event_type', 'sequence']
+        indexes = [models.Index(fields=['invoice', 'event_type', 'status'])]
+        # Rejected events were never registered: their nSeqEvento can be sent again
+        constraints = [
+            models.UniqueConstraint(
+                fields=['invoice', 'event_type', 'sequence'], condition=~models.Q(status='rejected'),
+                name='unique_fiscal_event_sequence',
+            ),
+        ]
+        verbose_name = 'Evento Fiscal'
+        verbose_name_plural = 'Eventos Fiscais'
+
+    def __str__(self):
+        return f"{self.get_event_type_display()} {self.sequence} - NF {self.invoice_id} ({self.get_status_display()})"
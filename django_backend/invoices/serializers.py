@@ -1,5 +1,8 @@
+from django.db import IntegrityError, transaction
 from rest_framework import serializers
-from .models import Invoice, InvoiceItem
+from .models import Invoice, InvoiceItem, FiscalEvent
+from .services.numeracao import alocar_numero, descartar_numero
+from .services.nfe_engine import clean_digits
 from clients.serializers import ClientListSerializer
 
 
@@ -15,8 +18,21 @@ class InvoiceItemSerializer(serializers.ModelSerializer):
         read_only_fields = ['id', 'total_value']
 
 
+class FiscalEventSerializer(serializers.ModelSerializer):
+    event_type_display = serializers.CharField(source='get_event_type_display', read_only=True)
+    
+    class Meta:
+        model = FiscalEvent
+        fields = [
+            'id', 'event_type', 'event_type_display', 'sequence', 'text', 'status',
+            'lot_id', 'protocol', 'registered_at', 'last_code', 'last_message', 'created_at'
+        ]
+        read_only_fields = fields
+
+
 class InvoiceSerializer(serializers.ModelSerializer):
     items = InvoiceItemSerializer(many=True, read_only=True)
+    events = FiscalEventSerializer(many=True, read_only=True)
     client_name = serializers.CharField(source='client.name', read_only=True)
     created_by_name = serializers.CharField(source='created_by.get_full_name', read_only=True)
     
@@ -41,9 +57,15 @@ class InvoiceSerializer(serializers.ModelSerializer):
             'total_value', 'notes', 'additional_info',
             # Status e arquivos
             'status', 'protocol', 'xml_file', 'pdf_file',
-            'items', 'created_by', 'created_by_name', 'created_at', 'updated_at'
+            'items', 'events', 'created_by', 'created_by_name', 'created_at', 'updated_at'
         ]
-        read_only_fields = ['id', 'access_key', 'created_at', 'updated_at', 'items', 'client_name', 'created_by_name']
+        read_only_fields = ['id', 'access_key', 'created_at', 'updated_at', 'items', 'events', 'client_name', 'created_by_name']
+    
+    def validate_issuer_tax_id(self, value):
+        # Unchanged value is kept as stored (rows left formatted by migration 0013)
+        if self.instance is not None and value == self.instance.issuer_tax_id:
+            return value
+        return clean_digits(value)
 
 
 class InvoiceListSerializer(serializers.ModelSerializer):
@@ -78,10 +100,21 @@ class InvoiceCreateSerializer(serializers.ModelSerializer):
             'icms_base', 'icms_value', 'ipi_value', 'pis_value', 'cofins_value', 'iss_value',
             'notes', 'additional_info', 'items'
         ]
+        extra_kwargs = {'number': {'required': False, 'allow_blank': True}}
+        # Unicidade da numeração é garantida pelo alocador e pela constraint do banco
+        validators = []
     
     def create(self, validated_data):
         items_data = validated_data.pop('items')
         
+        # Number omitted: next number from the issuer/model/series sequence
+        validated_data['issuer_tax_id'] = clean_digits(validated_data.get('issuer_tax_id'))
+        alocado = not validated_data.get('number')
+        if alocado:
+            validated_data['number'] = str(alocar_numero(
+                validated_data.get('issuer_tax_id'), validated_data.get('model_code'), validated_data.get('series')
+            ))
+        
         # Check if it is an interstate operation
         issuer_state = validated_data.get('issuer_state', '').upper()
         receiver_state = validated_data.get('receiver_state', '').upper()
@@ -100,7 +133,23 @@ class InvoiceCreateSerializer(serializers.ModelSerializer):
             obs += f'INTERSTATE OPERATION: {issuer_state} -> {receiver_state}. ICMS not highlighted per legislation.'
             validated_data['notes'] = obs
         
-        invoice = Invoice.objects.create(**validated_data)
+        try:
+            with transaction.atomic():
+                invoice = Invoice.objects.create(**validated_data)
+        except Exception as e:
+            usado = isinstance(e, IntegrityError) and Invoice.objects.filter(
+                issuer_tax_id=validated_data.get('issuer_tax_id'), model_code=validated_data.get('model_code', '55'),
+                series=validated_data.get('series', '1'), number=validated_data['number'],
+            ).exists()
+            if alocado and not usado:
+                # Allocated number that did not become an invoice: recorded as a gap to be voided
+                descartar_numero(
+                    validated_data.get('issuer_tax_id'), validated_data.get('model_code'), validated_data.get('series'),
+                    int(validated_data['number']), f'Falha ao gravar a nota: {type(e).__name__}',
+                )
+            if usado:
+                raise serializers.ValidationError({'number': 'Number already used for this issuer, model and series.'})
+            raise
         
         # Create items
         total_products = 0
@@ -0,0 +1,244 @@
+"""
+Serviço de chaves de acesso de NF-e/NFC-e (44 dígitos)
+Monta, aloca e valida chaves em lote. Os dígitos verificadores (módulo 11)
+são calculados de forma vetorizada com NumPy quando disponível, com
+fallback em Python puro.
+
+Formato: cUF(2) + AAMM(4) + CNPJ/CPF(14) + mod(2) + serie(3) + nNF(9)
+         + tpEmis(1) + cNF(8) + DV(1)
+"""
+import secrets
+import re
+
+try:
+    import numpy as np
+    _HAS_NUMPY = True
+except ImportError:
+    _HAS_NUMPY = False
+
+UF_CODES = {
+    'AC': '12', 'AL': '27', 'AP': '16', 'AM': '13', 'BA': '29', 'CE': '23',
+    'DF': '53', 'ES': '32', 'GO': '52', 'MA': '21', 'MT': '51', 'MS': '50',
+    'MG': '31', 'PA': '15', 'PB': '25', 'PR': '41', 'PE': '26', 'PI': '22',
+    'RJ': '33', 'RN': '24', 'RS': '43', 'RO': '11', 'RR': '14', 'SC': '42',
+    'SE': '28', 'SP': '35', 'TO': '17'
+}
+
+CODIGOS_UF_VALIDOS = frozenset(UF_CODES.values())
+MODELOS_VALIDOS = frozenset(('55', '65'))
+
+# Só dígitos ASCII: str.isdigit() também aceita '²', '٣' e outros dígitos Unicode
+DIGITOS = frozenset('0123456789')
+# Pontuação aceita entre os dígitos de uma chave digitada (além de espaços)
+SEPARADORES = frozenset('.-/')
+_CHAVE_44 = re.compile(r'[0-9]{44}')
+
+# Pesos 2..9 aplicados da direita para a esquerda sobre os 43 primeiros dígitos
+PESOS = [2 + (i % 8) for i in range(43)][::-1]
+
+if _HAS_NUMPY:
+    _PESOS_NP = np.array(PESOS, dtype=np.int64)
+
+
+def _limpar(valor):
+    """Remove formatação (pontos, barras, traços) de CNPJ/CPF"""
+    if not valor:
+        return ''
+    return valor.replace('.', '').replace('/', '').replace('-', '').strip()
+
+
+# ========== Dígito verificador ==========
+
+def calcular_dv(chave_sem_dv):
+    """Dígito verificador de uma chave (43 dígitos)"""
+    soma = sum(int(d) * p for d, p in zip(chave_sem_dv, PESOS))
+    resto = soma % 11
+    return 0 if resto < 2 else 11 - resto
+
+
+def calcular_dvs(chaves_sem_dv):
+    """
+    Dígitos verificadores de várias chaves em uma única operação
+
+    Args:
+        chaves_sem_dv: Lista de strings com 43 dígitos
+
+    Returns:
+        list: Dígitos verificadores (int), na mesma ordem
+    """
+    if not chaves_sem_dv:
+        return []
+    if not _HAS_NUMPY:
+        return [calcular_dv(chave) for chave in chaves_sem_dv]
+
+    # Matriz N x 43 de dígitos direto dos bytes ASCII
+    digitos = np.frombuffer(''.join(chaves_sem_dv).encode('ascii'), dtype=np.uint8)
+    digitos = digitos.reshape(-1, 43).astype(np.int64) - 48
+    resto = (digitos @ _PESOS_NP) % 11
+    return np.where(resto < 2, 0, 11 - resto).tolist()
+
+
+# ========== Montagem e alocação ==========
+
+def prefixo_chave(invoice, tp_emis=None):
+    """
+    cUF + AAMM + CNPJ/CPF + mod + série + nNF + tpEmis (35 dígitos)
+
+    tpEmis omitido usa o tipo de emissão da nota (1-Normal ou contingência)
+    """
+    tp_emis = tp_emis or getattr(invoice, 'emission_type', None) or '1'
+    uf_code = UF_CODES.get(invoice.issuer_state or 'PR', '41')
+    aamm = invoice.issue_date.strftime('%y%m')
+    cnpj_cpf = _limpar(invoice.issuer_tax_id).zfill(14)
+    mod = invoice.model_code or '55'
+    serie = str(invoice.series).zfill(3)
+    nnf = str(invoice.number).zfill(9)
+    return f"{uf_code}{aamm}{cnpj_cpf}{mod}{serie}{nnf}{tp_emis}"
+
+
+def _gerar_cnf(nnf):
+    """Código numérico aleatório de 8 dígitos, diferente do nNF (regra da SEFAZ)"""
+    while True:
+        cnf = str(secrets.randbelow(90000000) + 10000000)
+        if cnf != nnf[-8:]:
+            return cnf
+
+
+def montar_chaves(prefixos, cnfs=None):
+    """
+    Completa vários prefixos (35 dígitos) com cNF e DV
+
+    Args:
+        prefixos: Lista de prefixos gerados por prefixo_chave()
+        cnfs: Lista opcional de cNF (8 dígitos); aleatórios se omitida
+
+    Returns:
+        list: Chaves de 44 dígitos
+    """
+    if cnfs is None:
+        cnfs = [_gerar_cnf(prefixo[25:34]) for prefixo in prefixos]
+    sem_dv = [prefixo + cnf for prefixo, cnf in zip(prefixos, cnfs)]
+    return [f"{chave}{dv}" for chave, dv in zip(sem_dv, calcular_dvs(sem_dv))]
+
+
+def gerar_chave(invoice, tp_emis=None, cnf=None):
+    """Gera uma nova chave de 44 dígitos para a nota"""
+    return montar_chaves([prefixo_chave(invoice, tp_emis)], None if cnf is None else [cnf])[0]
+
+
+def formato_valido(chave):
+    """Indica se a chave tem exatamente 44 dígitos ASCII"""
+    return bool(chave) and _CHAVE_44.fullmatch(chave) is not None
+
+
+def chave_confere(chave, invoice, tp_emis=None):
+    """Indica se a chave salva ainda corresponde aos dados da nota"""
+    return (
+        formato_valido(chave)
+        and chave[:35] == prefixo_chave(invoice, tp_emis)
+        and int(chave[-1]) == calcular_dv(chave[:43])
+    )
+
+
+def alocar_chaves(invoices, tp_emis=None, salvar=True):
+    """
+    Aloca chaves para várias notas de uma vez
+
+    Notas cuja chave salva ainda confere com os dados são mantidas; as
+    demais recebem chave nova, gravada com um único bulk_update.
+
+    Args:
+        invoices: Iterável de Invoice
+        tp_emis: Tipo de emissão (padrão: o de cada nota)
+        salvar: Se True, persiste as chaves novas
+
+    Returns:
+        dict: {invoice_id: chave}
+    """
+    invoices = list(invoices)
+    pendentes = [inv for inv in invoices if not chave_confere(inv.access_key, inv, tp_emis)]
+
+    chaves = montar_chaves([prefixo_chave(inv, tp_emis) for inv in pendentes])
+    for inv, chave in zip(pendentes, chaves):
+        inv.access_key = chave
+
+    if salvar and pendentes:
+        type(pendentes[0]).objects.bulk_update(pendentes, ['access_key'], batch_size=1000)
+
+    return {inv.pk: inv.access_key for inv in invoices}
+
+
+# ========== Validação ==========
+
+def _erro_estrutural(chave):
+    """Valida formato e campos da chave (sem o DV). Retorna mensagem ou None"""
+    if not formato_valido(chave):
+        return 'Chave deve ter 44 dígitos numéricos'
+    if chave[0:2] not in CODIGOS_UF_VALIDOS:
+        return f'Código de UF inválido: {chave[0:2]}'
+    if not 1 <= int(chave[4:6]) <= 12:
+        return f'Mês de emissão inválido: {chave[4:6]}'
+    if chave[20:22] not in MODELOS_VALIDOS:
+        return f'Modelo inválido: {chave[20:22]}'
+    return None
+
+
+def validar_chaves(chaves):
+    """
+    Valida várias chaves de acesso (formato, UF, mês, modelo e DV)
+
+    Args:
+        chaves: Lista de strings (espaços, '.', '-' e '/' são ignorados;
+                qualquer outro caractere invalida a chave)
+
+    Returns:
+        list: [{'chave': '4125...', 'valida': True, 'erro': None}, ...]
+    """
+    normalizadas = [
+        ''.join(c for c in str(chave) if not c.isspace() and c not in SEPARADORES) for chave in chaves
+    ]
+    resultados = []
+    bem_formadas = []
+
+    for chave in normalizadas:
+        invalidos = ''.join(dict.fromkeys(c for c in chave if c not in DIGITOS))
+        if invalidos:
+            # Prefixo 'NFe', letra ou dígito não ASCII: não é uma chave digitada com formatação
+            erro = f'Caractere inválido na chave: {invalidos}'
+        else:
+            erro = _erro_estrutural(chave)
+        resultados.append({'chave': chave, 'valida': erro is None, 'erro': erro})
+        if erro is None:
+            bem_formadas.append(len(resultados) - 1)
+
+    dvs = calcular_dvs([normalizadas[i][:43] for i in bem_formadas])
+    for indice, dv in zip(bem_formadas, dvs):
+        informado = int(normalizadas[indice][43])
+        if informado != dv:
+            resultados[indice]['valida'] = False
+            resultados[indice]['erro'] = f'Dígito verificador inválido: esperado {dv}, informado {informado}'
+
+    return resultados
+
+
+def conciliar_chaves(chaves, queryset, lote=900):
+    """
+    Marca quais chaves válidas já existem no banco (importação/conciliação)
+
+    Args:
+        chaves: Resultado de validar_chaves()
+        queryset: QuerySet de Invoice usado na busca
+        lote: Quantidade de chaves por consulta (limite de parâmetros do banco)
+
+    Returns:
+        list: Os mesmos dicts com 'registrada': True/False
+    """
+    validas = [r['chave'] for r in chaves if r['valida']]
+    encontradas = set()
+    for inicio in range(0, len(validas), lote):
+        encontradas.update(
+            queryset.filter(access_key__in=validas[inicio:inicio + lote]).values_list('access_key', flat=True)
+        )
+    for resultado in chaves:
+        resultado['registrada'] = resultado['chave'] in encontradas
+    return chaves
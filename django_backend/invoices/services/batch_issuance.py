@@ -0,0 +1,141 @@
+"""
+Emissão de NF-e em lote
+Distribui o pipeline de emissão (XML, validação, DANFE e backup) entre
+processos de um pool limitado e devolve o resultado de cada nota
+"""
+from concurrent.futures import ProcessPoolExecutor
+from django.conf import settings
+from django.db import connections
+from .access_key import alocar_chaves
+import logging
+import os
+import time
+
+logger = logging.getLogger(__name__)
+
+# Limites padrão (podem ser sobrescritos no settings.py)
+DEFAULT_MAX_WORKERS = 4
+DEFAULT_MAX_BATCH_SIZE = 500
+
+
+def _inicializar_worker():
+    """Prepara o processo filho: Django configurado e sem conexões herdadas"""
+    import django
+    from django.apps import apps
+
+    if not apps.ready:
+        os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'contabiliza_backend.settings')
+        django.setup()
+
+    connections.close_all()
+
+
+def _emitir_por_id(invoice_id):
+    """Executa o pipeline de emissão para uma nota (roda dentro do worker)"""
+    from invoices.models import Invoice
+    from .nfe_pipeline import emitir_nfe
+
+    inicio = time.perf_counter()
+    resultado = {
+        'invoice_id': invoice_id,
+        'sucesso': False,
+        'chave_acesso': None,
+        'status': None,
+        'xml_file': None,
+        'pdf_file': None,
+        'erros': [],
+        'backup': None,
+    }
+
+    try:
+        invoice = Invoice.objects.select_related('client').get(pk=invoice_id)
+        emissao = emitir_nfe(invoice)
+
+        resultado.update({
+            'sucesso': emissao['sucesso'],
+            'chave_acesso': emissao['chave_acesso'],
+            'status': emissao['status'],
+            'erros': emissao['validacao']['erros'],
+            'backup': emissao['backup'],
+        })
+        if emissao['sucesso']:
+            resultado['xml_file'] = invoice.xml_file.name or None
+            resultado['pdf_file'] = invoice.pdf_file.name or None
+    except Invoice.DoesNotExist:
+        resultado['erros'] = ['Nota fiscal não encontrada']
+    except Exception as e:
+        logger.error(f"Erro ao emitir NF-e #{invoice_id}: {str(e)}")
+        resultado['erros'] = [f'Erro ao gerar NF-e: {str(e)}']
+
+    resultado['tempo'] = round(time.perf_counter() - inicio, 4)
+    return resultado
+
+
+def get_max_workers():
+    """Número máximo de processos permitido para emissão em lote"""
+    return int(getattr(settings, 'NFE_BATCH_MAX_WORKERS', DEFAULT_MAX_WORKERS))
+
+
+def get_max_batch_size():
+    """Quantidade máxima de notas aceitas em um único lote"""
+    return int(getattr(settings, 'NFE_BATCH_MAX_SIZE', DEFAULT_MAX_BATCH_SIZE))
+
+
+def emitir_lote(invoice_ids, workers=None):
+    """
+    Emite várias NF-e em paralelo
+
+    Args:
+        invoice_ids: Lista de IDs de Invoice
+        workers: Quantidade de processos (limitada por NFE_BATCH_MAX_WORKERS).
+                 Com 1 worker o lote roda no próprio processo.
+
+    Returns:
+        dict: {
+            'total': 10,
+            'sucesso': 9,
+            'falhas': 1,
+            'workers': 4,
+            'tempo_total': 3.21,      # segundos
+            'notas_por_segundo': 3.1,
+            'resultados': [{'invoice_id': 1, 'sucesso': True, ...}, ...]
+        }
+    """
+    invoice_ids = list(dict.fromkeys(int(i) for i in invoice_ids))
+
+    max_batch = get_max_batch_size()
+    if len(invoice_ids) > max_batch:
+        raise ValueError(f'Lote com {len(invoice_ids)} notas excede o limite de {max_batch}')
+
+    workers = max(1, min(int(workers or get_max_workers()), get_max_workers(), len(invoice_ids) or 1))
+
+    inicio = time.perf_counter()
+
+    # Chaves de acesso alocadas de uma vez (DVs em lote, um único bulk_update);
+    # os workers reaproveitam a chave salva em vez de gerar uma por nota
+    from invoices.models import Invoice
+    alocar_chaves(Invoice.objects.filter(pk__in=invoice_ids))
+
+    if workers == 1:
+        resultados = [_emitir_por_id(invoice_id) for invoice_id in invoice_ids]
+    else:
+        # Conexões abertas não podem ser compartilhadas com processos filhos
+        connections.close_all()
+        chunksize = max(1, len(invoice_ids) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers, initializer=_inicializar_worker) as executor:
+            resultados = list(executor.map(_emitir_por_id, invoice_ids, chunksize=chunksize))
+
+    tempo_total = time.perf_counter() - inicio
+    sucesso = sum(1 for r in resultados if r['sucesso'])
+
+    logger.info(f"Lote de {len(invoice_ids)} NF-e emitido em {tempo_total:.2f}s com {workers} worker(s)")
+
+    return {
+        'total': len(resultados),
+        'sucesso': sucesso,
+        'falhas': len(resultados) - sucesso,
+        'workers': workers,
+        'tempo_total': round(tempo_total, 4),
+        'notas_por_segundo': round(len(resultados) / tempo_total, 2) if tempo_total else None,
+        'resultados': resultados,
+    }
@@ -0,0 +1,107 @@
+"""
+Código de barras Code128-C vetorial para a chave de acesso
+A chave (44 dígitos) é codificada em pares de dígitos no conjunto C e
+desenhada como retângulos preenchidos direto no documento (fpdf ou
+reportlab), sem gerar imagem. As barras de cada símbolo são calculadas uma
+vez na importação e o desenho de cada chave fica no cache de códigos de
+barras do danfe_recursos.
+"""
+from . import danfe_recursos as recursos
+
+# Larguras (barra, espaço, barra, ...) dos símbolos 0..106, em módulos
+TABELA = (
+    '212222', '222122', '222221', '121223', '121322', '131222', '122213', '122312', '132212', '221213',
+    '221312', '231212', '112232', '122132', '122231', '113222', '123122', '123221', '223211', '221132',
+    '221231', '213212', '223112', '312131', '311222', '321122', '321221', '312212', '322112', '322211',
+    '212123', '212321', '232121', '111323', '131123', '131321', '112313', '132113', '132311', '211313',
+    '231113', '231311', '112133', '112331', '132131', '113123', '113321', '133121', '313121', '211331',
+    '231131', '213113', '213311', '213131', '311123', '311321', '331121', '312113', '312311', '332111',
+    '314111', '221411', '431111', '111224', '111422', '121124', '121421', '141122', '141221', '112214',
+    '112412', '122114', '122411', '142112', '142211', '241211', '221114', '413111', '241112', '134111',
+    '111242', '121142', '121241', '114212', '124112', '124211', '411212', '421112', '421211', '212141',
+    '214121', '412121', '111143', '111341', '131141', '114113', '114311', '411113', '411311', '113141',
+    '114131', '311141', '411131', '211412', '211214', '211232', '2331112',
+)
+INICIO_C = 105
+PARADA = 106
+
+# Margem clara obrigatória antes e depois das barras, em módulos
+ZONA_SILENCIOSA = 10
+
+
+def _barras_simbolo(larguras):
+    """'212222' -> ((0, 2), (3, 2), (7, 2)): início e largura de cada barra"""
+    barras = []
+    posicao = 0
+    for indice, largura in enumerate(larguras):
+        if indice % 2 == 0:
+            barras.append((posicao, int(largura)))
+        posicao += int(largura)
+    return tuple(barras), posicao
+
+
+_BARRAS = tuple(_barras_simbolo(larguras) for larguras in TABELA)
+
+
+def codificar(digitos):
+    """
+    Símbolos do Code128-C para uma sequência par de dígitos
+
+    Returns:
+        list: [105, pares..., dígito verificador, 106]
+
+    Raises:
+        ValueError: se houver caracteres não numéricos ou quantidade ímpar
+    """
+    if not digitos or not digitos.isdigit() or len(digitos) % 2:
+        raise ValueError(f"Code128-C exige quantidade par de dígitos: '{digitos}'")
+    simbolos = [INICIO_C] + [int(digitos[i:i + 2]) for i in range(0, len(digitos), 2)]
+    verificador = (simbolos[0] + sum(i * valor for i, valor in enumerate(simbolos[1:], 1))) % 103
+    return simbolos + [verificador, PARADA]
+
+
+def _padrao(digitos):
+    barras = []
+    posicao = ZONA_SILENCIOSA
+    for simbolo in codificar(digitos):
+        barras_simbolo, largura = _BARRAS[simbolo]
+        barras.extend((posicao + inicio, largura_barra) for inicio, largura_barra in barras_simbolo)
+        posicao += largura
+    return tuple(barras), posicao + ZONA_SILENCIOSA
+
+
+def padrao(digitos):
+    """
+    Barras da sequência em módulos, com as zonas silenciosas
+
+    Returns:
+        tuple: (((inicio, largura), ...), total de módulos)
+    """
+    return recursos.codigos_barras.obter(('code128c', digitos), lambda: _padrao(digitos))
+
+
+def desenhar_fpdf(pdf, digitos, x, y, w, h):
+    """Desenha o código em (x, y) ocupando w x h (unidade do documento) num único bloco de retângulos"""
+    barras, total = padrao(digitos)
+    k = pdf.k
+    modulo = w * k / total
+    base = (pdf.h - y) * k
+    altura = -h * k
+    x = x * k
+    retangulos = ' '.join(
+        f'{x + inicio * modulo:.2f} {base:.2f} {largura * modulo:.2f} {altura:.2f} re' for inicio, largura in barras
+    )
+    pdf._out(f'q 0 g {retangulos} f Q')
+
+
+def desenho_reportlab(digitos, largura, altura, bar_height, bar_width):
+    """Drawing do reportlab com as barras em retângulos (largura do módulo = bar_width)"""
+    from reportlab.graphics.shapes import Drawing, Rect
+    from reportlab.lib import colors
+
+    barras, _ = _padrao(digitos)
+    drawing = Drawing(largura, altura)
+    for inicio, largura_barra in barras:
+        drawing.add(Rect(inicio * bar_width, 0, largura_barra * bar_width, bar_height,
+                         fillColor=colors.black, strokeColor=None))
+    return drawing
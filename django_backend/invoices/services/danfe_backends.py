@@ -0,0 +1,109 @@
+"""
+Registro dos geradores (backends) de DANFE
+Cada layout ('pr', 'padrao', 'nfce') é desenhado pelo backend configurado
+em settings.NFE_DANFE_BACKEND_POR_LAYOUT; o modelo do documento
+(settings.NFE_DANFE_LAYOUT_POR_MODELO) e depois a UF do emitente
+(settings.NFE_DANFE_LAYOUT_POR_UF) definem o layout. Os números do benchmark_danfe
+(invoices/benchmarks/danfe_baseline.json) servem de base para a escolha.
+Todo PDF passa pelo estágio de saída (saida_pdf) antes de ser devolvido.
+"""
+from django.conf import settings
+from django.utils.module_loading import import_string
+from . import saida_pdf
+
+# Backends conhecidos: nome -> classe com generate() -> bytes
+DEFAULT_BACKENDS = {
+    'sefaz_pr': 'invoices.services.danfe_sefaz_pr.DANFESefazGenerator',
+    'parana': 'invoices.services.danfe_pr_generator.DANFEParanaGenerator',
+    'reportlab': 'invoices.services.pdf_generator.InvoicePDFGenerator',
+    'fpdf': 'invoices.services.danfe_fpdf_generator.DANFEFpdfGenerator',
+    'python_danfe': 'invoices.services.danfe_lib_adapter.DanfeLibAdapter',
+    'erpbrasil': 'invoices.services.danfe_erpbrasil_adapter.DanfeErpBrasilAdapter',
+    'nfce': 'invoices.services.danfe_nfce.DANFENFCeGenerator',
+}
+
+# Limites padrão (podem ser sobrescritos no settings.py)
+DEFAULT_BACKEND_POR_LAYOUT = {
+    'pr': 'sefaz_pr',
+    'padrao': 'reportlab',
+    'nfce': 'nfce',
+}
+DEFAULT_LAYOUT_POR_MODELO = {
+    '65': 'nfce',
+}
+DEFAULT_LAYOUT_POR_UF = {
+    'PR': 'pr',
+}
+LAYOUT_PADRAO = 'padrao'
+
+
+def get_backends():
+    """Backends conhecidos, com os extras de settings.NFE_DANFE_BACKENDS"""
+    return {**DEFAULT_BACKENDS, **getattr(settings, 'NFE_DANFE_BACKENDS', {})}
+
+
+def get_backend_por_layout():
+    """Backend de cada layout (settings.NFE_DANFE_BACKEND_POR_LAYOUT)"""
+    return {**DEFAULT_BACKEND_POR_LAYOUT, **getattr(settings, 'NFE_DANFE_BACKEND_POR_LAYOUT', {})}
+
+
+def get_layout_por_modelo():
+    """Layout de cada modelo de documento, ex.: NFC-e (settings.NFE_DANFE_LAYOUT_POR_MODELO)"""
+    return getattr(settings, 'NFE_DANFE_LAYOUT_POR_MODELO', DEFAULT_LAYOUT_POR_MODELO)
+
+
+def get_layout_por_uf():
+    """Layout usado para emitentes de cada UF (settings.NFE_DANFE_LAYOUT_POR_UF)"""
+    return getattr(settings, 'NFE_DANFE_LAYOUT_POR_UF', DEFAULT_LAYOUT_POR_UF)
+
+
+def layouts():
+    return tuple(get_backend_por_layout())
+
+
+def escolher_layout(invoice, layout=None):
+    """Layout pedido, se existir; senão o do modelo, o da UF do emitente ou o padrão"""
+    if layout in get_backend_por_layout():
+        return layout
+    if invoice.model_code in get_layout_por_modelo():
+        return get_layout_por_modelo()[invoice.model_code]
+    return get_layout_por_uf().get(invoice.issuer_state, LAYOUT_PADRAO)
+
+
+def backend_do_layout(layout):
+    return get_backend_por_layout()[layout]
+
+
+def carregar(nome):
+    """
+    Classe do backend
+
+    Raises:
+        KeyError: backend não registrado
+        ImportError: dependência opcional do backend não instalada
+    """
+    return import_string(get_backends()[nome])
+
+
+def disponiveis():
+    """Backends registrados cuja classe pode ser importada neste ambiente"""
+    nomes = []
+    for nome in get_backends():
+        try:
+            carregar(nome)
+        except ImportError:
+            continue
+        nomes.append(nome)
+    return nomes
+
+
+def renderizar(invoice, layout=None, backend=None):
+    """
+    Gera o DANFE com o backend indicado ou com o do layout
+
+    Returns:
+        bytes: PDF já compactado (ou em PDF/A) conforme saida_pdf.modo()
+    """
+    backend = backend or backend_do_layout(escolher_layout(invoice, layout))
+    pdf = bytes(carregar(backend)(invoice).generate())
+    return saida_pdf.processar(pdf, titulo=f'DANFE {invoice.number}/{invoice.series}')
@@ -0,0 +1,162 @@
+"""
+Cache do DANFE renderizado, por hash do conteúdo
+O hash cobre só o que o DANFE mostra (campos da nota, do destinatário e dos
+itens) mais a versão do layout e o modo do estágio de saída. O PDF fica no cache do Django e, depois de
+gravado, em invoice.pdf_file com o hash em invoice.danfe_hash; notas que não
+mudaram nunca voltam ao fpdf/reportlab. Salvar a nota ou um item descarta a
+entrada do cache (signals.py).
+"""
+from django.conf import settings
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.db import models
+from decimal import Decimal
+from .danfe_backends import escolher_layout, backend_do_layout, layouts, renderizar
+from . import saida_pdf
+import hashlib
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Limites padrão (podem ser sobrescritos no settings.py)
+DEFAULT_CACHE = 'default'
+DEFAULT_TTL = 24 * 3600
+
+# Layout -> versão; incremente ao mudar o desenho do gerador (o backend do layout também entra no hash)
+VERSAO_LAYOUT = {
+    'pr': '1',
+    'padrao': '3',
+    'nfce': '1',
+}
+
+# Campos que aparecem no DANFE (tudo o que algum backend de danfe_backends lê)
+CAMPOS_NOTA = (
+    'number', 'series', 'access_key', 'protocol', 'issue_date', 'authorization_date', 'additional_info', 'notes',
+    'operation_type', 'operation_nature', 'cfop',
+    'issuer_name', 'issuer_tax_id', 'issuer_state_registration', 'issuer_address', 'issuer_number',
+    'issuer_district', 'issuer_city', 'issuer_state', 'issuer_zip_code', 'issuer_phone',
+    'client_id', 'receiver_name', 'receiver_tax_id', 'receiver_state_registration', 'receiver_address',
+    'receiver_number', 'receiver_district', 'receiver_city', 'receiver_state', 'receiver_zip_code', 'receiver_phone',
+    'total_products', 'total_services', 'shipping', 'insurance', 'discount', 'other_expenses',
+    'icms_base', 'icms_value', 'ipi_value', 'iss_value', 'pis_value', 'cofins_value', 'total_value', 'freight_mode',
+    'model_code', 'environment', 'emission_type', 'payment_method', 'payment_description',
+)
+CAMPOS_CLIENTE = (
+    'name', 'tax_id', 'state_registration', 'street', 'number', 'neighborhood', 'city', 'state', 'zip_code', 'phone',
+)
+CAMPOS_ITEM = (
+    'code', 'description', 'ncm', 'cfop', 'unit', 'quantity', 'unit_value', 'total_value',
+    'icms_cst', 'icms_rate', 'icms_value', 'ipi_rate', 'ipi_value',
+)
+
+
+def get_cache():
+    """Cache do Django usado para os PDFs (settings.NFE_DANFE_CACHE)"""
+    return caches[getattr(settings, 'NFE_DANFE_CACHE', DEFAULT_CACHE)]
+
+
+def get_ttl():
+    """Segundos de validade de um PDF no cache (settings.NFE_DANFE_CACHE_TTL)"""
+    return int(getattr(settings, 'NFE_DANFE_CACHE_TTL', DEFAULT_TTL))
+
+
+def _valor(invoice, campo):
+    """Valor do campo como fica gravado (ex.: 0 e Decimal('0.00') se igualam)"""
+    valor = getattr(invoice, campo)
+    field = invoice._meta.get_field(campo)
+    if isinstance(field, models.DecimalField) and valor is not None:
+        return Decimal(valor).quantize(Decimal(1).scaleb(-field.decimal_places))
+    return valor
+
+
+def impressao(invoice, layout=None):
+    """
+    Hash SHA-256 do conteúdo que o DANFE mostra
+
+    Args:
+        invoice: Invoice
+        layout: Layout de danfe_backends (padrão: escolher_layout())
+
+    Returns:
+        str: 64 dígitos hexadecimais
+    """
+    layout = escolher_layout(invoice, layout)
+    cliente = invoice.client
+    conteudo = {
+        'layout': [layout, VERSAO_LAYOUT.get(layout, '1'), backend_do_layout(layout), saida_pdf.modo()],
+        'nota': [_valor(invoice, campo) for campo in CAMPOS_NOTA],
+        'cliente': [getattr(cliente, campo) for campo in CAMPOS_CLIENTE],
+        'itens': list(invoice.items.order_by('pk').values_list(*CAMPOS_ITEM)),
+    }
+    return hashlib.sha256(json.dumps(conteudo, default=str, separators=(',', ':')).encode('utf-8')).hexdigest()
+
+
+def _chave(invoice_id, layout):
+    return f'danfe:{invoice_id}:{layout}'
+
+
+def _renderizar(invoice, layout):
+    return renderizar(invoice, layout)
+
+
+def obter_danfe(invoice, layout=None):
+    """
+    PDF do DANFE, renderizado só quando o conteúdo mudou
+
+    Procura pelo hash no cache, depois em invoice.pdf_file (se danfe_hash
+    confere) e só então renderiza.
+
+    Returns:
+        tuple: (bytes do PDF, hash)
+    """
+    layout = escolher_layout(invoice, layout)
+    digest = impressao(invoice, layout)
+    cache = get_cache()
+    chave = _chave(invoice.pk, layout)
+
+    entrada = cache.get(chave)
+    if entrada and entrada[0] == digest:
+        return entrada[1], digest
+
+    if invoice.danfe_hash == digest and invoice.pdf_file:
+        try:
+            with invoice.pdf_file.open('rb') as pdf_file:
+                pdf = pdf_file.read()
+        except (FileNotFoundError, OSError) as e:
+            logger.warning(f"DANFE da nota {invoice.pk} não encontrado no storage: {str(e)}")
+        else:
+            cache.set(chave, (digest, pdf), get_ttl())
+            return pdf, digest
+
+    pdf = _renderizar(invoice, layout)
+    cache.set(chave, (digest, pdf), get_ttl())
+    return pdf, digest
+
+
+def gravar_danfe(invoice, nome=None, layout=None, save=True):
+    """
+    Grava o DANFE em invoice.pdf_file se o conteúdo mudou
+
+    Args:
+        invoice: Invoice
+        nome: Nome do arquivo (padrão: <chave>-danfe.pdf)
+        layout: Layout de danfe_backends (padrão: escolher_layout())
+        save: Salva pdf_file e danfe_hash na nota
+
+    Returns:
+        bytes: PDF
+    """
+    pdf, digest = obter_danfe(invoice, layout)
+    if invoice.danfe_hash != digest or not invoice.pdf_file:
+        nome = nome or f"{invoice.access_key or invoice.pk}-danfe.pdf"
+        invoice.pdf_file.save(nome, ContentFile(pdf), save=False)
+        invoice.danfe_hash = digest
+        if save:
+            invoice.save(update_fields=['pdf_file', 'danfe_hash'])
+    return pdf
+
+
+def invalidar(invoice_id):
+    """Descarta os PDFs em cache da nota (todos os layouts)"""
+    get_cache().delete_many([_chave(invoice_id, layout) for layout in layouts()])
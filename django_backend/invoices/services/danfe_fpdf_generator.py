@@ -5,6 +5,7 @@ Muito mais leve que ReportLab
 from fpdf import FPDF
 from decimal import Decimal
 from datetime import datetime
+from . import danfe_recursos as recursos
 import io
 
 
@@ -16,6 +17,7 @@ class DANFEFpdfGenerator:
         self.pdf = FPDF(orientation='P', unit='mm', format='A4')
         self.pdf.set_auto_page_break(auto=True, margin=10)
         self.pdf.add_page()
+        self.fonte = recursos.fonte_fpdf('Arial')
         
     def _format_currency(self, value):
         """Formata valor monetário"""
@@ -45,10 +47,10 @@ class DANFEFpdfGenerator:
     def _build_header(self):
         """Constrói o cabeçalho do DANFE"""
         # Título
-        self.pdf.set_font('Arial', 'B', 16)
+        self.pdf.set_font(self.fonte, 'B', 16)
         self.pdf.cell(0, 10, 'DANFE - Documento Auxiliar da Nota Fiscal Eletrônica', 0, 1, 'C')
         
-        self.pdf.set_font('Arial', '', 8)
+        self.pdf.set_font(self.fonte, '', 8)
         self.pdf.cell(0, 5, 'Não é documento fiscal - Simples representação da NF-e', 0, 1, 'C')
         self.pdf.ln(3)
         
@@ -56,12 +58,12 @@ class DANFEFpdfGenerator:
         """Constrói dados do emitente e destinatário"""
         # Box Emitente
         y_start = self.pdf.get_y()
-        self.pdf.set_font('Arial', 'B', 9)
+        self.pdf.set_font(self.fonte, 'B', 9)
         self.pdf.cell(95, 5, 'EMITENTE', 1, 0)
         self.pdf.cell(95, 5, 'DESTINATÁRIO/REMETENTE', 1, 1)
         
         # Dados do Emitente
-        self.pdf.set_font('Arial', '', 8)
+        self.pdf.set_font(self.fonte, '', 8)
         y_start = self.pdf.get_y()
         
         # Coluna Emitente
@@ -100,10 +102,10 @@ class DANFEFpdfGenerator:
         
     def _build_invoice_data(self):
         """Constrói dados da nota fiscal"""
-        self.pdf.set_font('Arial', 'B', 9)
+        self.pdf.set_font(self.fonte, 'B', 9)
         self.pdf.cell(0, 5, 'DADOS DA NOTA FISCAL', 1, 1, 'C')
         
-        self.pdf.set_font('Arial', '', 8)
+        self.pdf.set_font(self.fonte, '', 8)
         data = [
             f"Número: {self.invoice.number}",
             f"Série: {self.invoice.series}",
@@ -125,7 +127,7 @@ class DANFEFpdfGenerator:
         
     def _build_items_table(self):
         """Constrói tabela de produtos/serviços"""
-        self.pdf.set_font('Arial', 'B', 8)
+        self.pdf.set_font(self.fonte, 'B', 8)
         self.pdf.cell(0, 5, 'PRODUTOS / SERVIÇOS', 1, 1, 'C')
         
         # Cabeçalho da tabela
@@ -138,7 +140,7 @@ class DANFEFpdfGenerator:
         self.pdf.cell(35, 5, 'Valor Total', 1, 1, 'C')
         
         # Itens
-        self.pdf.set_font('Arial', '', 7)
+        self.pdf.set_font(self.fonte, '', 7)
         items = self.invoice.items.all()
         
         if not items.exists():
@@ -147,20 +149,20 @@ class DANFEFpdfGenerator:
             for idx, item in enumerate(items, 1):
                 self.pdf.cell(10, 5, str(idx), 1, 0, 'C')
                 self.pdf.cell(60, 5, (item.description or '')[:35], 1, 0, 'L')
-                self.pdf.cell(20, 5, item.ncm_code or '', 1, 0, 'C')
+                self.pdf.cell(20, 5, item.ncm or '', 1, 0, 'C')
                 self.pdf.cell(20, 5, f"{float(item.quantity or 0):.2f}", 1, 0, 'R')
                 self.pdf.cell(15, 5, item.unit or '', 1, 0, 'C')
-                self.pdf.cell(30, 5, self._format_currency(item.unit_price), 1, 0, 'R')
-                self.pdf.cell(35, 5, self._format_currency(item.total_price), 1, 1, 'R')
+                self.pdf.cell(30, 5, self._format_currency(item.unit_value), 1, 0, 'R')
+                self.pdf.cell(35, 5, self._format_currency(item.total_value), 1, 1, 'R')
         
         self.pdf.ln(2)
         
     def _build_totals(self):
         """Constrói totalizadores"""
-        self.pdf.set_font('Arial', 'B', 9)
+        self.pdf.set_font(self.fonte, 'B', 9)
         self.pdf.cell(0, 5, 'CÁLCULO DO IMPOSTO', 1, 1, 'C')
         
-        self.pdf.set_font('Arial', '', 8)
+        self.pdf.set_font(self.fonte, '', 8)
         totals = [
             ('Base ICMS', self._format_currency(self.invoice.icms_base)),
             ('Valor ICMS', self._format_currency(self.invoice.icms_value)),
@@ -190,10 +192,10 @@ class DANFEFpdfGenerator:
         
     def _build_transport(self):
         """Constrói dados de transporte"""
-        self.pdf.set_font('Arial', 'B', 9)
+        self.pdf.set_font(self.fonte, 'B', 9)
         self.pdf.cell(0, 5, 'TRANSPORTADOR / VOLUMES TRANSPORTADOS', 1, 1, 'C')
         
-        self.pdf.set_font('Arial', '', 8)
+        self.pdf.set_font(self.fonte, '', 8)
         freight_labels = {
             '0': '0-Emitente',
             '1': '1-Destinatário',
@@ -209,10 +211,10 @@ class DANFEFpdfGenerator:
         
     def _build_additional(self):
         """Constrói informações adicionais"""
-        self.pdf.set_font('Arial', 'B', 9)
+        self.pdf.set_font(self.fonte, 'B', 9)
         self.pdf.cell(0, 5, 'DADOS ADICIONAIS', 1, 1, 'C')
         
-        self.pdf.set_font('Arial', '', 7)
+        self.pdf.set_font(self.fonte, '', 7)
         notes = self.invoice.notes or 'Sem observações'
         
         # Quebra texto em linhas
@@ -242,7 +244,7 @@ class DANFEFpdfGenerator:
     def _build_footer(self):
         """Constrói rodapé"""
         self.pdf.ln(5)
-        self.pdf.set_font('Arial', 'I', 7)
+        self.pdf.set_font(self.fonte, 'I', 7)
         self.pdf.cell(0, 5, 'Documento gerado eletronicamente - Contabiliza.IA', 0, 1, 'C')
         
         if self.invoice.access_key:
@@ -0,0 +1,258 @@
+"""
+DANFE NFC-e (cupom de 80 mm para impressoras térmicas)
+Layout do Manual de Especificações Técnicas do DANFE NFC-e e QR Code:
+emitente, itens, totais, pagamento, chave de acesso com a URL de consulta,
+consumidor, identificação e protocolo, QR Code e tributos.
+
+Feito para volume de varejo: nada de platypus, o texto é de largura fixa
+(Courier, 48 colunas) e já sai quebrado em linhas, a altura da página é
+calculada antes de desenhar e o QR Code vem do codificador em cache do
+qr_code, desenhado em retângulos vetoriais.
+"""
+from django.conf import settings
+from fpdf import FPDF
+from . import danfe_recursos as recursos
+from . import qr_code
+from .access_key import montar_chaves, prefixo_chave
+from decimal import Decimal
+import hashlib
+import textwrap
+
+# Limites padrão (podem ser sobrescritos no settings.py)
+DEFAULT_URLS = {
+    'PR': {
+        'qrcode': 'http://www.fazenda.pr.gov.br/nfce/qrcode',
+        'consulta': 'http://www.fazenda.pr.gov.br/nfce/consulta',
+    },
+}
+
+# Geometria do cupom (mm)
+LARGURA_PAPEL = 80
+MARGEM = 4
+COLUNAS = 48
+TAMANHO_FONTE = 7
+ENTRELINHA = 3.0
+LADO_QR = 30
+ESPACO_QR = 2
+
+# Versão do QR Code da NFC-e (NT 2015.002)
+VERSAO_QRCODE = '2'
+
+SEPARADOR = '-' * COLUNAS
+
+
+def get_urls():
+    """URLs do QR Code e de consulta por UF (settings.NFE_NFCE_URLS)"""
+    return {**DEFAULT_URLS, **getattr(settings, 'NFE_NFCE_URLS', {})}
+
+
+def get_csc():
+    """
+    Código de Segurança do Contribuinte e seu identificador (settings.NFE_NFCE_CSC, NFE_NFCE_CSC_ID)
+
+    Returns:
+        tuple: (csc, id do token sem zeros à esquerda)
+    """
+    csc = getattr(settings, 'NFE_NFCE_CSC', '')
+    id_token = str(getattr(settings, 'NFE_NFCE_CSC_ID', '')).lstrip('0')
+    return csc, id_token
+
+
+def _urls(uf):
+    try:
+        return get_urls()[uf]
+    except KeyError:
+        raise ValueError(f"URLs da NFC-e não configuradas para a UF '{uf}' (settings.NFE_NFCE_URLS)")
+
+
+def conteudo_qrcode(invoice, chave):
+    """
+    URL do QR Code (versão 2, emissão online)
+
+    Returns:
+        str: '<url>?p=<chave>|2|<tpAmb>|<cIdToken>|<SHA-1 em hexadecimal maiúsculo>'
+
+    Raises:
+        ValueError: CSC ou URL da UF não configurados
+    """
+    csc, id_token = get_csc()
+    if not csc or not id_token:
+        raise ValueError('CSC da NFC-e não configurado (settings.NFE_NFCE_CSC e NFE_NFCE_CSC_ID)')
+    parametros = f'{chave}|{VERSAO_QRCODE}|{invoice.environment}|{id_token}'
+    assinatura = hashlib.sha1(f'{parametros}{csc}'.encode('utf-8')).hexdigest().upper()
+    return f"{_urls(invoice.issuer_state)['qrcode']}?p={parametros}|{assinatura}"
+
+
+def _moeda(valor):
+    return f"{Decimal(valor or 0):,.2f}".replace(',', 'X').replace('.', ',').replace('X', '.')
+
+
+def _quantidade(valor):
+    return f"{Decimal(valor or 0):,.3f}".replace(',', 'X').replace('.', ',').replace('X', '.')
+
+
+def _documento(doc):
+    doc = ''.join(filter(str.isdigit, str(doc or '')))
+    if len(doc) == 11:
+        return f'CPF {doc[:3]}.{doc[3:6]}.{doc[6:9]}-{doc[9:]}'
+    if len(doc) == 14:
+        return f'CNPJ {doc[:2]}.{doc[2:5]}.{doc[5:8]}/{doc[8:12]}-{doc[12:]}'
+    return doc
+
+
+def _data(valor):
+    return valor.strftime('%d/%m/%Y %H:%M:%S') if valor else ''
+
+
+class DANFENFCeGenerator:
+    """Gera o DANFE NFC-e em bobina de 80 mm"""
+
+    def __init__(self, invoice):
+        self.invoice = invoice
+        self.fonte = recursos.fonte_fpdf('Courier')
+        self.linhas = []
+
+    def _chave(self):
+        """Chave da nota; sem chave (nota não transmitida) usa uma de pré-visualização"""
+        if self.invoice.access_key:
+            return self.invoice.access_key
+        return montar_chaves([prefixo_chave(self.invoice)], ['0' * 8])[0]
+
+    # ========== Linhas de texto ==========
+
+    def _texto(self, texto, alinhamento='L', negrito=False):
+        for linha in textwrap.wrap(str(texto), COLUNAS) or ['']:
+            if alinhamento == 'C':
+                linha = linha.center(COLUNAS)
+            elif alinhamento == 'R':
+                linha = linha.rjust(COLUNAS)
+            self.linhas.append((linha, negrito))
+
+    def _par(self, rotulo, valor, negrito=False):
+        """Rótulo à esquerda e valor à direita na mesma linha"""
+        valor = str(valor)
+        self.linhas.append((f'{rotulo[:COLUNAS - len(valor) - 1]:<{COLUNAS - len(valor)}}{valor}', negrito))
+
+    def _separador(self):
+        self.linhas.append((SEPARADOR, False))
+
+    def _emitente(self):
+        inv = self.invoice
+        self._texto(inv.issuer_name, 'C', True)
+        documento = _documento(inv.issuer_tax_id)
+        if inv.issuer_state_registration:
+            documento += f' IE {inv.issuer_state_registration}'
+        self._texto(documento, 'C')
+        endereco = ', '.join(filter(None, (
+            inv.issuer_address, inv.issuer_number, inv.issuer_district,
+            f'{inv.issuer_city} - {inv.issuer_state}' if inv.issuer_city else inv.issuer_state,
+        )))
+        self._texto(endereco, 'C')
+        self._separador()
+        self._texto('DOCUMENTO AUXILIAR DA NOTA FISCAL DE', 'C', True)
+        self._texto('CONSUMIDOR ELETRÔNICA', 'C', True)
+        self._separador()
+
+    def _itens(self, itens):
+        self._par('CÓDIGO DESCRIÇÃO', 'QTDE UN VL UNIT VL TOTAL', True)
+        for numero, item in enumerate(itens, 1):
+            self._texto(f'{numero:03d} {item.code} {item.description}')
+            self._texto(
+                f'{_quantidade(item.quantity)} {item.unit} X {_moeda(item.unit_value)} = {_moeda(item.total_value)}', 'R'
+            )
+        self._separador()
+
+    def _totais(self, quantidade):
+        inv = self.invoice
+        self._par('QTD. TOTAL DE ITENS', quantidade)
+        self._par('VALOR TOTAL R$', _moeda(inv.total_products))
+        if inv.discount:
+            self._par('DESCONTO R$', _moeda(inv.discount))
+        acrescimos = (inv.shipping or 0) + (inv.insurance or 0) + (inv.other_expenses or 0)
+        if acrescimos:
+            self._par('ACRÉSCIMOS R$', _moeda(acrescimos))
+        self._par('VALOR A PAGAR R$', _moeda(inv.total_value), True)
+        self._par('FORMA DE PAGAMENTO', 'VALOR PAGO R$', True)
+        forma = inv.payment_description or inv.get_payment_method_display().split('-', 1)[-1]
+        self._par(forma, _moeda(inv.total_value))
+        self._separador()
+
+    def _consulta(self, chave):
+        self._texto('Consulte pela Chave de Acesso em', 'C', True)
+        self._texto(_urls(self.invoice.issuer_state)['consulta'], 'C')
+        grupos = [chave[i:i + 4] for i in range(0, len(chave), 4)]
+        self._texto(' '.join(grupos[:6]), 'C')
+        self._texto(' '.join(grupos[6:]), 'C')
+        self._separador()
+
+    def _consumidor(self):
+        inv = self.invoice
+        if inv.receiver_tax_id:
+            self._texto(f'CONSUMIDOR - {_documento(inv.receiver_tax_id)}', 'C', True)
+            if inv.receiver_name:
+                self._texto(inv.receiver_name, 'C')
+        else:
+            self._texto('CONSUMIDOR NÃO IDENTIFICADO', 'C', True)
+        self._separador()
+
+    def _identificacao(self):
+        inv = self.invoice
+        self._texto(f'NFC-e nº {str(inv.number).zfill(9)} Série {str(inv.series).zfill(3)} {_data(inv.issue_date)}', 'C', True)
+        if inv.protocol:
+            self._texto(f'Protocolo de autorização: {inv.protocol}', 'C')
+            self._texto(f'Data de autorização: {_data(inv.authorization_date)}', 'C')
+        else:
+            self._texto('DOCUMENTO SEM AUTORIZAÇÃO DE USO', 'C', True)
+        if inv.environment == '2':
+            self._texto('EMITIDA EM AMBIENTE DE HOMOLOGAÇÃO', 'C', True)
+            self._texto('SEM VALOR FISCAL', 'C', True)
+        if inv.emission_type != '1':
+            self._texto('EMITIDA EM CONTINGÊNCIA', 'C', True)
+
+    def _rodape(self):
+        inv = self.invoice
+        tributos = sum((v or 0 for v in (inv.icms_value, inv.ipi_value, inv.pis_value, inv.cofins_value)), Decimal('0'))
+        self._texto(f'Tributos Totais Incidentes (Lei Federal 12.741/2012): R$ {_moeda(tributos)}', 'C')
+        if inv.additional_info:
+            self._separador()
+            self._texto(inv.additional_info)
+
+    # ========== Desenho ==========
+
+    def _escrever(self, pdf, linhas, y):
+        negrito_atual = None
+        for linha, negrito in linhas:
+            if negrito != negrito_atual:
+                pdf.set_font(self.fonte, 'B' if negrito else '', TAMANHO_FONTE)
+                negrito_atual = negrito
+            y += ENTRELINHA
+            pdf.text(MARGEM, y - 0.6, linha)
+        return y
+
+    def generate(self):
+        """Gera o cupom com o QR Code de consulta"""
+        itens = list(self.invoice.items.order_by('pk'))
+        chave = self._chave()
+        conteudo = conteudo_qrcode(self.invoice, chave)
+
+        self._emitente()
+        self._itens(itens)
+        self._totais(len(itens))
+        self._consulta(chave)
+        self._consumidor()
+        self._identificacao()
+        antes_qr = self.linhas
+        self.linhas = []
+        self._rodape()
+        depois_qr = self.linhas
+
+        altura = 2 * MARGEM + (len(antes_qr) + len(depois_qr)) * ENTRELINHA + LADO_QR + 2 * ESPACO_QR
+        pdf = FPDF('P', 'mm', (LARGURA_PAPEL, altura))
+        pdf.set_auto_page_break(False)
+        pdf.add_page()
+
+        y = self._escrever(pdf, antes_qr, MARGEM) + ESPACO_QR
+        qr_code.desenhar_fpdf(pdf, conteudo, (LARGURA_PAPEL - LADO_QR) / 2, y, LADO_QR)
+        self._escrever(pdf, depois_qr, y + LADO_QR + ESPACO_QR)
+
+        return bytes(pdf.output())
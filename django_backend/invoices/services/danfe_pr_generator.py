@@ -6,73 +6,90 @@ from reportlab.lib.pagesizes import A4
 from reportlab.lib import colors
 from reportlab.lib.units import mm
 from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Image
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib.styles import ParagraphStyle
 from reportlab.lib.enums import TA_CENTER, TA_LEFT, TA_RIGHT
-from reportlab.graphics.barcode import code128
-from reportlab.graphics.shapes import Drawing
 from django.core.files.base import ContentFile
+from . import danfe_recursos as recursos
+from .tabela_itens import TabelaItens
 import io
 from datetime import datetime
 
 
+def _estilos():
+    """Estilos de texto do documento, criados uma vez por processo (danfe_recursos)"""
+    styles = recursos.folha_estilos()
+    estilos = {}
+    estilos['title'] = ParagraphStyle(
+        'Title',
+        parent=styles['Normal'],
+        fontSize=14,
+        fontName='Helvetica-Bold',
+        alignment=TA_CENTER,
+        spaceAfter=2
+    )
+
+    estilos['header'] = ParagraphStyle(
+        'Header',
+        parent=styles['Normal'],
+        fontSize=8,
+        fontName='Helvetica-Bold',
+        alignment=TA_CENTER
+    )
+
+    estilos['label'] = ParagraphStyle(
+        'Label',
+        parent=styles['Normal'],
+        fontSize=6,
+        fontName='Helvetica-Bold',
+        textColor=colors.black
+    )
+
+    estilos['value'] = ParagraphStyle(
+        'Value',
+        parent=styles['Normal'],
+        fontSize=8,
+        fontName='Helvetica',
+        textColor=colors.black
+    )
+
+    estilos['small'] = ParagraphStyle(
+        'Small',
+        parent=styles['Normal'],
+        fontSize=7,
+        fontName='Helvetica'
+    )
+
+    estilos['big'] = ParagraphStyle(
+        'Big',
+        parent=styles['Normal'],
+        fontSize=20,
+        fontName='Helvetica-Bold',
+        alignment=TA_CENTER
+    )
+    return estilos
+
+
+recursos.registrar('estilos_danfe_pr', _estilos)
+
+
 class DANFEParanaGenerator:
     """Gerador de DANFE para Nota Fiscal do Produtor Rural - Padrão SEFAZ-PR"""
     
     def __init__(self, invoice):
         self.invoice = invoice
         self.width, self.height = A4
-        self.styles = getSampleStyleSheet()
+        self.styles = recursos.folha_estilos()
         self._setup_styles()
     
     def _setup_styles(self):
         """Configura os estilos de texto do documento"""
-        self.title_style = ParagraphStyle(
-            'Title',
-            parent=self.styles['Normal'],
-            fontSize=14,
-            fontName='Helvetica-Bold',
-            alignment=TA_CENTER,
-            spaceAfter=2
-        )
-        
-        self.header_style = ParagraphStyle(
-            'Header',
-            parent=self.styles['Normal'],
-            fontSize=8,
-            fontName='Helvetica-Bold',
-            alignment=TA_CENTER
-        )
-        
-        self.label_style = ParagraphStyle(
-            'Label',
-            parent=self.styles['Normal'],
-            fontSize=6,
-            fontName='Helvetica-Bold',
-            textColor=colors.black
-        )
-        
-        self.value_style = ParagraphStyle(
-            'Value',
-            parent=self.styles['Normal'],
-            fontSize=8,
-            fontName='Helvetica',
-            textColor=colors.black
-        )
-        
-        self.small_style = ParagraphStyle(
-            'Small',
-            parent=self.styles['Normal'],
-            fontSize=7,
-            fontName='Helvetica'
-        )
-        
-        self.big_style = ParagraphStyle(
-            'Big',
-            parent=self.styles['Normal'],
-            fontSize=20,
-            fontName='Helvetica-Bold',
-            alignment=TA_CENTER
-        )
+        estilos = recursos.obter('estilos_danfe_pr')
+        self.title_style = estilos['title']
+        self.header_style = estilos['header']
+        self.label_style = estilos['label']
+        self.value_style = estilos['value']
+        self.small_style = estilos['small']
+        self.big_style = estilos['big']
     
     def _format_cpf_cnpj(self, doc):
         """Formata CPF ou CNPJ"""
@@ -277,10 +294,7 @@ class DANFEParanaGenerator:
         
         # Código de Barras
         try:
-            barcode = code128.Code128(access_key, barHeight=15*mm, barWidth=0.33*mm)
-            drawing = Drawing(190*mm, 18*mm)
-            drawing.add(barcode)
-            elements.append(drawing)
+            elements.append(recursos.codigo_barras_reportlab(access_key, 190*mm, 18*mm, 15*mm, 0.33*mm))
         except:
             elements.append(Paragraph(f'[CÓDIGO DE BARRAS: {access_key}]', self.small_style))
         
@@ -613,74 +627,41 @@ class DANFEParanaGenerator:
         
         # Cabeçalho da tabela
         headers = [
-            Paragraph('<b>CÓDIGO<br/>PRODUTO</b>', self.label_style),
-            Paragraph('<b>DESCRIÇÃO DO<br/>PRODUTO/SERVIÇOS</b>', self.label_style),
-            Paragraph('<b>NCM/SH</b>', self.label_style),
-            Paragraph('<b>CST</b>', self.label_style),
-            Paragraph('<b>CFOP</b>', self.label_style),
-            Paragraph('<b>UNID</b>', self.label_style),
-            Paragraph('<b>QUANTIDADE</b>', self.label_style),
-            Paragraph('<b>VALOR<br/>UNITÁRIO</b>', self.label_style),
-            Paragraph('<b>VALOR<br/>TOTAL</b>', self.label_style),
-            Paragraph('<b>BASE<br/>CÁLC. ICMS</b>', self.label_style),
-            Paragraph('<b>ALÍQ.<br/>ICMS</b>', self.label_style),
-            Paragraph('<b>VALOR<br/>ICMS</b>', self.label_style),
-            Paragraph('<b>ALÍQ.<br/>IPI</b>', self.label_style),
-            Paragraph('<b>VALOR<br/>IPI</b>', self.label_style)
+            'CÓDIGO\nPRODUTO', 'DESCRIÇÃO DO\nPRODUTO/SERVIÇOS', 'NCM/SH', 'CST', 'CFOP', 'UNID', 'QUANT.',
+            'VALOR\nUNITÁRIO', 'VALOR\nTOTAL', 'BASE\nCÁLC. ICMS', 'ALÍQ.\nICMS', 'VALOR\nICMS', 'ALÍQ.\nIPI', 'VALOR\nIPI',
         ]
         
-        data = [headers]
-        
-        # Adicionar itens
-        for item in self.invoice.items.all():
-            data.append([
-                Paragraph(str(item.code), self.small_style),
-                Paragraph(item.description[:30], self.small_style),
-                Paragraph(item.ncm or '-', self.small_style),
-                Paragraph(item.icms_cst or '-', self.small_style),
-                Paragraph(item.cfop or '-', self.small_style),
-                Paragraph(item.unit, self.small_style),
-                Paragraph(f"{item.quantity:.4f}".rstrip('0').rstrip('.'), self.small_style),
-                Paragraph(f"{item.unit_value:.2f}", self.small_style),
-                Paragraph(f"{item.total_value:.2f}", self.small_style),
-                Paragraph(f"{item.total_value:.2f}", self.small_style),  # Base ICMS aproximada
-                Paragraph(f"{item.icms_rate:.2f}", self.small_style),
-                Paragraph(f"{item.icms_value:.2f}", self.small_style),
-                Paragraph(f"{item.ipi_rate:.2f}", self.small_style),
-                Paragraph(f"{item.ipi_value:.2f}", self.small_style)
-            ])
+        # Itens como texto; a tabela paginada calcula as alturas uma vez
+        rows = [
+            (
+                str(item.code),
+                item.description[:30],
+                item.ncm or '-',
+                item.icms_cst or '-',
+                item.cfop or '-',
+                item.unit,
+                f"{item.quantity:.4f}".rstrip('0').rstrip('.'),
+                f"{item.unit_value:.2f}",
+                f"{item.total_value:.2f}",
+                f"{item.total_value:.2f}",  # Base ICMS aproximada
+                f"{item.icms_rate:.2f}",
+                f"{item.icms_value:.2f}",
+                f"{item.ipi_rate:.2f}",
+                f"{item.ipi_value:.2f}",
+            )
+            for item in self.invoice.items.all()
+        ]
         
         # Se não houver itens
-        if len(data) == 1:
-            data.append([
-                Paragraph('-', self.small_style),
-                Paragraph('Nenhum item cadastrado', self.small_style),
-                Paragraph('-', self.small_style),
-                Paragraph('-', self.small_style),
-                Paragraph('-', self.small_style),
-                Paragraph('-', self.small_style),
-                Paragraph('-', self.small_style),
-                Paragraph('-', self.small_style),
-                Paragraph('-', self.small_style),
-                Paragraph('-', self.small_style),
-                Paragraph('-', self.small_style),
-                Paragraph('-', self.small_style),
-                Paragraph('-', self.small_style),
-                Paragraph('-', self.small_style)
-            ])
+        if not rows:
+            rows.append(('-', 'Nenhum item cadastrado') + ('-',) * 12)
         
         col_widths = [12*mm, 35*mm, 12*mm, 8*mm, 10*mm, 8*mm, 15*mm, 13*mm, 13*mm, 13*mm, 10*mm, 13*mm, 10*mm, 13*mm]
         
-        table = Table(data, colWidths=col_widths, repeatRows=1)
-        table.setStyle(TableStyle([
-            ('BOX', (0, 0), (-1, -1), 1, colors.black),
-            ('INNERGRID', (0, 0), (-1, -1), 0.5, colors.black),
-            ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),
-            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-            ('ALIGN', (0, 0), (-1, -1), 'CENTER'),
-            ('FONTSIZE', (0, 0), (-1, -1), 6),
-        ]))
-        elements.append(table)
+        elements.append(TabelaItens(
+            headers, rows, col_widths, alinhamentos=['C'] * len(col_widths), tamanho=7, borda=1, grade=0.5,
+            titulo_continuacao=f'DADOS DOS PRODUTOS/SERVIÇOS (CONTINUAÇÃO) - NF-e Nº {self.invoice.number} SÉRIE {self.invoice.series}',
+        ))
         
         return elements
     
@@ -0,0 +1,320 @@
+"""
+Registro de recursos compartilhados pelos geradores de DANFE
+Imagens, fontes, folhas de estilo do reportlab e códigos de barras são
+carregados uma vez por processo (precarregar_processo() roda na subida do
+worker de emissão e do WSGI; nos demais comandos carregam no primeiro uso) e
+entregues a
+DANFESefazGenerator, DANFEParanaGenerator, InvoicePDFGenerator,
+DANFEFpdfGenerator e DANFENFCeGenerator. Cada recurso mede quanto custou
+carregar e quantas vezes foi reaproveitado; estatisticas() estima o tempo
+de renderização poupado.
+"""
+from django.conf import settings
+from collections import OrderedDict
+from io import BytesIO
+import importlib
+import threading
+import logging
+import time
+import os
+
+logger = logging.getLogger(__name__)
+
+# Limites padrão (podem ser sobrescritos no settings.py)
+DEFAULT_PRECARREGAR = True
+DEFAULT_MAX_CODIGOS = 256
+
+# Módulos dos geradores (registram seus próprios estilos ao serem importados)
+GERADORES = (
+    'invoices.services.danfe_sefaz_pr',
+    'invoices.services.danfe_pr_generator',
+    'invoices.services.pdf_generator',
+    'invoices.services.danfe_fpdf_generator',
+    'invoices.services.danfe_nfce',
+)
+
+# Imagens conhecidas: nome -> caminhos candidatos relativos a django_backend/
+IMAGENS = {
+    'brasao_pr': (
+        os.path.join('assets', 'brasao_pr.png'),
+        os.path.join('..', 'frontend', 'assets', 'brasao_pr.png'),
+    ),
+}
+BASE_DIR = os.path.normpath(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+
+def get_precarregar():
+    """Carrega os recursos na subida do worker/WSGI (settings.NFE_DANFE_PRECARREGAR)"""
+    return bool(getattr(settings, 'NFE_DANFE_PRECARREGAR', DEFAULT_PRECARREGAR))
+
+
+def get_max_codigos():
+    """Códigos de barras mantidos em memória (settings.NFE_DANFE_CODIGOS_CACHE)"""
+    return int(getattr(settings, 'NFE_DANFE_CODIGOS_CACHE', DEFAULT_MAX_CODIGOS))
+
+
+class RegistroRecursos:
+    """Recursos nomeados, carregados uma vez e mantidos até limpar()"""
+
+    def __init__(self):
+        self._carregadores = {}
+        self._valores = {}
+        self._metricas = {}
+        self._lock = threading.RLock()
+
+    def registrar(self, nome, carregador):
+        """Associa um nome a uma função sem argumentos que produz o recurso"""
+        self._carregadores[nome] = carregador
+
+    def _carregar(self, nome):
+        inicio = time.perf_counter()
+        valor = self._carregadores[nome]()
+        self._valores[nome] = valor
+        self._metricas[nome] = {
+            'carregamento_ms': (time.perf_counter() - inicio) * 1000, 'usos': 0, 'reaproveitamentos': 0,
+        }
+        return valor
+
+    def obter(self, nome):
+        """Valor do recurso, carregando-o na primeira vez"""
+        if nome not in self._valores:
+            with self._lock:
+                if nome not in self._valores:
+                    valor = self._carregar(nome)
+                    self._metricas[nome]['usos'] += 1
+                    return valor
+        metricas = self._metricas[nome]
+        metricas['usos'] += 1
+        metricas['reaproveitamentos'] += 1
+        return self._valores[nome]
+
+    def precarregar(self):
+        """Carrega todos os recursos registrados que ainda não foram carregados"""
+        with self._lock:
+            for nome in list(self._carregadores):
+                if nome not in self._valores:
+                    try:
+                        self._carregar(nome)
+                    except Exception as e:
+                        logger.warning(f"Recurso do DANFE '{nome}' não pôde ser pré-carregado: {str(e)}")
+
+    def estatisticas(self):
+        """{'nome': {'carregamento_ms': 12.5, 'usos': 40, 'reaproveitamentos': 40, 'economia_ms': 500.0}}"""
+        return {
+            nome: {**metricas, 'economia_ms': metricas['reaproveitamentos'] * metricas['carregamento_ms']}
+            for nome, metricas in self._metricas.items()
+        }
+
+    def limpar(self):
+        with self._lock:
+            self._valores.clear()
+            self._metricas.clear()
+
+
+class CacheCodigosBarras:
+    """Códigos de barras já gerados (LRU), por chave de acesso e formato"""
+
+    def __init__(self):
+        self._itens = OrderedDict()
+        self._lock = threading.Lock()
+        self.gerados = 0
+        self.reaproveitados = 0
+        self.geracao_ms = 0.0
+
+    def obter(self, chave, gerar):
+        with self._lock:
+            if chave in self._itens:
+                self._itens.move_to_end(chave)
+                self.reaproveitados += 1
+                return self._itens[chave]
+
+        inicio = time.perf_counter()
+        valor = gerar()
+        with self._lock:
+            self.gerados += 1
+            self.geracao_ms += (time.perf_counter() - inicio) * 1000
+            self._itens[chave] = valor
+            while len(self._itens) > get_max_codigos():
+                self._itens.popitem(last=False)
+        return valor
+
+    def estatisticas(self):
+        media = self.geracao_ms / self.gerados if self.gerados else 0.0
+        return {
+            'gerados': self.gerados, 'reaproveitados': self.reaproveitados,
+            'geracao_ms_media': media, 'economia_ms': self.reaproveitados * media,
+        }
+
+    def limpar(self):
+        with self._lock:
+            self._itens.clear()
+            self.gerados = self.reaproveitados = 0
+            self.geracao_ms = 0.0
+
+
+registro = RegistroRecursos()
+codigos_barras = CacheCodigosBarras()
+
+
+def registrar(nome, carregador):
+    registro.registrar(nome, carregador)
+
+
+def obter(nome):
+    return registro.obter(nome)
+
+
+def precarregar():
+    """Importa os geradores e carrega todos os recursos"""
+    for modulo in GERADORES:
+        importlib.import_module(modulo)
+    registro.precarregar()
+
+
+def precarregar_processo():
+    """
+    Pré-carga na subida dos processos que renderizam DANFE (worker de emissão e WSGI)
+
+    Fora do AppConfig.ready: migrate, shell e os demais comandos não pagam a
+    carga e os recursos são carregados (e medidos) no primeiro uso.
+    """
+    if get_precarregar():
+        precarregar()
+
+
+def estatisticas():
+    """
+    Métricas dos recursos compartilhados
+
+    Returns:
+        dict: {
+            'recursos': {'folha_estilos': {'carregamento_ms': 3.1, 'usos': 40, 'reaproveitamentos': 40, 'economia_ms': 124.0}, ...},
+            'codigos_barras': {'gerados': 30, 'reaproveitados': 10, 'geracao_ms_media': 9.5, 'economia_ms': 95.0},
+            'economia_ms': 219.0
+        }
+    """
+    recursos = registro.estatisticas()
+    codigos = codigos_barras.estatisticas()
+    return {
+        'recursos': recursos,
+        'codigos_barras': codigos,
+        'economia_ms': sum(r['economia_ms'] for r in recursos.values()) + codigos['economia_ms'],
+    }
+
+
+def limpar():
+    """Descarta recursos e métricas (o próximo uso recarrega)"""
+    registro.limpar()
+    codigos_barras.limpar()
+
+
+# ========== Imagens ==========
+
+def _ler_imagem(nome):
+    for caminho in IMAGENS[nome]:
+        caminho = os.path.normpath(os.path.join(BASE_DIR, caminho))
+        if os.path.exists(caminho):
+            with open(caminho, 'rb') as arquivo:
+                return arquivo.read()
+    return None
+
+
+def _info_fpdf(conteudo):
+    """Imagem já decodificada e comprimida pelo fpdf, pronta para qualquer documento"""
+    from fpdf.image_parsing import get_img_info
+
+    return get_img_info('recurso', BytesIO(conteudo)) if conteudo else None
+
+
+def _anexar_fpdf(pdf, nome, info):
+    """Coloca a imagem pré-processada no cache do documento; devolve o nome para pdf.image()"""
+    imagens = pdf.image_cache.images
+    if nome not in imagens:
+        info = info.__class__(info)
+        info['i'] = len(imagens) + 1
+        info['usages'] = 0
+        info['iccp_i'] = None
+        iccp = info.get('iccp')
+        if iccp is not None:
+            perfis = pdf.image_cache.icc_profiles
+            info['iccp_i'] = perfis.setdefault(iccp, len(perfis))
+            info['iccp'] = None
+        imagens[nome] = info
+    return nome
+
+
+def imagem(nome):
+    """Bytes da imagem (ou None se o arquivo não existe no projeto)"""
+    return obter(f'imagem:{nome}')
+
+
+def imagem_fpdf(pdf, nome):
+    """
+    Nome a passar para pdf.image() da imagem pré-processada
+
+    Returns:
+        str | None: None se a imagem não existe no projeto
+    """
+    info = obter(f'imagem_fpdf:{nome}')
+    return _anexar_fpdf(pdf, f'recurso:{nome}', info) if info else None
+
+
+for _nome in IMAGENS:
+    registrar(f'imagem:{_nome}', lambda nome=_nome: _ler_imagem(nome))
+    registrar(f'imagem_fpdf:{_nome}', lambda nome=_nome: _info_fpdf(imagem(nome)))
+
+
+# ========== Fontes ==========
+
+def _fontes_fpdf():
+    """Apelidos do fpdf resolvidos (ex.: 'arial' -> 'helvetica'), evitando o aviso a cada set_font"""
+    from fpdf import FPDF
+
+    return dict(FPDF().font_aliases)
+
+
+def _fontes_reportlab():
+    from reportlab.pdfbase import pdfmetrics
+
+    nomes = ('Helvetica', 'Helvetica-Bold', 'Helvetica-Oblique', 'Helvetica-BoldOblique')
+    for fonte in nomes:
+        pdfmetrics.getFont(fonte)
+    return nomes
+
+
+def fonte_fpdf(familia):
+    """Família do fpdf sem apelido: fonte_fpdf('Arial') -> 'helvetica'"""
+    familia = familia.lower()
+    return obter('fontes_fpdf').get(familia, familia)
+
+
+registrar('fontes_fpdf', _fontes_fpdf)
+registrar('fontes_reportlab', _fontes_reportlab)
+
+
+# ========== Estilos (reportlab) ==========
+
+def _folha_estilos():
+    from reportlab.lib.styles import getSampleStyleSheet
+
+    obter('fontes_reportlab')
+    return getSampleStyleSheet()
+
+
+def folha_estilos():
+    """getSampleStyleSheet() compartilhada; os estilos não devem ser alterados"""
+    return obter('folha_estilos')
+
+
+registrar('folha_estilos', _folha_estilos)
+
+
+# ========== Códigos de barras ==========
+
+def codigo_barras_reportlab(chave, largura, altura, bar_height, bar_width):
+    """Drawing com o Code128-C vetorial da chave (reaproveitado entre documentos)"""
+    from .code128 import desenho_reportlab
+
+    return codigos_barras.obter(
+        ('reportlab', chave, largura, altura, bar_height, bar_width),
+        lambda: desenho_reportlab(chave, largura, altura, bar_height, bar_width),
+    )
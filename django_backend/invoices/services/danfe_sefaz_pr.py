@@ -1,38 +1,175 @@
 """
 Gerador de DANFE (Documento Auxiliar da Nota Fiscal Eletrônica)
 Padrão SEFAZ-PR - Layout EXATO conforme modelo oficial
+
+O desenho fixo (rótulos, caixas e linhas) está em danfe_pr_layout.json, com
+as coordenadas medidas por tools/extract_header_coords.py. Ele é renderizado
+uma única vez por processo (danfe_recursos) num fluxo de conteúdo
+reaproveitado como fundo da página; cada nota só escreve por cima os campos
+variáveis e o código de barras.
 """
 
 from fpdf import FPDF
-from io import BytesIO
-try:
-    from barcode import Code128
-    from barcode.writer import ImageWriter
-    _HAS_BARCODE_LIB = True
-except Exception:
-    _HAS_BARCODE_LIB = False
+from fpdf.enums import PDFResourceType
+from . import danfe_recursos as recursos
+from . import code128
 from datetime import datetime
+import json
+import os
+
+# Especificação de coordenadas do layout (mm)
+LAYOUT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'danfe_pr_layout.json')
+
+
+def _ler_layout(caminho=LAYOUT_PATH):
+    """
+    Lê a especificação de coordenadas do DANFE-PR
+
+    Linhas de campos ('linha' + 'celulas') são expandidas em campos
+    individuais com x absoluto e as famílias de fonte já saem resolvidas
+    pelo fpdf (Arial -> helvetica).
+
+    Returns:
+        dict: {
+            'fundo': [...],           # operações do desenho fixo
+            'campos': [...],          # campos variáveis com xy, wh, fonte, alinhamento, borda e bloco
+            'produtos': {...},        # grade dos itens
+            'codigo_barras': {...}
+        }
+    """
+    with open(caminho, encoding='utf-8') as arquivo:
+        layout = json.load(arquivo)
+
+    for item in layout['fundo'] + layout['campos'] + [layout['produtos']]:
+        if 'fonte' in item:
+            item['fonte'] = [recursos.fonte_fpdf(item['fonte'][0]), *item['fonte'][1:]]
+
+    campos = []
+    for campo in layout['campos']:
+        if 'linha' not in campo:
+            campos.append({'alinhamento': 'L', 'borda': 0, 'bloco': False, **campo})
+            continue
+        x, y = campo['linha']
+        for nome, largura, *alinhamento in campo['celulas']:
+            campos.append({
+                'nome': nome, 'xy': [x, y], 'wh': [largura, campo['h']], 'fonte': campo['fonte'],
+                'alinhamento': alinhamento[0] if alinhamento else campo.get('alinhamento', 'L'),
+                'borda': campo.get('borda', 0), 'bloco': False,
+            })
+            x += largura
+    layout['campos'] = campos
+    return layout
+
+
+def carregar_layout():
+    """Especificação do layout, lida uma vez por processo (ver _ler_layout())"""
+    return recursos.obter('layout_danfe_pr')
+
+
+def _desenhar_fundo(pdf, layout):
+    """Desenha o layout fixo e as bordas dos campos; devolve as fontes na ordem de uso"""
+    fontes = []
+
+    def fonte(spec):
+        familia, estilo, tamanho = spec
+        if (familia, estilo) not in fontes:
+            fontes.append((familia, estilo))
+        pdf.set_font(familia, estilo, tamanho)
+
+    for op in layout['fundo']:
+        tipo = op['op']
+        if tipo == 'espessura':
+            pdf.set_line_width(op['valor'])
+        elif tipo == 'retangulo':
+            pdf.rect(*op['xy'], *op['wh'])
+        elif tipo == 'celula':
+            fonte(op['fonte'])
+            pdf.set_xy(*op['xy'])
+            pdf.cell(*op['wh'], op['texto'], op.get('borda', 0), 0, op.get('alinhamento', 'L'))
+        elif tipo == 'linha':
+            fonte(op['fonte'])
+            pdf.set_xy(*op['xy'])
+            for largura, texto in op['celulas']:
+                pdf.cell(largura, op['h'], texto, op.get('borda', 0), 0, op.get('alinhamento', 'L'))
+        elif tipo == 'bloco':
+            fonte(op['fonte'])
+            pdf.set_xy(*op['xy'])
+            pdf.multi_cell(*op['wh'], op['texto'], op.get('borda', 0), op.get('alinhamento', 'L'))
+        elif tipo == 'brasao':
+            x, y = op['xy']
+            w, h = op['wh']
+            pdf.rect(x, y, w, h)
+            if recursos.imagem('brasao_pr'):
+                continue
+            # Placeholder textual caso imagem não esteja disponível
+            pdf.set_xy(x + 2, y + 8)
+            fonte([recursos.fonte_fpdf('Arial'), 'B', 7])
+            pdf.set_text_color(0, 0, 128)
+            pdf.multi_cell(w - 4, 3, 'Estado do\nParaná', 0, 'C')
+
+            pdf.set_xy(x + 2, y + h - 8)
+            fonte([recursos.fonte_fpdf('Arial'), '', 5])
+            pdf.set_text_color(0, 0, 0)
+            pdf.multi_cell(w - 4, 2, 'Secretaria da Fazenda\nNota Fiscal do Produtor\nRural Eletrônica', 0, 'C')
+        else:
+            raise ValueError(f'Operação de layout desconhecida: {tipo}')
+
+    # Bordas dos campos variáveis e da grade de itens também são fixas
+    for campo in layout['campos']:
+        if campo['borda']:
+            pdf.rect(*campo['xy'], *campo['wh'])
+    produtos = layout['produtos']
+    x, y = produtos['xy']
+    for linha in range(produtos['linhas']):
+        coluna_x = x
+        for _, largura, *_ in produtos['colunas']:
+            pdf.rect(coluna_x, y + linha * produtos['h'], largura, produtos['h'])
+            coluna_x += largura
+    return fontes
+
+
+def _renderizar_fundo():
+    pdf = FPDF('P', 'mm', 'A4')
+    pdf.add_page()
+    pdf.set_auto_page_break(False)
+    inicio = len(pdf.pages[pdf.page].contents)
+    fontes = _desenhar_fundo(pdf, carregar_layout())
+    return bytes(pdf.pages[pdf.page].contents[inicio:]), tuple(fontes)
+
+
+def fundo_pagina():
+    """
+    Fundo do DANFE-PR renderizado uma vez por processo
+
+    Returns:
+        tuple: (fluxo de conteúdo PDF em bytes, fontes [(família, estilo), ...] na ordem de registro)
+    """
+    return recursos.obter('fundo_danfe_pr')
+
+
+recursos.registrar('layout_danfe_pr', _ler_layout)
+recursos.registrar('fundo_danfe_pr', _renderizar_fundo)
 
 
 class DANFESefazGenerator:
     """Gera DANFE com layout idêntico ao padrão SEFAZ-PR"""
-    
+
     def __init__(self, invoice):
         self.invoice = invoice
         self.pdf = FPDF('P', 'mm', 'A4')
         self.pdf.add_page()
         self.pdf.set_auto_page_break(False)
-        
+
         # Margens
         self.margin_x = 5
         self.margin_y = 5
-    
+
     def _format_currency(self, value):
         """Formata valor monetário"""
         if value is None:
             return '0,00'
         return f"{float(value):,.2f}".replace(',', 'X').replace('.', ',').replace('X', '.')
-    
+
     def _format_cpf_cnpj(self, doc):
         """Formata CPF ou CNPJ"""
         if not doc:
@@ -43,7 +180,7 @@ class DANFESefazGenerator:
         elif len(doc) == 14:  # CNPJ
             return f'{doc[:2]}.{doc[2:5]}.{doc[5:8]}/{doc[8:12]}-{doc[12:]}'
         return doc
-    
+
     def _format_date(self, date):
         """Formata data"""
         if not date:
@@ -51,495 +188,73 @@ class DANFESefazGenerator:
         if isinstance(date, str):
             return date
         return date.strftime('%d/%m/%Y %H:%M')
-    
-    def _draw_brasao(self, x, y, w, h):
-        """Desenha o brasão do Estado do Paraná"""
-        # Box do brasão
-        self.pdf.rect(x, y, w, h)
-
-        # Tenta carregar imagem oficial do brasão, com fallbacks
-        import os
-        here = os.path.dirname(os.path.abspath(__file__))
-        # Caminhos relativos ao projeto
-        possible_paths = [
-            os.path.normpath(os.path.join(here, '..', '..', 'assets', 'brasao_pr.png')),
-            os.path.normpath(os.path.join(here, '..', '..', '..', 'frontend', 'assets', 'brasao_pr.png')),
-        ]
-        image_path = None
-        for p in possible_paths:
-            try:
-                if os.path.exists(p):
-                    image_path = p
-                    break
-            except Exception:
-                pass
-
-        if image_path:
-            try:
-                # Margens internas para respeitar área visual
-                self.pdf.image(image_path, x + 2, y + 2, w = w - 4, h = h - 4)
-                return
-            except Exception:
-                # Se falhar em carregar, cai no placeholder textual
-                pass
-
-        # Placeholder textual caso imagem não esteja disponível
-        self.pdf.set_xy(x + 2, y + 8)
-        self.pdf.set_font('Arial', 'B', 7)
-        self.pdf.set_text_color(0, 0, 128)
-        self.pdf.multi_cell(w - 4, 3, 'Estado do\nParaná', 0, 'C')
-
-        self.pdf.set_xy(x + 2, y + h - 8)
-        self.pdf.set_font('Arial', '', 5)
-        self.pdf.set_text_color(0, 0, 0)
-        self.pdf.multi_cell(w - 4, 2, 'Secretaria da Fazenda\nNota Fiscal do Produtor\nRural Eletrônica', 0, 'C')
-    
-    def generate(self):
-        """Gera PDF EXATAMENTE como o modelo SEFAZ-PR"""
-        y = self.margin_y
-        x = self.margin_x
-        
-        # ===== LINHA SUPERIOR (posições exatas) =====
-        self.pdf.set_line_width(0.2)
-        # Títulos superior
-        self.pdf.set_xy(4.23, 13.10)
-        self.pdf.set_font('Arial', '', 6)
-        self.pdf.cell(24.13, 2.12, 'DATA DO RECEBIMENTO', 0, 1, 'L')
-
-        self.pdf.set_xy(44.80, 13.10)
-        self.pdf.cell(49.53, 2.12, 'IDENTIFICAÇÃO E ASSINATURA DO RECEBEDOR', 0, 1, 'L')
-
-        # Bloco NF-e no canto direito com Nº e SÉRIE
-        self.pdf.set_xy(181.82, 12.80)
-        self.pdf.set_font('Arial', '', 6)
-        self.pdf.cell(4.45, 2.47, 'Nº:', 0, 1, 'L')
-        self.pdf.set_xy(186.62, 12.99)
-        self.pdf.set_font('Arial', 'B', 12)
-        self.pdf.cell(10.37, 7.43, str(self.invoice.number or '3481814'), 0, 1, 'L')
-
-        self.pdf.set_xy(177.06, 16.68)
-        self.pdf.set_font('Arial', '', 6)
-        self.pdf.cell(8.89, 2.47, 'SÉRIE:', 0, 1, 'L')
-        self.pdf.set_xy(186.62, 16.87)
-        self.pdf.set_font('Arial', 'B', 9)
-        self.pdf.cell(4.45, 2.47, str(self.invoice.series or '890'), 0, 1, 'L')
-
-        # Ajuste Y para início das três colunas
-        y = 24.0
-        
-        # ===== SEÇÃO PRINCIPAL: 3 COLUNAS =====
-        header_y = y
-        
-        # COLUNA 1: BRASÃO (posições exatas do bloco esquerdo)
-        # Box aproximado para o brasão à esquerda
-        self._draw_brasao(6.0, y, 36.0, 48.0)
-        
-        # COLUNA 2: DADOS DO EMITENTE com coordenadas extraídas
-        self.pdf.set_line_width(0.15)
-        self.pdf.rect(42.0, y, 86.0, 48.0)
-        # Nome
-        self.pdf.set_xy(47.45, 27.95)
-        self.pdf.set_font('Arial', 'B', 9)
-        emitente_nome = (self.invoice.issuer_name or 'ADRIANE THIEVES ARAUJO DE AZEVEDO')[:45]
-        self.pdf.cell(37.04, 5.27, emitente_nome, 0, 1, 'L')
-        # Endereço
-        self.pdf.set_xy(45.05, 32.04)
-        self.pdf.set_font('Arial', '', 7)
-        endereco = (self.invoice.issuer_address or 'Estrada para Palmeirinha') + ', ' + (self.invoice.issuer_number or 'S/N')
-        self.pdf.cell(41.49, 2.47, endereco[:60], 0, 1, 'L')
-        # Distrito
-        self.pdf.set_xy(60.04, 38.20)
-        self.pdf.set_font('Arial', '', 7)
-        self.pdf.cell(11.85, 2.47, self.invoice.issuer_district or 'Interior', 0, 1, 'L')
-        # Cidade - UF
-        self.pdf.set_xy(50.41, 42.27)
-        self.pdf.set_font('Arial', '', 7)
-        cidade = f"{self.invoice.issuer_city or 'Campina do Simão'} - {self.invoice.issuer_state or 'PR'}"
-        self.pdf.cell(31.11, 2.47, cidade, 0, 1, 'L')
-        # CEP + Fone/Fax
-        self.pdf.set_xy(55.60, 49.49)
-        self.pdf.set_font('Arial', '', 7)
-        cep = self.invoice.issuer_zip_code or '85148-000'
-        self.pdf.cell(20.74, 2.82, f"CEP: {cep} Fone/Fax:", 0, 1, 'L')
-        
-        # COLUNA 3: DANFE + CÓDIGO DE BARRAS (posições absolutas conforme referência)
-        # Box geral da coluna direita
-        danfe_box_x = 128.0  # 42.0 (emitente_x) + 86.0 (emitente_w)
-        danfe_box_w = 64
-        self.pdf.rect(danfe_box_x, y, danfe_box_w, 48)
-
-        # Título "DANFE"
-        self.pdf.set_xy(99.48, 24.85)
-        self.pdf.set_font('Arial', 'B', 12)
-        self.pdf.cell(11.64, 3.88, 'DANFE', 0, 1, 'L')
-
-        # Subtítulo
-        self.pdf.set_xy(92.08, 30.90)
-        self.pdf.set_font('Arial', '', 7)
-        self.pdf.cell(27.52, 3.0, 'Documento Auxiliar da Nota Fiscal Eletronica', 0, 1, 'L')
-
-        # 0 - ENTRADA / 1 - SAÍDA
-        self.pdf.set_xy(92.08, 35.33)
-        self.pdf.set_font('Arial', '', 6)
-        self.pdf.cell(16.30, 2.47, '0 - ENTRADA', 0, 1, 'L')
-        self.pdf.set_xy(92.08, 39.56)
-        self.pdf.cell(13.34, 2.47, '1 - SAÍDA', 0, 1, 'L')
-
-        # Quadradinho "1" (saída)
-        self.pdf.set_xy(115.50, 37.86)
-        self.pdf.set_font('Arial', '', 7)
-        self.pdf.cell(1.48, 2.47, '1', 1, 1, 'C')
-
-        # Nº / Série / Folha alinhados ao centro da coluna direita
-        self.pdf.set_xy(91.72, 44.55)
-        self.pdf.set_font('Arial', '', 7)
-        self.pdf.cell(4.45, 2.47, 'Nº:', 0, 0, 'L')
-        self.pdf.set_xy(101.60, 44.74)
-        self.pdf.set_font('Arial', 'B', 10)
-        self.pdf.cell(10.37, 2.47, str(self.invoice.number or '3481814'), 0, 1, 'L')
-
-        self.pdf.set_xy(91.72, 48.78)
-        self.pdf.set_font('Arial', '', 7)
-        self.pdf.cell(8.89, 2.47, 'SÉRIE:', 0, 0, 'L')
-        self.pdf.set_xy(101.60, 48.97)
-        self.pdf.set_font('Arial', 'B', 9)
-        self.pdf.cell(4.45, 2.47, str(self.invoice.series or '890'), 0, 1, 'L')
-
-        self.pdf.set_xy(91.72, 53.02)
-        self.pdf.set_font('Arial', '', 7)
-        self.pdf.cell(8.89, 2.47, 'FOLHA:', 0, 0, 'L')
-        self.pdf.set_xy(101.60, 53.20)
-        self.pdf.set_font('Arial', '', 7)
-        self.pdf.cell(8.89, 2.47, '1 de 1', 0, 1, 'L')
-        
-        y = header_y + 49
-        
-        # ===== CHAVE DE ACESSO + CÓDIGO DE BARRAS (PROFISSIONAL) =====
-        # Aplicação de coordenadas exatas do PDF de referência
-        # Box direito "CHAVE DE ACESSO"
-        acesso_x = 121.36
-        acesso_y = 33.56
-        acesso_w = 81.49
-        acesso_h = 8.11
-        self.pdf.rect(acesso_x, acesso_y, acesso_w, acesso_h)
-
-        # Título "CHAVE DE ACESSO"
-        self.pdf.set_xy(acesso_x, acesso_y - 4.0)
-        self.pdf.set_font('Arial', '', 6)
-        self.pdf.cell(19.05, 3, 'CHAVE DE ACESSO', 0, 1, 'L')
-
-        # Chave formatada (em linha conforme coordenadas)
-        chave = self.invoice.access_key or ('41' + '2511' + '78393592000146' + '55' + '890' + '003481814' + '1' + '67176859' + '5')
-        chave_fmt = ' '.join([chave[i:i+4] for i in range(0, min(len(chave), 44), 4)])
-        self.pdf.set_xy(124.99, 39.45)
-        self.pdf.set_font('Arial', 'B', 8)
-        self.pdf.cell(77.05, 4, chave_fmt, 0, 0, 'L')
-
-        # Código de barras Code128 posicionado abaixo da chave
-        if _HAS_BARCODE_LIB:
-            try:
-                barcode_writer = ImageWriter()
-                barcode_obj = Code128(chave[:44], writer=barcode_writer)
-                buf = BytesIO()
-                barcode_writer.set_options({
-                    'module_width': 0.20,
-                    'module_height': 12.0,
-                    'quiet_zone': 2.0,
-                    'font_size': 0,
-                })
-                barcode_obj.write(buf)
-                buf.seek(0)
-                # Posição aproximada do barcode sob a faixa de acesso
-                self.pdf.image(buf, 124.0, 41.5, w=60, h=12)
-            except Exception:
-                self.pdf.set_xy(124.0, 41.5)
-                self.pdf.set_font('Arial', '', 8)
-                self.pdf.cell(60, 12, '[Falha ao gerar barcode]', 1, 0, 'C')
-        else:
-            self.pdf.set_xy(124.0, 41.5)
-            self.pdf.set_font('Arial', '', 6)
-            self.pdf.cell(60, 12, 'Instale python-barcode para Code128', 1, 0, 'C')
-
-        # Texto de consulta sob a faixa direita, conforme coordenadas
-        self.pdf.set_xy(121.36, 51.51)
-        self.pdf.set_font('Arial', '', 5)
-        self.pdf.multi_cell(83.96, 2,
-            'Consulta de autenticidade no portal nacional da NF-e www.nfe.fazenda.gov.br/portal  ou  no  site  da  Sefaz Autorizadora',
-            0, 'L')
-
-        # Avançar Y para continuar seções subsequentes (alinha com o fluxo antigo)
-        y = header_y + 49 + 23
-        
-        # ===== PROTOCOLO DE AUTORIZAÇÃO =====
-        self.pdf.set_xy(x, y)
-        self.pdf.set_font('Arial', 'B', 6)
-        self.pdf.cell(186, 5, 'PROTOCOLO DE AUTORIZAÇÃO DE USO', 1, 1, 'L')
-        
-        y += 5
-        self.pdf.set_xy(x, y)
-        self.pdf.set_font('Arial', '', 7)
-        protocolo = f"{self.invoice.protocol or '141250404644212'} {self._format_date(self.invoice.authorization_date) if self.invoice.authorization_date else '27/11/2025 08:44'}"
-        self.pdf.cell(186, 5, protocolo, 1, 1, 'C')
-        
-        y += 6
-        
-        # ===== NATUREZA DA OPERAÇÃO + IE + CNPJ =====
-        self.pdf.set_xy(x, y)
-        self.pdf.set_font('Arial', '', 5)
-        self.pdf.cell(70, 3, 'NATUREZA DA OPERAÇÃO', 1, 0, 'L')
-        self.pdf.cell(58, 3, 'INSC. EST. DO SUBST. TRIBUTÁRIO', 1, 0, 'L')
-        self.pdf.cell(58, 3, 'CNPJ', 1, 1, 'L')
-        
-        y += 3
-        self.pdf.set_xy(x, y)
-        self.pdf.set_font('Arial', 'B', 7)
-        self.pdf.cell(70, 5, 'Venda', 1, 0, 'L')
-        self.pdf.cell(58, 5, self.invoice.issuer_state_registration or '9588805457', 1, 0, 'L')
-        self.pdf.cell(58, 5, '-', 1, 1, 'C')
-        
-        y += 6
-        
-        # ===== DESTINATÁRIO/REMETENTE =====
-        self.pdf.set_xy(x, y)
-        self.pdf.set_font('Arial', '', 5)
-        self.pdf.cell(186, 3, 'DESTINATÁRIO/REMETENTE', 1, 1, 'L')
-        
-        y += 3
-        
-        # LINHA 1: NOME/RAZÃO SOCIAL + CNPJ/CPF + DATA DE EMISSÃO
-        self.pdf.set_xy(x, y)
-        self.pdf.cell(116, 3, 'NOME/RAZÃO SOCIAL', 1, 0, 'L')
-        self.pdf.cell(40, 3, 'CNPJ/CPF', 1, 0, 'L')
-        self.pdf.cell(30, 3, 'DATA DE EMISSÃO', 1, 1, 'L')
-        
-        y += 3
-        self.pdf.set_xy(x, y)
-        self.pdf.set_font('Arial', 'B', 7)
-        dest_nome = (self.invoice.receiver_name or 'Cooperativa Agroindustrial Aliança de Carnes Nobres')[:60]
-        self.pdf.cell(116, 4, dest_nome, 1, 0, 'L')
-        self.pdf.cell(40, 4, self._format_cpf_cnpj(self.invoice.receiver_tax_id) or '10.015.928/0002-84', 1, 0, 'L')
-        self.pdf.cell(30, 4, self._format_date(self.invoice.issue_date) or '27/11/2025 08:44', 1, 1, 'C')
-        
-        y += 4
-        
-        # LINHA 2: ENDEREÇO + BAIRRO/DISTRITO + DATA DE SAÍDA/ENTRADA
-        self.pdf.set_xy(x, y)
-        self.pdf.set_font('Arial', '', 5)
-        self.pdf.cell(116, 3, 'ENDEREÇO', 1, 0, 'L')
-        self.pdf.cell(40, 3, 'BAIRRO/DISTRITO', 1, 0, 'L')
-        self.pdf.cell(30, 3, 'DATA DE SAÍDA/ENTRADA', 1, 1, 'L')
-        
-        y += 3
-        self.pdf.set_xy(x, y)
-        self.pdf.set_font('Arial', 'B', 7)
-        endereco_dest = (self.invoice.receiver_address or 'PR 170,SN ZONA RURAL, KM 395')[:60]
-        self.pdf.cell(116, 4, endereco_dest, 1, 0, 'L')
-        self.pdf.cell(40, 4, self.invoice.receiver_district or 'ENTRE RIOS', 1, 0, 'L')
-        self.pdf.cell(30, 4, self._format_date(self.invoice.issue_date) or '27/11/2025 08:44', 1, 1, 'C')
-        
-        y += 4
-        
-        # LINHA 3: MUNICÍPIO + UF + INSCRIÇÃO ESTADUAL + HORA DE SAÍDA
-        self.pdf.set_xy(x, y)
-        self.pdf.set_font('Arial', '', 5)
-        self.pdf.cell(94, 3, 'MUNICÍPIO', 1, 0, 'L')
-        self.pdf.cell(22, 3, 'UF', 1, 0, 'L')
-        self.pdf.cell(40, 3, 'INSCRIÇÃO ESTADUAL', 1, 0, 'L')
-        self.pdf.cell(30, 3, 'HORA DE SAÍDA', 1, 1, 'L')
-        
-        y += 3
-        self.pdf.set_xy(x, y)
-        self.pdf.set_font('Arial', 'B', 7)
-        self.pdf.cell(94, 4, self.invoice.receiver_city or 'Guarapuava', 1, 0, 'L')
-        self.pdf.cell(22, 4, self.invoice.receiver_state or 'PR', 1, 0, 'L')
-        self.pdf.cell(40, 4, self.invoice.receiver_state_registration or '9079795205', 1, 0, 'L')
-        self.pdf.cell(30, 4, '', 1, 1, 'C')
-        
-        y += 5
-        
-        # ===== FATURA/DUPLICATAS =====
-        self.pdf.set_xy(x, y)
-        self.pdf.set_font('Arial', '', 5)
-        self.pdf.cell(186, 3, 'FATURA/DUPLICATAS', 1, 1, 'L')
-        
-        y += 3
-        
-        # Cabeçalho das duplicatas
-        self.pdf.set_xy(x, y)
-        dup_w = 186 / 8  # 8 colunas
-        self.pdf.cell(dup_w, 3, 'FATURA/DUPLICATA', 1, 0, 'L')
-        self.pdf.cell(dup_w, 3, 'VENCIMENTO', 1, 0, 'L')
-        self.pdf.cell(dup_w, 3, 'VALOR', 1, 0, 'L')
-        self.pdf.cell(dup_w, 3, 'FATURA/DUPLICATA', 1, 0, 'L')
-        self.pdf.cell(dup_w, 3, 'VENCIMENTO', 1, 0, 'L')
-        self.pdf.cell(dup_w, 3, 'VALOR', 1, 0, 'L')
-        self.pdf.cell(dup_w, 3, 'VENCIMENTO', 1, 0, 'L')
-        self.pdf.cell(dup_w, 3, 'VALOR', 1, 1, 'L')
-        
-        y += 3
-        
-        # Valores zerados
-        self.pdf.set_xy(x, y)
-        self.pdf.set_font('Arial', '', 6)
-        for i in range(8):
-            self.pdf.cell(dup_w, 4, '0,00', 1, 0, 'R')
-        self.pdf.ln()
-        
-        y += 5
-        
-        # ===== CÁLCULO DO IMPOSTO =====
-        self.pdf.set_xy(x, y)
-        self.pdf.set_font('Arial', '', 5)
-        self.pdf.cell(186, 3, 'CÁLCULO DO IMPOSTO', 1, 1, 'L')
-        
-        y += 3
-        
-        # LINHA 1: BASE DE CÁLCULO DO ICMS + VALOR DO ICMS + BASE DE CÁLCULO ICMS ST + VALOR DO ICMS ST + VALOR TOTAL DOS PRODUTOS
-        self.pdf.set_xy(x, y)
-        col_w = 186 / 5
-        self.pdf.cell(col_w, 3, 'BASE DE CÁLCULO ICMS', 1, 0, 'L')
-        self.pdf.cell(col_w, 3, 'VALOR DO ICMS', 1, 0, 'L')
-        self.pdf.cell(col_w, 3, 'BASE DE CÁLCULO ICMS ST', 1, 0, 'L')
-        self.pdf.cell(col_w, 3, 'VALOR DO ICMS ST', 1, 0, 'L')
-        self.pdf.cell(col_w, 3, 'VALOR TOTAL DOS PRODUTOS', 1, 1, 'L')
-        
-        y += 3
-        self.pdf.set_xy(x, y)
-        self.pdf.set_font('Arial', 'B', 7)
-        self.pdf.cell(col_w, 4, '0,00', 1, 0, 'R')
-        self.pdf.cell(col_w, 4, '0,00', 1, 0, 'R')
-        self.pdf.cell(col_w, 4, '0,00', 1, 0, 'R')
-        self.pdf.cell(col_w, 4, '0,00', 1, 0, 'R')
-        self.pdf.cell(col_w, 4, self._format_currency(self.invoice.total_products or 117000.00), 1, 1, 'R')
-        
-        y += 4
-        
-        # LINHA 2: VALOR DO FRETE + VALOR DO SEGURO + DESCONTO + OUTRAS DESPESAS + VALOR TOTAL DA NOTA
-        self.pdf.set_xy(x, y)
-        self.pdf.set_font('Arial', '', 5)
-        self.pdf.cell(col_w, 3, 'VALOR DO FRETE', 1, 0, 'L')
-        self.pdf.cell(col_w, 3, 'VALOR DO SEGURO', 1, 0, 'L')
-        self.pdf.cell(col_w, 3, 'DESCONTO', 1, 0, 'L')
-        self.pdf.cell(col_w, 3, 'OUTRAS DESPESAS ACESSÓRIAS', 1, 0, 'L')
-        self.pdf.cell(col_w, 3, 'VALOR TOTAL DA NOTA', 1, 1, 'L')
-        
-        y += 3
-        self.pdf.set_xy(x, y)
-        self.pdf.set_font('Arial', 'B', 7)
-        self.pdf.cell(col_w, 4, self._format_currency(self.invoice.shipping or 0.00), 1, 0, 'R')
-        self.pdf.cell(col_w, 4, self._format_currency(self.invoice.insurance or 0.00), 1, 0, 'R')
-        self.pdf.cell(col_w, 4, self._format_currency(self.invoice.discount or 0.00), 1, 0, 'R')
-        self.pdf.cell(col_w, 4, self._format_currency(self.invoice.other_expenses or 0.00), 1, 0, 'R')
-        self.pdf.cell(col_w, 4, self._format_currency(self.invoice.total_value or 117000.00), 1, 1, 'R')
-        
-        y += 5
-        
-        # ===== TRANSPORTADOR/VOLUMES TRANSPORTADOS =====
-        self.pdf.set_xy(x, y)
-        self.pdf.set_font('Arial', '', 5)
-        self.pdf.cell(186, 3, 'TRANSPORTADOR/VOLUMES TRANSPORTADOS', 1, 1, 'L')
-        
-        y += 3
-        
-        # LINHA 1: RAZÃO SOCIAL + FRETE POR CONTA + CÓDIGO ANTT + PLACA DO VEÍCULO + UF + CNPJ/CPF
-        self.pdf.set_xy(x, y)
-        self.pdf.cell(50, 3, 'RAZÃO SOCIAL', 1, 0, 'L')
-        self.pdf.cell(43, 3, 'Frete por conta', 1, 0, 'L')
-        self.pdf.cell(23, 3, 'CÓDIGO ANTT', 1, 0, 'L')
-        self.pdf.cell(25, 3, 'PLACA DO VEÍCULO', 1, 0, 'L')
-        self.pdf.cell(12, 3, 'UF', 1, 0, 'L')
-        self.pdf.cell(33, 3, 'CNPJ/CPF', 1, 1, 'L')
-        
-        y += 3
-        self.pdf.set_xy(x, y)
-        self.pdf.set_font('Arial', '', 6)
-        self.pdf.cell(50, 8, '', 1, 0, 'L')
-        
-        # Frete por conta com texto multi-linha
-        self.pdf.set_xy(x + 50, y)
-        self.pdf.multi_cell(43, 4, 
-            'Contratação do Frete\npor conta do\nRemetente (CIF)', 
-            1, 'L')
-        
-        self.pdf.set_xy(x + 93, y)
-        self.pdf.cell(23, 8, '-', 1, 0, 'C')
-        self.pdf.cell(25, 8, '', 1, 0, 'C')
-        self.pdf.cell(12, 8, '', 1, 0, 'C')
-        self.pdf.cell(33, 8, '', 1, 1, 'C')
-        
-        y += 8
-        
-        # LINHA 2: ENDEREÇO + MUNICÍPIO + UF + INSCRIÇÃO ESTADUAL
-        self.pdf.set_xy(x, y)
-        self.pdf.set_font('Arial', '', 5)
-        self.pdf.cell(93, 3, 'ENDEREÇO', 1, 0, 'L')
-        self.pdf.cell(60, 3, 'MUNICÍPIO', 1, 0, 'L')
-        self.pdf.cell(12, 3, 'UF', 1, 0, 'L')
-        self.pdf.cell(21, 3, 'INSCRIÇÃO ESTADUAL', 1, 1, 'L')
-        
-        y += 3
-        self.pdf.set_xy(x, y)
-        self.pdf.set_font('Arial', '', 6)
-        self.pdf.cell(93, 4, '', 1, 0, 'L')
-        self.pdf.cell(60, 4, '', 1, 0, 'L')
-        self.pdf.cell(12, 4, '', 1, 0, 'C')
-        self.pdf.cell(21, 4, '', 1, 1, 'C')
-        
-        y += 5
-        
-        # LINHA 3: QUANTIDADE + ESPÉCIE + MARCA + NUMERAÇÃO + PESO BRUTO + PESO LÍQUIDO
-        self.pdf.set_xy(x, y)
-        self.pdf.set_font('Arial', '', 5)
-        self.pdf.cell(31, 3, 'QUANTIDADE', 1, 0, 'L')
-        self.pdf.cell(31, 3, 'ESPÉCIE', 1, 0, 'L')
-        self.pdf.cell(31, 3, 'MARCA', 1, 0, 'L')
-        self.pdf.cell(31, 3, 'NUMERAÇÃO', 1, 0, 'L')
-        self.pdf.cell(31, 3, 'PESO BRUTO', 1, 0, 'L')
-        self.pdf.cell(31, 3, 'PESO LÍQUIDO', 1, 1, 'L')
-        
-        y += 3
-        self.pdf.set_xy(x, y)
-        self.pdf.set_font('Arial', '', 6)
-        self.pdf.cell(31, 4, '-', 1, 0, 'C')
-        self.pdf.cell(31, 4, '-', 1, 0, 'C')
-        self.pdf.cell(31, 4, '-', 1, 0, 'C')
-        self.pdf.cell(31, 4, '-', 1, 0, 'C')
-        self.pdf.cell(31, 4, '-', 1, 0, 'C')
-        self.pdf.cell(31, 4, '-', 1, 1, 'C')
-        
-        y += 5
-        
-        # ===== DADOS DO PRODUTO/SERVIÇO =====
-        self.pdf.set_xy(x, y)
-        self.pdf.set_font('Arial', '', 5)
-        self.pdf.cell(186, 3, 'DADOS DO PRODUTO/SERVIÇO', 1, 1, 'L')
-        
-        y += 3
-        
-        # Cabeçalho da tabela de produtos
-        self.pdf.set_xy(x, y)
-        self.pdf.cell(14, 6, 'CÓDIGO/NÚMERO', 1, 0, 'C')
-        self.pdf.cell(38, 6, 'DESCRIÇÃO PRODUTO/SERVIÇO', 1, 0, 'C')
-        self.pdf.cell(12, 6, 'CÓDIGO', 1, 0, 'C')
-        self.pdf.cell(7, 6, 'CST', 1, 0, 'C')
-        self.pdf.cell(7, 6, 'CFOP', 1, 0, 'C')
-        self.pdf.cell(7, 6, 'UM', 1, 0, 'C')
-        self.pdf.cell(11, 6, 'QUANT.', 1, 0, 'C')
-        self.pdf.cell(13, 6, 'VALOR UNITÁRIO', 1, 0, 'C')
-        self.pdf.cell(13, 6, 'VALOR TOTAL', 1, 0, 'C')
-        self.pdf.cell(16, 3, 'BASE DE CÁLCULO', 1, 0, 'C')
-        self.pdf.cell(13, 6, 'VALOR ICMS', 1, 0, 'C')
-        self.pdf.cell(9, 6, 'VALOR IPI', 1, 0, 'C')
-        self.pdf.cell(10, 6, 'ALÍQUOTA', 1, 1, 'C')
-        
-        # Segunda linha do cabeçalho (subcampo)
-        self.pdf.set_xy(x + 122, y + 3)
-        self.pdf.cell(16, 3, 'ICMS', 1, 0, 'C')
-        
-        y += 6
-        
+
+    def _aplicar_fundo(self):
+        """Copia o fundo pré-renderizado para a página, isolado em q/Q"""
+        conteudo, fontes = fundo_pagina()
+        # Registra as fontes na mesma ordem do fundo: /F1, /F2... apontam para as mesmas fontes
+        for familia, estilo in fontes:
+            self.pdf.set_font(familia, estilo)
+            self.pdf._resource_catalog.add(PDFResourceType.FONT, self.pdf.current_font.i, self.pdf.page)
+        self.pdf._out(b'q\n' + conteudo + b'Q')
+
+    def _chave(self):
+        return self.invoice.access_key or ('41' + '2511' + '78393592000146' + '55' + '890' + '003481814' + '1' + '67176859' + '5')
+
+    def _valores(self):
+        """Texto de cada campo variável do layout"""
+        inv = self.invoice
+        chave = self._chave()
+        endereco = (inv.issuer_address or 'Estrada para Palmeirinha') + ', ' + (inv.issuer_number or 'S/N')
+        emissao = self._format_date(inv.issue_date) or '27/11/2025 08:44'
+        protocolo = f"{inv.protocol or '141250404644212'} {self._format_date(inv.authorization_date) if inv.authorization_date else '27/11/2025 08:44'}"
+        valores = {
+            'canhoto_numero': str(inv.number or '3481814'),
+            'canhoto_serie': str(inv.series or '890'),
+            'emitente_nome': (inv.issuer_name or 'ADRIANE THIEVES ARAUJO DE AZEVEDO')[:45],
+            'emitente_endereco': endereco[:60],
+            'emitente_bairro': inv.issuer_district or 'Interior',
+            'emitente_cidade': f"{inv.issuer_city or 'Campina do Simão'} - {inv.issuer_state or 'PR'}",
+            'emitente_cep': f"CEP: {inv.issuer_zip_code or '85148-000'} Fone/Fax:",
+            'numero': str(inv.number or '3481814'),
+            'serie': str(inv.series or '890'),
+            'folha': '1 de 1',
+            'chave_acesso': ' '.join([chave[i:i+4] for i in range(0, min(len(chave), 44), 4)]),
+            'protocolo': protocolo,
+            'natureza_operacao': 'Venda',
+            'ie_substituto': inv.issuer_state_registration or '9588805457',
+            'cnpj_substituto': '-',
+            'destinatario_nome': (inv.receiver_name or 'Cooperativa Agroindustrial Aliança de Carnes Nobres')[:60],
+            'destinatario_cnpj_cpf': self._format_cpf_cnpj(inv.receiver_tax_id) or '10.015.928/0002-84',
+            'data_emissao': emissao,
+            'destinatario_endereco': (inv.receiver_address or 'PR 170,SN ZONA RURAL, KM 395')[:60],
+            'destinatario_bairro': inv.receiver_district or 'ENTRE RIOS',
+            'data_saida': emissao,
+            'destinatario_municipio': inv.receiver_city or 'Guarapuava',
+            'destinatario_uf': inv.receiver_state or 'PR',
+            'destinatario_ie': inv.receiver_state_registration or '9079795205',
+            'base_icms': '0,00',
+            'valor_icms': '0,00',
+            'base_icms_st': '0,00',
+            'valor_icms_st': '0,00',
+            'total_produtos': self._format_currency(inv.total_products or 117000.00),
+            'frete': self._format_currency(inv.shipping or 0.00),
+            'seguro': self._format_currency(inv.insurance or 0.00),
+            'desconto': self._format_currency(inv.discount or 0.00),
+            'outras_despesas': self._format_currency(inv.other_expenses or 0.00),
+            'total_nota': self._format_currency(inv.total_value or 117000.00),
+            'transportador_antt': '-',
+            'informacoes_complementares': (inv.notes or 'Informações complementares NFP-e emitida por ADRIANE THIEVES ARAUJO DE AZEVEDO, CPF: 966.334.769-49')[:150],
+        }
+        for i in range(1, 9):
+            valores[f'duplicata_{i}'] = '0,00'
+        for campo in ('quantidade', 'especie', 'marca', 'numeracao', 'peso_bruto', 'peso_liquido'):
+            valores[f'volumes_{campo}'] = '-'
+        return valores
+
+    def _produtos(self):
         # Linhas de produtos (2 produtos conforme imagem)
-        produtos = [
+        return [
             {
                 'codigo': '5211.1026.02',
                 'descricao': 'SOJA PARA SASTE',
@@ -571,80 +286,57 @@ class DANFESefazGenerator:
                 'aliquota': 'RS 0,00'
             }
         ]
-        
-        self.pdf.set_font('Arial', '', 6)
-        for prod in produtos:
+
+    def _escrever_campos(self, layout):
+        valores = self._valores()
+        for campo in layout['campos']:
+            texto = valores.get(campo['nome'])
+            if not texto:
+                continue
+            self.pdf.set_font(*campo['fonte'])
+            self.pdf.set_xy(*campo['xy'])
+            if campo['bloco']:
+                self.pdf.multi_cell(*campo['wh'], texto, align=campo['alinhamento'])
+            else:
+                self.pdf.cell(*campo['wh'], texto, align=campo['alinhamento'])
+
+        produtos = layout['produtos']
+        x, y = produtos['xy']
+        self.pdf.set_font(*produtos['fonte'])
+        for prod in self._produtos()[:produtos['linhas']]:
+            self.pdf.set_xy(x, y)
+            for nome, largura, *alinhamento in produtos['colunas']:
+                self.pdf.cell(largura, produtos['h'], prod[nome], align=alinhamento[0] if alinhamento else 'L')
+            y += produtos['h']
+
+    def _escrever_codigo_barras(self, layout):
+        # Código de barras Code128-C (vetorial) posicionado abaixo da chave
+        x, y = layout['codigo_barras']['xy']
+        w, h = layout['codigo_barras']['wh']
+        try:
+            code128.desenhar_fpdf(self.pdf, self._chave()[:44], x, y, w, h)
+        except ValueError:
             self.pdf.set_xy(x, y)
-            self.pdf.cell(14, 5, prod['codigo'], 1, 0, 'L')
-            self.pdf.cell(38, 5, prod['descricao'], 1, 0, 'L')
-            self.pdf.cell(12, 5, prod['ncm'], 1, 0, 'C')
-            self.pdf.cell(7, 5, prod['cst'], 1, 0, 'C')
-            self.pdf.cell(7, 5, prod['cfop'], 1, 0, 'C')
-            self.pdf.cell(7, 5, prod['um'], 1, 0, 'C')
-            self.pdf.cell(11, 5, prod['quant'], 1, 0, 'R')
-            self.pdf.cell(13, 5, prod['valor_unit'], 1, 0, 'R')
-            self.pdf.cell(13, 5, prod['valor_total'], 1, 0, 'R')
-            self.pdf.cell(16, 5, prod['bc_icms'], 1, 0, 'R')
-            self.pdf.cell(13, 5, prod['valor_icms'], 1, 0, 'R')
-            self.pdf.cell(9, 5, prod['valor_ipi'], 1, 0, 'R')
-            self.pdf.cell(10, 5, prod['aliquota'], 1, 1, 'R')
-            y += 5
-        
-        y += 2
-        
-        # ===== CÁLCULO DO ISSQN =====
-        self.pdf.set_xy(x, y)
-        self.pdf.set_font('Arial', '', 5)
-        self.pdf.cell(186, 3, 'CÁLCULO DO ISSQN', 1, 1, 'L')
-        
-        y += 3
-        
-        # Linha única do ISSQN
-        self.pdf.set_xy(x, y)
-        issqn_w = 186 / 4
-        self.pdf.cell(issqn_w, 3, 'INSCRIÇÃO MUNICIPAL', 1, 0, 'L')
-        self.pdf.cell(issqn_w, 3, 'VALOR TOTAL DOS SERVIÇOS', 1, 0, 'L')
-        self.pdf.cell(issqn_w, 3, 'BASE DE CÁLCULO ISSQN', 1, 0, 'L')
-        self.pdf.cell(issqn_w, 3, 'VALOR DO ISSQN', 1, 1, 'L')
-        
-        y += 3
-        self.pdf.set_xy(x, y)
-        self.pdf.set_font('Arial', '', 6)
-        self.pdf.cell(issqn_w, 4, '', 1, 0, 'C')
-        self.pdf.cell(issqn_w, 4, '', 1, 0, 'R')
-        self.pdf.cell(issqn_w, 4, '', 1, 0, 'R')
-        self.pdf.cell(issqn_w, 4, '', 1, 1, 'R')
-        
-        y += 5
-        
-        # ===== DADOS ADICIONAIS =====
-        self.pdf.set_xy(x, y)
-        self.pdf.set_font('Arial', '', 5)
-        self.pdf.cell(186, 3, 'DADOS ADICIONAIS', 1, 1, 'L')
-        
-        y += 3
-        
-        # Duas colunas: Informações do Fisco | Reservado ao Fisco
-        self.pdf.set_xy(x, y)
-        self.pdf.cell(124, 3, 'Informações do Fisco:', 1, 0, 'L')
-        self.pdf.cell(62, 3, 'RESERVADO AO FISCO', 1, 1, 'L')
-        
-        y += 3
-        
-        # Conteúdo dos dados adicionais
-        self.pdf.set_xy(x, y)
-        self.pdf.set_font('Arial', '', 6)
-        info_texto = (self.invoice.notes or 'Informações complementares NFP-e emitida por ADRIANE THIEVES ARAUJO DE AZEVEDO, CPF: 966.334.769-49')[:150]
-        
-        # Box grande para informações (altura ~40mm)
-        self.pdf.rect(x, y, 124, 40)
-        self.pdf.rect(x + 124, y, 62, 40)
-        
-        # Texto dentro do box
-        self.pdf.set_xy(x + 2, y + 2)
-        self.pdf.multi_cell(120, 3, info_texto, 0, 'L')
-        
+            self.pdf.set_font(recursos.fonte_fpdf('Arial'), '', 8)
+            self.pdf.cell(w, h, '[Falha ao gerar barcode]', 1, 0, 'C')
+
+    def generate(self):
+        """Gera PDF EXATAMENTE como o modelo SEFAZ-PR"""
+        layout = carregar_layout()
+        self._aplicar_fundo()
+
+        brasao = recursos.imagem_fpdf(self.pdf, 'brasao_pr')
+        for op in layout['fundo']:
+            if op['op'] == 'brasao' and brasao:
+                # Margens internas para respeitar área visual
+                x, y = op['xy']
+                w, h = op['wh']
+                self.pdf.image(brasao, x + 2, y + 2, w=w - 4, h=h - 4)
+
+        self._escrever_campos(layout)
+        self._escrever_codigo_barras(layout)
+
         print("    [DANFE-SEFAZ-PR] ✓ Documento gerado com layout idêntico")
-        
+
         # Retornar o PDF como bytes
         return bytes(self.pdf.output(dest='S'))
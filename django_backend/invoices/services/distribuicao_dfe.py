@@ -0,0 +1,233 @@
+"""
+Sincronização incremental com a distribuição de DF-e (NFeDistribuicaoDFe)
+Para cada CNPJ/CPF interessado guarda o último NSU recebido e pede ao
+Ambiente Nacional só os documentos posteriores a ele. Cada docZip (base64 +
+gzip) é descompactado sob demanda enquanto o XML é lido, e as NF-e completas
+(procNFe) seguem para a importação de NF-e recebidas; as que não puderem ser
+gravadas (sem cliente ou com erro) ficam em DFePendingDocument e são tentadas
+de novo nas próximas sincronizações, já que o NSU avança sobre elas. Sem
+documentos novos, a próxima consulta espera o intervalo mínimo exigido pela SEFAZ.
+"""
+from datetime import timedelta
+from django.conf import settings
+from django.utils import timezone
+from .sefaz_integration import SefazIntegration
+from .importacao_nfe import XMLNaoSuportado, importar_fontes
+from .nfe_engine import clean_digits
+import logging
+import base64
+import zlib
+import io
+
+logger = logging.getLogger(__name__)
+
+# Limites padrão (podem ser sobrescritos no settings.py)
+DEFAULT_ESPERA = 3600
+DEFAULT_MAX_CONSULTAS = 20
+
+# cStat do retDistDFeInt
+CODIGO_DOCUMENTOS = '138'
+CODIGO_SEM_DOCUMENTOS = '137'
+CODIGO_CONSUMO_INDEVIDO = '656'
+
+# Caracteres base64 decodificados por vez (múltiplo de 4)
+BLOCO_BASE64 = 64 * 1024
+
+
+def get_espera():
+    """Segundos até nova consulta quando não há documentos novos (settings.NFE_DFE_ESPERA)"""
+    return float(getattr(settings, 'NFE_DFE_ESPERA', DEFAULT_ESPERA))
+
+
+def get_max_consultas():
+    """Consultas (páginas de até 50 documentos) por sincronização (settings.NFE_DFE_MAX_CONSULTAS)"""
+    return int(getattr(settings, 'NFE_DFE_MAX_CONSULTAS', DEFAULT_MAX_CONSULTAS))
+
+
+class _DocZip(io.RawIOBase):
+    """Conteúdo de um docZip descompactado em blocos, à medida que é lido"""
+
+    def __init__(self, conteudo):
+        self._conteudo = ''.join(conteudo.split())
+        self._posicao = 0
+        self._zlib = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        self._pendente = b''
+
+    def readable(self):
+        return True
+
+    def readinto(self, destino):
+        while not self._pendente and self._posicao < len(self._conteudo):
+            bloco = self._conteudo[self._posicao:self._posicao + BLOCO_BASE64]
+            self._posicao += BLOCO_BASE64
+            try:
+                self._pendente = self._zlib.decompress(base64.b64decode(bloco, validate=True))
+                if self._posicao >= len(self._conteudo):
+                    self._pendente += self._zlib.flush()
+            except (ValueError, zlib.error) as e:
+                raise XMLNaoSuportado(f'docZip inválido: {e}')
+
+        tamanho = min(len(destino), len(self._pendente))
+        destino[:tamanho] = self._pendente[:tamanho]
+        self._pendente = self._pendente[tamanho:]
+        return tamanho
+
+
+def abrir_doc_zip(conteudo):
+    """
+    Abre um docZip como arquivo binário
+
+    Args:
+        conteudo: Texto base64 do docZip (XML compactado com gzip)
+
+    Returns:
+        BufferedReader: XML descompactado sob demanda
+    """
+    return io.BufferedReader(_DocZip(conteudo))
+
+
+def _nome(documento):
+    return f"NSU {documento['nsu']} ({documento['schema']})"
+
+
+def _nfes(documentos, contagem):
+    """Pares (nome, arquivo) das NF-e completas; resumos e eventos só são contados"""
+    for documento in documentos:
+        schema = documento['schema']
+        if schema.startswith('procNFe'):
+            contagem['nfe'] += 1
+            yield _nome(documento), abrir_doc_zip(documento['conteudo'])
+        elif schema.startswith('resNFe'):
+            contagem['resumos'] += 1
+        else:
+            contagem['eventos'] += 1
+
+
+def _somar(total, parcial):
+    for campo, valor in parcial.items():
+        if campo == 'detalhes_erros':
+            total[campo].extend(valor)
+        else:
+            total[campo] += valor
+
+
+def _importar(estado, documentos, resultado, cliente, usuario):
+    """
+    Importa as procNFe de `documentos` e guarda as não gravadas para nova tentativa
+
+    Documentos que já estavam pendentes e agora foram gravados saem da lista.
+    """
+    from invoices.models import DFePendingDocument
+
+    ignoradas = []
+    _somar(resultado['importacao'], importar_fontes(
+        _nfes(documentos, resultado), cliente=cliente, usuario=usuario, ignoradas=ignoradas,
+    ))
+    motivos = dict(ignoradas)
+    gravadas = []
+    for documento in documentos:
+        if not documento['schema'].startswith('procNFe'):
+            continue
+        motivo = motivos.get(_nome(documento))
+        if motivo is None:
+            gravadas.append(documento['nsu'])
+            continue
+        pendente, criado = DFePendingDocument.objects.get_or_create(
+            sync_state=estado, nsu=documento['nsu'],
+            defaults={'schema': documento['schema'], 'content': documento['conteudo'], 'reason': motivo[:255]},
+        )
+        if not criado:
+            pendente.reason = motivo[:255]
+            pendente.attempts += 1
+            pendente.save(update_fields=['reason', 'attempts', 'updated_at'])
+    estado.pending_documents.filter(nsu__in=gravadas).delete()
+
+
+def sincronizar(cnpj_cpf, uf='PR', ambiente='homologacao', cliente=None, usuario=None, forcar=False,
+                max_consultas=None):
+    """
+    Busca os DF-e novos do interessado desde o último NSU gravado
+
+    O NSU é gravado após cada página importada: uma sincronização
+    interrompida recomeça da última página concluída. As procNFe não
+    gravadas (sem cliente ou com erro) ficam em DFePendingDocument e são
+    importadas de novo no início de cada sincronização.
+
+    Args:
+        cnpj_cpf: CNPJ/CPF interessado (certificado da consulta)
+        uf: UF do interessado (cUFAutor)
+        ambiente: 'homologacao' ou 'producao'
+        cliente: Client das NF-e importadas (padrão: pelo destinatário)
+        usuario: Usuário registrado em created_by
+        forcar: Consulta mesmo antes do intervalo mínimo
+        max_consultas: Páginas por sincronização (padrão: NFE_DFE_MAX_CONSULTAS)
+
+    Returns:
+        dict: {
+            'consultas': 2,
+            'documentos': 60,
+            'nfe': 55,          # procNFe enviadas à importação
+            'resumos': 4,       # resNFe (exigem manifestação para o XML completo)
+            'eventos': 1,
+            'ult_nsu': 60,
+            'max_nsu': 60,
+            'codigo': '137',
+            'mensagem': 'Nenhum documento localizado',
+            'proxima_consulta': datetime | None,
+            'reprocessadas': 1, # pendentes tentadas de novo
+            'pendentes': 0,     # procNFe ainda não importadas
+            'importacao': {...}  # ver importacao_nfe.importar_nfes()
+        }
+    """
+    from invoices.models import DFeSyncState
+
+    cnpj_cpf = clean_digits(cnpj_cpf)
+    estado, _ = DFeSyncState.objects.get_or_create(
+        tax_id=cnpj_cpf, environment='2' if ambiente == 'homologacao' else '1', defaults={'state': uf},
+    )
+    resultado = {
+        'consultas': 0, 'documentos': 0, 'nfe': 0, 'resumos': 0, 'eventos': 0,
+        'ult_nsu': estado.last_nsu, 'max_nsu': estado.max_nsu, 'codigo': None, 'mensagem': None,
+        'proxima_consulta': estado.next_sync_at, 'reprocessadas': 0, 'pendentes': 0,
+        'importacao': {'arquivos': 0, 'importadas': 0, 'itens': 0, 'duplicadas': 0, 'sem_cliente': 0,
+                       'erros': 0, 'detalhes_erros': []},
+    }
+    # Pendentes não dependem da SEFAZ: tentadas de novo mesmo durante a espera
+    pendentes = [
+        {'nsu': p.nsu, 'schema': p.schema, 'conteudo': p.content} for p in estado.pending_documents.all()
+    ]
+    if pendentes:
+        resultado['reprocessadas'] = len(pendentes)
+        _importar(estado, pendentes, {'nfe': 0, 'importacao': resultado['importacao']}, cliente, usuario)
+    resultado['pendentes'] = estado.pending_documents.count()
+    if not forcar and estado.next_sync_at and estado.next_sync_at > timezone.now():
+        resultado['mensagem'] = 'Aguardando o intervalo mínimo entre consultas sem documentos novos'
+        return resultado
+
+    sefaz = SefazIntegration(uf=uf, ambiente=ambiente)
+    for _ in range(max_consultas or get_max_consultas()):
+        retorno = sefaz.distribuicao_dfe(cnpj_cpf, estado.last_nsu)
+        resultado['consultas'] += 1
+        resultado['codigo'], resultado['mensagem'] = retorno['codigo'], retorno['mensagem']
+
+        if retorno['codigo'] == CODIGO_DOCUMENTOS:
+            resultado['documentos'] += len(retorno['documentos'])
+            _importar(estado, retorno['documentos'], resultado, cliente, usuario)
+            estado.documents_received += len(retorno['documentos'])
+        elif retorno['codigo'] not in (CODIGO_SEM_DOCUMENTOS, CODIGO_CONSUMO_INDEVIDO):
+            logger.error(f"Distribuição DF-e {cnpj_cpf}: {retorno['codigo']} - {retorno['mensagem']}")
+
+        estado.last_nsu = max(estado.last_nsu, retorno['ult_nsu'])
+        estado.max_nsu = max(retorno['max_nsu'], estado.last_nsu)
+        estado.last_code = retorno['codigo']
+        estado.last_message = (retorno['mensagem'] or '')[:255]
+        # Em dia (ou recusado): a SEFAZ exige esperar antes de consultar de novo
+        em_dia = retorno['codigo'] != CODIGO_DOCUMENTOS or estado.last_nsu >= estado.max_nsu
+        estado.next_sync_at = timezone.now() + timedelta(seconds=get_espera()) if em_dia else None
+        estado.save()
+        if em_dia:
+            break
+
+    resultado.update(ult_nsu=estado.last_nsu, max_nsu=estado.max_nsu, proxima_consulta=estado.next_sync_at,
+                     pendentes=estado.pending_documents.count())
+    return resultado
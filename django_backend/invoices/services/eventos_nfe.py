@@ -0,0 +1,368 @@
+"""
+Eventos da NF-e em lotes (envEvento): cancelamento e Carta de Correção
+Cada pedido vira um FiscalEvent; os eventos são agrupados por emitente, UF
+e ambiente em lotes de até 20, assinados com o certificado decifrado uma
+vez para todo o envio, e cada lote segue em uma única chamada ao
+NFeRecepcaoEvento4 (todos os lotes em paralelo). Os retEvento voltam para
+os FiscalEvent e as notas canceladas com um bulk_update por lote.
+"""
+from collections import defaultdict
+from xml.sax.saxutils import escape
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Max
+from django.utils import timezone
+from .sefaz_integration import SefazIntegration, NFE_NAMESPACE, remover_declaracao_xml
+from .sefaz_async import executar
+from .nfe_signer import assinatura_disponivel, carregar_certificado, assinar_xml
+from .nfe_engine import clean_digits
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Limite do leiaute de eventos 1.00 para o envEvento
+MAX_EVENTOS_LOTE = 20
+
+TIPO_CANCELAMENTO = '110111'
+TIPO_CARTA_CORRECAO = '110110'
+
+DESCRICOES = {
+    TIPO_CANCELAMENTO: 'Cancelamento',
+    TIPO_CARTA_CORRECAO: 'Carta de Correcao',
+}
+
+# Tamanho de xJust / xCorrecao
+LIMITES_TEXTO = {
+    TIPO_CANCELAMENTO: (15, 255),
+    TIPO_CARTA_CORRECAO: (15, 1000),
+}
+
+# Cartas de correção por nota (nSeqEvento)
+MAX_SEQUENCIA_CARTA_CORRECAO = 20
+
+# Status que ocupam o nSeqEvento (o evento pode ter chegado à SEFAZ)
+STATUS_SEQUENCIA = ('pending', 'error', 'registered')
+
+# cStat do retEvento com o evento registrado (155 = cancelamento fora de prazo)
+CODIGOS_REGISTRADO = ('135', '136', '155')
+
+# Texto fixo exigido no xCondUso da Carta de Correção
+CONDICAO_USO_CARTA_CORRECAO = (
+    'A Carta de Correcao e disciplinada pelo paragrafo 1o-A do art. 7o do Convenio S/N, de 15 de dezembro de '
+    '1970 e pode ser utilizada para regularizacao de erro ocorrido na emissao de documento fiscal, desde que o '
+    'erro nao esteja relacionado com: I - as variaveis que determinam o valor do imposto tais como: base de '
+    'calculo, aliquota, diferenca de preco, quantidade, valor da operacao ou da prestacao; II - a correcao de '
+    'dados cadastrais que implique mudanca do remetente ou do destinatario; III - a data de emissao ou de saida.'
+)
+
+
+def get_tamanho_lote():
+    """Eventos por lote (settings.NFE_EVENTOS_LOTE, máximo 20)"""
+    return max(1, min(int(getattr(settings, 'NFE_EVENTOS_LOTE', MAX_EVENTOS_LOTE)), MAX_EVENTOS_LOTE))
+
+
+def montar_evento(chave_acesso, tipo, sequencia, texto, cnpj_cpf, tp_amb, protocolo=None, data=None):
+    """
+    XML de um <evento> (sem assinatura)
+
+    Args:
+        chave_acesso: Chave de 44 dígitos da NF-e
+        tipo: TIPO_CANCELAMENTO ou TIPO_CARTA_CORRECAO
+        sequencia: nSeqEvento (1 no cancelamento)
+        texto: Justificativa (xJust) ou correção (xCorrecao)
+        cnpj_cpf: CNPJ/CPF do autor do evento (emitente)
+        tp_amb: '1' produção, '2' homologação
+        protocolo: Protocolo de autorização (obrigatório no cancelamento)
+        data: dhEvento (padrão: agora)
+
+    Returns:
+        str: <evento versao="1.00">...</evento>
+    """
+    documento = clean_digits(cnpj_cpf)
+    tag = 'CPF' if len(documento) == 11 else 'CNPJ'
+    data = timezone.localtime(data or timezone.now()).isoformat(timespec='seconds')
+
+    if tipo == TIPO_CANCELAMENTO:
+        detalhe = f'<nProt>{protocolo}</nProt><xJust>{escape(texto)}</xJust>'
+    else:
+        detalhe = f'<xCorrecao>{escape(texto)}</xCorrecao><xCondUso>{CONDICAO_USO_CARTA_CORRECAO}</xCondUso>'
+
+    return (
+        f'<evento xmlns="{NFE_NAMESPACE}" versao="1.00">'
+        f'<infEvento Id="ID{tipo}{chave_acesso}{int(sequencia):02d}">'
+        f'<cOrgao>{chave_acesso[:2]}</cOrgao><tpAmb>{tp_amb}</tpAmb><{tag}>{documento}</{tag}>'
+        f'<chNFe>{chave_acesso}</chNFe><dhEvento>{data}</dhEvento><tpEvento>{tipo}</tpEvento>'
+        f'<nSeqEvento>{int(sequencia)}</nSeqEvento><verEvento>1.00</verEvento>'
+        f'<detEvento versao="1.00"><descEvento>{DESCRICOES[tipo]}</descEvento>{detalhe}</detEvento>'
+        '</infEvento></evento>'
+    )
+
+
+def montar_lote(eventos, id_lote):
+    """envEvento com até 20 <evento> (assinados)"""
+    if len(eventos) > MAX_EVENTOS_LOTE:
+        raise ValueError(f'Lote com {len(eventos)} eventos (máximo {MAX_EVENTOS_LOTE})')
+    return (
+        f'<envEvento xmlns="{NFE_NAMESPACE}" versao="1.00"><idLote>{id_lote}</idLote>'
+        + ''.join(remover_declaracao_xml(evento) for evento in eventos)
+        + '</envEvento>'
+    )
+
+
+def assinar_eventos(eventos):
+    """
+    Assina cada <evento> com o certificado configurado
+
+    O PFX é decifrado uma vez para todos os eventos; sem certificado
+    (NFE_CERTIFICADO_PATH) os eventos seguem sem assinatura.
+    """
+    if not assinatura_disponivel():
+        return list(eventos)
+    certificado = carregar_certificado()
+    return [assinar_xml(evento, certificado, elemento='infEvento') for evento in eventos]
+
+
+def _ambiente(invoice):
+    return 'homologacao' if (invoice.environment or '2') == '2' else 'producao'
+
+
+def validar_pedido(invoice, tipo, texto):
+    """Motivo pelo qual o evento não pode ser pedido para a nota, ou None"""
+    minimo, maximo = LIMITES_TEXTO[tipo]
+    if not minimo <= len(texto or '') <= maximo:
+        campo = 'Justificativa' if tipo == TIPO_CANCELAMENTO else 'Correção'
+        return f'{campo} deve ter entre {minimo} e {maximo} caracteres'
+    if invoice.status == 'cancelled':
+        return 'NF-e já cancelada'
+    if invoice.status != 'authorized' or not invoice.access_key:
+        return f'NF-e com status {invoice.status} não aceita eventos'
+    if tipo == TIPO_CANCELAMENTO and not invoice.protocol:
+        return 'NF-e sem protocolo de autorização'
+    return None
+
+
+def criar_eventos(invoices, tipo, texto, usuario=None):
+    """
+    Registra os FiscalEvent pendentes das notas que aceitam o evento
+
+    Cartas de correção recebem o próximo nSeqEvento da nota (cada nova
+    carta substitui as anteriores), contando as pendentes e as com erro no
+    envio, que podem ter sido registradas. O cancelamento (nSeqEvento 1)
+    com erro no envio é reenviado no mesmo FiscalEvent; com outro pedido
+    ainda pendente, a nota é recusada. A numeração é feita com as notas
+    travadas (select_for_update), então pedidos simultâneos não repetem
+    a sequência.
+
+    Returns:
+        tuple: ([FiscalEvent, ...], [resultado de nota recusada, ...])
+    """
+    from invoices.models import Invoice, FiscalEvent
+
+    invoices = list({invoice.pk: invoice for invoice in invoices}.values())
+    eventos, recusados, reenviados = [], [], []
+    with transaction.atomic():
+        list(Invoice.objects.select_for_update().filter(pk__in=[invoice.pk for invoice in invoices]).order_by('pk')
+             .values_list('pk', flat=True))
+        ocupados = FiscalEvent.objects.filter(invoice__in=invoices, event_type=tipo, status__in=STATUS_SEQUENCIA)
+        sequencias = dict(ocupados.values_list('invoice').annotate(Max('sequence')))
+        abertos = {}
+        if tipo == TIPO_CANCELAMENTO:
+            abertos = {evento.invoice_id: evento for evento in ocupados.exclude(status='registered')}
+
+        for invoice in invoices:
+            motivo = validar_pedido(invoice, tipo, texto)
+            sequencia = sequencias.get(invoice.pk, 0) + 1
+            aberto = abertos.get(invoice.pk)
+            if motivo is None and aberto is not None and aberto.status == 'pending':
+                motivo = 'Cancelamento da NF-e já em envio'
+            elif motivo is None and sequencia > MAX_SEQUENCIA_CARTA_CORRECAO:
+                motivo = f'Limite de {MAX_SEQUENCIA_CARTA_CORRECAO} cartas de correção por NF-e atingido'
+            if motivo:
+                recusados.append({
+                    'invoice_id': invoice.pk, 'chave_acesso': invoice.access_key, 'tipo': tipo, 'sequencia': None,
+                    'status': 'rejected', 'codigo': None, 'mensagem': motivo, 'protocolo': None,
+                })
+                continue
+            if aberto is not None:
+                aberto.invoice, aberto.text, aberto.status = invoice, texto, 'pending'
+                reenviados.append(aberto)
+                eventos.append(aberto)
+                continue
+            evento = FiscalEvent(invoice=invoice, event_type=tipo, sequence=sequencia, text=texto, created_by=usuario)
+            eventos.append(evento)
+
+        FiscalEvent.objects.bulk_create([evento for evento in eventos if evento.pk is None])
+        FiscalEvent.objects.bulk_update(reenviados, ['text', 'status'])
+    return eventos, recusados
+
+
+def agrupar_lotes(eventos, tamanho=None):
+    """
+    Agrupa eventos por (emitente, UF, ambiente) em lotes de até `tamanho`
+
+    Returns:
+        list: [((cnpj_cpf, uf, ambiente), [FiscalEvent, ...]), ...]
+    """
+    tamanho = min(tamanho or get_tamanho_lote(), MAX_EVENTOS_LOTE)
+    grupos = defaultdict(list)
+    for evento in eventos:
+        invoice = evento.invoice
+        grupos[(clean_digits(invoice.issuer_tax_id), invoice.issuer_state or 'PR', _ambiente(invoice))].append(evento)
+
+    return [
+        (chave, lista[inicio:inicio + tamanho])
+        for chave, lista in grupos.items()
+        for inicio in range(0, len(lista), tamanho)
+    ]
+
+
+def _transmitir_lotes(lotes):
+    """
+    Monta, assina e envia todos os lotes ao mesmo tempo
+
+    Returns:
+        list: (id_lote, retorno ou Exception) na ordem dos lotes
+    """
+    from .sefaz_lote import gerar_id_lote
+
+    todos = [evento for _, eventos in lotes for evento in eventos]
+    xmls = assinar_eventos(
+        montar_evento(
+            evento.invoice.access_key, evento.event_type, evento.sequence, evento.text,
+            evento.invoice.issuer_tax_id, evento.invoice.environment or '2', protocolo=evento.invoice.protocol,
+        )
+        for evento in todos
+    )
+    for evento, xml in zip(todos, xmls):
+        evento.xml = xml
+
+    preparados = [
+        (SefazIntegration(uf=uf, ambiente=ambiente), montar_lote([evento.xml for evento in eventos], id_lote), id_lote)
+        for ((_, uf, ambiente), eventos), id_lote in zip(lotes, (gerar_id_lote() for _ in lotes))
+    ]
+
+    async def enviar():
+        return await asyncio.gather(
+            *(sefaz.aenviar_evento(env_evento) for sefaz, env_evento, _ in preparados),
+            return_exceptions=True,
+        )
+
+    return [(id_lote, retorno) for (_, _, id_lote), retorno in zip(preparados, executar(enviar()))]
+
+
+def aplicar_retornos(eventos, id_lote, retorno):
+    """
+    Grava o retEvento de cada evento do lote e cancela as notas
+
+    Args:
+        eventos: FiscalEvent do lote
+        id_lote: idLote enviado
+        retorno: Resultado de aenviar_evento() ou a Exception do envio
+
+    Returns:
+        list: [{'invoice_id': 1, 'chave_acesso': '...', 'tipo': '110111', 'sequencia': 1,
+                'status': 'registered', 'codigo': '135', 'mensagem': '...', 'protocolo': '...'}, ...]
+    """
+    from invoices.models import FiscalEvent
+
+    if isinstance(retorno, Exception):
+        logger.error(f"Erro ao enviar lote de eventos {id_lote}: {str(retorno)}")
+        por_evento, lote = {}, (None, f'Erro ao enviar lote: {str(retorno)}')
+    else:
+        por_evento = {(r['chave_acesso'], r['tipo'], r['sequencia']): r for r in retorno['eventos']}
+        lote = (retorno['codigo'], retorno['mensagem'])
+
+    agora = timezone.now()
+    canceladas = []
+    resultados = []
+    for evento in eventos:
+        invoice = evento.invoice
+        ret = por_evento.get((invoice.access_key, evento.event_type, evento.sequence))
+        evento.lot_id = id_lote
+        evento.updated_at = agora
+        if ret is None:
+            # Lote recusado inteiro (ex.: 225) ou não entregue
+            evento.status = 'error' if isinstance(retorno, Exception) else 'rejected'
+            evento.last_code, evento.last_message = lote[0], (lote[1] or '')[:255]
+        else:
+            evento.last_code, evento.last_message = ret['codigo'], (ret['mensagem'] or '')[:255]
+            if ret['codigo'] in CODIGOS_REGISTRADO:
+                evento.status = 'registered'
+                evento.protocol = ret['protocolo']
+                evento.registered_at = ret['data_registro'] or agora
+                if evento.event_type == TIPO_CANCELAMENTO:
+                    invoice.status = 'cancelled'
+                    canceladas.append(invoice)
+            else:
+                evento.status = 'rejected'
+
+        resultados.append({
+            'invoice_id': invoice.pk,
+            'chave_acesso': invoice.access_key,
+            'tipo': evento.event_type,
+            'sequencia': evento.sequence,
+            'status': evento.status,
+            'codigo': evento.last_code,
+            'mensagem': evento.last_message,
+            'protocolo': evento.protocol,
+        })
+
+    FiscalEvent.objects.bulk_update(
+        eventos, ['status', 'lot_id', 'protocol', 'registered_at', 'last_code', 'last_message', 'xml', 'updated_at'],
+    )
+    if canceladas:
+        type(canceladas[0]).objects.bulk_update(canceladas, ['status'])
+    return resultados
+
+
+def registrar_eventos(invoices, tipo, texto, usuario=None, tamanho_lote=None):
+    """
+    Envia o mesmo evento para várias notas em lotes envEvento
+
+    Args:
+        invoices: Iterável de Invoice
+        tipo: TIPO_CANCELAMENTO ou TIPO_CARTA_CORRECAO
+        texto: Justificativa do cancelamento ou texto da correção
+        usuario: Usuário registrado em created_by
+        tamanho_lote: Eventos por lote (padrão: NFE_EVENTOS_LOTE)
+
+    Returns:
+        dict: {
+            'lotes': 2,           # chamadas à SEFAZ
+            'eventos': 25,
+            'registrados': 24,
+            'rejeitados': 1,      # inclui notas recusadas antes do envio
+            'tempo_total': 0.41,
+            'resultados': [...]   # ver aplicar_retornos()
+        }
+    """
+    inicio = time.perf_counter()
+    eventos, recusados = criar_eventos(invoices, tipo, texto, usuario)
+    lotes = agrupar_lotes(eventos, tamanho_lote)
+
+    resultados = []
+    for (_, eventos_lote), (id_lote, retorno) in zip(lotes, _transmitir_lotes(lotes) if lotes else []):
+        resultados.extend(aplicar_retornos(eventos_lote, id_lote, retorno))
+    resultados.extend(recusados)
+
+    registrados = sum(1 for resultado in resultados if resultado['status'] == 'registered')
+    return {
+        'lotes': len(lotes),
+        'eventos': len(eventos),
+        'registrados': registrados,
+        'rejeitados': len(resultados) - registrados,
+        'tempo_total': round(time.perf_counter() - inicio, 4),
+        'resultados': resultados,
+    }
+
+
+def cancelar_notas(invoices, justificativa, usuario=None, tamanho_lote=None):
+    """Cancela várias NF-e autorizadas (evento 110111); ver registrar_eventos()"""
+    return registrar_eventos(invoices, TIPO_CANCELAMENTO, justificativa, usuario, tamanho_lote)
+
+
+def corrigir_notas(invoices, correcao, usuario=None, tamanho_lote=None):
+    """Envia a mesma Carta de Correção (evento 110110) para várias NF-e; ver registrar_eventos()"""
+    return registrar_eventos(invoices, TIPO_CARTA_CORRECAO, correcao, usuario, tamanho_lote)
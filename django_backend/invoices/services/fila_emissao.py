@@ -0,0 +1,318 @@
+"""
+Fila persistente de emissão de NF-e
+Cada IssuanceJob percorre as etapas do pipeline (XML, validação, DANFE,
+backup e, opcionalmente, autorização na SEFAZ) como uma máquina de estados
+gravada no banco: a etapa concluída é registrada antes da próxima começar,
+então um worker que cai é retomado na etapa em que parou. Vários workers
+podem rodar ao mesmo tempo; cada job é reservado com uma concessão (lease)
+por tempo limitado e tentativas com falha voltam para a fila com backoff.
+"""
+from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, PositiveIntegerField, Q, When
+from django.utils import timezone
+import traceback
+import threading
+import logging
+import socket
+import time
+import os
+
+logger = logging.getLogger(__name__)
+
+# Limites padrão (podem ser sobrescritos no settings.py)
+DEFAULT_LEASE = 300
+DEFAULT_MAX_TENTATIVAS = 5
+DEFAULT_ESPERA_RETENTATIVA = 5
+DEFAULT_ESPERA_MAXIMA = 300
+
+# Ordem das etapas; 'authorization' só roda em jobs com authorize=True
+ETAPAS = ('xml', 'validation', 'danfe', 'backup', 'authorization', 'done')
+
+
+class ValidacaoFalhou(Exception):
+    """XML rejeitado na validação: falha definitiva, sem nova tentativa"""
+
+
+class ReservaPerdida(Exception):
+    """A concessão do job venceu e outro worker assumiu a execução"""
+
+
+def get_lease():
+    """Segundos de reserva de um job por etapa (settings.NFE_FILA_LEASE)"""
+    return float(getattr(settings, 'NFE_FILA_LEASE', DEFAULT_LEASE))
+
+
+def get_max_tentativas():
+    """Tentativas antes de marcar o job como falho (settings.NFE_FILA_MAX_TENTATIVAS)"""
+    return int(getattr(settings, 'NFE_FILA_MAX_TENTATIVAS', DEFAULT_MAX_TENTATIVAS))
+
+
+def espera_retentativa(tentativas):
+    """Backoff exponencial entre tentativas (NFE_FILA_ESPERA_RETENTATIVA, teto NFE_FILA_ESPERA_MAXIMA)"""
+    base = float(getattr(settings, 'NFE_FILA_ESPERA_RETENTATIVA', DEFAULT_ESPERA_RETENTATIVA))
+    teto = float(getattr(settings, 'NFE_FILA_ESPERA_MAXIMA', DEFAULT_ESPERA_MAXIMA))
+    return min(base * 2 ** max(tentativas - 1, 0), teto)
+
+
+def identificador_worker():
+    """host:pid:thread, único entre os workers em execução"""
+    return f'{socket.gethostname()}:{os.getpid()}:{threading.get_ident()}'
+
+
+# ========== Enfileiramento ==========
+
+def _job_ativo(invoice):
+    from invoices.models import IssuanceJob
+
+    return IssuanceJob.objects.filter(invoice=invoice, status__in=('queued', 'running')).first()
+
+
+def enfileirar(invoice, autorizar=False, usuario=None):
+    """
+    Coloca a emissão da nota na fila
+
+    Um job ainda ativo (na fila ou em execução) da mesma nota é reaproveitado.
+    A constraint unique_active_issuance_job garante um só job ativo: se outro
+    pedido cria o job entre a consulta e o INSERT, o job dele é devolvido.
+
+    Args:
+        invoice: Objeto Invoice do Django
+        autorizar: Inclui a etapa de autorização na SEFAZ
+        usuario: Usuário que solicitou a emissão
+
+    Returns:
+        IssuanceJob
+    """
+    from invoices.models import IssuanceJob
+
+    for tentativa in range(3):
+        ativo = _job_ativo(invoice)
+        if ativo is not None:
+            if autorizar and not ativo.authorize:
+                IssuanceJob.objects.filter(pk=ativo.pk).update(authorize=True)
+                ativo.authorize = True
+            return ativo
+
+        try:
+            with transaction.atomic():
+                return IssuanceJob.objects.create(
+                    invoice=invoice, authorize=autorizar, created_by=usuario, run_after=timezone.now(),
+                )
+        except IntegrityError:
+            # Pedido simultâneo criou o job ativo: reaproveita o dele
+            if tentativa == 2:
+                raise
+
+
+# ========== Reserva (lease) ==========
+
+def _disponiveis(agora):
+    """Jobs na fila já liberados ou em execução com a concessão vencida (worker caiu)"""
+    return Q(status='queued', run_after__lte=agora) | Q(status='running', lease_expires_at__lt=agora)
+
+
+def reservar(worker, quantidade=1):
+    """
+    Reserva até `quantidade` jobs para o worker
+
+    A reserva é um UPDATE condicional por job: só um worker consegue trocar
+    a concessão de um mesmo job, sem travar a tabela (funciona em qualquer
+    banco, inclusive SQLite).
+
+    Returns:
+        list: IssuanceJob reservados
+    """
+    from invoices.models import IssuanceJob
+
+    agora = timezone.now()
+    # Concessão vencida de um job na última tentativa: o worker caiu em todas, falha definitiva
+    IssuanceJob.objects.filter(
+        status='running', lease_expires_at__lt=agora, attempts__gte=get_max_tentativas() - 1,
+    ).update(
+        status='failed', leased_by=None, lease_expires_at=None, finished_at=agora, updated_at=agora,
+        attempts=F('attempts') + 1, last_error='Concessão vencida em todas as tentativas (worker caiu durante a execução)',
+    )
+    candidatos = list(
+        IssuanceJob.objects.filter(_disponiveis(agora)).order_by('run_after')
+        .values_list('pk', flat=True)[:quantidade * 4]
+    )
+
+    reservados = []
+    for pk in candidatos:
+        if len(reservados) >= quantidade:
+            break
+        ganhou = IssuanceJob.objects.filter(_disponiveis(agora), pk=pk).update(
+            status='running', leased_by=worker, lease_expires_at=agora + timedelta(seconds=get_lease()),
+            # Concessão vencida conta como tentativa; na última o job já saiu da fila como falho (acima)
+            attempts=Case(When(status='running', then=F('attempts') + 1), default=F('attempts'), output_field=PositiveIntegerField()),
+            updated_at=agora,
+        )
+        if ganhou:
+            reservados.append(pk)
+
+    return list(IssuanceJob.objects.filter(pk__in=reservados).select_related('invoice').order_by('run_after'))
+
+
+def _avancar(job, worker, **campos):
+    """Grava o progresso e renova a concessão; falha se outro worker assumiu o job"""
+    from invoices.models import IssuanceJob
+
+    agora = timezone.now()
+    campos.setdefault('lease_expires_at', agora + timedelta(seconds=get_lease()))
+    campos['updated_at'] = agora
+    if not IssuanceJob.objects.filter(pk=job.pk, leased_by=worker, status='running').update(**campos):
+        raise ReservaPerdida(f'Job {job.pk} não pertence mais a {worker}')
+    for campo, valor in campos.items():
+        setattr(job, campo, valor)
+
+
+# ========== Etapas ==========
+
+def _etapa_xml(job, invoice):
+    from .nfe_pipeline import gerar_xml
+
+    _, chave_acesso = gerar_xml(invoice)
+    invoice.save(update_fields=['access_key', 'xml_file'])
+    return {'chave_acesso': chave_acesso}
+
+
+def _etapa_validation(job, invoice):
+    from .nfe_pipeline import validar_xml
+
+    validacao = validar_xml(invoice)
+    if not validacao['valido']:
+        raise ValidacaoFalhou(validacao)
+    return {'validacao': validacao}
+
+
+def _etapa_danfe(job, invoice):
+    from .nfe_pipeline import gerar_danfe
+
+    gerar_danfe(invoice, invoice.access_key)
+    if invoice.status == 'draft':
+        invoice.status = 'pending'
+    invoice.save(update_fields=['pdf_file', 'danfe_hash', 'status'])
+    return {'status': invoice.status}
+
+
+def _etapa_backup(job, invoice):
+    from .backup_service import backup_invoice_files
+
+    return {'backup': backup_invoice_files(invoice)}
+
+
+def _etapa_authorization(job, invoice):
+    from invoices.models import Invoice
+    from .sefaz_lote import autorizar_pendentes
+
+    invoice.refresh_from_db()
+    if invoice.status != 'pending' or (invoice.receipt_id and invoice.receipt.status == 'waiting'):
+        return {'autorizacao': {'status': invoice.status, 'mensagem': 'Nota já enviada à SEFAZ'}}
+
+    resultado = autorizar_pendentes(Invoice.objects.filter(pk=invoice.pk), aguardar=False)['resultados'][0]
+    invoice.refresh_from_db()
+    if invoice.status == 'pending' and not (invoice.receipt_id and invoice.receipt.status == 'waiting'):
+        # Sem recibo nem protocolo: falha de comunicação ou lote rejeitado, tenta de novo
+        raise ConnectionError(f"SEFAZ não recebeu a nota: {resultado['codigo']} - {resultado['mensagem']}")
+    return {'autorizacao': {
+        'status': invoice.status,
+        'codigo': resultado['codigo'],
+        'mensagem': resultado['mensagem'],
+        'recibo': invoice.receipt.number if invoice.receipt_id else None,
+    }}
+
+
+EXECUTORES = {
+    'xml': _etapa_xml,
+    'validation': _etapa_validation,
+    'danfe': _etapa_danfe,
+    'backup': _etapa_backup,
+    'authorization': _etapa_authorization,
+}
+
+
+def _proxima_etapa(job, etapa):
+    proxima = ETAPAS[ETAPAS.index(etapa) + 1]
+    if proxima == 'authorization' and not job.authorize:
+        proxima = 'done'
+    return proxima
+
+
+def processar(job, worker):
+    """
+    Executa as etapas restantes de um job reservado
+
+    Returns:
+        str: Status final do job ('done', 'queued' para nova tentativa ou 'failed')
+    """
+    invoice = job.invoice
+    try:
+        while job.stage != 'done':
+            saida = EXECUTORES[job.stage](job, invoice)
+            _avancar(job, worker, stage=_proxima_etapa(job, job.stage), result={**job.result, **saida})
+
+        _avancar(job, worker, status='done', leased_by=None, lease_expires_at=None, finished_at=timezone.now())
+    except ReservaPerdida as e:
+        logger.warning(str(e))
+        return 'lost'
+    except ValidacaoFalhou as e:
+        validacao = e.args[0]
+        _avancar(
+            job, worker, status='failed', leased_by=None, lease_expires_at=None, finished_at=timezone.now(),
+            attempts=job.attempts + 1, last_error='; '.join(validacao['erros'])[:10000],
+            result={**job.result, 'validacao': validacao},
+        )
+    except Exception as e:
+        tentativas = job.attempts + 1
+        erro = f'{type(e).__name__}: {str(e)}'
+        logger.error(f"Job {job.pk} falhou na etapa {job.stage} (tentativa {tentativas}): {erro}")
+        campos = {'attempts': tentativas, 'last_error': erro + '\n' + traceback.format_exc()[-4000:],
+                  'leased_by': None, 'lease_expires_at': None}
+        if tentativas >= get_max_tentativas():
+            campos.update(status='failed', finished_at=timezone.now())
+        else:
+            campos.update(status='queued', run_after=timezone.now() + timedelta(seconds=espera_retentativa(tentativas)))
+        try:
+            _avancar(job, worker, **campos)
+        except ReservaPerdida:
+            return 'lost'
+    return job.status
+
+
+def executar_worker(worker=None, parar=None, intervalo_ocioso=2.0, max_jobs=None):
+    """
+    Laço do worker: reserva um job por vez e executa até a fila esvaziar
+
+    Args:
+        worker: Identificador (padrão: host:pid:thread)
+        parar: threading.Event opcional para encerrar o laço
+        intervalo_ocioso: Espera com a fila vazia; None encerra quando esvaziar
+        max_jobs: Encerra após processar esta quantidade de jobs
+
+    Returns:
+        dict: {'done': 10, 'queued': 1, 'failed': 0, 'lost': 0}
+    """
+    worker = worker or identificador_worker()
+    contagem = {'done': 0, 'queued': 0, 'failed': 0, 'lost': 0}
+    processados = 0
+
+    while parar is None or not parar.is_set():
+        jobs = reservar(worker)
+        if not jobs:
+            if intervalo_ocioso is None:
+                break
+            if parar is not None:
+                parar.wait(intervalo_ocioso)
+            else:
+                time.sleep(intervalo_ocioso)
+            continue
+
+        for job in jobs:
+            contagem[processar(job, worker)] += 1
+            processados += 1
+        if max_jobs and processados >= max_jobs:
+            break
+
+    return contagem
@@ -0,0 +1,117 @@
+"""
+Idempotência de requisições que falam com a SEFAZ
+A primeira requisição com uma chave (cabeçalho Idempotency-Key ou a chave
+de acesso da nota) reserva um IdempotencyRecord; quando a SEFAZ dá a
+resposta final (autorizada, denegada ou rejeitada) ela é gravada e as
+repetições a recebem direto do banco, sem nova ida à SEFAZ. Respostas
+intermediárias (recibo em processamento, lote recusado, erro de
+comunicação) liberam a chave, e a próxima tentativa executa de novo.
+Repetições simultâneas são recusadas enquanto a primeira executa.
+"""
+from datetime import timedelta
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+import hashlib
+
+# Limites padrão (podem ser sobrescritos no settings.py)
+DEFAULT_TTL = 24 * 60 * 60
+DEFAULT_TEMPO_EXECUCAO = 120
+
+# Situações devolvidas por iniciar()
+NOVA = 'nova'
+REPETIDA = 'repetida'
+EM_ANDAMENTO = 'em_andamento'
+CONFLITO = 'conflito'
+
+
+def get_ttl():
+    """Segundos em que uma resposta é devolvida para a mesma chave (settings.NFE_IDEMPOTENCIA_TTL)"""
+    return float(getattr(settings, 'NFE_IDEMPOTENCIA_TTL', DEFAULT_TTL))
+
+
+def get_tempo_execucao():
+    """Segundos até uma execução sem resposta ser considerada abandonada (settings.NFE_IDEMPOTENCIA_TEMPO_EXECUCAO)"""
+    return float(getattr(settings, 'NFE_IDEMPOTENCIA_TEMPO_EXECUCAO', DEFAULT_TEMPO_EXECUCAO))
+
+
+def impressao(conteudo):
+    """SHA-256 do conteúdo enviado (XML da nota), para detectar mudança entre tentativas"""
+    if isinstance(conteudo, str):
+        conteudo = conteudo.encode('utf-8')
+    return hashlib.sha256(conteudo).hexdigest()
+
+
+def _pode_assumir(registro, digest, agora):
+    """Registro vencido, execução abandonada ou erro anterior com outra versão da nota"""
+    if registro.expires_at <= agora:
+        return True
+    if registro.status == 'in_progress':
+        return registro.locked_until is not None and registro.locked_until <= agora
+    return registro.fingerprint != digest and (registro.response_status or 0) >= 400
+
+
+def iniciar(escopo, chave, digest, invoice=None):
+    """
+    Reserva a chave para uma nova execução ou indica como responder
+
+    Args:
+        escopo: Operação (ex.: 'authorize_sefaz')
+        chave: Idempotency-Key ou chave de acesso
+        digest: impressao() da requisição
+        invoice: Nota a que a chave pertence
+
+    Returns:
+        tuple: (situação, IdempotencyRecord), situação sendo
+            NOVA: execute e chame concluir() ou liberar()
+            REPETIDA: devolva registro.response_status / response_body
+            EM_ANDAMENTO: outra requisição com a mesma chave está executando
+            CONFLITO: a chave já foi usada para outra nota
+    """
+    from invoices.models import IdempotencyRecord
+
+    agora = timezone.now()
+    campos = {
+        'fingerprint': digest,
+        'status': 'in_progress',
+        'response_status': None,
+        'response_body': None,
+        'locked_until': agora + timedelta(seconds=get_tempo_execucao()),
+        'expires_at': agora + timedelta(seconds=get_ttl()),
+    }
+
+    try:
+        with transaction.atomic():
+            return NOVA, IdempotencyRecord.objects.create(scope=escopo, key=chave, invoice=invoice, **campos)
+    except IntegrityError:
+        registro = IdempotencyRecord.objects.get(scope=escopo, key=chave)
+
+    if invoice is not None and registro.invoice_id != invoice.pk:
+        return CONFLITO, registro
+
+    if _pode_assumir(registro, digest, agora):
+        # Troca condicional: entre requisições simultâneas só uma assume
+        assumiu = IdempotencyRecord.objects.filter(pk=registro.pk, updated_at=registro.updated_at).update(
+            updated_at=agora, **campos
+        )
+        registro.refresh_from_db()
+        if assumiu:
+            return NOVA, registro
+
+    if registro.status == 'in_progress':
+        return EM_ANDAMENTO, registro
+    return REPETIDA, registro
+
+
+def concluir(registro, status_http, corpo):
+    """Grava a resposta final da SEFAZ, devolvida às repetições até o registro vencer"""
+    registro.status = 'completed'
+    registro.response_status = status_http
+    registro.response_body = corpo
+    registro.locked_until = None
+    registro.save(update_fields=['status', 'response_status', 'response_body', 'locked_until', 'updated_at'])
+
+
+def liberar(registro):
+    """Descarta a reserva sem resposta final ou após erro inesperado (a próxima tentativa executa de novo)"""
+    registro.delete()
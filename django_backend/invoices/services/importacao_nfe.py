@@ -0,0 +1,521 @@
+"""
+Importação em massa de NF-e recebidas de fornecedores (nfeProc)
+Lê diretórios, ZIPs ou arquivos XML soltos em streaming com
+lxml.etree.iterparse, limpando cada elemento depois de lido (memória
+limitada ao lote em montagem), e grava Invoice/InvoiceItem com bulk_create
+por lote. Notas já importadas são descartadas com uma única consulta de
+chaves de acesso por lote.
+"""
+from datetime import datetime
+from decimal import Decimal, InvalidOperation
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+from .access_key import formato_valido
+from .nfe_engine import NAMESPACE, clean_digits
+from .sefaz_lote import CODIGOS_AUTORIZADA, CODIGOS_DENEGADA
+import itertools
+import zipfile
+import logging
+import os
+
+try:
+    from lxml import etree
+    _HAS_LXML = True
+except ImportError:
+    _HAS_LXML = False
+
+logger = logging.getLogger(__name__)
+
+# Notas gravadas por bulk_create (pode ser sobrescrito no settings.py)
+DEFAULT_TAMANHO_LOTE = 500
+
+# Mensagens de erro guardadas no resultado
+MAX_ERROS_DETALHADOS = 100
+
+# Elementos tratados no iterparse (eventos 'end')
+_TAGS = ('ide', 'emit', 'dest', 'det', 'total', 'infAdic', 'infProt')
+
+
+def _q(caminho):
+    """'prod/cProd' -> '{ns}prod/{ns}cProd'"""
+    return '/'.join(f'{{{NAMESPACE}}}{parte}' for parte in caminho.split('/'))
+
+
+_TAG = {f'{{{NAMESPACE}}}{nome}': nome for nome in _TAGS}
+_INF_NFE = _q('infNFe')
+_P = {caminho: _q(caminho) for caminho in (
+    # ide
+    'nNF', 'serie', 'mod', 'natOp', 'dhEmi', 'dEmi', 'tpAmb', 'tpEmis', 'idDest', 'indFinal', 'indPres',
+    'dhCont', 'xJust',
+    # emit/dest
+    'CNPJ', 'CPF', 'idEstrangeiro', 'xNome', 'xFant', 'IE', 'CRT', 'indIEDest', 'email',
+    'enderEmit/xLgr', 'enderEmit/nro', 'enderEmit/xBairro', 'enderEmit/cMun', 'enderEmit/xMun',
+    'enderEmit/UF', 'enderEmit/CEP', 'enderEmit/fone',
+    'enderDest/xLgr', 'enderDest/nro', 'enderDest/xBairro', 'enderDest/cMun', 'enderDest/xMun',
+    'enderDest/UF', 'enderDest/CEP', 'enderDest/fone',
+    # det
+    'prod/cProd', 'prod/xProd', 'prod/NCM', 'prod/CFOP', 'prod/uCom', 'prod/qCom', 'prod/vUnCom',
+    'prod/vProd', 'prod/vDesc', 'imposto/ICMS', 'imposto/IPI/IPITrib', 'imposto/PIS',
+    'imposto/COFINS', 'imposto/ISSQN',
+    # grupos de imposto
+    'orig', 'CST', 'CSOSN', 'pICMS', 'vICMS', 'pIPI', 'vIPI', 'pPIS', 'vPIS', 'pCOFINS', 'vCOFINS',
+    # total
+    'ICMSTot/vBC', 'ICMSTot/vICMS', 'ICMSTot/vIPI', 'ICMSTot/vPIS', 'ICMSTot/vCOFINS', 'ICMSTot/vProd',
+    'ICMSTot/vDesc', 'ICMSTot/vFrete', 'ICMSTot/vSeg', 'ICMSTot/vOutro', 'ICMSTot/vNF',
+    'ISSQNtot/vServ', 'ISSQNtot/vISS',
+    # infAdic/infProt
+    'infCpl', 'infAdFisco', 'chNFe', 'nProt', 'dhRecbto', 'cStat',
+)}
+
+_CENTAVOS = Decimal('0.01')
+_QUATRO_CASAS = Decimal('0.0001')
+
+
+class XMLNaoSuportado(ValueError):
+    """Arquivo que não é uma NF-e (nfeProc/NFe) legível"""
+
+
+def get_tamanho_lote():
+    """Notas gravadas por lote (settings.NFE_IMPORTACAO_LOTE)"""
+    return max(1, int(getattr(settings, 'NFE_IMPORTACAO_LOTE', DEFAULT_TAMANHO_LOTE)))
+
+
+# ========== Fontes ==========
+
+def _fontes_zip(arquivo, nome_zip):
+    with zipfile.ZipFile(arquivo) as pacote:
+        for info in pacote.infolist():
+            if info.is_dir() or not info.filename.lower().endswith('.xml'):
+                continue
+            with pacote.open(info) as conteudo:
+                yield f'{nome_zip}:{info.filename}', conteudo
+
+
+def fontes(origem):
+    """
+    Percorre os XMLs de uma origem sem carregá-los em memória
+
+    Args:
+        origem: Diretório (recursivo, inclui ZIPs), arquivo .zip, arquivo .xml
+                ou arquivo aberto em modo binário (ZIP ou XML)
+
+    Yields:
+        tuple: (nome, arquivo binário aberto)
+    """
+    if hasattr(origem, 'read'):
+        nome = getattr(origem, 'name', None) or 'upload'
+        if zipfile.is_zipfile(origem):
+            origem.seek(0)
+            yield from _fontes_zip(origem, nome)
+        else:
+            origem.seek(0)
+            yield nome, origem
+        return
+
+    origem = os.fspath(origem)
+    if os.path.isdir(origem):
+        for pasta, subpastas, arquivos in os.walk(origem):
+            subpastas.sort()
+            for nome in sorted(arquivos):
+                if nome.lower().endswith(('.xml', '.zip')):
+                    yield from fontes(os.path.join(pasta, nome))
+    elif zipfile.is_zipfile(origem):
+        yield from _fontes_zip(origem, origem)
+    else:
+        with open(origem, 'rb') as arquivo:
+            yield origem, arquivo
+
+
+# ========== Leitura ==========
+
+def _texto(elem, caminho):
+    valor = elem.findtext(_P[caminho])
+    return valor.strip() if valor else None
+
+
+def _decimal(elem, caminho, quantum=_CENTAVOS):
+    valor = elem.findtext(_P[caminho])
+    if not valor:
+        return Decimal('0')
+    try:
+        return Decimal(valor).quantize(quantum)
+    except InvalidOperation:
+        raise XMLNaoSuportado(f'Valor inválido em {caminho}: {valor!r}')
+
+
+def _data(valor):
+    if not valor:
+        return None
+    data = datetime.fromisoformat(valor.strip())
+    return data if timezone.is_aware(data) else timezone.make_aware(data)
+
+
+def _grupo(elem, caminho):
+    """Primeiro filho de um grupo com escolha (ICMS00, ICMSSN102, PISAliq, ...)"""
+    grupo = elem.find(_P[caminho])
+    return grupo[0] if grupo is not None and len(grupo) else None
+
+
+def _documento(elem):
+    return clean_digits(_texto(elem, 'CNPJ') or _texto(elem, 'CPF') or _texto(elem, 'idEstrangeiro') or '')
+
+
+def _ler_ide(elem, nota):
+    modelo = _texto(elem, 'mod') or '55'
+    numero = _texto(elem, 'nNF')
+    try:
+        numero = str(int(numero))
+    except (TypeError, ValueError):
+        raise XMLNaoSuportado(f'Número da NF-e (nNF) ausente ou inválido: {numero!r}')
+    nota.update({
+        'number': numero,
+        'series': _texto(elem, 'serie') or '1',
+        'model_code': modelo,
+        'invoice_type': 'nfce' if modelo == '65' else 'nfe',
+        'issue_date': _data(_texto(elem, 'dhEmi') or _texto(elem, 'dEmi')),
+        'environment': _texto(elem, 'tpAmb') or '1',
+        'emission_type': _texto(elem, 'tpEmis') or '1',
+        'destination_indicator': _texto(elem, 'idDest') or '1',
+        'final_consumer_indicator': _texto(elem, 'indFinal') or '0',
+        'presence_indicator': _texto(elem, 'indPres') or '0',
+        'contingency_date': _data(_texto(elem, 'dhCont')),
+        'contingency_reason': _texto(elem, 'xJust'),
+        '_natureza': _texto(elem, 'natOp'),
+    })
+
+
+def _ler_emit(elem, nota):
+    nota.update({
+        'issuer_tax_id': _documento(elem),
+        'issuer_name': (_texto(elem, 'xNome') or '')[:200],
+        'issuer_fantasy_name': _texto(elem, 'xFant'),
+        'issuer_state_registration': _texto(elem, 'IE'),
+        'issuer_address': _texto(elem, 'enderEmit/xLgr'),
+        'issuer_number': _texto(elem, 'enderEmit/nro'),
+        'issuer_district': _texto(elem, 'enderEmit/xBairro'),
+        'issuer_city_code': _texto(elem, 'enderEmit/cMun'),
+        'issuer_city': _texto(elem, 'enderEmit/xMun'),
+        'issuer_state': _texto(elem, 'enderEmit/UF'),
+        'issuer_zip_code': _texto(elem, 'enderEmit/CEP'),
+        'issuer_phone': _texto(elem, 'enderEmit/fone'),
+        'tax_regime': _texto(elem, 'CRT') or '3',
+    })
+
+
+def _ler_dest(elem, nota):
+    nota.update({
+        'receiver_tax_id': _documento(elem),
+        'receiver_name': (_texto(elem, 'xNome') or '')[:200],
+        'receiver_state_registration': _texto(elem, 'IE'),
+        'receiver_address': _texto(elem, 'enderDest/xLgr'),
+        'receiver_number': _texto(elem, 'enderDest/nro'),
+        'receiver_district': _texto(elem, 'enderDest/xBairro'),
+        'receiver_city_code': _texto(elem, 'enderDest/cMun'),
+        'receiver_city': _texto(elem, 'enderDest/xMun'),
+        'receiver_state': _texto(elem, 'enderDest/UF'),
+        'receiver_zip_code': _texto(elem, 'enderDest/CEP'),
+        'receiver_phone': _texto(elem, 'enderDest/fone'),
+        'receiver_email': _texto(elem, 'email'),
+        'receiver_ie_indicator': _texto(elem, 'indIEDest') or '9',
+    })
+
+
+def _ler_det(elem, itens):
+    item = {
+        'item_type': 'service' if elem.find(_P['imposto/ISSQN']) is not None else 'product',
+        'code': (_texto(elem, 'prod/cProd') or '')[:50],
+        'description': (_texto(elem, 'prod/xProd') or '')[:200],
+        'ncm': _texto(elem, 'prod/NCM'),
+        'cfop': _texto(elem, 'prod/CFOP') or '',
+        'unit': (_texto(elem, 'prod/uCom') or 'UN')[:10],
+        'quantity': _decimal(elem, 'prod/qCom', _QUATRO_CASAS),
+        'unit_value': _decimal(elem, 'prod/vUnCom'),
+        'total_value': _decimal(elem, 'prod/vProd'),
+        'discount': _decimal(elem, 'prod/vDesc'),
+    }
+
+    icms = _grupo(elem, 'imposto/ICMS')
+    if icms is not None:
+        item.update({
+            'icms_origin': _texto(icms, 'orig') or '0',
+            'icms_cst': _texto(icms, 'CST') or _texto(icms, 'CSOSN') or '00',
+            'icms_rate': _decimal(icms, 'pICMS'),
+            'icms_value': _decimal(icms, 'vICMS'),
+        })
+    ipi = elem.find(_P['imposto/IPI/IPITrib'])
+    if ipi is not None:
+        item.update({'ipi_rate': _decimal(ipi, 'pIPI'), 'ipi_value': _decimal(ipi, 'vIPI')})
+    pis = _grupo(elem, 'imposto/PIS')
+    if pis is not None:
+        item.update({'pis_cst': _texto(pis, 'CST') or '01', 'pis_rate': _decimal(pis, 'pPIS'),
+                     'pis_value': _decimal(pis, 'vPIS')})
+    cofins = _grupo(elem, 'imposto/COFINS')
+    if cofins is not None:
+        item.update({'cofins_cst': _texto(cofins, 'CST') or '01', 'cofins_rate': _decimal(cofins, 'pCOFINS'),
+                     'cofins_value': _decimal(cofins, 'vCOFINS')})
+    itens.append(item)
+
+
+def _ler_total(elem, nota):
+    nota.update({
+        'icms_base': _decimal(elem, 'ICMSTot/vBC'),
+        'icms_value': _decimal(elem, 'ICMSTot/vICMS'),
+        'ipi_value': _decimal(elem, 'ICMSTot/vIPI'),
+        'pis_value': _decimal(elem, 'ICMSTot/vPIS'),
+        'cofins_value': _decimal(elem, 'ICMSTot/vCOFINS'),
+        'total_products': _decimal(elem, 'ICMSTot/vProd'),
+        'discount': _decimal(elem, 'ICMSTot/vDesc'),
+        'shipping': _decimal(elem, 'ICMSTot/vFrete'),
+        'insurance': _decimal(elem, 'ICMSTot/vSeg'),
+        'other_expenses': _decimal(elem, 'ICMSTot/vOutro'),
+        'total_value': _decimal(elem, 'ICMSTot/vNF'),
+        'total_services': _decimal(elem, 'ISSQNtot/vServ'),
+        'iss_value': _decimal(elem, 'ISSQNtot/vISS'),
+    })
+
+
+def _ler_inf_adic(elem, nota):
+    nota['additional_info'] = _texto(elem, 'infCpl')
+    nota['notes'] = _texto(elem, 'infAdFisco')
+
+
+def _ler_inf_prot(elem, nota):
+    codigo = _texto(elem, 'cStat')
+    nota['_chave_protocolo'] = _texto(elem, 'chNFe')
+    if codigo in CODIGOS_AUTORIZADA + CODIGOS_DENEGADA:
+        nota['status'] = 'authorized' if codigo in CODIGOS_AUTORIZADA else 'denied'
+        nota['protocol'] = _texto(elem, 'nProt')
+        nota['authorization_date'] = _data(_texto(elem, 'dhRecbto'))
+
+
+_LEITORES = {
+    'ide': _ler_ide, 'emit': _ler_emit, 'dest': _ler_dest, 'total': _ler_total,
+    'infAdic': _ler_inf_adic, 'infProt': _ler_inf_prot,
+}
+
+
+def ler_nfe(arquivo):
+    """
+    Lê uma NF-e (nfeProc ou NFe) em streaming
+
+    Cada grupo é convertido e limpo assim que termina de ser lido; os <det>
+    já processados são removidos da árvore.
+
+    Args:
+        arquivo: Caminho ou arquivo binário aberto
+
+    Returns:
+        tuple: (campos da Invoice, lista de campos dos InvoiceItem)
+    """
+    if not _HAS_LXML:
+        raise ValueError('Biblioteca lxml não instalada')
+
+    nota = {'status': 'pending'}
+    itens = []
+    chave = None
+    contexto = etree.iterparse(
+        arquivo, events=('start', 'end'), tag=(_INF_NFE, *_TAG), resolve_entities=False, no_network=True,
+    )
+    try:
+        for evento, elem in contexto:
+            if elem.tag == _INF_NFE:
+                if evento == 'start':
+                    chave = (elem.get('Id') or '').removeprefix('NFe')
+                continue
+            if evento == 'start':
+                continue
+
+            nome = _TAG[elem.tag]
+            if nome == 'det':
+                _ler_det(elem, itens)
+            else:
+                _LEITORES[nome](elem, nota)
+
+            elem.clear(keep_tail=False)
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+    except etree.XMLSyntaxError as e:
+        raise XMLNaoSuportado(f'XML malformado: {e}')
+    finally:
+        del contexto
+
+    chave = chave or nota.pop('_chave_protocolo', None)
+    nota.pop('_chave_protocolo', None)
+    if not formato_valido(chave) or 'number' not in nota or 'issuer_tax_id' not in nota:
+        raise XMLNaoSuportado('Arquivo não é uma NF-e (infNFe/ide/emit ausentes)')
+
+    nota['access_key'] = chave
+    nota['operation_type'] = 'entrada'
+    nota['operation_nature'] = 'outras'
+    natureza = nota.pop('_natureza', None)
+    if natureza:
+        nota['notes'] = '\n'.join(filter(None, [f'Natureza da operação: {natureza}', nota.get('notes')]))
+    nota['cfop'] = (itens[0]['cfop'] if itens else '')[:4] or nota.get('cfop', '5101')
+    return nota, itens
+
+
+# ========== Gravação ==========
+
+def _mapa_clientes():
+    """CPF/CNPJ (só dígitos) -> id do Client"""
+    from clients.models import Client
+
+    return {clean_digits(tax_id): pk for pk, tax_id in Client.objects.values_list('pk', 'tax_id').iterator()}
+
+
+def _inserir(novos, usuario):
+    from invoices.models import Invoice, InvoiceItem
+
+    with transaction.atomic():
+        invoices = Invoice.objects.bulk_create(
+            [Invoice(created_by=usuario, **nota) for _, nota, _ in novos], batch_size=get_tamanho_lote()
+        )
+        linhas = [
+            InvoiceItem(invoice=invoice, **item)
+            for invoice, (_, _, itens) in zip(invoices, novos) for item in itens
+        ]
+        InvoiceItem.objects.bulk_create(linhas, batch_size=500)
+    return len(invoices), len(linhas)
+
+
+def _gravar(lote, usuario):
+    """
+    Grava um lote de (nome, nota, itens) descartando chaves já importadas
+
+    Se o lote esbarra numa restrição do banco (ex.: numeração já cadastrada
+    com outra chave, ou a mesma chave gravada por outra importação em
+    paralelo), as notas são gravadas uma a uma e só as recusadas ficam de fora.
+
+    Returns:
+        tuple: (notas, itens, duplicadas, [(nome, erro), ...])
+    """
+    from invoices.models import Invoice
+
+    existentes = set(
+        Invoice.objects.filter(access_key__in=[nota['access_key'] for _, nota, _ in lote])
+        .values_list('access_key', flat=True)
+    )
+    novos = [(nome, nota, itens) for nome, nota, itens in lote if nota['access_key'] not in existentes]
+    duplicadas = len(lote) - len(novos)
+    if not novos:
+        return 0, 0, duplicadas, []
+
+    try:
+        return (*_inserir(novos, usuario), duplicadas, [])
+    except IntegrityError as e:
+        logger.warning(f"Lote de {len(novos)} NF-e recusado pelo banco, gravando nota a nota: {str(e)}")
+
+    notas = linhas = 0
+    erros = []
+    for novo in novos:
+        try:
+            gravadas, itens = _inserir([novo], usuario)
+        except IntegrityError as e:
+            erros.append((novo[0], f'Nota recusada pelo banco: {str(e)}'))
+            continue
+        notas += gravadas
+        linhas += itens
+    return notas, linhas, duplicadas, erros
+
+
+def importar_nfes(origens, cliente=None, usuario=None, tamanho_lote=None):
+    """
+    Importa NF-e recebidas (nfeProc) para Invoice/InvoiceItem
+
+    As notas entram como operação de entrada, vinculadas ao cliente cujo
+    CPF/CNPJ é o destinatário (ou a `cliente`, se informado), com status
+    e protocolo do protNFe. Notas com chave de acesso já cadastrada (ou
+    repetida na própria importação) são ignoradas.
+
+    Args:
+        origens: Origem ou lista de origens aceitas por fontes()
+        cliente: Client que recebe todas as notas (padrão: pelo destinatário)
+        usuario: Usuário registrado em created_by
+        tamanho_lote: Notas por bulk_create (padrão: NFE_IMPORTACAO_LOTE)
+
+    Returns:
+        dict: {
+            'arquivos': 10000,
+            'importadas': 9950,
+            'itens': 31000,
+            'duplicadas': 40,
+            'sem_cliente': 8,
+            'erros': 2,
+            'detalhes_erros': [{'arquivo': 'lote.zip:123.xml', 'erro': '...'}]
+        }
+    """
+    if isinstance(origens, (str, os.PathLike)) or hasattr(origens, 'read'):
+        origens = [origens]
+    return importar_fontes(
+        itertools.chain.from_iterable(fontes(origem) for origem in origens),
+        cliente=cliente, usuario=usuario, tamanho_lote=tamanho_lote,
+    )
+
+
+def importar_fontes(pares, cliente=None, usuario=None, tamanho_lote=None, ignoradas=None):
+    """
+    Importa NF-e de pares (nome, arquivo binário) já abertos
+
+    Mesma regra e retorno de importar_nfes(); usado por quem obtém os XMLs
+    de outra forma (ex.: docZip da distribuição de DF-e). Com `ignoradas`
+    (lista), recebe (nome, motivo) de cada NF-e não gravada (sem cliente
+    ou com erro), para quem precisa tentar de novo depois.
+    """
+    if not _HAS_LXML:
+        raise ValueError('Biblioteca lxml não instalada')
+    tamanho_lote = tamanho_lote or get_tamanho_lote()
+    clientes = None if cliente is not None else _mapa_clientes()
+
+    resultado = {'arquivos': 0, 'importadas': 0, 'itens': 0, 'duplicadas': 0, 'sem_cliente': 0,
+                 'erros': 0, 'detalhes_erros': []}
+    vistas = set()
+    lote = []
+
+    def registrar_erro(nome, erro):
+        resultado['erros'] += 1
+        if ignoradas is not None:
+            ignoradas.append((nome, erro))
+        if len(resultado['detalhes_erros']) < MAX_ERROS_DETALHADOS:
+            resultado['detalhes_erros'].append({'arquivo': nome, 'erro': erro})
+        logger.warning(f"NF-e não importada ({nome}): {erro}")
+
+    def descarregar():
+        importadas, itens, duplicadas, erros = _gravar(lote, usuario)
+        resultado['importadas'] += importadas
+        resultado['itens'] += itens
+        resultado['duplicadas'] += duplicadas
+        for nome, erro in erros:
+            registrar_erro(nome, erro)
+        lote.clear()
+
+    for nome, arquivo in pares:
+        resultado['arquivos'] += 1
+        try:
+            nota, itens = ler_nfe(arquivo)
+        except (XMLNaoSuportado, ValueError) as e:
+            registrar_erro(nome, str(e))
+            continue
+
+        if nota['access_key'] in vistas:
+            resultado['duplicadas'] += 1
+            continue
+        vistas.add(nota['access_key'])
+
+        if cliente is not None:
+            nota['client_id'] = cliente.pk
+        else:
+            nota['client_id'] = clientes.get(nota.get('receiver_tax_id'))
+            if nota['client_id'] is None:
+                resultado['sem_cliente'] += 1
+                if ignoradas is not None:
+                    ignoradas.append((nome, 'Destinatário sem cliente cadastrado'))
+                continue
+
+        lote.append((nome, nota, itens))
+        if len(lote) >= tamanho_lote:
+            descarregar()
+
+    if lote:
+        descarregar()
+    return resultado
@@ -0,0 +1,522 @@
+"""
+Motor único de serialização de NF-e (leiaute SEFAZ-PR v4.00)
+Monta uma visão plana e pré-formatada da nota e dos itens e gera o XML a
+partir de templates de texto, com formatadores de valores em cache.
+Usado por NFeGenerator (xml_generator.py) e NFeXMLGenerator (nfe_xml_generator.py).
+"""
+from functools import lru_cache
+from django.db import connections, router
+from django.utils import timezone
+from .access_key import UF_CODES, gerar_chave, chave_confere
+
+NAMESPACE = 'http://www.portalfiscal.inf.br/nfe'
+XML_DECLARATION = '<?xml version="1.0" encoding="utf-8"?>\n'
+
+# Itens lidos por consulta no modo streaming
+STREAMING_CHUNK_SIZE = 500
+
+NAT_OP_MAP = {
+    'venda_producao': 'Venda de producao',
+    'venda_mercadoria': 'Venda',
+    'venda_soja': 'Venda',
+    'prestacao_servico': 'Prestacao de servico',
+    'devolucao': 'Devolucao',
+    'transferencia': 'Transferencia',
+    'remessa': 'Remessa',
+    'outras': 'Venda',
+}
+
+ICMS_CSTS = ('00', '10', '20', '30', '40', '41', '50', '51', '60', '70', '90')
+PIS_COFINS_NT_CSTS = ('04', '05', '06', '07', '08', '09')
+
+# Campos dos itens lidos na visão plana (sem instanciar modelos). Os
+# campos de texto vêm primeiro: no SQL as colunas com Cast (decimais) são
+# sempre selecionadas depois das colunas simples.
+ITEM_TEXT_FIELDS = (
+    'code', 'description', 'ncm', 'cfop', 'unit',
+    'icms_origin', 'icms_cst', 'pis_cst', 'cofins_cst',
+)
+
+# Campos numéricos já saem do banco como float: a formatação usa float de
+# qualquer forma e assim evitamos o conversor Decimal do driver por coluna
+ITEM_DECIMAL_FIELDS = (
+    'quantity', 'unit_value', 'total_value', 'icms_rate', 'icms_value',
+    'pis_rate', 'pis_value', 'cofins_rate', 'cofins_value',
+)
+
+ITEM_FIELDS = ITEM_TEXT_FIELDS + ITEM_DECIMAL_FIELDS
+
+
+@lru_cache(maxsize=1)
+def _colunas_itens():
+    """Colunas do values_list dos itens (Cast para float nos decimais)"""
+    from django.db.models import FloatField
+    from django.db.models.functions import Cast
+    return ITEM_TEXT_FIELDS + tuple(Cast(campo, FloatField()) for campo in ITEM_DECIMAL_FIELDS)
+
+
+@lru_cache(maxsize=8)
+def _sql_itens(alias):
+    """SQL dos itens de uma nota, compilado uma única vez por banco"""
+    from invoices.models import InvoiceItem
+    queryset = InvoiceItem.objects.using(alias).filter(invoice_id=0).values_list(*_colunas_itens())
+    sql, params = queryset.query.get_compiler(alias).as_sql()
+    assert tuple(params) == (0,) and tuple(queryset.query.values_select) == ITEM_TEXT_FIELDS
+    return sql
+
+
+# ========== Formatadores (em cache) ==========
+
+@lru_cache(maxsize=8192)
+def fmt_decimal(value, decimals=2):
+    """Formata valor decimal com casas fixas (None = 0)"""
+    if value is None:
+        value = 0
+    return f"{float(value):.{decimals}f}"
+
+
+@lru_cache(maxsize=8192)
+def fmt_text(text):
+    """Escapa texto para conteúdo/atributo XML (None = vazio)"""
+    if text is None:
+        return ''
+    text = str(text)
+    if '\r' in text:
+        text = text.replace('\r\n', '\n').replace('\r', '\n')
+    return (text.replace('&', '&amp;').replace('<', '&lt;')
+                .replace('"', '&quot;').replace('>', '&gt;'))
+
+
+@lru_cache(maxsize=8192)
+def tag(name, text):
+    """Elemento simples com texto já escapado (<x/> quando vazio)"""
+    if not text:
+        return f'<{name}/>'
+    return f'<{name}>{text}</{name}>'
+
+
+def clean_digits(value):
+    """Remove formatação (pontos, barras, traços) de CNPJ/CPF/CEP/telefone"""
+    if not value:
+        return ''
+    return value.replace('.', '').replace('/', '').replace('-', '').strip()
+
+
+def _bloco(indent, campos):
+    """Monta linhas de elementos simples com a indentação informada"""
+    prefixo = '  ' * indent
+    return ''.join(f'{prefixo}{tag(nome, texto)}\n' for nome, texto in campos)
+
+
+# ========== Templates de itens ==========
+
+@lru_cache(maxsize=1024)
+def _bloco_icms(cst, orig, vbc, picms, vicms):
+    """Grupo ICMS (indentação do det: ICMS no nível 4)"""
+    if cst in ICMS_CSTS:
+        linhas = [('orig', orig), ('CST', cst)]
+        if cst == '00':
+            linhas += [('vBC', vbc), ('pICMS', picms), ('vICMS', vicms)]
+        grupo = f'ICMS{cst}'
+    else:
+        linhas = [('orig', orig), ('CST', '90')]
+        grupo = 'ICMS90'
+    return (
+        f'        <ICMS>\n          <{grupo}>\n'
+        f'{_bloco(6, linhas)}'
+        f'          </{grupo}>\n        </ICMS>\n'
+    )
+
+
+@lru_cache(maxsize=1024)
+def _bloco_pis_cofins(grupo, cst, vbc, aliq, valor):
+    """Grupo PIS ou COFINS (PISNT/PISAliq, COFINSNT/COFINSAliq)"""
+    if cst in PIS_COFINS_NT_CSTS:
+        sub = f'{grupo}NT'
+        linhas = [('CST', cst)]
+    else:
+        sub = f'{grupo}Aliq'
+        linhas = [('CST', cst), ('vBC', vbc), (f'p{grupo}', aliq), (f'v{grupo}', valor)]
+    return (
+        f'        <{grupo}>\n          <{sub}>\n'
+        f'{_bloco(6, linhas)}'
+        f'          </{sub}>\n        </{grupo}>\n'
+    )
+
+
+DET_TEMPLATE = (
+    '    <det nItem="{n}">\n'
+    '      <prod>\n'
+    '        {cProd}\n'
+    '        <cEAN>SEM GTIN</cEAN>\n'
+    '        {xProd}\n'
+    '{ncm}'
+    '        {CFOP}\n'
+    '        {uCom}\n'
+    '        <qCom>{q}</qCom>\n'
+    '        <vUnCom>{vun}</vUnCom>\n'
+    '        <vProd>{vprod}</vProd>\n'
+    '        <cEANTrib>SEM GTIN</cEANTrib>\n'
+    '        {uTrib}\n'
+    '        <qTrib>{q}</qTrib>\n'
+    '        <vUnTrib>{vun}</vUnTrib>\n'
+    '        <indTot>1</indTot>\n'
+    '      </prod>\n'
+    '      <imposto>\n'
+    '{icms}{pis}{cofins}'
+    '      </imposto>\n'
+    '    </det>\n'
+)
+
+
+def render_item(n, row):
+    """Serializa um item (tupla na ordem de ITEM_FIELDS)"""
+    (code, description, ncm, cfop, unit, icms_origin, icms_cst, pis_cst, cofins_cst,
+     quantity, unit_value, total_value, icms_rate, icms_value,
+     pis_rate, pis_value, cofins_rate, cofins_value) = row
+
+    vprod = fmt_decimal(total_value, 2)
+    unidade = fmt_text(unit or 'UN')
+    icms_cst = icms_cst or ''
+    pis_cst = pis_cst or ''
+    cofins_cst = cofins_cst or ''
+
+    if icms_cst == '00':
+        icms = _bloco_icms(icms_cst, fmt_text(icms_origin), vprod,
+                           fmt_decimal(icms_rate, 2), fmt_decimal(icms_value, 2))
+    else:
+        icms = _bloco_icms(icms_cst, fmt_text(icms_origin), None, None, None)
+
+    if pis_cst in PIS_COFINS_NT_CSTS:
+        pis = _bloco_pis_cofins('PIS', pis_cst, None, None, None)
+    else:
+        pis = _bloco_pis_cofins('PIS', fmt_text(pis_cst), vprod,
+                                fmt_decimal(pis_rate, 4), fmt_decimal(pis_value, 2))
+
+    if cofins_cst in PIS_COFINS_NT_CSTS:
+        cofins = _bloco_pis_cofins('COFINS', cofins_cst, None, None, None)
+    else:
+        cofins = _bloco_pis_cofins('COFINS', fmt_text(cofins_cst), vprod,
+                                   fmt_decimal(cofins_rate, 4), fmt_decimal(cofins_value, 2))
+
+    return DET_TEMPLATE.format(
+        n=n,
+        cProd=tag('cProd', fmt_text(code or str(n))),
+        xProd=tag('xProd', fmt_text(description)),
+        ncm=f'        {tag("NCM", fmt_text(ncm))}\n' if ncm else '',
+        CFOP=tag('CFOP', fmt_text(cfop or '5101')),
+        uCom=tag('uCom', unidade),
+        uTrib=tag('uTrib', unidade),
+        q=fmt_decimal(quantity, 4),
+        vun=fmt_decimal(unit_value, 10),
+        vprod=vprod,
+        icms=icms,
+        pis=pis,
+        cofins=cofins,
+    )
+
+
+# ========== Engine ==========
+
+class NFeEngine:
+    """Serializa a NF-e de uma Invoice a partir de uma visão plana pré-formatada"""
+
+    def __init__(self, invoice, tp_emis=None):
+        """
+        Args:
+            invoice: Objeto Invoice do Django
+            tp_emis: Tipo de emissão (1=Normal, 6=SVC-AN, 7=SVC-RS);
+                     padrão: invoice.emission_type
+        """
+        self.invoice = invoice
+        self.tp_emis = tp_emis or getattr(invoice, 'emission_type', None) or '1'
+        self._chave = None
+
+    @property
+    def chave_acesso(self):
+        """Chave da nota: reaproveita a salva se ainda confere, senão gera uma nova"""
+        if self._chave is None:
+            chave = self.invoice.access_key
+            if not chave_confere(chave, self.invoice, self.tp_emis):
+                chave = gerar_chave(self.invoice, self.tp_emis)
+            self._chave = chave
+        return self._chave
+
+    def itens(self, streaming=False):
+        """
+        Linhas dos itens (tuplas na ordem de ITEM_FIELDS)
+
+        Usa o prefetch da view quando disponível; em modo streaming lê os
+        itens em blocos direto do banco.
+        """
+        prefetched = getattr(self.invoice, '_prefetched_objects_cache', {}).get('items')
+        if prefetched is not None and not streaming:
+            return [tuple(getattr(item, campo) for campo in ITEM_FIELDS) for item in prefetched]
+
+        if streaming:
+            linhas = self.invoice.items.values_list(*_colunas_itens())
+            return linhas.iterator(chunk_size=STREAMING_CHUNK_SIZE)
+
+        alias = router.db_for_read(self.invoice.items.model, instance=self.invoice)
+        with connections[alias].cursor() as cursor:
+            cursor.execute(_sql_itens(alias), [self.invoice.pk])
+            return cursor.fetchall()
+
+    def gerar(self):
+        """
+        Gera o XML completo da NF-e
+
+        Returns:
+            str: XML da NF-e formatado
+        """
+        cabecalho, rodape = self._partes()
+        corpo = ''.join(render_item(n, row) for n, row in enumerate(self.itens(), 1))
+        return cabecalho + corpo + rodape
+
+    def escrever(self, output):
+        """
+        Gera o XML em modo streaming, escrevendo item a item em um arquivo
+        binário. O resultado é idêntico ao de gerar().
+
+        Returns:
+            str: Chave de acesso da NF-e
+        """
+        cabecalho, rodape = self._partes()
+        output.write(cabecalho.encode('utf-8'))
+        bloco = []
+        for n, row in enumerate(self.itens(streaming=True), 1):
+            bloco.append(render_item(n, row))
+            if len(bloco) == STREAMING_CHUNK_SIZE:
+                output.write(''.join(bloco).encode('utf-8'))
+                bloco = []
+        output.write((''.join(bloco) + rodape).encode('utf-8'))
+        return self.chave_acesso
+
+    def _partes(self):
+        """Cabeçalho (até dest) e rodapé (de total em diante) já serializados"""
+        v = self.visao()
+        cabecalho = (
+            XML_DECLARATION
+            + f'<NFe xmlns="{NAMESPACE}">\n'
+            + f'  <infNFe versao="4.00" Id="NFe{v["chave"]}">\n'
+            + self._ide(v) + self._emit(v) + self._dest(v)
+        )
+        rodape = (
+            self._total(v) + self._transp(v) + self._cobr(v) + self._pag(v)
+            + self._inf_adic(v) + self._inf_resp_tec(v)
+            + '  </infNFe>\n</NFe>\n'
+        )
+        return cabecalho, rodape
+
+    def visao(self):
+        """Visão plana da nota com todos os textos já formatados e escapados"""
+        inv = self.invoice
+        client = inv.client
+        chave = self.chave_acesso
+        dh_emi = inv.issue_date.strftime('%Y-%m-%dT%H:%M:%S-03:00')
+        c_mun_fg = inv.issuer_city_code or '4104428'  # Default Candoi-PR
+
+        return {
+            'chave': chave,
+            'cUF': UF_CODES.get(inv.issuer_state or 'PR', '41'),
+            'cNF': chave[-9:-1],
+            'cDV': chave[-1],
+            'natOp': NAT_OP_MAP.get(inv.operation_nature, 'Venda'),
+            'mod': fmt_text(inv.model_code or '55'),
+            'serie': fmt_text(str(inv.series)),
+            'nNF': fmt_text(str(inv.number)),
+            'dhEmi': dh_emi,
+            'tpNF': '1' if inv.operation_type == 'saida' else '0',
+            'idDest': fmt_text(inv.destination_indicator),
+            'cMunFG': fmt_text(c_mun_fg),
+            'tpEmis': self.tp_emis,
+            'dhCont': self._dh_cont() if self.tp_emis != '1' else '',
+            'xJust': fmt_text(inv.contingency_reason or 'SEFAZ autorizadora indisponivel')
+                     if self.tp_emis != '1' else '',
+            'tpAmb': fmt_text(inv.environment),
+            'indFinal': fmt_text(inv.final_consumer_indicator),
+            'indPres': fmt_text(inv.presence_indicator),
+
+            'emit_doc': clean_digits(inv.issuer_tax_id),
+            'emit_xNome': fmt_text(inv.issuer_name or 'EMITENTE'),
+            'emit_xFant': fmt_text(inv.issuer_fantasy_name),
+            'emit_xLgr': fmt_text(inv.issuer_address or 'Rua'),
+            'emit_nro': fmt_text(inv.issuer_number or 'S/N'),
+            'emit_xBairro': fmt_text(inv.issuer_district or 'Centro'),
+            'emit_xMun': fmt_text(inv.issuer_city or 'Municipio'),
+            'emit_UF': fmt_text(inv.issuer_state or 'PR'),
+            'emit_CEP': fmt_text(clean_digits(inv.issuer_zip_code or '85140000')),
+            'emit_fone': fmt_text(clean_digits(inv.issuer_phone)),
+            'emit_IE': fmt_text(inv.issuer_state_registration),
+            'CRT': fmt_text(inv.tax_regime),
+
+            'dest_doc': clean_digits(client.tax_id),
+            'dest_xNome': fmt_text(client.name),
+            'dest_xLgr': fmt_text(client.street or 'Rua'),
+            'dest_nro': fmt_text(client.number or 'S/N'),
+            'dest_xCpl': fmt_text(client.complement),
+            'dest_xBairro': fmt_text(client.neighborhood or 'Centro'),
+            'dest_cMun': fmt_text(inv.receiver_city_code or '4109401'),
+            'dest_xMun': fmt_text(client.city or 'Municipio'),
+            'dest_UF': fmt_text(client.state or 'PR'),
+            'dest_CEP': fmt_text(clean_digits(client.zip_code or '85000000')),
+            'indIEDest': fmt_text(inv.receiver_ie_indicator),
+            'dest_IE': fmt_text(client.state_registration) if inv.receiver_ie_indicator == '1' else '',
+
+            'vBC': fmt_decimal(inv.icms_base, 2),
+            'vICMS': fmt_decimal(inv.icms_value, 2),
+            'vProd': fmt_decimal(inv.total_products, 2),
+            'vFrete': fmt_decimal(inv.shipping, 2),
+            'vSeg': fmt_decimal(inv.insurance, 2),
+            'vDesc': fmt_decimal(inv.discount, 2),
+            'vIPI': fmt_decimal(inv.ipi_value, 2),
+            'vPIS': fmt_decimal(inv.pis_value, 2),
+            'vCOFINS': fmt_decimal(inv.cofins_value, 2),
+            'vOutro': fmt_decimal(inv.other_expenses, 2),
+            'vNF': fmt_decimal(inv.total_value, 2),
+
+            'modFrete': fmt_text(inv.freight_mode),
+            'indPag': fmt_text(inv.payment_indicator),
+            'tPag': fmt_text(inv.payment_method),
+            'xPag': fmt_text(inv.payment_description),
+            'dVenc': inv.due_date.strftime('%Y-%m-%d') if inv.due_date else '',
+            'infCpl': fmt_text(' | '.join(t for t in (inv.notes, inv.additional_info) if t)),
+
+            'tech_CNPJ': fmt_text(clean_digits(inv.tech_cnpj)),
+            'tech_xContato': fmt_text(inv.tech_contact),
+            'tech_email': fmt_text(inv.tech_email),
+            'tech_fone': fmt_text(clean_digits(inv.tech_phone)),
+        }
+
+    def _dh_cont(self):
+        """Entrada em contingência no horário de Brasília (datas com fuso são convertidas)"""
+        dh_cont = self.invoice.contingency_date or self.invoice.issue_date
+        if timezone.is_aware(dh_cont):
+            dh_cont = timezone.localtime(dh_cont)
+        return dh_cont.strftime('%Y-%m-%dT%H:%M:%S-03:00')
+
+    # ---------- Seções ----------
+
+    def _ide(self, v):
+        campos = [
+            ('cUF', v['cUF']), ('cNF', v['cNF']), ('natOp', v['natOp']), ('mod', v['mod']),
+            ('serie', v['serie']), ('nNF', v['nNF']), ('dhEmi', v['dhEmi']), ('dhSaiEnt', v['dhEmi']),
+            ('tpNF', v['tpNF']), ('idDest', v['idDest']), ('cMunFG', v['cMunFG']), ('tpImp', '1'),
+            ('tpEmis', v['tpEmis']), ('cDV', v['cDV']), ('tpAmb', v['tpAmb']), ('finNFe', '1'),
+            ('indFinal', v['indFinal']), ('indPres', v['indPres']), ('procEmi', '0'),
+            ('verProc', 'Contabiliza.IA v1.0'),
+        ]
+        if v['tpEmis'] != '1':
+            # Contingência: entrada em contingência e justificativa (15 a 256 caracteres)
+            campos += [('dhCont', v['dhCont']), ('xJust', v['xJust'])]
+        return '    <ide>\n' + _bloco(3, campos) + '    </ide>\n'
+
+    def _emit(self, v):
+        campos = []
+        if len(v['emit_doc']) == 14:
+            campos.append(('CNPJ', v['emit_doc']))
+        elif len(v['emit_doc']) == 11:
+            campos.append(('CPF', v['emit_doc']))
+        campos.append(('xNome', v['emit_xNome']))
+        if v['emit_xFant']:
+            campos.append(('xFant', v['emit_xFant']))
+
+        endereco = [
+            ('xLgr', v['emit_xLgr']), ('nro', v['emit_nro']), ('xBairro', v['emit_xBairro']),
+            ('cMun', v['cMunFG']), ('xMun', v['emit_xMun']), ('UF', v['emit_UF']),
+            ('CEP', v['emit_CEP']), ('cPais', '1058'), ('xPais', 'BRASIL'),
+        ]
+        if v['emit_fone']:
+            endereco.append(('fone', v['emit_fone']))
+
+        final = []
+        if v['emit_IE']:
+            final.append(('IE', v['emit_IE']))
+        final.append(('CRT', v['CRT']))
+
+        return (
+            '    <emit>\n' + _bloco(3, campos)
+            + '      <enderEmit>\n' + _bloco(4, endereco) + '      </enderEmit>\n'
+            + _bloco(3, final) + '    </emit>\n'
+        )
+
+    def _dest(self, v):
+        campos = []
+        if len(v['dest_doc']) == 14:
+            campos.append(('CNPJ', v['dest_doc']))
+        elif len(v['dest_doc']) == 11:
+            campos.append(('CPF', v['dest_doc']))
+        campos.append(('xNome', v['dest_xNome']))
+
+        endereco = [('xLgr', v['dest_xLgr']), ('nro', v['dest_nro'])]
+        if v['dest_xCpl']:
+            endereco.append(('xCpl', v['dest_xCpl']))
+        endereco += [
+            ('xBairro', v['dest_xBairro']), ('cMun', v['dest_cMun']), ('xMun', v['dest_xMun']),
+            ('UF', v['dest_UF']), ('CEP', v['dest_CEP']), ('cPais', '1058'), ('xPais', 'BRASIL'),
+        ]
+
+        final = [('indIEDest', v['indIEDest'])]
+        if v['dest_IE']:
+            final.append(('IE', v['dest_IE']))
+
+        return (
+            '    <dest>\n' + _bloco(3, campos)
+            + '      <enderDest>\n' + _bloco(4, endereco) + '      </enderDest>\n'
+            + _bloco(3, final) + '    </dest>\n'
+        )
+
+    def _total(self, v):
+        campos = [
+            ('vBC', v['vBC']), ('vICMS', v['vICMS']), ('vICMSDeson', '0.00'),
+            ('vFCPUFDest', '0.00'), ('vICMSUFDest', '0.00'), ('vICMSUFRemet', '0.00'),
+            ('vFCP', '0.00'), ('vBCST', '0.00'), ('vST', '0.00'), ('vFCPST', '0.00'),
+            ('vFCPSTRet', '0.00'), ('vProd', v['vProd']), ('vFrete', v['vFrete']),
+            ('vSeg', v['vSeg']), ('vDesc', v['vDesc']), ('vII', '0.00'), ('vIPI', v['vIPI']),
+            ('vIPIDevol', '0.00'), ('vPIS', v['vPIS']), ('vCOFINS', v['vCOFINS']),
+            ('vOutro', v['vOutro']), ('vNF', v['vNF']),
+        ]
+        return '    <total>\n      <ICMSTot>\n' + _bloco(4, campos) + '      </ICMSTot>\n    </total>\n'
+
+    def _transp(self, v):
+        return '    <transp>\n' + _bloco(3, [('modFrete', v['modFrete'])]) + '    </transp>\n'
+
+    def _cobr(self, v):
+        # Cobrança (fatura/duplicata) apenas para pagamento a prazo
+        if v['indPag'] != '1':
+            return ''
+        fatura = [('nFat', v['nNF']), ('vOrig', v['vNF']), ('vLiq', v['vNF'])]
+        duplicata = [('nDup', v['nNF'].zfill(3))]
+        if v['dVenc']:
+            duplicata.append(('dVenc', v['dVenc']))
+        duplicata.append(('vDup', v['vNF']))
+        return (
+            '    <cobr>\n'
+            + '      <fat>\n' + _bloco(4, fatura) + '      </fat>\n'
+            + '      <dup>\n' + _bloco(4, duplicata) + '      </dup>\n'
+            + '    </cobr>\n'
+        )
+
+    def _pag(self, v):
+        campos = [('indPag', v['indPag']), ('tPag', v['tPag'])]
+        if v['xPag']:
+            campos.append(('xPag', v['xPag']))
+        campos.append(('vPag', v['vNF']))
+        return '    <pag>\n      <detPag>\n' + _bloco(4, campos) + '      </detPag>\n    </pag>\n'
+
+    def _inf_adic(self, v):
+        if not v['infCpl']:
+            return ''
+        return '    <infAdic>\n' + _bloco(3, [('infCpl', v['infCpl'])]) + '    </infAdic>\n'
+
+    def _inf_resp_tec(self, v):
+        if not v['tech_CNPJ']:
+            return ''
+        campos = [('CNPJ', v['tech_CNPJ'])]
+        if v['tech_xContato']:
+            campos.append(('xContato', v['tech_xContato']))
+        if v['tech_email']:
+            campos.append(('email', v['tech_email']))
+        if v['tech_fone']:
+            campos.append(('fone', v['tech_fone']))
+        return '    <infRespTec>\n' + _bloco(3, campos) + '    </infRespTec>\n'
@@ -0,0 +1,117 @@
+"""
+Pipeline de emissão de NF-e
+Executa, para uma nota, as etapas de geração do XML, validação, DANFE e backup
+"""
+from django.conf import settings
+from django.core.files.base import ContentFile
+
+from .nfe_xml_generator import NFeXMLGenerator
+from .sefaz_integration import SefazIntegration
+from .backup_service import backup_invoice_files
+from .nfe_signer import assinatura_disponivel, assinar_xml
+from . import danfe_cache
+
+# A partir de quantos itens o XML é gerado em modo streaming
+DEFAULT_STREAMING_MIN_ITEMS = 500
+
+
+def gerar_xml(invoice):
+    """
+    Gera o XML da NF-e e grava no storage (sem salvar a Invoice)
+    
+    Notas com muitos itens (NFE_XML_STREAMING_MIN_ITEMS) são geradas em modo
+    streaming, direto no arquivo, sem montar a árvore inteira em memória;
+    nesse caso o XML não é devolvido (xml_content None) e a assinatura é
+    feita no próprio arquivo. Com certificado A1 configurado
+    (NFE_CERTIFICADO_PATH) o XML é gravado já assinado.
+
+    Returns:
+        tuple: (xml_content, chave_acesso)
+    """
+    xml_generator = NFeXMLGenerator(invoice)
+    streaming_min_items = getattr(settings, 'NFE_XML_STREAMING_MIN_ITEMS', DEFAULT_STREAMING_MIN_ITEMS)
+
+    if invoice.items.count() >= streaming_min_items:
+        chave_acesso = xml_generator.chave_acesso
+        xml_generator.save_streaming(invoice.xml_file, f"{chave_acesso}-nfe.xml", assinar=assinatura_disponivel())
+        xml_content = None
+    else:
+        xml_content = xml_generator.generate()
+        chave_acesso = xml_generator.chave_acesso
+        if assinatura_disponivel():
+            xml_content = assinar_xml(xml_content)
+
+        xml_filename = f"{chave_acesso}-nfe.xml"
+        invoice.xml_file.save(xml_filename, ContentFile(xml_content.encode('utf-8')), save=False)
+
+    invoice.access_key = chave_acesso
+
+    return xml_content, chave_acesso
+
+
+def validar_xml(invoice, xml_content=None):
+    """
+    Valida o XML da NF-e no padrão SEFAZ da UF do emitente
+
+    Sem xml_content valida o arquivo gravado (invoice.xml_file), lido em
+    blocos: é o caminho das notas geradas em modo streaming.
+    """
+    sefaz = SefazIntegration(uf=invoice.issuer_state or 'PR', ambiente='homologacao')
+    if xml_content is None:
+        with invoice.xml_file.open('rb') as xml_file:
+            return sefaz.validar_arquivo_nfe(xml_file)
+    return sefaz.validar_xml_nfe(xml_content)
+
+
+def gerar_danfe(invoice, chave_acesso):
+    """
+    Gera o DANFE (layout SEFAZ-PR para emitentes do PR) e grava no storage (sem salvar a Invoice)
+
+    Notas cujo conteúdo do DANFE não mudou reaproveitam o PDF já gerado
+    (danfe_cache) em vez de renderizar de novo.
+    """
+    return danfe_cache.gravar_danfe(invoice, f"{chave_acesso}-danfe.pdf", save=False)
+
+
+def emitir_nfe(invoice):
+    """
+    Executa o pipeline completo de emissão de uma NF-e
+
+    Args:
+        invoice: Objeto Invoice do Django
+
+    Returns:
+        dict: {
+            'sucesso': True/False,
+            'chave_acesso': '4125...',
+            'validacao': {'valido': True, 'erros': []},
+            'status': 'pending',
+            'backup': {'xml': '...', 'pdf': '...'}
+        }
+    """
+    xml_content, chave_acesso = gerar_xml(invoice)
+
+    validacao = validar_xml(invoice, xml_content)
+    if not validacao['valido']:
+        return {
+            'sucesso': False,
+            'chave_acesso': chave_acesso,
+            'validacao': validacao,
+            'status': invoice.status,
+            'backup': None,
+        }
+
+    gerar_danfe(invoice, chave_acesso)
+
+    invoice.status = 'pending'
+    invoice.save()
+
+    backup = backup_invoice_files(invoice)
+
+    return {
+        'sucesso': True,
+        'chave_acesso': chave_acesso,
+        'validacao': validacao,
+        'status': invoice.status,
+        'backup': backup,
+    }
@@ -0,0 +1,591 @@
+"""
+Assinatura digital XMLDSig de NF-e com certificado A1
+Assinatura envelopada sobre infNFe (C14N + RSA-SHA1), conforme o Manual de
+Orientação do Contribuinte. O PFX é lido e decifrado uma única vez por
+processo (por arquivo e senha) e a chave fica só em memória; lotes são
+assinados por um pool de processos. XMLs grandes (modo streaming) são
+assinados e conferidos direto no arquivo, sem carregar a árvore.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from xml.etree import ElementTree
+from django.conf import settings
+import threading
+import tempfile
+import shutil
+import copy
+import hashlib
+import base64
+import io
+import os
+
+try:
+    from lxml import etree
+    _HAS_LXML = True
+except ImportError:
+    _HAS_LXML = False
+
+try:
+    from cryptography import x509
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.asymmetric import padding
+    from cryptography.hazmat.primitives.serialization import Encoding, NoEncryption, PrivateFormat, pkcs12
+    from cryptography.exceptions import InvalidSignature
+    _HAS_CRYPTOGRAPHY = True
+except ImportError:
+    _HAS_CRYPTOGRAPHY = False
+
+NFE_NAMESPACE = 'http://www.portalfiscal.inf.br/nfe'
+DSIG_NAMESPACE = 'http://www.w3.org/2000/09/xmldsig#'
+C14N_ALGORITHM = 'http://www.w3.org/TR/2001/REC-xml-c14n-20010315'
+
+# Limite padrão de processos para assinatura em lote
+DEFAULT_MAX_WORKERS = 4
+
+# Bytes lidos por vez ao assinar/conferir um arquivo
+BLOCO_LEITURA = 64 * 1024
+
+# SignedInfo já na forma canônica (C14N) em que é assinado; dentro de
+# <Signature> o xmlns é herdado e não se repete
+SIGNED_INFO_TEMPLATE = (
+    '<SignedInfo{xmlns}>'
+    f'<CanonicalizationMethod Algorithm="{C14N_ALGORITHM}"></CanonicalizationMethod>'
+    f'<SignatureMethod Algorithm="{DSIG_NAMESPACE}rsa-sha1"></SignatureMethod>'
+    '<Reference URI="#{uri}">'
+    '<Transforms>'
+    f'<Transform Algorithm="{DSIG_NAMESPACE}enveloped-signature"></Transform>'
+    f'<Transform Algorithm="{C14N_ALGORITHM}"></Transform>'
+    '</Transforms>'
+    f'<DigestMethod Algorithm="{DSIG_NAMESPACE}sha1"></DigestMethod>'
+    '<DigestValue>{digest}</DigestValue>'
+    '</Reference>'
+    '</SignedInfo>'
+)
+
+SIGNATURE_TEMPLATE = (
+    f'<Signature xmlns="{DSIG_NAMESPACE}">'
+    '{signed_info}'
+    '<SignatureValue>{assinatura}</SignatureValue>'
+    '<KeyInfo><X509Data><X509Certificate>{certificado}</X509Certificate></X509Data></KeyInfo>'
+    '</Signature>'
+)
+
+# (caminho, SHA-256 da senha) -> (mtime, CertificadoA1)
+_certificados = {}
+_certificados_lock = threading.Lock()
+
+# Certificado do processo worker (carregado pelo initializer do pool)
+_certificado_worker = None
+
+
+class CertificadoA1:
+    """Chave privada e certificado X.509 extraídos de um arquivo PFX"""
+
+    def __init__(self, chave_privada, certificado):
+        self.chave_privada = chave_privada
+        self.certificado = certificado
+        self.certificado_b64 = base64.b64encode(certificado.public_bytes(Encoding.DER)).decode('ascii')
+
+    @classmethod
+    def from_pfx(cls, dados, senha):
+        """
+        Decifra um PFX (PKCS#12)
+
+        Args:
+            dados: Conteúdo do arquivo .pfx
+            senha: Senha do certificado (str ou bytes)
+
+        Returns:
+            CertificadoA1
+        """
+        if isinstance(senha, str):
+            senha = senha.encode('utf-8')
+        chave_privada, certificado, _ = pkcs12.load_key_and_certificates(dados, senha)
+        if chave_privada is None or certificado is None:
+            raise ValueError('PFX sem chave privada ou certificado')
+        return cls(chave_privada, certificado)
+
+    @property
+    def titular(self):
+        """Nome do titular (CN do subject)"""
+        nomes = self.certificado.subject.get_attributes_for_oid(x509.NameOID.COMMON_NAME)
+        return nomes[0].value if nomes else self.certificado.subject.rfc4514_string()
+
+    @property
+    def validade(self):
+        """Data/hora (UTC) de expiração do certificado"""
+        return self.certificado.not_valid_after_utc
+
+    @property
+    def impressao_digital(self):
+        """SHA-256 do certificado em hexadecimal (identifica o certificado entre recargas do PFX)"""
+        return self.certificado.fingerprint(hashes.SHA256()).hex()
+
+    @property
+    def pem(self):
+        """Certificado (sem a chave) em PEM, ex.: para a lista de CAs aceitas em TLS mútuo"""
+        return self.certificado.public_bytes(Encoding.PEM).decode('ascii')
+
+    @contextmanager
+    def arquivos_pem(self):
+        """
+        (certificado.pem, chave.pem) para o ssl carregar a cadeia
+
+        O ssl só lê a chave de arquivo: ela é gravada sem cifra apenas pelo
+        tempo do bloco, com permissão 0600 num diretório 0700, e removida na
+        saída. Prefira carregar_em().
+        """
+        diretorio = tempfile.mkdtemp(prefix='nfe-a1-')
+        try:
+            conteudos = (
+                self.certificado.public_bytes(Encoding.PEM),
+                self.chave_privada.private_bytes(Encoding.PEM, PrivateFormat.PKCS8, NoEncryption()),
+            )
+            caminhos = []
+            for nome, conteudo in zip(('certificado.pem', 'chave.pem'), conteudos):
+                caminho = os.path.join(diretorio, nome)
+                with os.fdopen(os.open(caminho, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), 'wb') as arquivo:
+                    arquivo.write(conteudo)
+                caminhos.append(caminho)
+            yield tuple(caminhos)
+        finally:
+            shutil.rmtree(diretorio, ignore_errors=True)
+
+    def carregar_em(self, contexto):
+        """Carrega certificado e chave em um ssl.SSLContext (TLS mútuo com a SEFAZ)"""
+        with self.arquivos_pem() as (certificado_pem, chave_pem):
+            contexto.load_cert_chain(certificado_pem, chave_pem)
+        return contexto
+
+    def assinar(self, dados):
+        """Assinatura RSA-SHA1 (PKCS#1 v1.5) dos bytes informados"""
+        return self.chave_privada.sign(dados, padding.PKCS1v15(), hashes.SHA1())
+
+
+def get_certificado_path():
+    """Caminho do PFX configurado (settings.NFE_CERTIFICADO_PATH) ou None"""
+    return getattr(settings, 'NFE_CERTIFICADO_PATH', None)
+
+
+def get_certificado_senha():
+    """Senha do PFX configurado (settings.NFE_CERTIFICADO_SENHA)"""
+    return getattr(settings, 'NFE_CERTIFICADO_SENHA', '')
+
+
+def get_max_workers():
+    """Número máximo de processos para assinatura em lote"""
+    return int(getattr(settings, 'NFE_SIGNER_MAX_WORKERS', DEFAULT_MAX_WORKERS))
+
+
+def assinatura_disponivel():
+    """Indica se há dependências e certificado configurado para assinar"""
+    return _HAS_LXML and _HAS_CRYPTOGRAPHY and bool(get_certificado_path())
+
+
+def carregar_certificado(caminho=None, senha=None):
+    """
+    Certificado A1 decifrado, em cache por processo
+
+    O PFX só é lido novamente quando o arquivo muda no disco (renovação
+    do certificado). A senha faz parte da chave do cache: uma senha errada
+    nunca recebe o certificado decifrado com a certa.
+
+    Args:
+        caminho: Caminho do .pfx (padrão: settings.NFE_CERTIFICADO_PATH)
+        senha: Senha do .pfx (padrão: settings.NFE_CERTIFICADO_SENHA)
+
+    Returns:
+        CertificadoA1
+    """
+    if not _HAS_CRYPTOGRAPHY:
+        raise ValueError('Biblioteca cryptography não instalada')
+
+    caminho = str(caminho or get_certificado_path() or '')
+    if not caminho:
+        raise ValueError('Certificado digital não configurado (NFE_CERTIFICADO_PATH)')
+    if senha is None:
+        senha = get_certificado_senha()
+
+    try:
+        mtime = os.stat(caminho).st_mtime_ns
+    except FileNotFoundError:
+        raise ValueError(f'Certificado digital não encontrado: {caminho}')
+
+    chave = (caminho, hashlib.sha256(senha.encode('utf-8') if isinstance(senha, str) else senha).hexdigest())
+    entrada = _certificados.get(chave)
+    if entrada and entrada[0] == mtime:
+        return entrada[1]
+
+    with _certificados_lock:
+        entrada = _certificados.get(chave)
+        if entrada and entrada[0] == mtime:
+            return entrada[1]
+
+        with open(caminho, 'rb') as pfx:
+            certificado = CertificadoA1.from_pfx(pfx.read(), senha)
+        _certificados[chave] = (mtime, certificado)
+        return certificado
+
+
+def limpar_cache():
+    """Descarta os certificados decifrados (usado em testes e após renovação)"""
+    with _certificados_lock:
+        _certificados.clear()
+
+
+def _digest(elemento):
+    """DigestValue (SHA-1 em base64) da forma canônica do elemento"""
+    # Mesmo C14N do modo streaming: o do libxml2 emite xmlns="" indevido nos
+    # netos quando o subconjunto redeclara o namespace padrão herdado de <NFe>
+    xml = etree.tostring(elemento, with_tail=False)
+    return ler_arquivo(io.BytesIO(xml), etree.QName(elemento).localname)['digest']
+
+
+def assinar_xml(xml, certificado=None, elemento='infNFe'):
+    """
+    Assina o XML da NF-e (assinatura envelopada sobre infNFe)
+
+    O conteúdo original é preservado byte a byte; a tag <Signature> é
+    inserida como último filho de <NFe>. Eventos (<evento>) são assinados
+    da mesma forma com elemento='infEvento'.
+
+    Args:
+        xml: String/bytes com o XML da NF-e
+        certificado: CertificadoA1 (padrão: certificado configurado)
+        elemento: Tag com o atributo Id referenciado pela assinatura
+
+    Returns:
+        str: XML assinado
+    """
+    if not _HAS_LXML:
+        raise ValueError('Biblioteca lxml não instalada')
+
+    certificado = certificado or carregar_certificado()
+    texto = xml.decode('utf-8') if isinstance(xml, bytes) else xml
+
+    documento = etree.fromstring(texto.encode('utf-8'))
+    alvo = documento.find(f'.//{{{NFE_NAMESPACE}}}{elemento}')
+    if alvo is None or not alvo.get('Id'):
+        raise ValueError(f'Tag {elemento} com atributo Id não encontrada')
+
+    pai = alvo.getparent()
+    if pai is None or pai.find(f'{{{DSIG_NAMESPACE}}}Signature') is not None:
+        raise ValueError(f'XML sem tag pai de {elemento} ou já assinado')
+
+    uri, digest = alvo.get('Id'), _digest(alvo)
+    signed_info_c14n = SIGNED_INFO_TEMPLATE.format(xmlns=f' xmlns="{DSIG_NAMESPACE}"', uri=uri, digest=digest)
+    assinatura = SIGNATURE_TEMPLATE.format(
+        signed_info=SIGNED_INFO_TEMPLATE.format(xmlns='', uri=uri, digest=digest),
+        assinatura=base64.b64encode(certificado.assinar(signed_info_c14n.encode('utf-8'))).decode('ascii'),
+        certificado=certificado.certificado_b64,
+    )
+
+    # Caso comum (XML gerado pelo NFeEngine): insere antes de </NFe> sem reserializar
+    fechamento = texto.rfind(f'</{etree.QName(pai).localname}>')
+    if pai is documento and fechamento != -1:
+        return texto[:fechamento] + assinatura + texto[fechamento:]
+
+    pai.append(etree.fromstring(assinatura))
+    declaracao = texto.startswith('<?xml')
+    return etree.tostring(documento, encoding='utf-8', xml_declaration=declaracao).decode('utf-8')
+
+
+def verificar_assinatura(xml):
+    """
+    Confere a assinatura XMLDSig da NF-e (digest de infNFe e SignatureValue)
+
+    Args:
+        xml: String/bytes com o XML assinado
+
+    Returns:
+        dict: {
+            'valida': True/False,
+            'verificada': True,       # False quando lxml/cryptography não estão disponíveis
+            'titular': 'EMPRESA LTDA:00000000000191',
+            'erros': []
+        }
+    """
+    resultado = {'valida': True, 'verificada': False, 'titular': None, 'erros': []}
+    if not (_HAS_LXML and _HAS_CRYPTOGRAPHY):
+        return resultado
+    resultado['verificada'] = True
+
+    def falha(mensagem):
+        resultado['valida'] = False
+        resultado['erros'].append(mensagem)
+        return resultado
+
+    try:
+        documento = etree.fromstring(xml.encode('utf-8') if isinstance(xml, str) else xml)
+    except etree.XMLSyntaxError as e:
+        return falha(f'Erro ao parsear XML: {str(e)}')
+
+    ns = {'ds': DSIG_NAMESPACE}
+    signature = documento.find('.//ds:Signature', ns)
+    if signature is None:
+        return falha('XML não assinado digitalmente')
+
+    referencia = signature.find('ds:SignedInfo/ds:Reference', ns)
+    uri = (referencia.get('URI') or '').lstrip('#') if referencia is not None else ''
+    alvo = documento.xpath('//*[@Id=$id]', id=uri) if uri else []
+    if not alvo:
+        return falha(f'Elemento referenciado pela assinatura não encontrado: #{uri}')
+
+    return _conferir(signature, _digest(alvo[0]), resultado)
+
+
+def _conferir(signature, digest, resultado):
+    """Confere DigestValue e SignatureValue de <Signature> (lxml) contra o digest calculado"""
+    def falha(mensagem):
+        resultado['valida'] = False
+        resultado['erros'].append(mensagem)
+        return resultado
+
+    ns = {'ds': DSIG_NAMESPACE}
+    if digest != signature.findtext('ds:SignedInfo/ds:Reference/ds:DigestValue', namespaces=ns):
+        return falha('DigestValue não confere: conteúdo de infNFe alterado após a assinatura')
+
+    try:
+        certificado = x509.load_der_x509_certificate(
+            base64.b64decode(signature.findtext('ds:KeyInfo/ds:X509Data/ds:X509Certificate', namespaces=ns) or '')
+        )
+        nomes = certificado.subject.get_attributes_for_oid(x509.NameOID.COMMON_NAME)
+        resultado['titular'] = nomes[0].value if nomes else None
+        certificado.public_key().verify(
+            base64.b64decode(signature.findtext('ds:SignatureValue', namespaces=ns) or ''),
+            # C14N sobre uma cópia: o libxml2 emite xmlns="" indevido nos filhos
+            # quando o subconjunto redeclara o namespace padrão herdado de <NFe>
+            etree.tostring(copy.deepcopy(signature.find('ds:SignedInfo', ns)), method='c14n'),
+            padding.PKCS1v15(),
+            hashes.SHA1(),
+        )
+    except InvalidSignature:
+        return falha('SignatureValue inválido para o certificado informado')
+    except ValueError as e:
+        return falha(f'Certificado da assinatura inválido: {str(e)}')
+
+    return resultado
+
+
+class _LeitorArquivo:
+    """
+    Alvo do parser (ElementTree) que lê um XML de NF-e sem montar a árvore
+
+    Calcula o digest C14N do elemento assinado à medida que o XML passa e
+    monta só a <Signature> (pequena) com lxml.
+    """
+
+    def __init__(self, elemento):
+        self.elemento = f'{{{NFE_NAMESPACE}}}{elemento}'
+        self.leitura = {'raiz': None, 'atributos': None, 'digest': None, 'signature': None}
+        self._hash = hashlib.sha1()
+        self._c14n = None
+        self._assinatura = None
+        self._escopos = [{}]
+        self._pendentes = {}
+        self._profundidade = 0
+
+    def start_ns(self, prefixo, uri):
+        if self._c14n is not None:
+            self._c14n.start_ns(prefixo, uri)
+        elif not self._profundidade:
+            self._pendentes[prefixo] = uri
+
+    def start(self, tag, atributos):
+        if self._profundidade:
+            self._profundidade += 1
+            (self._c14n or self._assinatura).start(tag, atributos)
+            return
+        escopo = dict(self._escopos[-1], **self._pendentes)
+        self._pendentes = {}
+        self._escopos.append(escopo)
+        if self.leitura['raiz'] is None:
+            self.leitura['raiz'] = tag
+        if tag == self.elemento and self.leitura['digest'] is None:
+            # C14N do subconjunto: o namespace herdado dos ancestrais vai no próprio elemento
+            self.leitura['atributos'] = dict(atributos)
+            self._c14n = ElementTree.C14NWriterTarget(lambda texto: self._hash.update(texto.encode('utf-8')))
+            for prefixo, uri in escopo.items():
+                self._c14n.start_ns(prefixo, uri)
+            self._c14n.start(tag, atributos)
+            self._profundidade = 1
+        elif tag == f'{{{DSIG_NAMESPACE}}}Signature' and self.leitura['signature'] is None:
+            self._assinatura = etree.TreeBuilder()
+            self._assinatura.start(tag, atributos, {None: DSIG_NAMESPACE})
+            self._profundidade = 1
+
+    def end(self, tag):
+        if not self._profundidade:
+            self._escopos.pop()
+            return
+        (self._c14n or self._assinatura).end(tag)
+        self._profundidade -= 1
+        if self._profundidade:
+            return
+        self._escopos.pop()
+        if self._c14n is not None:
+            self._c14n = None
+            self.leitura['digest'] = base64.b64encode(self._hash.digest()).decode('ascii')
+        else:
+            self.leitura['signature'] = self._assinatura.close()
+            self._assinatura = None
+
+    def data(self, texto):
+        if self._profundidade:
+            (self._c14n or self._assinatura).data(texto)
+
+    def close(self):
+        return self.leitura
+
+
+def ler_arquivo(arquivo, elemento='infNFe'):
+    """
+    Lê um XML de NF-e de um arquivo binário em blocos, sem montar a árvore
+
+    Args:
+        arquivo: Arquivo binário aberto para leitura (lido a partir do início)
+        elemento: Tag com o atributo Id referenciado pela assinatura
+
+    Returns:
+        dict: {
+            'raiz': '{http://www.portalfiscal.inf.br/nfe}NFe',
+            'atributos': {'versao': '4.00', 'Id': 'NFe4125...'},  # None sem o elemento
+            'digest': 'base64...',                                # DigestValue do elemento
+            'signature': <Element Signature (lxml)> | None
+        }
+
+    Raises:
+        xml.etree.ElementTree.ParseError: XML mal formado
+    """
+    arquivo.seek(0)
+    parser = ElementTree.XMLParser(target=_LeitorArquivo(elemento))
+    for bloco in iter(lambda: arquivo.read(BLOCO_LEITURA), b''):
+        parser.feed(bloco)
+    return parser.close()
+
+
+def assinar_arquivo(arquivo, certificado=None, elemento='infNFe'):
+    """
+    Assina um XML de NF-e direto no arquivo (modo streaming)
+
+    Mesmo resultado de assinar_xml(), com o XML lido em blocos: a memória
+    não cresce com a quantidade de itens. A <Signature> é inserida antes
+    do fechamento da tag raiz.
+
+    Args:
+        arquivo: Arquivo binário aberto para leitura e escrita (ex.: 'w+b')
+        certificado: CertificadoA1 (padrão: certificado configurado)
+        elemento: Tag com o atributo Id referenciado pela assinatura
+    """
+    if not _HAS_LXML:
+        raise ValueError('Biblioteca lxml não instalada')
+
+    certificado = certificado or carregar_certificado()
+    leitura = ler_arquivo(arquivo, elemento)
+    uri = (leitura['atributos'] or {}).get('Id')
+    if not uri:
+        raise ValueError(f'Tag {elemento} com atributo Id não encontrada')
+    if leitura['signature'] is not None:
+        raise ValueError('XML já assinado')
+
+    signed_info_c14n = SIGNED_INFO_TEMPLATE.format(xmlns=f' xmlns="{DSIG_NAMESPACE}"', uri=uri, digest=leitura['digest'])
+    assinatura = SIGNATURE_TEMPLATE.format(
+        signed_info=SIGNED_INFO_TEMPLATE.format(xmlns='', uri=uri, digest=leitura['digest']),
+        assinatura=base64.b64encode(certificado.assinar(signed_info_c14n.encode('utf-8'))).decode('ascii'),
+        certificado=certificado.certificado_b64,
+    )
+
+    fechamento = f'</{etree.QName(leitura["raiz"]).localname}>'.encode('utf-8')
+    fim = arquivo.seek(0, os.SEEK_END)
+    inicio = arquivo.seek(max(0, fim - BLOCO_LEITURA))
+    cauda = arquivo.read()
+    posicao = cauda.rfind(fechamento)
+    if posicao == -1:
+        raise ValueError(f'Fechamento {fechamento.decode()} não encontrado no fim do arquivo')
+    arquivo.seek(inicio + posicao)
+    arquivo.write(assinatura.encode('utf-8') + cauda[posicao:])
+    arquivo.truncate()
+    arquivo.flush()
+
+
+def verificar_assinatura_arquivo(arquivo, leitura=None):
+    """
+    Confere a assinatura de um XML de NF-e lendo o arquivo em blocos
+
+    Args:
+        arquivo: Arquivo binário aberto para leitura
+        leitura: Resultado de ler_arquivo() já obtido (evita reler o arquivo)
+
+    Returns:
+        dict: mesmo formato de verificar_assinatura()
+    """
+    resultado = {'valida': True, 'verificada': False, 'titular': None, 'erros': []}
+    if not (_HAS_LXML and _HAS_CRYPTOGRAPHY):
+        return resultado
+    resultado['verificada'] = True
+
+    try:
+        leitura = leitura or ler_arquivo(arquivo)
+    except ElementTree.ParseError as e:
+        resultado['valida'] = False
+        resultado['erros'].append(f'Erro ao parsear XML: {str(e)}')
+        return resultado
+
+    signature = leitura['signature']
+    if signature is None:
+        resultado['valida'] = False
+        resultado['erros'].append('XML não assinado digitalmente')
+        return resultado
+
+    referencia = signature.find(f'{{{DSIG_NAMESPACE}}}SignedInfo/{{{DSIG_NAMESPACE}}}Reference')
+    uri = (referencia.get('URI') or '').lstrip('#') if referencia is not None else ''
+    if not uri or uri != (leitura['atributos'] or {}).get('Id'):
+        resultado['valida'] = False
+        resultado['erros'].append(f'Elemento referenciado pela assinatura não encontrado: #{uri}')
+        return resultado
+
+    return _conferir(signature, leitura['digest'], resultado)
+
+
+# ========== Assinatura em lote ==========
+
+def _inicializar_worker(caminho, senha):
+    """Decifra o PFX uma vez no processo filho"""
+    global _certificado_worker
+    _certificado_worker = carregar_certificado(caminho, senha)
+
+
+def _assinar_no_worker(xml):
+    """Assina um XML com o certificado do processo (roda dentro do worker)"""
+    return assinar_xml(xml, _certificado_worker)
+
+
+def assinar_lote(xmls, workers=None, caminho=None, senha=None):
+    """
+    Assina vários XML de NF-e em paralelo
+
+    Args:
+        xmls: Lista de strings com os XML
+        workers: Quantidade de processos (limitada por NFE_SIGNER_MAX_WORKERS).
+                 Com 1 worker o lote roda no próprio processo.
+        caminho: Caminho do .pfx (padrão: settings.NFE_CERTIFICADO_PATH)
+        senha: Senha do .pfx (padrão: settings.NFE_CERTIFICADO_SENHA)
+
+    Returns:
+        list: XML assinados, na mesma ordem
+    """
+    xmls = list(xmls)
+    caminho = str(caminho or get_certificado_path() or '')
+    senha = get_certificado_senha() if senha is None else senha
+
+    # Falha cedo (senha errada, arquivo ausente) antes de subir o pool
+    certificado = carregar_certificado(caminho, senha)
+
+    workers = max(1, min(int(workers or get_max_workers()), get_max_workers(), len(xmls) or 1))
+    if workers == 1:
+        return [assinar_xml(xml, certificado) for xml in xmls]
+
+    chunksize = max(1, len(xmls) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_inicializar_worker,
+                             initargs=(caminho, senha)) as executor:
+        return list(executor.map(_assinar_no_worker, xmls, chunksize=chunksize))
@@ -0,0 +1,278 @@
+"""
+Numeração de NF-e/NFC-e por emitente, modelo e série
+Cada (CNPJ/CPF, modelo, série) tem uma NumberSequence com o próximo número
+livre. Os workers reservam blocos de números com um UPDATE condicional na
+linha da sequência (sem lock de tabela) e entregam os números do bloco em
+memória. Sobras de blocos que não podem voltar para a sequência (liberadas
+no encerramento do processo) e números descartados viram NumberGap, a
+serem inutilizados na SEFAZ.
+"""
+from django.conf import settings
+from django.db import IntegrityError, OperationalError, transaction
+from django.db.models import BigIntegerField, Max, Min
+from django.db.models.functions import Cast
+from .nfe_engine import clean_digits
+import threading
+import logging
+import atexit
+import random
+import time
+import os
+
+logger = logging.getLogger(__name__)
+
+# Números por bloco reservado (pode ser sobrescrito no settings.py)
+DEFAULT_TAMANHO_BLOCO = 50
+
+# Tentativas com o banco travado por outra escrita (SQLite)
+TENTATIVAS_BANCO_TRAVADO = 50
+
+# nNF tem 9 dígitos
+MAIOR_NUMERO = 999999999
+
+
+def get_tamanho_bloco():
+    """Números reservados por vez (settings.NFE_NUMERACAO_BLOCO)"""
+    return max(1, int(getattr(settings, 'NFE_NUMERACAO_BLOCO', DEFAULT_TAMANHO_BLOCO)))
+
+
+def _chave(cnpj_cpf, modelo, serie):
+    return clean_digits(cnpj_cpf), str(modelo or '55'), str(serie or '1')
+
+
+def _numeros_usados(cnpj_cpf, modelo, serie):
+    """
+    Notas do emitente/modelo/série com número só de dígitos, anotadas com `numero_int`
+
+    O CNPJ/CPF é gravado limpo (Invoice.save() e migração 0013); as notas que
+    a migração manteve formatadas repetem um número da grafia limpa e não
+    mudam o resultado.
+    """
+    from invoices.models import Invoice
+
+    return Invoice.objects.filter(
+        issuer_tax_id=cnpj_cpf, model_code=modelo, series=serie, number__regex=r'^[0-9]+$',
+    ).annotate(numero_int=Cast('number', BigIntegerField()))
+
+
+def _maior_numero_usado(cnpj_cpf, modelo, serie):
+    """Maior número já gravado em notas do emitente/modelo/série (semente da sequência)"""
+    return _numeros_usados(cnpj_cpf, modelo, serie).aggregate(maior=Max('numero_int'))['maior'] or 0
+
+
+def _sequencia(cnpj_cpf, modelo, serie):
+    from invoices.models import NumberSequence
+
+    sequencia = NumberSequence.objects.filter(issuer_tax_id=cnpj_cpf, model_code=modelo, series=serie).first()
+    if sequencia is not None:
+        return sequencia
+    try:
+        with transaction.atomic():
+            return NumberSequence.objects.create(
+                issuer_tax_id=cnpj_cpf, model_code=modelo, series=serie,
+                next_number=_maior_numero_usado(cnpj_cpf, modelo, serie) + 1,
+            )
+    except IntegrityError:
+        # Outro worker criou a sequência ao mesmo tempo
+        return NumberSequence.objects.get(issuer_tax_id=cnpj_cpf, model_code=modelo, series=serie)
+
+
+def reservar_bloco(cnpj_cpf, modelo='55', serie='1', tamanho=None):
+    """
+    Reserva uma faixa contínua de números na sequência
+
+    Args:
+        cnpj_cpf: CNPJ/CPF do emitente (com ou sem formatação)
+        modelo: '55' (NF-e) ou '65' (NFC-e)
+        serie: Série da nota
+        tamanho: Números no bloco (padrão: NFE_NUMERACAO_BLOCO)
+
+    Returns:
+        tuple: (primeiro, último) número reservado
+    """
+    from invoices.models import NumberSequence
+
+    cnpj_cpf, modelo, serie = _chave(cnpj_cpf, modelo, serie)
+    tamanho = tamanho or get_tamanho_bloco()
+
+    travado = 0
+    while True:
+        try:
+            sequencia = _sequencia(cnpj_cpf, modelo, serie)
+            inicio = sequencia.next_number
+            if inicio + tamanho - 1 > MAIOR_NUMERO:
+                raise ValueError(f'Numeração esgotada para {cnpj_cpf} modelo {modelo} série {serie}')
+            # Só um worker consegue avançar a partir do mesmo valor lido
+            if NumberSequence.objects.filter(pk=sequencia.pk, next_number=inicio).update(next_number=inicio + tamanho):
+                return inicio, inicio + tamanho - 1
+        except OperationalError as e:
+            # SQLite recusa escritas simultâneas com "locked" em vez de esperar
+            travado += 1
+            if 'locked' not in str(e) or travado >= TENTATIVAS_BANCO_TRAVADO:
+                raise
+            time.sleep(random.uniform(0, 0.002 * travado))
+
+
+def registrar_lacuna(cnpj_cpf, modelo, serie, inicio, fim, motivo=None):
+    """Registra uma faixa de números não usada (pendente de inutilização)"""
+    from invoices.models import NumberGap
+
+    cnpj_cpf, modelo, serie = _chave(cnpj_cpf, modelo, serie)
+    lacuna, _ = NumberGap.objects.get_or_create(
+        issuer_tax_id=cnpj_cpf, model_code=modelo, series=serie, start_number=inicio,
+        defaults={'end_number': fim, 'reason': (motivo or '')[:255] or None},
+    )
+    return lacuna
+
+
+class AlocadorNumeracao:
+    """
+    Entrega números a partir de blocos reservados na sequência
+
+    Use uma instância por worker/processo; threads da mesma instância
+    compartilham os blocos. Só a reserva de um bloco novo vai ao banco.
+    """
+
+    def __init__(self, tamanho_bloco=None):
+        self.tamanho_bloco = tamanho_bloco
+        self._blocos = {}
+        self._lock = threading.Lock()
+
+    def proximo(self, cnpj_cpf, modelo='55', serie='1'):
+        """Próximo número livre (int) do emitente/modelo/série"""
+        chave = _chave(cnpj_cpf, modelo, serie)
+        with self._lock:
+            bloco = self._blocos.get(chave)
+            if bloco is None or bloco[0] > bloco[1]:
+                bloco = self._blocos[chave] = list(reservar_bloco(*chave, tamanho=self.tamanho_bloco))
+            numero = bloco[0]
+            bloco[0] += 1
+            return numero
+
+    def descartar(self, cnpj_cpf, modelo, serie, numero, motivo='Número descartado'):
+        """Número entregue que não virou nota (ex.: falha ao gravar)"""
+        return registrar_lacuna(cnpj_cpf, modelo, serie, numero, numero, motivo)
+
+    def liberar(self, motivo='Sobra de bloco reservado'):
+        """
+        Devolve as sobras dos blocos (encerramento do worker)
+
+        A sobra volta para a sequência se nenhum outro bloco foi reservado
+        depois dela; senão é registrada como lacuna.
+
+        Returns:
+            list: Lacunas registradas
+        """
+        from invoices.models import NumberSequence
+
+        lacunas = []
+        with self._lock:
+            for (cnpj_cpf, modelo, serie), (proximo, fim) in self._blocos.items():
+                if proximo > fim:
+                    continue
+                devolvido = NumberSequence.objects.filter(
+                    issuer_tax_id=cnpj_cpf, model_code=modelo, series=serie, next_number=fim + 1,
+                ).update(next_number=proximo)
+                if not devolvido:
+                    lacunas.append(registrar_lacuna(cnpj_cpf, modelo, serie, proximo, fim, motivo))
+            self._blocos.clear()
+        return lacunas
+
+
+def apurar_lacunas(cnpj_cpf, modelo='55', serie='1', desde=None, ate=None):
+    """
+    Registra os números da sequência que não viraram nota (ex.: worker que caiu)
+
+    Execute com os workers parados ou informe `ate` abaixo dos blocos em uso.
+
+    Args:
+        desde: Primeiro número considerado (padrão: menor número com nota ou lacuna)
+        ate: Último número considerado (padrão: último número reservado)
+
+    Returns:
+        list: Lacunas novas registradas
+    """
+    from invoices.models import NumberGap, NumberSequence
+
+    cnpj_cpf, modelo, serie = _chave(cnpj_cpf, modelo, serie)
+    sequencia = NumberSequence.objects.filter(issuer_tax_id=cnpj_cpf, model_code=modelo, series=serie).first()
+    if sequencia is None:
+        return []
+    ate = min(ate or sequencia.next_number - 1, sequencia.next_number - 1)
+
+    # Faixas ocupadas: notas (um número cada) e lacunas já registradas
+    notas = _numeros_usados(cnpj_cpf, modelo, serie)
+    registradas = NumberGap.objects.filter(issuer_tax_id=cnpj_cpf, model_code=modelo, series=serie)
+    if desde is None:
+        menores = [
+            notas.aggregate(menor=Min('numero_int'))['menor'],
+            registradas.aggregate(menor=Min('start_number'))['menor'],
+        ]
+        desde = min((menor for menor in menores if menor is not None), default=1)
+    # Só os números da faixa apurada saem do banco
+    ocupadas = [
+        (numero, numero) for numero in notas.filter(numero_int__gte=desde, numero_int__lte=ate)
+        .values_list('numero_int', flat=True).distinct().iterator()
+    ]
+    ocupadas.extend(registradas.values_list('start_number', 'end_number'))
+    ocupadas.sort()
+
+    lacunas = []
+    proximo = desde
+    for inicio, fim in ocupadas + [(ate + 1, ate + 1)]:
+        if inicio > proximo and proximo <= ate:
+            lacunas.append(registrar_lacuna(
+                cnpj_cpf, modelo, serie, proximo, min(inicio - 1, ate), 'Número reservado sem nota'
+            ))
+        proximo = max(proximo, fim + 1)
+    return lacunas
+
+
+# ========== Alocador do processo ==========
+
+_alocador = None
+_alocador_lock = threading.Lock()
+
+
+def limpar():
+    """Descarta o alocador do processo (processos filhos reservam os próprios blocos)"""
+    global _alocador, _alocador_lock
+    _alocador, _alocador_lock = None, threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=limpar)
+
+
+def get_alocador():
+    global _alocador
+    with _alocador_lock:
+        if _alocador is None:
+            _alocador = AlocadorNumeracao()
+        return _alocador
+
+
+def alocar_numero(cnpj_cpf, modelo='55', serie='1'):
+    """Próximo número do emitente/modelo/série pelo alocador do processo"""
+    return get_alocador().proximo(cnpj_cpf, modelo, serie)
+
+
+def descartar_numero(cnpj_cpf, modelo, serie, numero, motivo='Número descartado'):
+    """Número do alocador do processo que não virou nota: fica como lacuna para inutilização"""
+    return get_alocador().descartar(cnpj_cpf, modelo, serie, numero, motivo)
+
+
+def _liberar_ao_sair():
+    """Sobras dos blocos do processo voltam à sequência ou viram lacuna no encerramento"""
+    if _alocador is None:
+        return
+    try:
+        lacunas = _alocador.liberar()
+    except Exception as e:
+        logger.error(f"Sobras de numeração não liberadas no encerramento: {str(e)}")
+        return
+    if lacunas:
+        logger.warning(f"{len(lacunas)} lacuna(s) de numeração registradas no encerramento")
+
+
+atexit.register(_liberar_ao_sair)
@@ -0,0 +1,195 @@
+"""
+Pacote de DANFEs e XMLs de várias notas, gerado em streaming
+Para pedidos como "todos os DANFEs e XMLs do cliente X em março": as notas
+são lidas do banco com iterator() e cada arquivo vai para a saída assim que
+fica pronto, num único PDF (páginas copiadas objeto a objeto com o
+pdfminer) ou num ZIP com os pares XML + PDF. O PDF de cada nota vem de
+obter_danfe(), que reaproveita o cache e o arquivo gravado; a memória fica
+limitada a uma nota por vez.
+"""
+from django.conf import settings
+from pdfminer.pdfpage import PDFPage
+from .danfe_cache import obter_danfe
+from .saida_pdf import Copiador, ler, CATALOGO as _CATALOGO, PAGINAS as _PAGINAS
+import zipfile
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Limites padrão (podem ser sobrescritos no settings.py)
+DEFAULT_TAMANHO_BLOCO = 64 * 1024
+DEFAULT_NOTAS_POR_CONSULTA = 100
+
+
+def get_tamanho_bloco():
+    """Bytes lidos por vez dos XMLs gravados (settings.NFE_PACOTE_BLOCO)"""
+    return int(getattr(settings, 'NFE_PACOTE_BLOCO', DEFAULT_TAMANHO_BLOCO))
+
+
+def get_notas_por_consulta():
+    """Notas carregadas do banco por vez (settings.NFE_PACOTE_NOTAS_POR_CONSULTA)"""
+    return int(getattr(settings, 'NFE_PACOTE_NOTAS_POR_CONSULTA', DEFAULT_NOTAS_POR_CONSULTA))
+
+
+def nome_pdf(invoice):
+    return f"DANFE_{invoice.number}_{invoice.series}.pdf"
+
+
+def nome_xml(invoice):
+    return f"NFe{invoice.number}_{invoice.series}.xml"
+
+
+def _notas(invoices):
+    if hasattr(invoices, 'iterator'):
+        return invoices.iterator(chunk_size=get_notas_por_consulta())
+    return iter(invoices)
+
+
+# ========== PDF único ==========
+
+class PdfUnico:
+    """
+    Escreve um PDF com as páginas de vários PDFs, sem montá-lo em memória
+
+    Cada PDF de origem tem seus objetos alcançáveis a partir das páginas
+    copiados com nova numeração; objetos iguais aos de notas anteriores
+    (fontes, imagens, perfis de cor) não são escritos de novo. Só os
+    deslocamentos (xref), os números das páginas e um resumo de 16 bytes por
+    objeto escrito ficam guardados até o fim.
+    """
+
+    def __init__(self):
+        self.posicao = 0
+        self.deslocamentos = {}
+        self.paginas = []
+        self._unicos = {}
+        self._proximo = _PAGINAS + 1
+
+    def _novo(self):
+        numero = self._proximo
+        self._proximo += 1
+        return numero
+
+    def _saida(self, dados):
+        self.posicao += len(dados)
+        return dados
+
+    def _objeto(self, numero, corpo):
+        self.deslocamentos[numero] = self.posicao
+        return self._saida(b'%d 0 obj\n' % numero + corpo + b'\nendobj\n')
+
+    def cabecalho(self):
+        return self._saida(b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n')
+
+    def anexar(self, conteudo):
+        """
+        Objetos das páginas de um PDF (bytes), já renumerados
+
+        O PDF é copiado inteiro antes de sair o primeiro objeto; se falhar,
+        nada é escrito e a numeração e os objetos já vistos voltam ao que eram.
+        """
+        proximo = self._proximo
+        copiador = Copiador(ler(conteudo), self._novo, self._unicos)
+        try:
+            paginas = [copiador.pagina(pagina, _PAGINAS) for pagina in PDFPage.create_pages(copiador.documento)]
+        except Exception:
+            self._proximo = proximo
+            for resumo in copiador.novos_resumos:
+                del self._unicos[resumo]
+            raise
+        self.paginas.extend(paginas)
+        for numero, corpo, _ in copiador.objetos:
+            yield self._objeto(numero, corpo)
+
+    def fechar(self):
+        """Árvore de páginas, catálogo, xref e trailer"""
+        kids = b' '.join(b'%d 0 R' % numero for numero in self.paginas)
+        yield self._objeto(_PAGINAS, b'<</Type /Pages /Kids [' + kids + b'] /Count %d>>' % len(self.paginas))
+        yield self._objeto(_CATALOGO, b'<</Type /Catalog /Pages %d 0 R>>' % _PAGINAS)
+
+        inicio_xref = self.posicao
+        tabela = [b'xref\n0 %d\n' % self._proximo, b'0000000000 65535 f \n']
+        tabela.extend(b'%010d 00000 n \n' % self.deslocamentos[numero] for numero in range(1, self._proximo))
+        tabela.append(b'trailer\n<</Size %d /Root %d 0 R>>\nstartxref\n%d\n%%%%EOF\n' % (
+            self._proximo, _CATALOGO, inicio_xref))
+        yield b''.join(tabela)
+
+
+def pdf_unico(invoices):
+    """
+    Streaming de um PDF com os DANFEs das notas, na ordem recebida
+
+    Args:
+        invoices: QuerySet ou iterável de Invoice
+
+    Yields:
+        bytes: Pedaços do PDF (um objeto por vez)
+    """
+    escritor = PdfUnico()
+    yield escritor.cabecalho()
+    for invoice in _notas(invoices):
+        try:
+            pdf, _ = obter_danfe(invoice)
+            yield from escritor.anexar(pdf)
+        except Exception as e:
+            logger.warning(f"DANFE da nota {invoice.pk} fora do pacote: {str(e)}")
+    yield from escritor.fechar()
+
+
+# ========== ZIP ==========
+
+class _Saida:
+    """Arquivo só de escrita que entrega o que recebeu a cada esvaziar()"""
+
+    def __init__(self):
+        self._partes = []
+
+    def write(self, dados):
+        self._partes.append(bytes(dados))
+        return len(dados)
+
+    def flush(self):
+        pass
+
+    def esvaziar(self):
+        dados = b''.join(self._partes)
+        self._partes.clear()
+        return dados
+
+
+def zip_notas(invoices):
+    """
+    Streaming de um ZIP com o XML gravado e o DANFE de cada nota
+
+    O XML é copiado do storage em blocos de get_tamanho_bloco(); notas sem
+    XML gravado entram só com o PDF. Falhas ficam listadas em ERROS.txt.
+
+    Yields:
+        bytes: Pedaços do ZIP
+    """
+    saida = _Saida()
+    erros = []
+    with zipfile.ZipFile(saida, 'w', compression=zipfile.ZIP_DEFLATED) as arquivo:
+        for invoice in _notas(invoices):
+            if invoice.xml_file:
+                try:
+                    with invoice.xml_file.open('rb') as origem, arquivo.open(nome_xml(invoice), 'w') as destino:
+                        for bloco in iter(lambda: origem.read(get_tamanho_bloco()), b''):
+                            destino.write(bloco)
+                            yield saida.esvaziar()
+                except (FileNotFoundError, OSError) as e:
+                    erros.append(f"{nome_xml(invoice)}: {str(e)}")
+                yield saida.esvaziar()
+
+            try:
+                pdf, _ = obter_danfe(invoice)
+            except Exception as e:
+                erros.append(f"{nome_pdf(invoice)}: {str(e)}")
+            else:
+                arquivo.writestr(nome_pdf(invoice), pdf)
+            yield saida.esvaziar()
+
+        if erros:
+            logger.warning(f"Pacote de notas com {len(erros)} arquivo(s) com erro")
+            arquivo.writestr('ERROS.txt', '\n'.join(erros))
+    yield saida.esvaziar()
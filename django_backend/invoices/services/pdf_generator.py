@@ -2,61 +2,84 @@ from reportlab.lib.pagesizes import A4
 from reportlab.lib import colors
 from reportlab.lib.units import mm
 from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Paragraph, Spacer, Image
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+from reportlab.lib.styles import ParagraphStyle
 from reportlab.lib.enums import TA_CENTER, TA_LEFT, TA_RIGHT
-from reportlab.graphics.barcode import code128
-from reportlab.graphics.shapes import Drawing
 from django.core.files.base import ContentFile
+from . import danfe_recursos as recursos
+from .tabela_itens import TabelaItens
 import io
 from datetime import datetime
 
 
+def _estilos():
+    """Estilos do DANFE padrão, criados uma vez por processo (danfe_recursos)"""
+    styles = recursos.folha_estilos()
+    estilos = {}
+
+    # Estilos personalizados conforme layout DANFE
+    estilos['title'] = ParagraphStyle(
+        'DANFETitle',
+        parent=styles['Heading1'],
+        fontSize=18,
+        textColor=colors.black,
+        fontName='Helvetica-Bold',
+        spaceAfter=3,
+        alignment=TA_CENTER
+    )
+
+    estilos['header'] = ParagraphStyle(
+        'Header',
+        parent=styles['Normal'],
+        fontSize=7,
+        textColor=colors.black,
+        spaceAfter=3,
+        fontName='Helvetica'
+    )
+
+    estilos['field_label'] = ParagraphStyle(
+        'FieldLabel',
+        parent=styles['Normal'],
+        fontSize=6,
+        textColor=colors.black,
+        fontName='Helvetica-Bold'
+    )
+
+    estilos['field_value'] = ParagraphStyle(
+        'FieldValue',
+        parent=styles['Normal'],
+        fontSize=8,
+        textColor=colors.black,
+        fontName='Helvetica'
+    )
+
+    estilos['footer'] = ParagraphStyle('Footer', parent=styles['Normal'], fontSize=7, alignment=TA_CENTER, textColor=colors.grey)
+    estilos['total'] = ParagraphStyle('TotNF', parent=estilos['field_value'], fontSize=10, fontName='Helvetica-Bold')
+    estilos['receipt'] = ParagraphStyle('Rec', parent=estilos['field_value'], fontSize=7)
+    return estilos
+
+
+recursos.registrar('estilos_pdf_generator', _estilos)
+
+
 class InvoicePDFGenerator:
     """Gerador de PDF para DANFE - Nota Fiscal do Produtor Rural (Layout SEFAZ-PR)"""
     
     def __init__(self, invoice):
         self.invoice = invoice
         self.width, self.height = A4
-        self.styles = getSampleStyleSheet()
-        
-        # Estilos personalizados conforme layout DANFE
-        self.title_style = ParagraphStyle(
-            'DANFETitle',
-            parent=self.styles['Heading1'],
-            fontSize=18,
-            textColor=colors.black,
-            fontName='Helvetica-Bold',
-            spaceAfter=3,
-            alignment=TA_CENTER
-        )
+        self.styles = recursos.folha_estilos()
         
-        self.header_style = ParagraphStyle(
-            'Header',
-            parent=self.styles['Normal'],
-            fontSize=7,
-            textColor=colors.black,
-            spaceAfter=3,
-            fontName='Helvetica'
-        )
-        
-        self.field_label_style = ParagraphStyle(
-            'FieldLabel',
-            parent=self.styles['Normal'],
-            fontSize=6,
-            textColor=colors.black,
-            fontName='Helvetica-Bold'
-        )
-        
-        self.field_value_style = ParagraphStyle(
-            'FieldValue',
-            parent=self.styles['Normal'],
-            fontSize=8,
-            textColor=colors.black,
-            fontName='Helvetica'
-        )
+        estilos = recursos.obter('estilos_pdf_generator')
+        self.title_style = estilos['title']
+        self.header_style = estilos['header']
+        self.field_label_style = estilos['field_label']
+        self.field_value_style = estilos['field_value']
+        self.footer_style = estilos['footer']
+        self.total_style = estilos['total']
+        self.receipt_style = estilos['receipt']
     
-    def generate_pdf(self):
-        """Gera o PDF da DANFE com layout mais aderente ao modelo oficial."""
+    def generate(self):
+        """Gera o PDF da DANFE e retorna o conteúdo (sem salvar no banco)"""
         buffer = io.BytesIO()
         doc = SimpleDocTemplate(buffer, pagesize=A4, topMargin=6*mm, bottomMargin=8*mm, leftMargin=8*mm, rightMargin=8*mm)
 
@@ -93,19 +116,34 @@ class InvoicePDFGenerator:
         elements.append(Spacer(1, 4*mm))
         footer = Paragraph(
             f"Documento emitido eletronicamente - Contabiliza.IA - {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}",
-            ParagraphStyle('Footer', parent=self.styles['Normal'], fontSize=7, alignment=TA_CENTER, textColor=colors.grey)
+            self.footer_style
         )
         elements.append(footer)
 
         doc.build(elements)
         pdf_content = buffer.getvalue()
         buffer.close()
+        return pdf_content
 
+    def generate_pdf(self):
+        """Gera o PDF da DANFE com layout mais aderente ao modelo oficial."""
+        pdf_content = self.generate()
         filename = f"DANFE_{self.invoice.number}_{self.invoice.series}.pdf"
         self.invoice.pdf_file.save(filename, ContentFile(pdf_content))
         return pdf_content
 
     # ===================== BLOCO CABEÇALHO =====================
+    def _format_cpf_cnpj(self, doc):
+        """Formata CPF ou CNPJ"""
+        if not doc:
+            return ''
+        doc = ''.join(filter(str.isdigit, str(doc)))
+        if len(doc) == 11:  # CPF
+            return f"{doc[:3]}.{doc[3:6]}.{doc[6:9]}-{doc[9:]}"
+        elif len(doc) == 14:  # CNPJ
+            return f"{doc[:2]}.{doc[2:5]}.{doc[5:8]}/{doc[8:12]}-{doc[12:]}"
+        return doc
+
     def _format_access_key(self):
         key = self.invoice.access_key or ('0' * 44)
         return ' '.join([key[i:i+4] for i in range(0, len(key), 4)])
@@ -113,11 +151,7 @@ class InvoicePDFGenerator:
     def _barcode_drawing(self, key):
         # Fallback: se Code128 não puder ser embutido no Drawing, retorna Paragraph informativo
         try:
-            bc = code128.Code128(key, barHeight=12*mm, barWidth=0.28*mm)
-            drawing = Drawing(180*mm, 15*mm)
-            # Alguns builds do reportlab exigem add() direto
-            drawing.add(bc)
-            return drawing
+            return recursos.codigo_barras_reportlab(key, 180*mm, 15*mm, 12*mm, 0.28*mm)
         except Exception:
             return Paragraph(f"<b>[BARCODE]</b> {key}", self.field_value_style)
 
@@ -156,7 +190,7 @@ class InvoicePDFGenerator:
     def _build_parties_block(self):
         elements = []
         client = self.invoice.client
-        emit_html = f"""<b>EMITENTE</b><br/>{self.invoice.issuer_name}<br/>CNPJ: {self.invoice.issuer_tax_id}"""
+        emit_html = f"""<b>EMITENTE</b><br/>{self.invoice.issuer_name}<br/>CNPJ: {self._format_cpf_cnpj(self.invoice.issuer_tax_id)}"""
         dest_html = f"""<b>DESTINATÁRIO</b><br/>{client.name}<br/>CPF/CNPJ: {client.tax_id}<br/>Endereço: {client.street}, {client.number} - {client.neighborhood} - {client.city}/{client.state} - CEP: {client.zip_code}"""
         parties_data = [[Paragraph(emit_html, self.field_value_style), Paragraph(dest_html, self.field_value_style)]]
         parties_table = Table(parties_data, colWidths=[90*mm, 90*mm])
@@ -194,9 +228,8 @@ class InvoicePDFGenerator:
     def _build_items_block(self):
         elements = []
         header = ['cProd', 'xProd', 'NCM', 'CFOP', 'uCom', 'qCom', 'vUnCom', 'vProd', 'vBC', 'vICMS', 'vIPI']
-        rows = [header]
-        for item in self.invoice.items.all():
-            rows.append([
+        rows = [
+            (
                 item.code,
                 item.description[:25] + ('...' if len(item.description) > 25 else ''),
                 item.ncm or '-',
@@ -208,20 +241,17 @@ class InvoicePDFGenerator:
                 f"{item.total_value:.2f}",  # vBC (aprox total item)
                 f"{item.icms_value:.2f}",
                 f"{item.ipi_value:.2f}"
-            ])
-        if len(rows) == 1:
-            rows.append(['-', 'Nenhum item', '-', '-', '-', '-', '-', '-', '-', '-', '-'])
+            )
+            for item in self.invoice.items.all()
+        ]
+        if not rows:
+            rows.append(('-', 'Nenhum item', '-', '-', '-', '-', '-', '-', '-', '-', '-'))
         col_widths = [16*mm, 32*mm, 10*mm, 10*mm, 10*mm, 12*mm, 16*mm, 16*mm, 14*mm, 14*mm, 14*mm]
-        table = Table(rows, colWidths=col_widths, repeatRows=1)
-        table.setStyle(TableStyle([
-            ('BOX', (0, 0), (-1, -1), 0.6, colors.black),
-            ('INNERGRID', (0, 0), (-1, -1), 0.4, colors.black),
-            ('BACKGROUND', (0, 0), (-1, 0), colors.lightgrey),
-            ('FONTNAME', (0, 0), (-1, 0), 'Helvetica-Bold'),
-            ('FONTSIZE', (0, 0), (-1, -1), 6),
-            ('VALIGN', (0, 0), (-1, -1), 'MIDDLE'),
-        ]))
-        elements.append(table)
+        # Tabela paginada: cabeçalho repetido e faixa de continuação nas páginas seguintes
+        elements.append(TabelaItens(
+            header, rows, col_widths, borda=0.6, grade=0.4,
+            titulo_continuacao=f'PRODUTOS / SERVIÇOS (CONTINUAÇÃO) - NF-e Nº {self.invoice.number} SÉRIE {self.invoice.series}',
+        ))
         return elements
 
     # ===================== TOTAIS =====================
@@ -239,7 +269,7 @@ class InvoicePDFGenerator:
              Paragraph('<b>Desconto</b><br/>' + f"R$ {t.discount:.2f}", self.field_value_style),
              Paragraph('<b>Outras Desp.</b><br/>' + f"R$ {t.other_expenses:.2f}", self.field_value_style),
              Paragraph('<b>Valor IPI</b><br/>' + f"R$ {t.ipi_value:.2f}", self.field_value_style)],
-            [Paragraph('<b>Valor Total da NF</b>', self.field_label_style), '', '', '', Paragraph(f"R$ {t.total_value:.2f}", ParagraphStyle('TotNF', parent=self.field_value_style, fontSize=10, fontName='Helvetica-Bold'))]
+            [Paragraph('<b>Valor Total da NF</b>', self.field_label_style), '', '', '', Paragraph(f"R$ {t.total_value:.2f}", self.total_style)]
         ]
         table = Table(data, colWidths=[36*mm, 36*mm, 36*mm, 36*mm, 36*mm])
         table.setStyle(TableStyle([
@@ -274,7 +304,7 @@ class InvoicePDFGenerator:
         elements = []
         txt = ('Recebemos de ' + self.invoice.issuer_name + ' os produtos/mercadorias constantes da NF-e indicada ' \
                'abaixo. Em ' + datetime.now().strftime('%d/%m/%Y') + '. ______________________________________ Assinatura')
-        receipt = Paragraph('<b>RECIBO DO DESTINATÁRIO</b><br/>' + txt, ParagraphStyle('Rec', parent=self.field_value_style, fontSize=7))
+        receipt = Paragraph('<b>RECIBO DO DESTINATÁRIO</b><br/>' + txt, self.receipt_style)
         box = Table([[receipt]], colWidths=[180*mm])
         box.setStyle(TableStyle([
             ('BOX', (0, 0), (-1, -1), 0.7, colors.black),
@@ -0,0 +1,359 @@
+"""
+QR Code (modo byte, correção M) para o DANFE NFC-e
+Codificador enxuto para a URL de consulta: as tabelas do corpo de Galois e
+os polinômios geradores de Reed-Solomon são calculados uma vez, e cada
+versão tem um molde (padrões fixos, informação de formato e ordem das
+posições de dados) montado na primeira vez que é usada. Codificar uma URL
+se resume a gerar os bytes de correção e preencher as posições do molde.
+
+A máscara é a de menor penalidade pelas regras da ISO/IEC 18004 (7.8.3):
+as oito são montadas a partir do mesmo molde e avaliadas uma vez por
+conteúdo, já que o desenho de cada conteúdo fica no cache de códigos de
+barras do danfe_recursos.
+"""
+from functools import lru_cache
+from operator import itemgetter
+from . import danfe_recursos as recursos
+import re
+
+# Correção de erros M por versão: (bytes de correção por bloco,
+# blocos do grupo 1, bytes de dados por bloco do grupo 1, idem grupo 2)
+BLOCOS_M = (
+    (10, 1, 16, 0, 0), (16, 1, 28, 0, 0), (26, 1, 44, 0, 0), (18, 2, 32, 0, 0), (24, 2, 43, 0, 0),
+    (16, 4, 27, 0, 0), (18, 4, 31, 0, 0), (22, 2, 38, 2, 39), (22, 3, 36, 2, 37), (26, 4, 43, 1, 44),
+    (30, 1, 50, 4, 51), (22, 6, 36, 2, 37), (22, 8, 37, 1, 38), (24, 4, 40, 5, 41), (24, 5, 41, 5, 42),
+    (28, 7, 45, 3, 46), (28, 10, 46, 1, 47), (26, 9, 43, 4, 44), (26, 3, 44, 11, 45), (26, 3, 41, 13, 42),
+    (26, 17, 42, 0, 0), (28, 17, 46, 0, 0), (28, 4, 47, 14, 48), (28, 6, 45, 14, 46), (28, 8, 47, 13, 48),
+    (28, 19, 46, 4, 47), (28, 22, 45, 3, 46), (28, 3, 45, 23, 46), (28, 21, 45, 7, 46), (28, 19, 47, 10, 48),
+    (28, 2, 46, 29, 47), (28, 10, 46, 23, 47), (28, 14, 46, 21, 47), (28, 14, 46, 23, 47), (28, 12, 47, 26, 48),
+    (28, 6, 47, 34, 48), (28, 29, 46, 14, 47), (28, 13, 46, 32, 47), (28, 40, 47, 7, 48), (28, 18, 47, 31, 48),
+)
+VERSAO_MAXIMA = len(BLOCOS_M)
+
+NIVEL_M = 0b00
+
+# Padrões de máscara (linha, coluna) -> inverte o módulo de dados
+MASCARAS = (
+    lambda i, j: (i + j) % 2 == 0,
+    lambda i, j: i % 2 == 0,
+    lambda i, j: j % 3 == 0,
+    lambda i, j: (i + j) % 3 == 0,
+    lambda i, j: (i // 2 + j // 3) % 2 == 0,
+    lambda i, j: i * j % 2 + i * j % 3 == 0,
+    lambda i, j: (i * j % 2 + i * j % 3) % 2 == 0,
+    lambda i, j: ((i + j) % 2 + i * j % 3) % 2 == 0,
+)
+
+# Margem clara obrigatória em volta do símbolo, em módulos
+ZONA_SILENCIOSA = 4
+
+# '0'/'1' -> 0/1 e trechos de módulos escuros numa linha
+_BITS = bytes.maketrans(b'01', b'\x00\x01')
+_DIGITOS = bytes.maketrans(b'\x00\x01', b'01')
+_ESCUROS = re.compile(b'\x01+')
+
+# Penalidades: 5+ módulos seguidos da mesma cor (N1) e padrão 1:1:3:1:1 com
+# 4 módulos claros antes ou depois (N3)
+_TRECHOS = re.compile(b'\x00{5,}|\x01{5,}')
+_LOCALIZADOR = re.compile(b'(?=\x00\x00\x00\x00\x01\x00\x01\x01\x01\x00\x01|\x01\x00\x01\x01\x01\x00\x01\x00\x00\x00\x00)')
+_CLARA = bytes(ZONA_SILENCIOSA)
+
+# GF(256) com o polinômio 0x11D; EXP dobrado dispensa o "% 255"
+EXP = [0] * 512
+LOG = [0] * 256
+_valor = 1
+for _i in range(255):
+    EXP[_i] = _valor
+    LOG[_valor] = _i
+    _valor <<= 1
+    if _valor & 0x100:
+        _valor ^= 0x11D
+for _i in range(255, 512):
+    EXP[_i] = EXP[_i - 255]
+
+
+@lru_cache(maxsize=None)
+def _gerador(grau):
+    """Logaritmos dos coeficientes do polinômio gerador (sem o termo líder)"""
+    coeficientes = [1]
+    for i in range(grau):
+        produto = [0] * (len(coeficientes) + 1)
+        for j, coeficiente in enumerate(coeficientes):
+            produto[j] ^= coeficiente
+            if coeficiente:
+                produto[j + 1] ^= EXP[LOG[coeficiente] + i]
+        coeficientes = produto
+    return tuple(LOG[c] for c in coeficientes[1:])
+
+
+def _correcao(dados, grau):
+    """Bytes de correção Reed-Solomon de um bloco"""
+    gerador = _gerador(grau)
+    resto = [0] * grau
+    for byte in dados:
+        fator = byte ^ resto[0]
+        del resto[0]
+        resto.append(0)
+        if fator:
+            log_fator = LOG[fator]
+            for i, log_coeficiente in enumerate(gerador):
+                resto[i] ^= EXP[log_coeficiente + log_fator]
+    return resto
+
+
+def _capacidade(versao):
+    """Bytes de dados da versão"""
+    _, blocos1, dados1, blocos2, dados2 = BLOCOS_M[versao - 1]
+    return blocos1 * dados1 + blocos2 * dados2
+
+
+def _bits_contagem(versao):
+    return 8 if versao < 10 else 16
+
+
+def escolher_versao(tamanho):
+    """
+    Menor versão que comporta `tamanho` bytes no modo byte
+
+    Raises:
+        ValueError: conteúdo maior que a versão 40
+    """
+    for versao in range(1, VERSAO_MAXIMA + 1):
+        if 4 + _bits_contagem(versao) + 8 * tamanho <= 8 * _capacidade(versao):
+            return versao
+    raise ValueError(f'Conteúdo grande demais para um QR Code: {tamanho} bytes')
+
+
+def _alinhamentos(versao):
+    """Centros dos padrões de alinhamento (linhas e colunas)"""
+    if versao == 1:
+        return ()
+    quantidade = versao // 7 + 2
+    lado = versao * 4 + 17
+    passo = 26 if versao == 32 else (versao * 4 + quantidade * 2 + 1) // (quantidade * 2 - 2) * 2
+    return (6, *sorted(lado - 7 - i * passo for i in range(quantidade - 1)))
+
+
+def _bch(valor, bits, polinomio):
+    grau = polinomio.bit_length() - 1
+    resto = valor << grau
+    for i in range(bits + grau - 1, grau - 1, -1):
+        if resto >> i & 1:
+            resto ^= polinomio << (i - grau)
+    return valor << grau | resto
+
+
+@lru_cache(maxsize=None)
+def _molde(versao):
+    """
+    Matriz da versão sem os dados
+
+    Returns:
+        tuple: (bytes lado x lado com os módulos fixos e o formato já
+                desenhados, um por máscara; itemgetter que monta a matriz
+                a partir de bits de dados + molde; cada máscara como
+                inteiro na ordem das posições; quantidade de posições de
+                dados; lado)
+    """
+    lado = versao * 4 + 17
+    modulos = bytearray(lado * lado)
+    fixo = bytearray(lado * lado)
+
+    def marcar(linha, coluna, escuro):
+        modulos[linha * lado + coluna] = escuro
+        fixo[linha * lado + coluna] = 1
+
+    # Localizadores com separadores
+    for linha0, coluna0 in ((3, 3), (3, lado - 4), (lado - 4, 3)):
+        for dl in range(-4, 5):
+            for dc in range(-4, 5):
+                linha, coluna = linha0 + dl, coluna0 + dc
+                if 0 <= linha < lado and 0 <= coluna < lado:
+                    marcar(linha, coluna, max(abs(dl), abs(dc)) not in (2, 4))
+
+    # Temporização
+    for i in range(lado):
+        if not fixo[6 * lado + i]:
+            marcar(6, i, i % 2 == 0)
+        if not fixo[i * lado + 6]:
+            marcar(i, 6, i % 2 == 0)
+
+    # Alinhamento (fora dos cantos dos localizadores)
+    centros = _alinhamentos(versao)
+    ultimo = len(centros) - 1
+    for i, linha0 in enumerate(centros):
+        for j, coluna0 in enumerate(centros):
+            if (i, j) in ((0, 0), (0, ultimo), (ultimo, 0)):
+                continue
+            for dl in range(-2, 3):
+                for dc in range(-2, 3):
+                    marcar(linha0 + dl, coluna0 + dc, max(abs(dl), abs(dc)) != 1)
+
+    # Informação de formato (reservada aqui, desenhada por máscara abaixo) e módulo escuro
+    formato = (
+        [(i, 8) for i in range(6)] + [(7, 8), (8, 8), (8, 7)] + [(8, 14 - i) for i in range(9, 15)],
+        [(8, lado - 1 - i) for i in range(8)] + [(lado - 15 + i, 8) for i in range(8, 15)],
+    )
+    for copia in formato:
+        for linha, coluna in copia:
+            marcar(linha, coluna, 0)
+    marcar(lado - 8, 8, 1)
+
+    # Informação de versão (7+)
+    if versao >= 7:
+        informacao = _bch(versao, 6, 0x1F25)
+        for i in range(18):
+            a, b = lado - 11 + i % 3, i // 3
+            marcar(b, a, informacao >> i & 1)
+            marcar(a, b, informacao >> i & 1)
+
+    # Posições de dados em zigue-zague, de baixo para cima, de duas em duas colunas
+    posicoes = {}
+    direita = lado - 1
+    while direita >= 1:
+        if direita == 6:
+            direita = 5
+        subindo = (direita + 1) & 2 == 0
+        for passo in range(lado):
+            linha = lado - 1 - passo if subindo else passo
+            for coluna in (direita, direita - 1):
+                indice = linha * lado + coluna
+                if not fixo[indice]:
+                    posicoes[indice] = len(posicoes)
+        direita -= 2
+
+    # Cada módulo vem do bit de dados da sua posição ou, se fixo, do próprio molde
+    total = len(posicoes)
+    coletar = itemgetter(*(posicoes.get(indice, total + indice) for indice in range(lado * lado)))
+
+    moldes = []
+    mascaras = []
+    for numero, invertida in enumerate(MASCARAS):
+        formato_bits = _bch(NIVEL_M << 3 | numero, 5, 0x537) ^ 0x5412
+        for copia in formato:
+            for i, (linha, coluna) in enumerate(copia):
+                modulos[linha * lado + coluna] = formato_bits >> i & 1
+        moldes.append(bytes(modulos))
+        mascaras.append(int(''.join('1' if invertida(p // lado, p % lado) else '0' for p in posicoes), 2))
+    return tuple(moldes), coletar, tuple(mascaras), total, lado
+
+
+def penalidade(linhas):
+    """Penalidade de uma matriz pelas regras N1 a N4 da ISO/IEC 18004 (7.8.3)"""
+    lado = len(linhas)
+    pontos = 0
+    for linha in (*linhas, *(bytes(coluna) for coluna in zip(*linhas))):
+        # N1: 3 pontos por trecho de 5 módulos iguais, mais 1 por módulo a mais
+        pontos += sum(trecho.end() - trecho.start() - 2 for trecho in _TRECHOS.finditer(linha))
+        # N3: 40 por padrão parecido com localizador (a zona silenciosa conta como clara)
+        pontos += 40 * len(_LOCALIZADOR.findall(_CLARA + linha + _CLARA))
+
+    # N2: 3 por bloco 2x2 da mesma cor, com cada linha como inteiro
+    valores = [int(linha.translate(_DIGITOS), 2) for linha in linhas]
+    limite = (1 << lado - 1) - 1
+    for acima, abaixo in zip(valores, valores[1:]):
+        iguais = ~(acima ^ abaixo)
+        pontos += 3 * (iguais & iguais >> 1 & ~(acima ^ acima >> 1) & limite).bit_count()
+
+    # N4: 10 por cada 5% de desvio da proporção de escuros em relação a 50%
+    escuros = sum(linha.count(1) for linha in linhas)
+    pontos += 10 * (abs(escuros * 20 - lado * lado * 10) // (lado * lado))
+    return pontos
+
+
+def _palavras(conteudo, versao):
+    """Bytes de dados (modo, contagem, conteúdo, terminador e preenchimento) intercalados com os de correção"""
+    capacidade = _capacidade(versao)
+    contagem = _bits_contagem(versao)
+    bits = 4 + contagem + 8 * len(conteudo)
+    valor = (0b0100 << contagem | len(conteudo)) << 8 * len(conteudo) | int.from_bytes(conteudo, 'big')
+    # Terminador (até 4 zeros) e alinhamento ao byte
+    sobra = min(4, 8 * capacidade - bits)
+    valor <<= sobra
+    bits += sobra
+    valor <<= -bits % 8
+    bits += -bits % 8
+    dados = list(valor.to_bytes(bits // 8, 'big'))
+    dados.extend((0xEC, 0x11) * ((capacidade - len(dados)) // 2 + 1))
+    del dados[capacidade:]
+
+    grau, blocos1, dados1, blocos2, dados2 = BLOCOS_M[versao - 1]
+    blocos = []
+    inicio = 0
+    for tamanho in (dados1,) * blocos1 + (dados2,) * blocos2:
+        blocos.append(dados[inicio:inicio + tamanho])
+        inicio += tamanho
+    correcoes = [_correcao(bloco, grau) for bloco in blocos]
+
+    palavras = []
+    for i in range(max(dados1, dados2)):
+        palavras.extend(bloco[i] for bloco in blocos if i < len(bloco))
+    for i in range(grau):
+        palavras.extend(correcao[i] for correcao in correcoes)
+    return palavras
+
+
+def codificar(conteudo, versao=None, mascara=None):
+    """
+    Matriz do QR Code
+
+    Args:
+        conteudo: str (UTF-8) ou bytes
+        versao: Versão forçada (padrão: a menor que comporta o conteúdo)
+        mascara: Máscara forçada, 0 a 7 (padrão: a de menor penalidade)
+
+    Returns:
+        tuple: (linhas da matriz como bytes de 0/1, versão)
+    """
+    if isinstance(conteudo, str):
+        conteudo = conteudo.encode('utf-8')
+    versao = versao or escolher_versao(len(conteudo))
+    moldes, coletar, mascaras, posicoes, lado = _molde(versao)
+
+    palavras = _palavras(conteudo, versao)
+    # Bits restantes após os dados ficam claros antes da máscara
+    bits = int.from_bytes(bytes(palavras), 'big') << (posicoes - 8 * len(palavras))
+
+    melhor = None
+    for numero in range(len(MASCARAS)) if mascara is None else (mascara,):
+        dados = format(bits ^ mascaras[numero], f'0{posicoes}b').encode('ascii').translate(_BITS)
+        modulos = bytes(coletar(dados + moldes[numero]))
+        linhas = tuple(modulos[i:i + lado] for i in range(0, lado * lado, lado))
+        pontos = penalidade(linhas) if mascara is None else 0
+        # Empate fica com a máscara de menor número
+        if melhor is None or pontos < melhor[0]:
+            melhor = pontos, linhas
+    return melhor[1], versao
+
+
+def _padrao(conteudo):
+    linhas, _ = codificar(conteudo)
+    retangulos = ' '.join(
+        f'{trecho.start() + ZONA_SILENCIOSA} {numero + ZONA_SILENCIOSA} {trecho.end() - trecho.start()} 1 re'
+        for numero, linha in enumerate(linhas) for trecho in _ESCUROS.finditer(linha)
+    )
+    return retangulos, len(linhas) + 2 * ZONA_SILENCIOSA
+
+
+def padrao(conteudo):
+    """
+    Módulos escuros agrupados em trechos horizontais, com a zona silenciosa
+
+    Returns:
+        tuple: ('coluna linha comprimento 1 re ...' em módulos, a partir do
+                canto superior esquerdo; total de módulos por lado)
+    """
+    return recursos.codigos_barras.obter(('qrcode', conteudo), lambda: _padrao(conteudo))
+
+
+def desenhar_fpdf(pdf, conteudo, x, y, lado):
+    """Desenha o QR Code em (x, y) como um quadrado de `lado` (unidade do documento) num único bloco de retângulos"""
+    retangulos, total = padrao(conteudo)
+    k = pdf.k
+    modulo = lado * k / total
+    # Matriz que leva módulos (linha crescendo para baixo) ao espaço da página
+    pdf._out(f'q 0 g {modulo:.4f} 0 0 {-modulo:.4f} {x * k:.2f} {(pdf.h - y) * k:.2f} cm {retangulos} f Q')
+
+
+# Moldes das versões que as URLs de consulta da NFC-e costumam ocupar
+recursos.registrar('moldes_qr_code', lambda: [_molde(versao) for versao in range(6, 11)])
@@ -0,0 +1,629 @@
+"""
+Estágio de saída dos PDFs de DANFE
+Com settings.NFE_DANFE_OTIMIZAR (desligado por padrão até a saída ser
+conferida em outros leitores de PDF), o PDF que sai de
+danfe_backends.renderizar() passa por processar(): os objetos alcançáveis
+a partir das páginas são copiados (com o pdfminer) sem duplicatas, os streams são recomprimidos em Flate nível 9 (sem a camada
+ASCII85 do reportlab), fontes que nenhum texto seleciona saem dos recursos
+e os dicionários vão para um object stream com xref comprimida.
+
+No modo de arquivo (settings.NFE_DANFE_PDFA) o resultado segue o PDF/A-2b
+para a guarda legal de 5 anos: as fontes padrão do PDF, que não são
+embutidas, dão lugar a TrueType de métricas compatíveis com só os
+caracteres usados, e entram os metadados XMP e o perfil sRGB
+(OutputIntent).
+"""
+from django.conf import settings
+from django.utils import timezone
+from collections import defaultdict
+from functools import lru_cache
+from io import BytesIO
+from pdfminer.pdfparser import PDFParser
+from pdfminer.pdfdocument import PDFDocument
+from pdfminer.pdfpage import PDFPage
+from pdfminer.pdfinterp import PDFResourceManager, PDFPageInterpreter
+from pdfminer.pdfdevice import PDFDevice
+from pdfminer.pdftypes import PDFObjRef, PDFStream, PDFObjectNotFound, resolve1
+from pdfminer.psparser import PSLiteral, LIT
+from . import danfe_recursos as recursos
+from xml.sax.saxutils import escape
+import hashlib
+import logging
+import zlib
+import re
+import os
+
+logger = logging.getLogger(__name__)
+
+# Limites padrão (podem ser sobrescritos no settings.py)
+DEFAULT_OTIMIZAR = False
+DEFAULT_PDFA = False
+DEFAULT_FONTES_PDFA = {
+    'Helvetica': 'LiberationSans-Regular.ttf',
+    'Helvetica-Bold': 'LiberationSans-Bold.ttf',
+    'Helvetica-Oblique': 'LiberationSans-Italic.ttf',
+    'Helvetica-BoldOblique': 'LiberationSans-BoldItalic.ttf',
+    'Courier': 'LiberationMono-Regular.ttf',
+    'Courier-Bold': 'LiberationMono-Bold.ttf',
+    'Courier-Oblique': 'LiberationMono-Italic.ttf',
+    'Courier-BoldOblique': 'LiberationMono-BoldItalic.ttf',
+    'Times-Roman': 'LiberationSerif-Regular.ttf',
+    'Times-Bold': 'LiberationSerif-Bold.ttf',
+    'Times-Italic': 'LiberationSerif-Italic.ttf',
+    'Times-BoldItalic': 'LiberationSerif-BoldItalic.ttf',
+}
+DEFAULT_DIRETORIOS_FONTES = (
+    os.path.join(recursos.BASE_DIR, 'assets', 'fonts'),
+    '/usr/share/fonts/truetype/liberation',
+    '/usr/share/fonts/truetype/liberation2',
+    '/usr/share/fonts/liberation-sans',
+    '/usr/share/fonts/liberation-mono',
+    '/usr/share/fonts/liberation-serif',
+)
+
+# Objetos reservados nos PDFs escritos aqui
+CATALOGO = 1
+PAGINAS = 2
+
+# Caracteres que precisam de escape (#xx) em nomes PDF
+_DELIMITADORES = frozenset(b'#()<>[]{}/%')
+
+# Filtros que o pdfminer decodifica sem perda; streams só com eles são recomprimidos
+_FILTROS_RECOMPRIMIVEIS = frozenset(('FlateDecode', 'Fl', 'ASCII85Decode', 'A85', 'ASCIIHexDecode', 'AHx'))
+
+# Seleção de fonte nos fluxos de conteúdo: /F1 7 Tf
+_TF = re.compile(rb'/([^\s/\[\]()<>{}%]+)\s+[-+]?[\d.]+\s+Tf')
+
+_BINARIO = b'%\xe2\xe3\xcf\xd3\n'
+
+
+def get_otimizar():
+    """Passa os DANFEs pelo estágio de saída (settings.NFE_DANFE_OTIMIZAR)"""
+    return bool(getattr(settings, 'NFE_DANFE_OTIMIZAR', DEFAULT_OTIMIZAR))
+
+
+def get_pdfa():
+    """Gera os DANFEs em PDF/A-2b (settings.NFE_DANFE_PDFA)"""
+    return bool(getattr(settings, 'NFE_DANFE_PDFA', DEFAULT_PDFA))
+
+
+def get_fontes_pdfa():
+    """TrueType que substitui cada fonte padrão no PDF/A (settings.NFE_PDFA_FONTES)"""
+    return {**DEFAULT_FONTES_PDFA, **getattr(settings, 'NFE_PDFA_FONTES', {})}
+
+
+def get_diretorios_fontes():
+    """Onde procurar as fontes de nome relativo (settings.NFE_PDFA_DIRETORIOS_FONTES)"""
+    return tuple(getattr(settings, 'NFE_PDFA_DIRETORIOS_FONTES', DEFAULT_DIRETORIOS_FONTES))
+
+
+def modo():
+    """Modo do estágio de saída, que também entra no hash do DANFE: 'pdfa', 'compacto' ou 'original'"""
+    if get_pdfa():
+        return 'pdfa'
+    return 'compacto' if get_otimizar() else 'original'
+
+
+# ========== Serialização ==========
+
+def nome(valor):
+    if isinstance(valor, str):
+        valor = valor.encode('utf-8')
+    return b'/' + b''.join(
+        bytes((c,)) if 33 <= c <= 126 and c not in _DELIMITADORES else b'#%02X' % c for c in valor
+    )
+
+
+def numero(valor):
+    if isinstance(valor, int):
+        return str(valor).encode()
+    texto = f'{valor:.6f}'.rstrip('0').rstrip('.')
+    return (texto if texto not in ('', '-0') else '0').encode()
+
+
+class Referencia:
+    """Referência a um objeto do PDF de saída (não passa pela renumeração)"""
+
+    def __init__(self, numero):
+        self.numero = numero
+
+
+class Stream:
+    """Stream montado na saída, com os dados já codificados conforme os atributos"""
+
+    def __init__(self, atributos, dados):
+        self.atributos = atributos
+        self.dados = dados
+
+
+def serializar(obj, ref):
+    """
+    Bytes de um objeto PDF
+
+    Args:
+        obj: Objeto do pdfminer ou montado aqui (Referencia, Stream)
+        ref: Função objid de origem -> número do objeto na saída
+    """
+    if isinstance(obj, Referencia):
+        return b'%d 0 R' % obj.numero
+    if isinstance(obj, PDFObjRef):
+        return b'%d 0 R' % ref(obj.objid)
+    if isinstance(obj, PDFStream):
+        atributos = dict(obj.attrs)
+        dados = obj.rawdata
+        if dados is None:
+            # Já decodificado pelo pdfminer: grava sem filtro
+            dados = obj.data
+            atributos.pop('Filter', None)
+            atributos.pop('DecodeParms', None)
+        obj = Stream(atributos, dados)
+    if isinstance(obj, Stream):
+        atributos = {**obj.atributos, 'Length': len(obj.dados)}
+        return serializar(atributos, ref) + b'\nstream\n' + obj.dados + b'\nendstream'
+    if isinstance(obj, dict):
+        return b'<<' + b''.join(nome(k) + b' ' + serializar(v, ref) for k, v in obj.items()) + b'>>'
+    if isinstance(obj, list):
+        return b'[' + b' '.join(serializar(v, ref) for v in obj) + b']'
+    if isinstance(obj, PSLiteral):
+        return nome(obj.name)
+    if isinstance(obj, bool):
+        return b'true' if obj else b'false'
+    if isinstance(obj, (int, float)):
+        return numero(obj)
+    if isinstance(obj, bytes):
+        return b'<' + obj.hex().encode() + b'>'
+    if obj is None:
+        return b'null'
+    raise ValueError(f'Objeto PDF não suportado: {obj!r}')
+
+
+class Copiador:
+    """
+    Copia os objetos de um PDF de origem com nova numeração e sem duplicatas
+
+    Os filhos são serializados antes dos pais, então objetos iguais (mesmo
+    conteúdo e mesmos filhos) recebem o mesmo número, inclusive entre PDFs
+    diferentes quando `unicos` é compartilhado.
+
+    Args:
+        documento: PDFDocument de origem
+        novo: Função sem argumentos que devolve o próximo número livre
+        unicos: {resumo do objeto: número} já escritos (padrão: só deste PDF)
+        transformar: Função obj -> obj aplicada a cada objeto antes de serializar
+    """
+
+    def __init__(self, documento, novo, unicos=None, transformar=None):
+        self.documento = documento
+        self.novo = novo
+        self.unicos = {} if unicos is None else unicos
+        self.transformar = transformar
+        self.objetos = []
+        self.novos_resumos = []
+        self._mapa = {}
+        self._visitando = set()
+
+    def _registrar(self, corpo, stream, numero=None):
+        resumo = hashlib.blake2b(corpo, digest_size=16).digest()
+        if numero is None:
+            if resumo in self.unicos:
+                return self.unicos[resumo]
+            numero = self.novo()
+        if resumo not in self.unicos:
+            self.unicos[resumo] = numero
+            self.novos_resumos.append(resumo)
+        self.objetos.append((numero, corpo, stream))
+        return numero
+
+    def ref(self, objid):
+        """Número de saída do objeto de origem, copiando-o (e seus filhos) na primeira vez"""
+        if objid in self._mapa:
+            return self._mapa[objid]
+        if objid in self._visitando:
+            # Ciclo: o número sai agora e o objeto não entra na deduplicação
+            self._mapa[objid] = self.novo()
+            return self._mapa[objid]
+
+        self._visitando.add(objid)
+        try:
+            obj = self.documento.getobj(objid)
+        except PDFObjectNotFound:
+            obj = None
+        if self.transformar:
+            obj = self.transformar(obj)
+        corpo = serializar(obj, self.ref)
+        self._visitando.discard(objid)
+        self._mapa[objid] = self._registrar(corpo, isinstance(obj, (PDFStream, Stream)), self._mapa.get(objid))
+        return self._mapa[objid]
+
+    def emitir(self, obj):
+        """Número de um objeto montado na saída (Stream, dict...), reaproveitando um igual"""
+        return self._registrar(serializar(obj, self.ref), isinstance(obj, (PDFStream, Stream)))
+
+    def pagina(self, pagina, pai):
+        """Copia uma PDFPage como filha de `pai` (páginas nunca são deduplicadas)"""
+        # Atributos herdados (MediaBox, Resources...) já vêm resolvidos
+        atributos = {k: v for k, v in pagina.attrs.items() if k != 'Parent'}
+        atributos['Parent'] = Referencia(pai)
+        if self.transformar and 'Resources' in atributos:
+            atributos['Resources'] = self.transformar(resolve1(atributos['Resources']))
+        return self._registrar(serializar(atributos, self.ref), False, self.novo())
+
+
+def ler(conteudo):
+    """
+    PDFDocument do pdfminer para os bytes de um PDF
+
+    Raises:
+        ValueError: PDF criptografado
+    """
+    documento = PDFDocument(PDFParser(BytesIO(conteudo)))
+    if documento.encryption:
+        raise ValueError('PDF criptografado não pode ser reescrito')
+    return documento
+
+
+# ========== Compactação ==========
+
+def _nome_filtros(atributos):
+    filtros = resolve1(atributos.get('Filter'))
+    if filtros is None:
+        return []
+    if not isinstance(filtros, list):
+        filtros = [filtros]
+    return [getattr(resolve1(filtro), 'name', filtro) for filtro in filtros]
+
+
+def _decodificar(stream):
+    """Dados decodificados sem perder o rawdata do stream (o get_data() do pdfminer o descarta)"""
+    if stream.rawdata is None:
+        return stream.data
+    return PDFStream(stream.attrs, stream.rawdata, stream.decipher).get_data()
+
+
+def _recomprimir(stream):
+    """Stream em Flate nível 9; imagens (DCT, JPX...) e streams com DecodeParms ficam como estão"""
+    atributos = dict(stream.attrs)
+    original = stream.rawdata
+    if original is None:
+        # Já decodificado: os filtros de origem não valem mais para stream.data
+        filtros = []
+        atributos.pop('Filter', None)
+        atributos.pop('DecodeParms', None)
+        original = stream.data
+    else:
+        filtros = _nome_filtros(atributos)
+        if 'DecodeParms' in atributos or 'DP' in atributos or not set(filtros) <= _FILTROS_RECOMPRIMIVEIS:
+            return Stream(atributos, original)
+
+    dados = zlib.compress(_decodificar(stream), 9)
+    if filtros == ['FlateDecode'] and len(original) <= len(dados):
+        return Stream(atributos, original)
+    atributos['Filter'] = LIT('FlateDecode')
+    return Stream(atributos, dados)
+
+
+def _fontes_usadas(documento, paginas):
+    """Nomes de recurso de fonte selecionados com Tf em algum fluxo de conteúdo (páginas e formulários)"""
+    fluxos = []
+    for pagina in paginas:
+        conteudo = resolve1(pagina.attrs.get('Contents'))
+        fluxos.extend(conteudo if isinstance(conteudo, list) else [conteudo])
+    for xref in documento.xrefs:
+        for objid in xref.get_objids():
+            try:
+                obj = documento.getobj(objid)
+            except PDFObjectNotFound:
+                continue
+            if isinstance(obj, PDFStream) and getattr(resolve1(obj.attrs.get('Subtype')), 'name', None) == 'Form':
+                fluxos.append(obj)
+
+    usadas = set()
+    for fluxo in fluxos:
+        fluxo = resolve1(fluxo)
+        if isinstance(fluxo, PDFStream):
+            usadas.update(recurso.decode('latin-1') for recurso in _TF.findall(_decodificar(fluxo)))
+    return usadas
+
+
+class _Transformacao:
+    """Ajustes aplicados a cada objeto copiado por otimizar()"""
+
+    def __init__(self, fontes_usadas, fontes_pdfa=None):
+        self.fontes_usadas = fontes_usadas
+        self.fontes_pdfa = fontes_pdfa
+
+    def _recursos(self, recursos_pdf):
+        recursos_pdf = dict(resolve1(recursos_pdf))
+        if 'Font' in recursos_pdf:
+            fontes = resolve1(recursos_pdf['Font'])
+            recursos_pdf['Font'] = {k: v for k, v in fontes.items() if k in self.fontes_usadas}
+        return recursos_pdf
+
+    def __call__(self, obj):
+        if isinstance(obj, PDFStream):
+            stream = _recomprimir(obj)
+            if 'Resources' in stream.atributos:
+                stream.atributos['Resources'] = self._recursos(stream.atributos['Resources'])
+            for chave in ('Interpolate', 'OPI', 'Alternates') if self.fontes_pdfa else ():
+                stream.atributos.pop(chave, None)
+            return stream
+        if isinstance(obj, dict):
+            if 'Font' in obj:
+                return self._recursos(obj)
+            if self.fontes_pdfa and getattr(resolve1(obj.get('Type')), 'name', None) == 'Font':
+                return self.fontes_pdfa.substituir(obj)
+        return obj
+
+
+# ========== PDF/A-2b ==========
+
+class _Caracteres(PDFDevice):
+    """Códigos de caractere mostrados com cada fonte (BaseFont)"""
+
+    def __init__(self, rsrcmgr):
+        super().__init__(rsrcmgr)
+        self.usados = defaultdict(set)
+
+    def render_string(self, textstate, seq, ncs, graphicstate):
+        codigos = self.usados[getattr(textstate.font, 'basefont', None)]
+        for item in seq:
+            if isinstance(item, bytes):
+                codigos.update(item)
+
+
+def _caracteres(paginas):
+    gerenciador = PDFResourceManager(caching=True)
+    dispositivo = _Caracteres(gerenciador)
+    interpretador = PDFPageInterpreter(gerenciador, dispositivo)
+    for pagina in paginas:
+        interpretador.process_page(pagina)
+    return dispositivo.usados
+
+
+def _caminho_fonte(base):
+    arquivo = get_fontes_pdfa().get(base)
+    if not arquivo:
+        raise ValueError(f"Fonte '{base}' sem substituta para PDF/A (settings.NFE_PDFA_FONTES)")
+    for diretorio in ('',) + get_diretorios_fontes():
+        caminho = os.path.join(diretorio, arquivo)
+        if os.path.isfile(caminho):
+            return caminho
+    raise ValueError(f"Arquivo da fonte '{arquivo}' para PDF/A não encontrado (settings.NFE_PDFA_DIRETORIOS_FONTES)")
+
+
+@lru_cache(maxsize=32)
+def _ler_fonte(caminho):
+    with open(caminho, 'rb') as arquivo:
+        return arquivo.read()
+
+
+def _perfil_srgb():
+    from PIL import ImageCms
+
+    return ImageCms.ImageCmsProfile(ImageCms.createProfile('sRGB')).tobytes()
+
+
+recursos.registrar('perfil_srgb', _perfil_srgb)
+
+
+class _FontesPDFA:
+    """Troca as fontes padrão (Type1 não embutidas) por TrueType embutidas e reduzidas"""
+
+    def __init__(self, caracteres, copiador=None):
+        self.caracteres = caracteres
+        self.copiador = copiador
+        self._trocadas = {}
+
+    def substituir(self, fonte):
+        if 'FontDescriptor' in fonte or getattr(resolve1(fonte.get('Subtype')), 'name', None) != 'Type1':
+            return fonte  # já embutida
+        base = getattr(resolve1(fonte.get('BaseFont')), 'name', None)
+        codificacao = getattr(resolve1(fonte.get('Encoding')), 'name', None)
+        if codificacao != 'WinAnsiEncoding':
+            raise ValueError(f"Fonte '{base}' sem WinAnsiEncoding não pode ser embutida no PDF/A")
+        if base not in self._trocadas:
+            self._trocadas[base] = self._embutir(base, self.caracteres.get(base) or {32})
+        return self._trocadas[base]
+
+    def _embutir(self, base, codigos):
+        from fontTools.ttLib import TTFont
+        from fontTools import subset
+
+        fonte = TTFont(BytesIO(_ler_fonte(_caminho_fonte(base))))
+        mapa = fonte.getBestCmap()
+        caracteres = {}
+        for codigo in codigos:
+            try:
+                caracteres[codigo] = bytes((codigo,)).decode('cp1252')
+            except UnicodeDecodeError:
+                continue
+        faltando = ''.join(c for c in caracteres.values() if ord(c) not in mapa)
+        if faltando:
+            raise ValueError(f"Fonte de '{base}' para PDF/A sem os caracteres {faltando!r}")
+
+        escala = 1000 / fonte['head'].unitsPerEm
+        primeiro, ultimo = min(caracteres), max(caracteres)
+        larguras = [
+            round(fonte['hmtx'][mapa[ord(caracteres[codigo])]][0] * escala) if codigo in caracteres else 0
+            for codigo in range(primeiro, ultimo + 1)
+        ]
+        postscript = (fonte['name'].getDebugName(6) or base).replace(' ', '')
+        os2 = fonte['OS/2']
+        cabecalho = fonte['head']
+        descritor = {
+            'Type': LIT('FontDescriptor'),
+            'Flags': 32 | (1 if fonte['post'].isFixedPitch else 0) | (64 if fonte['post'].italicAngle else 0),
+            'FontBBox': [round(v * escala) for v in (cabecalho.xMin, cabecalho.yMin, cabecalho.xMax, cabecalho.yMax)],
+            'ItalicAngle': float(fonte['post'].italicAngle),
+            'Ascent': round(os2.sTypoAscender * escala),
+            'Descent': round(os2.sTypoDescender * escala),
+            'CapHeight': round(getattr(os2, 'sCapHeight', os2.sTypoAscender) * escala),
+            'StemV': 80,
+        }
+
+        opcoes = subset.Options()
+        opcoes.layout_features = []
+        opcoes.hinting = False
+        opcoes.name_IDs = []
+        opcoes.notdef_outline = True
+        redutor = subset.Subsetter(opcoes)
+        redutor.populate(unicodes=[ord(c) for c in caracteres.values()])
+        redutor.subset(fonte)
+        saida = BytesIO()
+        fonte.save(saida)
+        dados = saida.getvalue()
+
+        # Prefixo de subconjunto: 6 letras maiúsculas derivadas do conteúdo
+        resumo = hashlib.sha1(dados).digest()
+        prefixo = ''.join(chr(65 + b % 26) for b in resumo[:6])
+        nome_fonte = LIT(f'{prefixo}+{postscript}')
+
+        arquivo = self.copiador.emitir(Stream({'Length1': len(dados), 'Filter': LIT('FlateDecode')}, zlib.compress(dados, 9)))
+        descritor = self.copiador.emitir({'FontName': nome_fonte, **descritor, 'FontFile2': Referencia(arquivo)})
+        return {
+            'Type': LIT('Font'), 'Subtype': LIT('TrueType'), 'BaseFont': nome_fonte,
+            'FirstChar': primeiro, 'LastChar': ultimo, 'Widths': larguras,
+            'Encoding': LIT('WinAnsiEncoding'), 'FontDescriptor': Referencia(descritor),
+        }
+
+
+def _xmp(titulo, data):
+    data = data.isoformat(timespec='seconds')
+    titulo = escape(titulo or '')
+    return (
+        '<?xpacket begin="﻿" id="W5M0MpCehiHzreSzNTczkc9d"?>\n'
+        '<x:xmpmeta xmlns:x="adobe:ns:meta/"><rdf:RDF xmlns:rdf="http://www.w3.org/1999/02/22-rdf-syntax-ns#">\n'
+        '<rdf:Description rdf:about="" xmlns:pdfaid="http://www.aiim.org/pdfa/ns/id/">'
+        '<pdfaid:part>2</pdfaid:part><pdfaid:conformance>B</pdfaid:conformance></rdf:Description>\n'
+        '<rdf:Description rdf:about="" xmlns:dc="http://purl.org/dc/elements/1.1/">'
+        f'<dc:title><rdf:Alt><rdf:li xml:lang="x-default">{titulo}</rdf:li></rdf:Alt></dc:title></rdf:Description>\n'
+        '<rdf:Description rdf:about="" xmlns:xmp="http://ns.adobe.com/xap/1.0/">'
+        f'<xmp:CreateDate>{data}</xmp:CreateDate><xmp:ModifyDate>{data}</xmp:ModifyDate></rdf:Description>\n'
+        '</rdf:RDF></x:xmpmeta>\n'
+        '<?xpacket end="w"?>'
+    ).encode('utf-8')
+
+
+# ========== Escrita ==========
+
+def _escrever(objetos, catalogo):
+    """
+    PDF 1.7 com os objetos que não são streams num object stream e xref comprimida
+
+    Args:
+        objetos: [(número, corpo, é stream)], números 3..N sem lacunas
+        catalogo: Corpo do catálogo (objeto 1); as páginas (2) estão em objetos
+    """
+    objetos = sorted([(CATALOGO, catalogo, False), *objetos])
+    total = len(objetos) + 1
+    numero_pacote, numero_xref = total, total + 1
+
+    # Object stream: "número deslocamento ..." seguido dos corpos
+    soltos = [(n, corpo) for n, corpo, stream in objetos if not stream]
+    indices = {}
+    cabecalho = []
+    corpos = []
+    posicao = 0
+    for indice, (n, corpo) in enumerate(soltos):
+        indices[n] = indice
+        cabecalho.append(b'%d %d' % (n, posicao))
+        corpos.append(corpo)
+        posicao += len(corpo) + 1
+    cabecalho = b' '.join(cabecalho) + b'\n'
+    pacote = zlib.compress(cabecalho + b'\n'.join(corpos) + b'\n', 9)
+
+    partes = [b'%PDF-1.7\n' + _BINARIO]
+    posicao = len(partes[0])
+    deslocamentos = {}
+
+    def objeto(n, corpo):
+        nonlocal posicao
+        deslocamentos[n] = posicao
+        dados = b'%d 0 obj\n' % n + corpo + b'\nendobj\n'
+        partes.append(dados)
+        posicao += len(dados)
+
+    for n, corpo, stream in objetos:
+        if stream:
+            objeto(n, corpo)
+    objeto(numero_pacote, serializar(Stream({
+        'Type': LIT('ObjStm'), 'N': len(soltos), 'First': len(cabecalho), 'Filter': LIT('FlateDecode'),
+    }, pacote), None))
+
+    inicio_xref = posicao
+    tamanho = numero_xref + 1
+    largura = max(1, (max(inicio_xref, numero_pacote).bit_length() + 7) // 8)
+    entradas = [b'\x00' + bytes(largura) + b'\xff\xff']
+    deslocamentos[numero_xref] = inicio_xref
+    for n in range(1, tamanho):
+        if n in indices:
+            entradas.append(b'\x02' + numero_pacote.to_bytes(largura, 'big') + indices[n].to_bytes(2, 'big'))
+        else:
+            entradas.append(b'\x01' + deslocamentos[n].to_bytes(largura, 'big') + b'\x00\x00')
+    identificador = hashlib.md5(b''.join(corpos)).digest()
+    objeto(numero_xref, serializar(Stream({
+        'Type': LIT('XRef'), 'Size': tamanho, 'W': [1, largura, 2], 'Root': Referencia(CATALOGO),
+        'ID': [identificador, identificador], 'Filter': LIT('FlateDecode'),
+    }, zlib.compress(b''.join(entradas), 9)), None))
+    partes.append(b'startxref\n%d\n%%%%EOF\n' % inicio_xref)
+    return b''.join(partes)
+
+
+def otimizar(conteudo, arquivo=False, titulo=None):
+    """
+    Reescreve um PDF compacto e, se pedido, em PDF/A-2b
+
+    Args:
+        conteudo: Bytes do PDF gerado
+        arquivo: Gera PDF/A-2b (fontes embutidas, XMP e OutputIntent sRGB)
+        titulo: Título gravado nos metadados XMP do PDF/A
+
+    Returns:
+        bytes: PDF
+
+    Raises:
+        ValueError: PDF criptografado ou, no PDF/A, fonte sem substituta
+    """
+    documento = ler(conteudo)
+    paginas = list(PDFPage.create_pages(documento))
+    proximo = iter(range(PAGINAS + 1, 1 << 31))
+
+    fontes_pdfa = _FontesPDFA(_caracteres(paginas)) if arquivo else None
+    copiador = Copiador(documento, proximo.__next__, transformar=_Transformacao(_fontes_usadas(documento, paginas), fontes_pdfa))
+    if fontes_pdfa:
+        fontes_pdfa.copiador = copiador
+
+    filhas = [copiador.pagina(pagina, PAGINAS) for pagina in paginas]
+    copiador.objetos.append((PAGINAS, serializar({
+        'Type': LIT('Pages'), 'Kids': [Referencia(n) for n in filhas], 'Count': len(filhas),
+    }, None), False))
+
+    catalogo = {'Type': LIT('Catalog'), 'Pages': Referencia(PAGINAS)}
+    if arquivo:
+        perfil = copiador.emitir(Stream({'N': 3, 'Filter': LIT('FlateDecode')}, zlib.compress(recursos.obter('perfil_srgb'), 9)))
+        catalogo['Metadata'] = Referencia(copiador.emitir(
+            Stream({'Type': LIT('Metadata'), 'Subtype': LIT('XML')}, _xmp(titulo, timezone.now()))
+        ))
+        catalogo['OutputIntents'] = [{
+            'Type': LIT('OutputIntent'), 'S': LIT('GTS_PDFA1'),
+            'OutputConditionIdentifier': b'sRGB IEC61966-2.1', 'DestOutputProfile': Referencia(perfil),
+        }]
+    return _escrever(copiador.objetos, serializar(catalogo, None))
+
+
+def processar(conteudo, titulo=None):
+    """
+    Estágio de saída conforme o settings (chamado por danfe_backends.renderizar)
+
+    Sem NFE_DANFE_OTIMIZAR nem NFE_DANFE_PDFA devolve o PDF como veio; se a
+    compactação falhar, o original é mantido. Falhas no PDF/A são propagadas.
+    """
+    if get_pdfa():
+        return otimizar(conteudo, arquivo=True, titulo=titulo)
+    if not get_otimizar():
+        return conteudo
+    try:
+        return otimizar(conteudo)
+    except Exception as e:
+        logger.warning(f"PDF mantido sem compactação: {str(e)}")
+        return conteudo
@@ -0,0 +1,303 @@
+"""
+Transporte assíncrono (asyncio) para os web services da SEFAZ
+Mantém, por endpoint (host/porta de cada UF em SefazConfig), um pool de
+conexões HTTP/1.1 keep-alive com TLS mútuo (certificado A1), com limite de
+chamadas simultâneas e timeout. As conexões vivem em um event loop próprio
+do processo, então a negociação TLS é paga uma vez e reaproveitada entre
+requisições do Django.
+"""
+from collections import deque
+from urllib.parse import urlsplit
+from django.conf import settings
+import threading
+import asyncio
+import logging
+import time
+import ssl
+import os
+
+logger = logging.getLogger(__name__)
+
+# Limites padrão (podem ser sobrescritos no settings.py)
+DEFAULT_MAX_CONEXOES = 4
+DEFAULT_KEEPALIVE = 30
+
+
+class ConexaoEncerrada(ConnectionError):
+    """
+    O servidor fechou a conexão durante a troca
+
+    `enviada` indica se a requisição já tinha saído inteira: nesse caso a
+    SEFAZ pode tê-la processado e ela não é repetida.
+    """
+
+    def __init__(self, mensagem, enviada):
+        super().__init__(mensagem)
+        self.enviada = enviada
+
+
+def get_max_conexoes():
+    """Chamadas simultâneas por endpoint (settings.NFE_SEFAZ_MAX_CONEXOES)"""
+    return int(getattr(settings, 'NFE_SEFAZ_MAX_CONEXOES', DEFAULT_MAX_CONEXOES))
+
+
+def get_keepalive():
+    """Segundos que uma conexão ociosa é mantida (settings.NFE_SEFAZ_KEEPALIVE)"""
+    return float(getattr(settings, 'NFE_SEFAZ_KEEPALIVE', DEFAULT_KEEPALIVE))
+
+
+def criar_contexto_ssl(certificado=None, ca_bundle=None):
+    """
+    Contexto TLS do cliente
+
+    Args:
+        certificado: CertificadoA1 (nfe_signer) para TLS mútuo ou None
+        ca_bundle: Caminho da cadeia ICP-Brasil, None (CAs do sistema) ou
+                   False (sem verificação do servidor - apenas testes)
+    """
+    contexto = ssl.create_default_context(cafile=ca_bundle or None)
+    if ca_bundle is False:
+        contexto.check_hostname = False
+        contexto.verify_mode = ssl.CERT_NONE
+    if certificado:
+        certificado.carregar_em(contexto)
+    return contexto
+
+
+class PoolEndpoint:
+    """Conexões keep-alive para um único host:porta"""
+
+    def __init__(self, host, porta, contexto_ssl=None, limite=None, keepalive=None):
+        self.host = host
+        self.porta = porta
+        self.contexto_ssl = contexto_ssl
+        self.limite = limite or get_max_conexoes()
+        self.keepalive = get_keepalive() if keepalive is None else keepalive
+        self.conexoes_abertas = 0
+        self.requisicoes = 0
+        self._semaforo = asyncio.Semaphore(self.limite)
+        self._ociosas = deque()
+
+    async def _abrir(self):
+        reader, writer = await asyncio.open_connection(
+            self.host, self.porta, ssl=self.contexto_ssl,
+            server_hostname=self.host if self.contexto_ssl else None,
+        )
+        self.conexoes_abertas += 1
+        return reader, writer
+
+    def _fechar(self, conexao):
+        conexao[1].close()
+
+    def _pegar_ociosa(self):
+        """Conexão ociosa ainda dentro do keep-alive, descartando as vencidas e as fechadas pelo servidor"""
+        agora = time.monotonic()
+        while self._ociosas:
+            conexao, usada_em = self._ociosas.pop()
+            if agora - usada_em < self.keepalive and not conexao[1].is_closing() and not conexao[0].at_eof():
+                return conexao
+            self._fechar(conexao)
+        return None
+
+    async def _trocar(self, conexao, caminho, corpo, cabecalhos):
+        reader, writer = conexao
+        requisicao = (
+            f'POST {caminho} HTTP/1.1\r\n'
+            f'Host: {self.host}:{self.porta}\r\n'
+            f'Content-Length: {len(corpo)}\r\n'
+            'Connection: keep-alive\r\n'
+            + ''.join(f'{nome}: {valor}\r\n' for nome, valor in cabecalhos.items())
+            + '\r\n'
+        )
+        try:
+            writer.write(requisicao.encode('latin-1') + corpo)
+            await writer.drain()
+        except (BrokenPipeError, ConnectionResetError) as e:
+            raise ConexaoEncerrada(str(e), enviada=False)
+        try:
+            linha = await reader.readline()
+        except (BrokenPipeError, ConnectionResetError) as e:
+            raise ConexaoEncerrada(str(e), enviada=True)
+        if not linha:
+            raise ConexaoEncerrada('Conexão encerrada pelo servidor', enviada=True)
+
+        versao, codigo = linha.decode('latin-1').split(' ', 2)[:2]
+        resposta_cabecalhos = {}
+        while True:
+            linha = await reader.readline()
+            if linha in (b'\r\n', b'\n', b''):
+                break
+            nome, _, valor = linha.decode('latin-1').partition(':')
+            resposta_cabecalhos[nome.strip().lower()] = valor.strip()
+
+        manter = versao == 'HTTP/1.1' and resposta_cabecalhos.get('connection', '').lower() != 'close'
+        if resposta_cabecalhos.get('transfer-encoding', '').lower() == 'chunked':
+            conteudo = await self._ler_chunked(reader)
+        elif 'content-length' in resposta_cabecalhos:
+            conteudo = await reader.readexactly(int(resposta_cabecalhos['content-length']))
+        else:
+            conteudo, manter = await reader.read(), False
+
+        return int(codigo), conteudo, manter
+
+    async def _ler_chunked(self, reader):
+        partes = []
+        while True:
+            tamanho = int((await reader.readline()).split(b';')[0].strip() or b'0', 16)
+            if not tamanho:
+                await reader.readline()
+                return b''.join(partes)
+            partes.append(await reader.readexactly(tamanho))
+            await reader.readline()
+
+    async def post(self, caminho, corpo, cabecalhos=None, timeout=None):
+        """
+        POST com reaproveitamento de conexão
+
+        Returns:
+            tuple: (status HTTP, bytes da resposta)
+        """
+        from .sefaz_integration import get_timeout
+
+        timeout = timeout or get_timeout()
+        async with self._semaforo:
+            self.requisicoes += 1
+            for tentativa in range(2):
+                conexao = self._pegar_ociosa()
+                reaproveitada = conexao is not None
+                try:
+                    if conexao is None:
+                        conexao = await asyncio.wait_for(self._abrir(), timeout)
+                    codigo, conteudo, manter = await asyncio.wait_for(
+                        self._trocar(conexao, caminho, corpo, cabecalhos or {}), timeout
+                    )
+                except ConexaoEncerrada as e:
+                    self._fechar(conexao)
+                    # Keep-alive expirado do lado do servidor antes do envio: tenta uma vez em
+                    # conexão nova. Depois do envio não repete (autorização e eventos não são idempotentes)
+                    if reaproveitada and tentativa == 0 and not e.enviada:
+                        continue
+                    raise
+                except asyncio.TimeoutError:
+                    if conexao is not None:
+                        self._fechar(conexao)
+                    raise TimeoutError(f'SEFAZ {self.host} não respondeu em {timeout:.0f}s')
+                except BaseException:
+                    if conexao is not None:
+                        self._fechar(conexao)
+                    raise
+
+                if manter and self.keepalive > 0:
+                    self._ociosas.append((conexao, time.monotonic()))
+                else:
+                    self._fechar(conexao)
+                return codigo, conteudo
+
+    async def fechar(self):
+        while self._ociosas:
+            self._fechar(self._ociosas.pop()[0])
+
+
+class SefazTransporte:
+    """Pools de conexão por endpoint, criados sob demanda"""
+
+    def __init__(self):
+        self._pools = {}
+        self._contextos = {}
+
+    def _contexto_ssl(self):
+        from .nfe_signer import assinatura_disponivel, carregar_certificado
+
+        certificado = carregar_certificado() if assinatura_disponivel() else None
+        ca_bundle = getattr(settings, 'NFE_SEFAZ_CA_BUNDLE', None)
+        # Pela impressão digital: o mesmo certificado recarregado reaproveita o contexto
+        chave = (certificado.impressao_digital if certificado else None, ca_bundle)
+        if chave not in self._contextos:
+            self._contextos[chave] = criar_contexto_ssl(certificado, ca_bundle)
+        return chave, self._contextos[chave]
+
+    def pool(self, url):
+        """Pool do endpoint da URL (um por esquema/host/porta/certificado)"""
+        partes = urlsplit(url)
+        https = partes.scheme == 'https'
+        chave_contexto, contexto = self._contexto_ssl() if https else (None, None)
+        chave = (partes.scheme, partes.hostname, partes.port or (443 if https else 80), chave_contexto)
+        if chave not in self._pools:
+            self._pools[chave] = PoolEndpoint(chave[1], chave[2], contexto)
+        return self._pools[chave]
+
+    async def post(self, url, corpo, cabecalhos=None, timeout=None):
+        partes = urlsplit(url)
+        caminho = (partes.path or '/') + (f'?{partes.query}' if partes.query else '')
+        return await self.pool(url).post(caminho, corpo, cabecalhos, timeout)
+
+    def estatisticas(self):
+        """{'host:porta': {'conexoes_abertas': 1, 'requisicoes': 40}}"""
+        return {
+            f'{pool.host}:{pool.porta}': {'conexoes_abertas': pool.conexoes_abertas, 'requisicoes': pool.requisicoes}
+            for pool in self._pools.values()
+        }
+
+    async def fechar(self):
+        for pool in self._pools.values():
+            await pool.fechar()
+        self._pools.clear()
+        self._contextos.clear()
+
+
+# ========== Event loop compartilhado do processo ==========
+
+_loop = None
+_transporte = None
+_estado_lock = threading.Lock()
+
+
+def _reiniciar_apos_fork():
+    """Processos filhos (pool de emissão) não herdam a thread do event loop"""
+    global _loop, _transporte, _estado_lock
+    _loop, _transporte, _estado_lock = None, None, threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reiniciar_apos_fork)
+
+
+def _loop_compartilhado():
+    global _loop
+    with _estado_lock:
+        if _loop is None:
+            loop = asyncio.new_event_loop()
+            threading.Thread(target=loop.run_forever, name='sefaz-transporte', daemon=True).start()
+            _loop = loop
+        return _loop
+
+
+def get_transporte():
+    """Transporte do processo (usar apenas dentro de executar())"""
+    global _transporte
+    if _transporte is None:
+        _transporte = SefazTransporte()
+    return _transporte
+
+
+def executar(coro):
+    """
+    Executa uma corrotina no event loop compartilhado e aguarda o resultado
+
+    Permite que código síncrono (views, comandos) use as conexões mantidas
+    pelo transporte.
+    """
+    return asyncio.run_coroutine_threadsafe(coro, _loop_compartilhado()).result()
+
+
+def agendar(coro):
+    """Agenda uma corrotina no event loop compartilhado sem aguardar (tarefas de fundo)"""
+    return asyncio.run_coroutine_threadsafe(coro, _loop_compartilhado())
+
+
+def fechar_conexoes():
+    """Fecha as conexões ociosas e descarta os pools (testes, troca de certificado)"""
+    global _transporte
+    if _transporte is not None and _loop is not None:
+        transporte, _transporte = _transporte, None
+        executar(transporte.fechar())
@@ -0,0 +1,245 @@
+"""
+Contingência da autorização de NF-e (SVC-AN / SVC-RS)
+Mantém, por autorizador (UF ou SVC) e ambiente, um circuit breaker que abre
+após falhas seguidas e faz as chamadas falharem na hora, e um cache do
+status do serviço (NFeStatusServico4) renovado em segundo plano. Com os dois
+decide se um lote vai para a SEFAZ da UF ou para a SEFAZ Virtual de
+Contingência.
+"""
+from django.conf import settings
+import threading
+import logging
+import time
+import os
+
+logger = logging.getLogger(__name__)
+
+# Limites padrão (podem ser sobrescritos no settings.py)
+DEFAULT_FALHAS = 5
+DEFAULT_ESPERA = 60
+DEFAULT_STATUS_TTL = 300
+
+# cStat de serviço paralisado (momentaneamente / sem previsão de retorno)
+CODIGOS_PARALISADO = ('108', '109')
+
+
+class CircuitoAberto(ConnectionError):
+    """Autorizador com falhas seguidas: chamada recusada sem ir à rede"""
+
+
+def get_limite_falhas():
+    """Falhas seguidas que abrem o circuito (settings.NFE_SEFAZ_CB_FALHAS)"""
+    return int(getattr(settings, 'NFE_SEFAZ_CB_FALHAS', DEFAULT_FALHAS))
+
+
+def get_espera():
+    """Segundos com o circuito aberto antes de testar de novo (settings.NFE_SEFAZ_CB_ESPERA)"""
+    return float(getattr(settings, 'NFE_SEFAZ_CB_ESPERA', DEFAULT_ESPERA))
+
+
+def get_status_ttl():
+    """Validade do status do serviço em cache (settings.NFE_SEFAZ_STATUS_TTL; 0 = não consulta)"""
+    return float(getattr(settings, 'NFE_SEFAZ_STATUS_TTL', DEFAULT_STATUS_TTL))
+
+
+class CircuitBreaker:
+    """
+    Circuit breaker de um autorizador
+
+    fechado: chamadas liberadas; `limite_falhas` falhas seguidas abrem o circuito
+    aberto: chamadas recusadas com CircuitoAberto durante `espera` segundos
+    meio_aberto: passada a espera, uma única chamada de teste é liberada;
+                 sucesso fecha o circuito, falha reabre
+    """
+
+    FECHADO = 'fechado'
+    ABERTO = 'aberto'
+    MEIO_ABERTO = 'meio_aberto'
+
+    def __init__(self, nome, limite_falhas=None, espera=None):
+        self.nome = nome
+        self.limite_falhas = limite_falhas or get_limite_falhas()
+        self.espera = get_espera() if espera is None else espera
+        self.estado = self.FECHADO
+        self.falhas = 0
+        self.aberto_em = None
+        self._testando = False
+        self._lock = threading.Lock()
+
+    def _espera_vencida(self):
+        return time.monotonic() - self.aberto_em >= self.espera
+
+    def disponivel(self):
+        """Indica se uma chamada seria liberada agora (sem alterar o estado)"""
+        with self._lock:
+            if self.estado == self.FECHADO:
+                return True
+            if self.estado == self.ABERTO:
+                return self._espera_vencida()
+            return not self._testando
+
+    def verificar(self):
+        """Libera a chamada ou levanta CircuitoAberto"""
+        with self._lock:
+            if self.estado == self.ABERTO and self._espera_vencida():
+                self.estado = self.MEIO_ABERTO
+                self._testando = False
+
+            if self.estado == self.MEIO_ABERTO:
+                if self._testando:
+                    raise CircuitoAberto(f'{self.nome}: aguardando a chamada de teste')
+                self._testando = True
+            elif self.estado == self.ABERTO:
+                restante = self.espera - (time.monotonic() - self.aberto_em)
+                raise CircuitoAberto(
+                    f'{self.nome} indisponível após {self.falhas} falhas seguidas; '
+                    f'nova tentativa em {max(restante, 0):.0f}s'
+                )
+
+    def registrar_sucesso(self):
+        with self._lock:
+            if self.estado != self.FECHADO:
+                logger.info(f"Circuito {self.nome} fechado: autorizador respondendo")
+            self.estado = self.FECHADO
+            self.falhas = 0
+            self._testando = False
+
+    def registrar_falha(self):
+        with self._lock:
+            self.falhas += 1
+            self._testando = False
+            if self.estado == self.MEIO_ABERTO or (self.estado == self.FECHADO and self.falhas >= self.limite_falhas):
+                logger.warning(f"Circuito {self.nome} aberto após {self.falhas} falhas seguidas")
+                self.estado = self.ABERTO
+                self.aberto_em = time.monotonic()
+
+    def resumo(self):
+        """{'estado': 'aberto', 'falhas': 5}"""
+        with self._lock:
+            return {'estado': self.estado, 'falhas': self.falhas}
+
+
+# ========== Estado do processo ==========
+
+_circuitos = {}
+_status = {}
+_atualizando = set()
+_lock = threading.Lock()
+
+
+def _reiniciar_apos_fork():
+    """Processos filhos começam com circuitos fechados e sem cache"""
+    global _circuitos, _status, _atualizando, _lock
+    _circuitos, _status, _atualizando, _lock = {}, {}, set(), threading.Lock()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reiniciar_apos_fork)
+
+
+def get_circuito(autorizador, ambiente='homologacao'):
+    """Circuit breaker do autorizador (sigla da UF, 'SVC-AN' ou 'SVC-RS') no ambiente"""
+    chave = (autorizador, ambiente)
+    with _lock:
+        if chave not in _circuitos:
+            _circuitos[chave] = CircuitBreaker(f'SEFAZ {autorizador} ({ambiente})')
+        return _circuitos[chave]
+
+
+def limpar():
+    """Fecha todos os circuitos e descarta o status em cache (testes)"""
+    with _lock:
+        _circuitos.clear()
+        _status.clear()
+        _atualizando.clear()
+
+
+# ========== Status do serviço em cache ==========
+
+async def _aconsultar_status(uf, ambiente, contingencia):
+    from .sefaz_integration import SefazIntegration
+
+    try:
+        resultado = await SefazIntegration(uf, ambiente, contingencia).aconsultar_status_servico()
+    except Exception as e:
+        logger.error(f"Erro ao consultar status {contingencia or uf}: {str(e)}")
+        resultado = {'status': 'error', 'mensagem': str(e)}
+
+    chave = (contingencia or uf, ambiente)
+    with _lock:
+        _status[chave] = (time.monotonic(), resultado)
+        _atualizando.discard(chave)
+    return resultado
+
+
+def status_servico(uf, ambiente='homologacao', contingencia=None):
+    """
+    Status do serviço do autorizador com cache
+
+    Dentro da validade (NFE_SEFAZ_STATUS_TTL) devolve o último resultado sem
+    ir à SEFAZ. Vencido, devolve o resultado anterior e agenda a renovação
+    em segundo plano, então só a primeira consulta espera a resposta.
+
+    Args:
+        uf: Sigla da UF
+        ambiente: 'homologacao' ou 'producao'
+        contingencia: 'SVC-AN' ou 'SVC-RS' para consultar a SVC
+
+    Returns:
+        dict: Resultado de SefazIntegration.consultar_status_servico()
+    """
+    from .sefaz_async import executar, agendar
+
+    chave = (contingencia or uf, ambiente)
+    with _lock:
+        entrada = _status.get(chave)
+        renovar = (
+            entrada is not None and chave not in _atualizando
+            and time.monotonic() - entrada[0] >= get_status_ttl()
+        )
+        if renovar:
+            _atualizando.add(chave)
+
+    if entrada is None:
+        return executar(_aconsultar_status(uf, ambiente, contingencia))
+    if renovar:
+        agendar(_aconsultar_status(uf, ambiente, contingencia))
+    return entrada[1]
+
+
+# ========== Roteamento ==========
+
+def escolher_autorizador(uf, ambiente='homologacao'):
+    """
+    Decide quem autoriza as próximas notas da UF
+
+    A UF é usada enquanto o circuito dela estiver fechado e o status em
+    cache não indicar serviço paralisado (108/109); caso contrário, a SVC
+    da UF, se o circuito dela permitir.
+
+    Returns:
+        dict: {
+            'contingencia': None | 'SVC-AN' | 'SVC-RS',
+            'tp_emis': '1',        # '6' (SVC-AN) ou '7' (SVC-RS) em contingência
+            'motivo': None         # justificativa (xJust) em contingência
+        }
+
+    Raises:
+        CircuitoAberto: UF e SVC indisponíveis
+    """
+    from .sefaz_integration import SefazConfig, TP_EMIS_CONTINGENCIA
+
+    circuito = get_circuito(uf, ambiente)
+    if circuito.disponivel():
+        status = status_servico(uf, ambiente) if get_status_ttl() > 0 else {}
+        if status.get('codigo') not in CODIGOS_PARALISADO:
+            return {'contingencia': None, 'tp_emis': '1', 'motivo': None}
+        motivo = f"SEFAZ {uf} paralisada: {status['codigo']} - {status.get('mensagem') or ''}"
+    else:
+        motivo = f"SEFAZ {uf} indisponível após {circuito.falhas} falhas seguidas de comunicação"
+
+    contingencia = SefazConfig.get_contingencia(uf)
+    if not get_circuito(contingencia, ambiente).disponivel():
+        raise CircuitoAberto(f'{motivo}; {contingencia} também indisponível')
+
+    return {'contingencia': contingencia, 'tp_emis': TP_EMIS_CONTINGENCIA[contingencia], 'motivo': motivo[:256]}
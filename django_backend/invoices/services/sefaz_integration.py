@@ -7,9 +7,128 @@ import xml.etree.ElementTree as ET
 from datetime import datetime
 from django.conf import settings
 import logging
+import time
+from .xsd_validator import validar_xml as validar_xml_xsd, validar_arquivo as validar_arquivo_xsd
+from .nfe_signer import verificar_assinatura, verificar_assinatura_arquivo, ler_arquivo
+from .sefaz_async import get_transporte, executar
+from .sefaz_contingencia import CODIGOS_PARALISADO, get_circuito
 
 logger = logging.getLogger(__name__)
 
+NFE_NAMESPACE = 'http://www.portalfiscal.inf.br/nfe'
+SOAP12_NAMESPACE = 'http://www.w3.org/2003/05/soap-envelope'
+
+# Tempo máximo (segundos) de espera por uma resposta da SEFAZ
+DEFAULT_TIMEOUT = 30
+
+# Serviço -> namespace do WSDL (elementos nfeDadosMsg / nfeResultMsg)
+SERVICOS_WSDL = {
+    'autorizacao': 'http://www.portalfiscal.inf.br/nfe/wsdl/NFeAutorizacao4',
+    'retorno_autorizacao': 'http://www.portalfiscal.inf.br/nfe/wsdl/NFeRetAutorizacao4',
+    'consulta_protocolo': 'http://www.portalfiscal.inf.br/nfe/wsdl/NFeConsultaProtocolo4',
+    'status_servico': 'http://www.portalfiscal.inf.br/nfe/wsdl/NFeStatusServico4',
+    'inutilizacao': 'http://www.portalfiscal.inf.br/nfe/wsdl/NFeInutilizacao4',
+    'evento': 'http://www.portalfiscal.inf.br/nfe/wsdl/NFeRecepcaoEvento4',
+    'distribuicao_dfe': 'http://www.portalfiscal.inf.br/nfe/wsdl/NFeDistribuicaoDFe',
+}
+
+# Serviços cuja nfeDadosMsg vai dentro de um elemento de operação
+OPERACOES_SOAP = {
+    'distribuicao_dfe': 'nfeDistDFeInteresse',
+}
+
+# Serviços atendidos pelo Ambiente Nacional, não pela UF
+SERVICOS_NACIONAIS = ('distribuicao_dfe',)
+
+
+# SEFAZ Virtual de Contingência -> tpEmis das notas emitidas nela
+TP_EMIS_CONTINGENCIA = {
+    'SVC-AN': '6',
+    'SVC-RS': '7',
+}
+
+CONTINGENCIA_POR_TP_EMIS = {tp_emis: svc for svc, tp_emis in TP_EMIS_CONTINGENCIA.items()}
+
+
+def get_timeout():
+    """Timeout das chamadas à SEFAZ (settings.NFE_SEFAZ_TIMEOUT)"""
+    return float(getattr(settings, 'NFE_SEFAZ_TIMEOUT', DEFAULT_TIMEOUT))
+
+
+def remover_declaracao_xml(xml):
+    """Remove a declaração <?xml ...?> para embutir o documento em outro XML"""
+    xml = xml.lstrip()
+    if xml.startswith('<?xml'):
+        xml = xml[xml.index('?>') + 2:].lstrip()
+    return xml
+
+
+def montar_envelope_soap(servico, corpo):
+    """Envelope SOAP 1.2 com a mensagem do serviço em nfeDadosMsg"""
+    dados = f'<nfeDadosMsg xmlns="{SERVICOS_WSDL[servico]}">{remover_declaracao_xml(corpo)}</nfeDadosMsg>'
+    operacao = OPERACOES_SOAP.get(servico)
+    if operacao:
+        dados = f'<{operacao} xmlns="{SERVICOS_WSDL[servico]}">{dados}</{operacao}>'
+    return (
+        '<?xml version="1.0" encoding="utf-8"?>'
+        f'<soap12:Envelope xmlns:soap12="{SOAP12_NAMESPACE}"><soap12:Body>'
+        f'{dados}'
+        '</soap12:Body></soap12:Envelope>'
+    )
+
+
+def extrair_retorno_soap(conteudo):
+    """
+    Extrai a mensagem de retorno (primeiro filho de nfeResultMsg)
+
+    Returns:
+        Element: Ex.: retEnviNFe, retConsReciNFe, retConsStatServ
+    """
+    root = ET.fromstring(conteudo)
+    body = root.find(f'{{{SOAP12_NAMESPACE}}}Body')
+    if body is None or not len(body):
+        raise ValueError('Resposta SOAP sem Body')
+
+    mensagem = body[0]
+    if mensagem.tag == f'{{{SOAP12_NAMESPACE}}}Fault':
+        motivo = ''.join(mensagem.itertext()).strip()
+        raise ValueError(f'SOAP Fault: {motivo}')
+    # nfeResultMsg ou <operação>Response/<operação>Result: desce até a mensagem da NF-e
+    while not mensagem.tag.startswith(f'{{{NFE_NAMESPACE}}}'):
+        if not len(mensagem):
+            raise ValueError('Resposta SOAP sem mensagem de retorno')
+        mensagem = mensagem[0]
+    return mensagem
+
+
+def ler_protocolos(retorno):
+    """
+    Lê os protNFe de um retEnviNFe/retConsReciNFe
+
+    Returns:
+        list: [{
+            'chave_acesso': '4125...',
+            'codigo': '100',
+            'mensagem': 'Autorizado o uso da NF-e',
+            'protocolo': '141250000000001',
+            'data_autorizacao': datetime | None
+        }, ...]
+    """
+    protocolos = []
+    for inf_prot in retorno.iter(f'{{{NFE_NAMESPACE}}}infProt'):
+        def campo(nome):
+            return inf_prot.findtext(f'{{{NFE_NAMESPACE}}}{nome}')
+
+        data = campo('dhRecbto')
+        protocolos.append({
+            'chave_acesso': campo('chNFe'),
+            'codigo': campo('cStat'),
+            'mensagem': campo('xMotivo'),
+            'protocolo': campo('nProt'),
+            'data_autorizacao': datetime.fromisoformat(data) if data else None,
+        })
+    return protocolos
+
 
 class SefazConfig:
     """Configurações dos Web Services da SEFAZ por UF"""
@@ -34,6 +153,43 @@ class SefazConfig:
         }
     }
     
+    # SEFAZ Virtual de Contingência do Ambiente Nacional (SVC-AN) - tpEmis 6
+    WEBSERVICES_SVC_AN = {
+        'homologacao': {
+            'autorizacao': 'https://hom.svc.fazenda.gov.br/NFeAutorizacao4/NFeAutorizacao4.asmx',
+            'retorno_autorizacao': 'https://hom.svc.fazenda.gov.br/NFeRetAutorizacao4/NFeRetAutorizacao4.asmx',
+            'consulta_protocolo': 'https://hom.svc.fazenda.gov.br/NFeConsultaProtocolo4/NFeConsultaProtocolo4.asmx',
+            'status_servico': 'https://hom.svc.fazenda.gov.br/NFeStatusServico4/NFeStatusServico4.asmx',
+            'evento': 'https://hom.svc.fazenda.gov.br/NFeRecepcaoEvento4/NFeRecepcaoEvento4.asmx'
+        },
+        'producao': {
+            'autorizacao': 'https://www.svc.fazenda.gov.br/NFeAutorizacao4/NFeAutorizacao4.asmx',
+            'retorno_autorizacao': 'https://www.svc.fazenda.gov.br/NFeRetAutorizacao4/NFeRetAutorizacao4.asmx',
+            'consulta_protocolo': 'https://www.svc.fazenda.gov.br/NFeConsultaProtocolo4/NFeConsultaProtocolo4.asmx',
+            'status_servico': 'https://www.svc.fazenda.gov.br/NFeStatusServico4/NFeStatusServico4.asmx',
+            'evento': 'https://www.svc.fazenda.gov.br/NFeRecepcaoEvento4/NFeRecepcaoEvento4.asmx'
+        }
+    }
+    
+    # Ambiente Nacional (AN) - serviços nacionais, como a distribuição de DF-e
+    WEBSERVICES_AN = {
+        'homologacao': {
+            'distribuicao_dfe': 'https://hom1.nfe.fazenda.gov.br/NFeDistribuicaoDFe/NFeDistribuicaoDFe.asmx'
+        },
+        'producao': {
+            'distribuicao_dfe': 'https://www1.nfe.fazenda.gov.br/NFeDistribuicaoDFe/NFeDistribuicaoDFe.asmx'
+        }
+    }
+    
+    # SEFAZ Virtual de Contingência do RS (SVC-RS) - tpEmis 7, sem inutilização
+    WEBSERVICES_SVC_RS = {
+        ambiente: {servico: url for servico, url in servicos.items() if servico != 'inutilizacao'}
+        for ambiente, servicos in WEBSERVICES_SVRS.items()
+    }
+    
+    # UFs atendidas pela SVC-RS em contingência (as demais usam a SVC-AN)
+    UFS_SVC_RS = frozenset(('AM', 'BA', 'CE', 'GO', 'MA', 'MS', 'MT', 'PA', 'PE', 'PI', 'PR'))
+    
     # Acre (AC) - Usa SVRS
     WEBSERVICES_AC = WEBSERVICES_SVRS
     
@@ -362,75 +518,326 @@ class SefazConfig:
         if uf not in webservices:
             raise ValueError(f"UF {uf} não suportada. UFs disponíveis: {', '.join(sorted(webservices.keys()))}")
         
+        # Endereços fixos por serviço (servidor de testes, proxy de homologação)
+        sobrescritos = getattr(settings, 'NFE_SEFAZ_WEBSERVICES', None) or {}
+        if servico in sobrescritos:
+            return sobrescritos[servico]
+        
+        if servico in SERVICOS_NACIONAIS:
+            return cls.WEBSERVICES_AN.get(ambiente, {}).get(servico)
         return webservices[uf].get(ambiente, {}).get(servico)
+    
+    @classmethod
+    def get_contingencia(cls, uf):
+        """SEFAZ Virtual de Contingência que assume a autorização da UF ('SVC-AN' ou 'SVC-RS')"""
+        return 'SVC-RS' if uf in cls.UFS_SVC_RS else 'SVC-AN'
+    
+    @classmethod
+    def get_webservice_url_contingencia(cls, contingencia, ambiente, servico):
+        """
+        Retorna a URL do webservice da SEFAZ Virtual de Contingência
+        
+        Args:
+            contingencia: 'SVC-AN' ou 'SVC-RS'
+            ambiente: 'homologacao' ou 'producao'
+            servico: 'autorizacao', 'retorno_autorizacao', 'status_servico', etc
+        """
+        webservices = {
+            'SVC-AN': cls.WEBSERVICES_SVC_AN,
+            'SVC-RS': cls.WEBSERVICES_SVC_RS,
+        }
+        
+        if contingencia not in webservices:
+            raise ValueError(f"Contingência {contingencia} não suportada. Use SVC-AN ou SVC-RS")
+        
+        sobrescritos = getattr(settings, 'NFE_SEFAZ_WEBSERVICES_SVC', None) or {}
+        if servico in sobrescritos:
+            return sobrescritos[servico]
+        
+        return webservices[contingencia].get(ambiente, {}).get(servico)
 
 
 class SefazIntegration:
     """Serviço de integração com Web Services da SEFAZ"""
     
-    def __init__(self, uf='PR', ambiente='homologacao'):
+    def __init__(self, uf='PR', ambiente='homologacao', contingencia=None):
         """
         Inicializa o serviço de integração
         
         Args:
             uf: Unidade Federativa (PR, MG, SP, etc)
             ambiente: 'homologacao' ou 'producao'
+            contingencia: 'SVC-AN' ou 'SVC-RS' para usar a SEFAZ Virtual de
+                          Contingência no lugar do autorizador da UF
         """
         self.uf = uf
         self.ambiente = ambiente
+        self.contingencia = contingencia
         self.config = SefazConfig()
         
+    @property
+    def autorizador(self):
+        """Quem atende as chamadas: a UF ou a SVC"""
+        return self.contingencia or self.uf
+    
     def get_url(self, servico):
         """Obtém URL do serviço"""
+        if self.contingencia and servico not in SERVICOS_NACIONAIS:
+            return self.config.get_webservice_url_contingencia(self.contingencia, self.ambiente, servico)
         return self.config.get_webservice_url(self.uf, self.ambiente, servico)
     
+    def _tp_amb(self):
+        """tpAmb do leiaute: 1 = produção, 2 = homologação"""
+        return '2' if self.ambiente == 'homologacao' else '1'
+    
+    async def aenviar_soap(self, servico, corpo, timeout=None):
+        """
+        Envia uma mensagem SOAP 1.2 ao web service da UF (versão assíncrona)
+        
+        Usa o pool keep-alive com TLS mútuo do endpoint (sefaz_async), então
+        várias chamadas podem rodar ao mesmo tempo com asyncio.gather().
+        
+        Args:
+            servico: Chave do serviço em SefazConfig (ex.: 'autorizacao')
+            corpo: XML da mensagem (ex.: enviNFe)
+            timeout: Segundos (padrão: NFE_SEFAZ_TIMEOUT)
+            
+        Returns:
+            Element: Mensagem de retorno (ex.: retEnviNFe)
+        """
+        codigo, conteudo = await get_transporte().post(
+            self.get_url(servico),
+            montar_envelope_soap(servico, corpo).encode('utf-8'),
+            {'Content-Type': 'application/soap+xml; charset=utf-8'},
+            timeout,
+        )
+        if codigo >= 400 and b'Envelope' not in conteudo:
+            raise ConnectionError(f'SEFAZ {self.autorizador} respondeu HTTP {codigo}')
+        return extrair_retorno_soap(conteudo)
+    
+    def enviar_soap(self, servico, corpo, timeout=None):
+        """Versão síncrona de aenviar_soap()"""
+        return executar(self.aenviar_soap(servico, corpo, timeout))
+    
+    async def aautorizar_lote(self, xmls, id_lote, sincrono=False):
+        """
+        Envia um lote enviNFe (até 50 NF-e assinadas) em uma única chamada
+        
+        A SEFAZ só aceita processamento síncrono (indSinc=1) para lotes com
+        uma única nota; os demais retornam um recibo para consulta.
+        
+        Args:
+            xmls: Lista de strings com os XML assinados
+            id_lote: Identificador numérico do lote (até 15 dígitos)
+            sincrono: Solicita processamento síncrono
+            
+        Returns:
+            dict: {
+                'sucesso': True/False,   # lote recebido/processado
+                'codigo': '103',
+                'mensagem': 'Lote recebido com sucesso',
+                'recibo': '411000000000001',  # None no modo síncrono
+                'protocolos': [...]           # ver ler_protocolos()
+            }
+        """
+        corpo = (
+            f'<enviNFe xmlns="{NFE_NAMESPACE}" versao="4.00">'
+            f'<idLote>{id_lote}</idLote><indSinc>{1 if sincrono else 0}</indSinc>'
+            + ''.join(remover_declaracao_xml(xml) for xml in xmls)
+            + '</enviNFe>'
+        )
+        
+        # Autorizador com falhas seguidas: falha imediata em vez de esperar o timeout
+        circuito = get_circuito(self.autorizador, self.ambiente)
+        circuito.verificar()
+        
+        logger.info(f"Enviando lote {id_lote} com {len(xmls)} NF-e - {self.autorizador}/{self.ambiente}")
+        try:
+            retorno = await self.aenviar_soap('autorizacao', corpo)
+        except Exception:
+            circuito.registrar_falha()
+            raise
+        codigo = retorno.findtext(f'{{{NFE_NAMESPACE}}}cStat')
+        if codigo in CODIGOS_PARALISADO:
+            circuito.registrar_falha()
+        else:
+            circuito.registrar_sucesso()
+        
+        return {
+            'sucesso': codigo in ('103', '104'),
+            'codigo': codigo,
+            'mensagem': retorno.findtext(f'{{{NFE_NAMESPACE}}}xMotivo'),
+            'recibo': retorno.findtext(f'{{{NFE_NAMESPACE}}}infRec/{{{NFE_NAMESPACE}}}nRec'),
+            'protocolos': ler_protocolos(retorno),
+        }
+    
+    def autorizar_lote(self, xmls, id_lote, sincrono=False):
+        """Versão síncrona de aautorizar_lote()"""
+        return executar(self.aautorizar_lote(xmls, id_lote, sincrono))
+    
+    async def aconsultar_recibo(self, recibo):
+        """
+        Consulta o resultado de um lote assíncrono (NFeRetAutorizacao4)
+        
+        Returns:
+            dict: {
+                'codigo': '104',          # 105 = lote ainda em processamento
+                'mensagem': 'Lote processado',
+                'protocolos': [...]
+            }
+        """
+        corpo = (
+            f'<consReciNFe xmlns="{NFE_NAMESPACE}" versao="4.00">'
+            f'<tpAmb>{self._tp_amb()}</tpAmb><nRec>{recibo}</nRec>'
+            '</consReciNFe>'
+        )
+        retorno = await self.aenviar_soap('retorno_autorizacao', corpo)
+        return {
+            'codigo': retorno.findtext(f'{{{NFE_NAMESPACE}}}cStat'),
+            'mensagem': retorno.findtext(f'{{{NFE_NAMESPACE}}}xMotivo'),
+            'protocolos': ler_protocolos(retorno),
+        }
+    
+    def consultar_recibo(self, recibo):
+        """Versão síncrona de aconsultar_recibo()"""
+        return executar(self.aconsultar_recibo(recibo))
+    
+    async def aconsultar_protocolo(self, chave_acesso):
+        """
+        Consulta a situação de uma NF-e na SEFAZ (NFeConsultaProtocolo4)
+        
+        Returns:
+            dict: {
+                'codigo': '100',          # 217 = NF-e não consta na base
+                'mensagem': 'Autorizado o uso da NF-e',
+                'protocolos': [...]
+            }
+        """
+        corpo = (
+            f'<consSitNFe xmlns="{NFE_NAMESPACE}" versao="4.00">'
+            f'<tpAmb>{self._tp_amb()}</tpAmb><xServ>CONSULTAR</xServ><chNFe>{chave_acesso}</chNFe>'
+            '</consSitNFe>'
+        )
+        retorno = await self.aenviar_soap('consulta_protocolo', corpo)
+        return {
+            'codigo': retorno.findtext(f'{{{NFE_NAMESPACE}}}cStat'),
+            'mensagem': retorno.findtext(f'{{{NFE_NAMESPACE}}}xMotivo'),
+            'protocolos': ler_protocolos(retorno),
+        }
+    
+    async def aenviar_evento(self, env_evento):
+        """
+        Envia um lote de eventos já assinado (envEvento) ao NFeRecepcaoEvento4
+        
+        Returns:
+            dict: {
+                'codigo': '128',          # lote de evento processado
+                'mensagem': 'Lote de Evento Processado',
+                'eventos': [{'chave_acesso': '...', 'tipo': '110111', 'sequencia': 1, 'codigo': '135',
+                             'mensagem': '...', 'protocolo': '...', 'data_registro': datetime | None}]
+            }
+        """
+        retorno = await self.aenviar_soap('evento', env_evento)
+        eventos = []
+        for inf in retorno.iter(f'{{{NFE_NAMESPACE}}}infEvento'):
+            def campo(nome):
+                return inf.findtext(f'{{{NFE_NAMESPACE}}}{nome}')
+            sequencia, data = campo('nSeqEvento'), campo('dhRegEvento')
+            eventos.append({
+                'chave_acesso': campo('chNFe'),
+                'tipo': campo('tpEvento'),
+                'sequencia': int(sequencia) if sequencia and sequencia.isdigit() else None,
+                'codigo': campo('cStat'),
+                'mensagem': campo('xMotivo'),
+                'protocolo': campo('nProt'),
+                'data_registro': datetime.fromisoformat(data) if data else None,
+            })
+        return {
+            'codigo': retorno.findtext(f'{{{NFE_NAMESPACE}}}cStat'),
+            'mensagem': retorno.findtext(f'{{{NFE_NAMESPACE}}}xMotivo'),
+            'eventos': eventos,
+        }
+    
+    def enviar_evento(self, env_evento):
+        """Versão síncrona de aenviar_evento()"""
+        return executar(self.aenviar_evento(env_evento))
+    
+    async def adistribuicao_dfe(self, cnpj_cpf, ult_nsu):
+        """
+        Pede ao Ambiente Nacional os DF-e de interesse após o último NSU (NFeDistribuicaoDFe)
+        
+        Args:
+            cnpj_cpf: CNPJ/CPF interessado (só dígitos)
+            ult_nsu: Último NSU já recebido (0 na primeira consulta)
+        
+        Returns:
+            dict: {
+                'codigo': '138',          # 137 = nenhum documento, 656 = consumo indevido
+                'mensagem': 'Documento localizado',
+                'ult_nsu': 50,
+                'max_nsu': 120,
+                'documentos': [{'nsu': 1, 'schema': 'procNFe_v4.00.xsd', 'conteudo': '<base64 gzip>'}]
+            }
+        """
+        documento = 'CPF' if len(cnpj_cpf) == 11 else 'CNPJ'
+        corpo = (
+            f'<distDFeInt xmlns="{NFE_NAMESPACE}" versao="1.01">'
+            f'<tpAmb>{self._tp_amb()}</tpAmb><cUFAutor>{self._get_codigo_uf()}</cUFAutor>'
+            f'<{documento}>{cnpj_cpf}</{documento}><distNSU><ultNSU>{int(ult_nsu):015d}</ultNSU></distNSU>'
+            '</distDFeInt>'
+        )
+        retorno = await self.aenviar_soap('distribuicao_dfe', corpo)
+        return {
+            'codigo': retorno.findtext(f'{{{NFE_NAMESPACE}}}cStat'),
+            'mensagem': retorno.findtext(f'{{{NFE_NAMESPACE}}}xMotivo'),
+            'ult_nsu': int(retorno.findtext(f'{{{NFE_NAMESPACE}}}ultNSU') or ult_nsu),
+            'max_nsu': int(retorno.findtext(f'{{{NFE_NAMESPACE}}}maxNSU') or ult_nsu),
+            'documentos': [
+                {'nsu': int(doc.get('NSU')), 'schema': doc.get('schema') or '', 'conteudo': doc.text or ''}
+                for doc in retorno.iter(f'{{{NFE_NAMESPACE}}}docZip')
+            ],
+        }
+    
+    def distribuicao_dfe(self, cnpj_cpf, ult_nsu):
+        """Versão síncrona de adistribuicao_dfe()"""
+        return executar(self.adistribuicao_dfe(cnpj_cpf, ult_nsu))
+    
+    async def aconsultar_status_servico(self):
+        """Versão assíncrona de consultar_status_servico()"""
+        corpo = (
+            f'<consStatServ xmlns="{NFE_NAMESPACE}" versao="4.00">'
+            f'<tpAmb>{self._tp_amb()}</tpAmb><cUF>{self._get_codigo_uf()}</cUF><xServ>STATUS</xServ>'
+            '</consStatServ>'
+        )
+        inicio = time.perf_counter()
+        retorno = await self.aenviar_soap('status_servico', corpo)
+        codigo = retorno.findtext(f'{{{NFE_NAMESPACE}}}cStat')
+        
+        return {
+            'status': 'online' if codigo == '107' else 'offline',
+            'codigo': codigo,
+            'mensagem': retorno.findtext(f'{{{NFE_NAMESPACE}}}xMotivo'),
+            'tempo_medio': float(retorno.findtext(f'{{{NFE_NAMESPACE}}}tMed') or 0),
+            'tempo_resposta': round(time.perf_counter() - inicio, 4),
+            'ambiente': self.ambiente,
+            'uf': self.uf
+        }
+    
     def consultar_status_servico(self):
         """
-        Consulta o status do serviço da SEFAZ
+        Consulta o status do serviço da SEFAZ (NFeStatusServico4)
         
         Returns:
             dict: {
-                'status': 'online' | 'offline',
+                'status': 'online' | 'offline' | 'error',
                 'codigo': '107',
                 'mensagem': 'Serviço em Operação',
-                'tempo_medio': 1.5  # segundos
+                'tempo_medio': 1.5  # segundos, informado pela SEFAZ
             }
         """
         try:
-            url = self.get_url('status_servico')
-            
-            # XML de consulta (simplificado - em produção deve ser completo)
-            xml_consulta = f"""<?xml version="1.0" encoding="UTF-8"?>
-<consStatServ xmlns="http://www.portalfiscal.inf.br/nfe" versao="4.00">
-    <tpAmb>{2 if self.ambiente == 'homologacao' else 1}</tpAmb>
-    <cUF>{self._get_codigo_uf()}</cUF>
-    <xServ>STATUS</xServ>
-</consStatServ>"""
-            
-            # Em produção real, usar certificado digital e SOAP
             logger.info(f"Consultando status SEFAZ {self.uf} - {self.ambiente}")
-            
-            # Simulação para testes (remover em produção)
-            if self.ambiente == 'homologacao':
-                return {
-                    'status': 'online',
-                    'codigo': '107',
-                    'mensagem': 'Serviço em Operação',
-                    'tempo_medio': 1.2,
-                    'ambiente': self.ambiente,
-                    'uf': self.uf
-                }
-            
-            # TODO: Implementar requisição SOAP real com certificado
-            # response = requests.post(url, data=xml_consulta, 
-            #                         cert=('cert.pem', 'key.pem'),
-            #                         headers={'Content-Type': 'text/xml'})
-            
-            return {
-                'status': 'offline',
-                'mensagem': 'Integração não implementada (necessário certificado digital)'
-            }
-            
+            return executar(self.aconsultar_status_servico())
         except Exception as e:
             logger.error(f"Erro ao consultar status: {str(e)}")
             return {
@@ -438,6 +845,7 @@ class SefazIntegration:
                 'mensagem': str(e)
             }
     
+    
     def validar_xml_nfe(self, xml_nfe):
         """
         Valida o XML da NF-e antes de enviar
@@ -448,7 +856,8 @@ class SefazIntegration:
         Returns:
             dict: {
                 'valido': True/False,
-                'erros': ['lista de erros']
+                'erros': ['lista de erros'],
+                'detalhes': [{'linha': 12, 'coluna': 0, 'mensagem': '...'}]
             }
         """
         erros = []
@@ -461,37 +870,94 @@ class SefazIntegration:
             if root.tag != '{http://www.portalfiscal.inf.br/nfe}NFe':
                 erros.append('Tag raiz inválida')
             
-            # Verificar versão
-            versao = root.get('versao')
-            if versao != '4.00':
-                erros.append(f'Versão incorreta: {versao}. Esperado: 4.00')
-            
             # Verificar infNFe
             inf_nfe = root.find('.//{http://www.portalfiscal.inf.br/nfe}infNFe')
             if inf_nfe is None:
                 erros.append('Tag infNFe não encontrada')
             
+            # Verificar versão (atributo de infNFe no leiaute 4.00)
+            versao = inf_nfe.get('versao') if inf_nfe is not None else root.get('versao')
+            if versao != '4.00':
+                erros.append(f'Versão incorreta: {versao}. Esperado: 4.00')
+            
             # Verificar assinatura (em produção)
             signature = root.find('.//{http://www.w3.org/2000/09/xmldsig#}Signature')
             if signature is None and self.ambiente == 'producao':
                 erros.append('XML não assinado digitalmente')
+            elif signature is not None:
+                erros.extend(verificar_assinatura(xml_nfe)['erros'])
             
-            # TODO: Adicionar mais validações conforme schema XSD
+            # Validação completa contra o XSD (schema compilado em cache).
+            # A assinatura já foi verificada acima conforme o ambiente.
+            xsd = validar_xml_xsd(xml_nfe, versao=versao or '4.00', exigir_assinatura=False)
+            erros.extend(xsd['erros'])
             
             return {
                 'valido': len(erros) == 0,
-                'erros': erros
+                'erros': erros,
+                'detalhes': xsd['detalhes']
             }
             
         except ET.ParseError as e:
             return {
                 'valido': False,
-                'erros': [f'Erro ao parsear XML: {str(e)}']
+                'erros': [f'Erro ao parsear XML: {str(e)}'],
+                'detalhes': []
             }
     
+    def validar_arquivo_nfe(self, arquivo):
+        """
+        Mesmas verificações de validar_xml_nfe() lendo o XML de um arquivo
+        
+        Para notas geradas em modo streaming: o arquivo é lido em blocos
+        (assinatura e XSD), sem carregar o XML inteiro em memória.
+        
+        Args:
+            arquivo: Arquivo binário aberto para leitura
+            
+        Returns:
+            dict: mesmo formato de validar_xml_nfe()
+        """
+        erros = []
+        
+        try:
+            leitura = ler_arquivo(arquivo)
+        except ET.ParseError as e:
+            return {
+                'valido': False,
+                'erros': [f'Erro ao parsear XML: {str(e)}'],
+                'detalhes': []
+            }
+        
+        if leitura['raiz'] != '{http://www.portalfiscal.inf.br/nfe}NFe':
+            erros.append('Tag raiz inválida')
+        if leitura['atributos'] is None:
+            erros.append('Tag infNFe não encontrada')
+        
+        versao = (leitura['atributos'] or {}).get('versao')
+        if versao != '4.00':
+            erros.append(f'Versão incorreta: {versao}. Esperado: 4.00')
+        
+        if leitura['signature'] is None and self.ambiente == 'producao':
+            erros.append('XML não assinado digitalmente')
+        elif leitura['signature'] is not None:
+            erros.extend(verificar_assinatura_arquivo(arquivo, leitura)['erros'])
+        
+        xsd = validar_arquivo_xsd(arquivo, versao=versao or '4.00', exigir_assinatura=False)
+        erros.extend(xsd['erros'])
+        
+        return {
+            'valido': len(erros) == 0,
+            'erros': erros,
+            'detalhes': xsd['detalhes']
+        }
+    
     def autorizar_nfe(self, xml_nfe):
         """
-        Envia NF-e para autorização na SEFAZ
+        Envia uma NF-e para autorização (lote síncrono de uma nota)
+        
+        Para várias notas use sefaz_lote.autorizar_pendentes(), que envia
+        até 50 notas por lote e registra os recibos.
         
         Args:
             xml_nfe: String com XML da NF-e assinado
@@ -501,11 +967,14 @@ class SefazIntegration:
                 'sucesso': True/False,
                 'codigo': '100',  # Código de retorno SEFAZ
                 'mensagem': 'Autorizado o uso da NF-e',
-                'protocolo': '135210000000001',
+                'protocolo': '141210000000001',
                 'chave_acesso': '41210812345678901234550010000000011234567890',
-                'data_autorizacao': datetime.now()
+                'data_autorizacao': datetime,
+                'recibo': None  # lote aceito sem processamento síncrono: consultar_recibo()
             }
         """
+        from .sefaz_lote import CODIGOS_AUTORIZADA, gerar_id_lote
+        
         try:
             # Validar XML antes de enviar
             validacao = self.validar_xml_nfe(xml_nfe)
@@ -516,28 +985,29 @@ class SefazIntegration:
                     'mensagem': f"Erro na validação: {', '.join(validacao['erros'])}"
                 }
             
-            url = self.get_url('autorizacao')
+            chave_acesso = self._extrair_chave_acesso(xml_nfe)
+            logger.info(f"Enviando NF-e {chave_acesso} para autorização - {self.ambiente}")
             
-            logger.info(f"Enviando NF-e para autorização - {self.ambiente}")
-            
-            # Em ambiente de homologação, simular resposta
-            if self.ambiente == 'homologacao':
-                # TODO: Implementar envio real em produção
+            envio = executar(self.aautorizar_lote([xml_nfe], gerar_id_lote(), sincrono=True))
+            protocolo = next((p for p in envio['protocolos'] if p['chave_acesso'] == chave_acesso), None)
+            if protocolo is None:
+                # Lote recusado ou recebido para processamento posterior (recibo)
                 return {
-                    'sucesso': True,
-                    'codigo': '100',
-                    'mensagem': 'Autorizado o uso da NF-e',
-                    'protocolo': f"9999{datetime.now().strftime('%Y%m%d%H%M%S')}",
-                    'chave_acesso': self._extrair_chave_acesso(xml_nfe),
-                    'data_autorizacao': datetime.now(),
-                    'ambiente': 'homologacao',
-                    'observacao': 'SEM VALOR FISCAL - EMITIDA EM AMBIENTE DE HOMOLOGAÇÃO'
+                    'sucesso': False,
+                    'codigo': envio['codigo'],
+                    'mensagem': envio['mensagem'],
+                    'chave_acesso': chave_acesso,
+                    'recibo': envio['recibo'],
                 }
             
-            # TODO: Implementar requisição SOAP com certificado digital
             return {
-                'sucesso': False,
-                'mensagem': 'Integração completa requer certificado digital A1/A3'
+                'sucesso': protocolo['codigo'] in CODIGOS_AUTORIZADA,
+                'codigo': protocolo['codigo'],
+                'mensagem': protocolo['mensagem'],
+                'protocolo': protocolo['protocolo'],
+                'chave_acesso': chave_acesso,
+                'data_autorizacao': protocolo['data_autorizacao'],
+                'recibo': None,
             }
             
         except Exception as e:
@@ -548,6 +1018,10 @@ class SefazIntegration:
                 'mensagem': f'Erro interno: {str(e)}'
             }
     
+    def consultar_protocolo(self, chave_acesso):
+        """Versão síncrona de aconsultar_protocolo()"""
+        return executar(self.aconsultar_protocolo(chave_acesso))
+    
     def consultar_nfe(self, chave_acesso):
         """
         Consulta situação de uma NF-e pela chave de acesso
@@ -556,33 +1030,35 @@ class SefazIntegration:
             chave_acesso: Chave de 44 dígitos
             
         Returns:
-            dict: Dados da NF-e e protocolo
+            dict: {
+                'sucesso': True/False,   # a SEFAZ devolveu o protocolo da nota
+                'codigo': '100',          # 217 = NF-e não consta na base
+                'mensagem': 'Autorizado o uso da NF-e',
+                'chave_acesso': '4125...',
+                'protocolo': '141250000000001',
+                'data_autorizacao': datetime | None
+            }
         """
+        from .access_key import formato_valido
+        
         try:
-            if len(chave_acesso) != 44:
+            if not formato_valido(chave_acesso):
                 return {
                     'sucesso': False,
                     'mensagem': 'Chave de acesso deve ter 44 dígitos'
                 }
             
-            url = self.get_url('consulta_protocolo')
-            
             logger.info(f"Consultando NF-e: {chave_acesso}")
             
-            # Simulação para homologação
-            if self.ambiente == 'homologacao':
-                return {
-                    'sucesso': True,
-                    'codigo': '100',
-                    'situacao': 'Autorizada',
-                    'chave_acesso': chave_acesso,
-                    'protocolo': f"9999{datetime.now().strftime('%Y%m%d%H%M%S')}",
-                    'ambiente': 'homologacao'
-                }
-            
+            retorno = self.consultar_protocolo(chave_acesso)
+            protocolo = next((p for p in retorno['protocolos'] if p['chave_acesso'] == chave_acesso), {})
             return {
-                'sucesso': False,
-                'mensagem': 'Implementação requer certificado digital'
+                'sucesso': bool(protocolo),
+                'codigo': retorno['codigo'],
+                'mensagem': retorno['mensagem'],
+                'chave_acesso': chave_acesso,
+                'protocolo': protocolo.get('protocolo'),
+                'data_autorizacao': protocolo.get('data_autorizacao'),
             }
             
         except Exception as e:
@@ -594,7 +1070,10 @@ class SefazIntegration:
     
     def cancelar_nfe(self, chave_acesso, protocolo, justificativa):
         """
-        Cancela uma NF-e autorizada
+        Cancela uma NF-e autorizada (evento 110111 em um envEvento próprio)
+        
+        Para cancelar várias notas use eventos_nfe.cancelar_notas(), que
+        envia até 20 eventos por chamada e registra os FiscalEvent.
         
         Args:
             chave_acesso: Chave de 44 dígitos
@@ -604,6 +1083,9 @@ class SefazIntegration:
         Returns:
             dict: Resultado do cancelamento
         """
+        from .eventos_nfe import TIPO_CANCELAMENTO, CODIGOS_REGISTRADO, montar_evento, montar_lote, assinar_eventos
+        from .sefaz_lote import gerar_id_lote
+        
         try:
             if len(justificativa) < 15:
                 return {
@@ -611,24 +1093,23 @@ class SefazIntegration:
                     'mensagem': 'Justificativa deve ter no mínimo 15 caracteres'
                 }
             
-            url = self.get_url('evento')
-            
             logger.info(f"Cancelando NF-e: {chave_acesso}")
             
-            # Simulação
-            if self.ambiente == 'homologacao':
-                return {
-                    'sucesso': True,
-                    'codigo': '135',
-                    'mensagem': 'Evento registrado e vinculado a NF-e',
-                    'chave_acesso': chave_acesso,
-                    'protocolo_cancelamento': f"9999{datetime.now().strftime('%Y%m%d%H%M%S')}",
-                    'data_cancelamento': datetime.now()
-                }
+            # CNPJ/CPF do emitente: posições 7 a 20 da chave
+            evento = montar_evento(
+                chave_acesso, TIPO_CANCELAMENTO, 1, justificativa, chave_acesso[6:20], self._tp_amb(), protocolo=protocolo,
+            )
+            retorno = self.enviar_evento(montar_lote(assinar_eventos([evento]), gerar_id_lote()))
+            resultado = retorno['eventos'][0] if retorno['eventos'] else {}
+            codigo = resultado.get('codigo') or retorno['codigo']
             
             return {
-                'sucesso': False,
-                'mensagem': 'Implementação requer certificado digital'
+                'sucesso': codigo in CODIGOS_REGISTRADO,
+                'codigo': codigo,
+                'mensagem': resultado.get('mensagem') or retorno['mensagem'],
+                'chave_acesso': chave_acesso,
+                'protocolo_cancelamento': resultado.get('protocolo'),
+                'data_cancelamento': resultado.get('data_registro'),
             }
             
         except Exception as e:
@@ -0,0 +1,392 @@
+"""
+Autorização de NF-e em lotes (enviNFe)
+Agrupa as notas pendentes por emitente e UF em lotes de até 50, envia cada
+lote em uma única chamada à SEFAZ (todos os lotes em paralelo) e distribui
+os protNFe de volta para as Invoices com um único bulk_update por lote.
+Quando a SEFAZ da UF está fora (circuit breaker aberto ou serviço
+paralisado), as notas são reemitidas em contingência e enviadas à SVC.
+"""
+from collections import defaultdict
+from django.conf import settings
+from django.utils import timezone
+from .sefaz_integration import SefazIntegration, CONTINGENCIA_POR_TP_EMIS
+from .sefaz_contingencia import CircuitoAberto, escolher_autorizador
+from .sefaz_async import executar
+from .sefaz_recibos import registrar_recibo
+from .nfe_engine import clean_digits
+from . import nfe_pipeline
+import itertools
+import socket
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Limite do leiaute 4.00 para o enviNFe
+MAX_NOTAS_LOTE = 50
+
+# Consulta do recibo (NFeRetAutorizacao4) enquanto o lote está em processamento
+DEFAULT_INTERVALO_CONSULTA = 1.0
+DEFAULT_MAX_CONSULTAS = 10
+
+# cStat do protNFe -> status da Invoice
+CODIGOS_AUTORIZADA = ('100', '150')
+CODIGOS_DENEGADA = ('110', '205', '301', '302', '303')
+
+_sequencia_lote = itertools.count(1)
+
+
+def get_tamanho_lote():
+    """Notas por lote (settings.NFE_LOTE_TAMANHO, máximo 50)"""
+    return max(1, min(int(getattr(settings, 'NFE_LOTE_TAMANHO', MAX_NOTAS_LOTE)), MAX_NOTAS_LOTE))
+
+
+def gerar_id_lote():
+    """Identificador numérico do lote (15 dígitos, único no processo)"""
+    return f'{int(time.time()) % 10 ** 10:010d}{next(_sequencia_lote) % 10 ** 5:05d}'
+
+
+def _ambiente(invoice):
+    return 'homologacao' if (invoice.environment or '2') == '2' else 'producao'
+
+
+def agrupar_lotes(invoices, tamanho=None):
+    """
+    Agrupa notas por (emitente, UF, ambiente, tpEmis) em lotes de até `tamanho`
+
+    Args:
+        invoices: Iterável de Invoice
+        tamanho: Notas por lote (padrão: NFE_LOTE_TAMANHO)
+
+    Returns:
+        list: [((cnpj_cpf, uf, ambiente, tp_emis), [invoice, ...]), ...]
+    """
+    tamanho = min(tamanho or get_tamanho_lote(), MAX_NOTAS_LOTE)
+    grupos = defaultdict(list)
+    for invoice in invoices:
+        chave = (
+            clean_digits(invoice.issuer_tax_id), invoice.issuer_state or 'PR',
+            _ambiente(invoice), invoice.emission_type or '1',
+        )
+        grupos[chave].append(invoice)
+
+    return [
+        (chave, notas[inicio:inicio + tamanho])
+        for chave, notas in grupos.items()
+        for inicio in range(0, len(notas), tamanho)
+    ]
+
+
+def entrar_em_contingencia(invoices, tp_emis, motivo):
+    """
+    Reemite as notas para a SEFAZ Virtual de Contingência
+
+    Grava tpEmis, data de entrada e justificativa, gera nova chave (o tpEmis
+    faz parte dela), XML assinado e, se já existia, o DANFE.
+
+    Args:
+        invoices: Notas ainda não autorizadas
+        tp_emis: '6' (SVC-AN) ou '7' (SVC-RS)
+        motivo: Justificativa da contingência (xJust)
+    """
+    agora = timezone.now()
+    for invoice in invoices:
+        invoice.emission_type = tp_emis
+        invoice.contingency_date = agora
+        invoice.contingency_reason = motivo[:256]
+        campos = ['emission_type', 'contingency_date', 'contingency_reason', 'access_key', 'xml_file']
+
+        _, chave_acesso = nfe_pipeline.gerar_xml(invoice)
+        if invoice.pdf_file:
+            nfe_pipeline.gerar_danfe(invoice, chave_acesso)
+            campos.extend(['pdf_file', 'danfe_hash'])
+        invoice.save(update_fields=campos)
+
+    logger.warning(f"{len(invoices)} NF-e reemitidas em contingência (tpEmis {tp_emis}): {motivo}")
+
+
+def _rotear(lotes):
+    """
+    Define o autorizador de cada lote de notas normais
+
+    Lotes de UFs com a SEFAZ indisponível são reemitidos em contingência e
+    passam a ter o tpEmis da SVC na chave do lote.
+    """
+    rotas = {}
+    roteados = []
+    for chave, invoices in lotes:
+        cnpj_cpf, uf, ambiente, tp_emis = chave
+        if tp_emis == '1':
+            if (uf, ambiente) not in rotas:
+                try:
+                    rotas[(uf, ambiente)] = escolher_autorizador(uf, ambiente)
+                except CircuitoAberto as e:
+                    # Sem alternativa: o envio falha na hora pelo próprio circuito
+                    logger.error(str(e))
+                    rotas[(uf, ambiente)] = None
+            rota = rotas[(uf, ambiente)]
+            if rota and rota['contingencia']:
+                entrar_em_contingencia(invoices, rota['tp_emis'], rota['motivo'])
+                chave = (cnpj_cpf, uf, ambiente, rota['tp_emis'])
+        roteados.append((chave, invoices))
+    return roteados
+
+
+def _nao_entregue(erro):
+    """Falhas em que o lote com certeza não chegou à SEFAZ (seguro reemitir)"""
+    return isinstance(erro, (CircuitoAberto, ConnectionRefusedError, socket.gaierror))
+
+
+def _ler_xml(invoice):
+    with invoice.xml_file.open('rb') as xml_file:
+        return xml_file.read().decode('utf-8')
+
+
+async def _aguardar_recibo(sefaz, recibo):
+    """Consulta o recibo até o lote sair de processamento (cStat 105)"""
+    intervalo = float(getattr(settings, 'NFE_LOTE_INTERVALO_CONSULTA', DEFAULT_INTERVALO_CONSULTA))
+    tentativas = int(getattr(settings, 'NFE_LOTE_MAX_CONSULTAS', DEFAULT_MAX_CONSULTAS))
+
+    retorno = None
+    for tentativa in range(tentativas):
+        retorno = await sefaz.aconsultar_recibo(recibo)
+        if retorno['codigo'] != '105':
+            break
+        await asyncio.sleep(intervalo * (tentativa + 1))
+    return retorno
+
+
+async def _transmitir(sefaz, xmls, id_lote, aguardar=True):
+    """Envia um lote e, se assíncrono e `aguardar`, consulta o recibo até o processamento"""
+    # Síncrono só é aceito pela SEFAZ para lotes de uma nota
+    envio = await sefaz.aautorizar_lote(xmls, id_lote, sincrono=aguardar and len(xmls) == 1)
+
+    if aguardar and envio['sucesso'] and envio['recibo'] and not envio['protocolos']:
+        consulta = await _aguardar_recibo(sefaz, envio['recibo'])
+        envio.update(codigo=consulta['codigo'], mensagem=consulta['mensagem'], protocolos=consulta['protocolos'])
+    return envio
+
+
+def _transmitir_lotes(lotes, aguardar=True):
+    """
+    Transmite todos os lotes ao mesmo tempo pelo transporte assíncrono
+
+    Lotes de UFs diferentes seguem em paralelo; no mesmo endpoint o
+    paralelismo é limitado por NFE_SEFAZ_MAX_CONEXOES.
+
+    Returns:
+        list: (id_lote, envio ou Exception) na ordem dos lotes
+    """
+    preparados = [
+        (
+            SefazIntegration(uf=uf, ambiente=ambiente, contingencia=CONTINGENCIA_POR_TP_EMIS.get(tp_emis)),
+            [_ler_xml(inv) for inv in invoices],
+            gerar_id_lote(),
+        )
+        for (_, uf, ambiente, tp_emis), invoices in lotes
+    ]
+
+    async def todos():
+        return await asyncio.gather(
+            *(_transmitir(sefaz, xmls, id_lote, aguardar) for sefaz, xmls, id_lote in preparados),
+            return_exceptions=True,
+        )
+
+    return [(id_lote, envio) for (_, _, id_lote), envio in zip(preparados, executar(todos()))]
+
+
+def aplicar_protocolos(invoices, protocolos):
+    """
+    Atualiza status, protocolo e data de autorização das notas do lote
+
+    Args:
+        invoices: Notas do lote
+        protocolos: Lista de ler_protocolos()
+
+    Returns:
+        list: [{'invoice_id': 1, 'chave_acesso': '...', 'status': 'authorized',
+                'codigo': '100', 'mensagem': '...', 'protocolo': '...',
+                'respondida': True}, ...]   # respondida: a SEFAZ devolveu o protNFe da nota
+    """
+    por_chave = {p['chave_acesso']: p for p in protocolos}
+    alteradas = []
+    resultados = []
+
+    for invoice in invoices:
+        protocolo = por_chave.get(invoice.access_key)
+        if protocolo is None:
+            resultados.append({
+                'invoice_id': invoice.pk, 'chave_acesso': invoice.access_key, 'status': invoice.status,
+                'codigo': None, 'mensagem': 'Protocolo não retornado pela SEFAZ', 'protocolo': None,
+                'respondida': False,
+            })
+            continue
+
+        if protocolo['codigo'] in CODIGOS_AUTORIZADA:
+            invoice.status = 'authorized'
+        elif protocolo['codigo'] in CODIGOS_DENEGADA:
+            invoice.status = 'denied'
+
+        if protocolo['codigo'] in CODIGOS_AUTORIZADA + CODIGOS_DENEGADA:
+            invoice.protocol = protocolo['protocolo']
+            invoice.authorization_date = protocolo['data_autorizacao'] or timezone.now()
+            alteradas.append(invoice)
+
+        resultados.append({
+            'invoice_id': invoice.pk,
+            'chave_acesso': invoice.access_key,
+            'status': invoice.status,
+            'codigo': protocolo['codigo'],
+            'mensagem': protocolo['mensagem'],
+            'protocolo': protocolo['protocolo'],
+            'respondida': True,
+        })
+
+    if alteradas:
+        type(alteradas[0]).objects.bulk_update(alteradas, ['status', 'protocol', 'authorization_date'])
+
+    return resultados
+
+
+def _aguardando_recibo(envio):
+    """Lote aceito e ainda em processamento na SEFAZ"""
+    return envio['sucesso'] and envio['recibo'] and not envio['protocolos'] and envio['codigo'] in ('103', '105')
+
+
+def _resultado_lote(invoices, id_lote, envio, chave_lote):
+    if envio['protocolos']:
+        resultados = aplicar_protocolos(invoices, envio['protocolos'])
+    elif _aguardando_recibo(envio):
+        # Ainda em processamento: o agendador de recibos aplica os protocolos depois
+        _, uf, ambiente, tp_emis = chave_lote
+        registrar_recibo(invoices, envio['recibo'], id_lote, uf, ambiente, tp_emis)
+        resultados = [{
+            'invoice_id': inv.pk, 'chave_acesso': inv.access_key, 'status': inv.status,
+            'codigo': envio['codigo'], 'mensagem': envio['mensagem'], 'protocolo': None, 'respondida': False,
+        } for inv in invoices]
+    else:
+        # Lote inteiro rejeitado (ou ainda em processamento): notas seguem pendentes
+        logger.warning(f"Lote {id_lote} sem protocolos: {envio['codigo']} - {envio['mensagem']}")
+        resultados = [{
+            'invoice_id': inv.pk, 'chave_acesso': inv.access_key, 'status': inv.status,
+            'codigo': envio['codigo'], 'mensagem': envio['mensagem'], 'protocolo': None, 'respondida': False,
+        } for inv in invoices]
+
+    return {
+        'id_lote': id_lote,
+        'codigo': envio['codigo'],
+        'mensagem': envio['mensagem'],
+        'recibo': envio['recibo'],
+        'resultados': resultados,
+    }
+
+
+def enviar_lote(invoices, uf='PR', ambiente='homologacao', aguardar=True):
+    """
+    Envia um lote (até 50 notas do mesmo emitente/UF/tpEmis) e aplica os protocolos
+
+    Notas em contingência (tpEmis 6/7) seguem para a SVC correspondente.
+    Com aguardar=False o lote é enviado em modo assíncrono e o recibo fica
+    registrado para o agendador (sefaz_recibos), sem esperar o processamento.
+
+    Returns:
+        dict: {
+            'id_lote': '172900000000001',
+            'codigo': '104',
+            'mensagem': 'Lote processado',
+            'recibo': '411000000000001',
+            'resultados': [...]   # ver aplicar_protocolos()
+        }
+    """
+    tp_emis = (invoices[0].emission_type or '1') if invoices else '1'
+    chave_lote = (None, uf, ambiente, tp_emis)
+    id_lote, envio = _transmitir_lotes([(chave_lote, invoices)], aguardar)[0]
+    if isinstance(envio, Exception):
+        raise envio
+    return _resultado_lote(invoices, id_lote, envio, chave_lote)
+
+
+def autorizar_pendentes(queryset=None, tamanho_lote=None, aguardar=True):
+    """
+    Autoriza em lotes todas as notas pendentes com XML gerado
+
+    Antes do envio cada UF é roteada (escolher_autorizador); lotes normais
+    que não chegaram à SEFAZ da UF são reemitidos e reenviados à SVC se o
+    circuito da UF abrir com a falha.
+
+    Lotes que seguem em processamento (aguardar=False, ou recibo ainda em
+    105 ao fim das consultas) ficam com o recibo registrado para o agendador.
+
+    Args:
+        queryset: Notas a enviar (padrão: status 'pending' com xml_file)
+        tamanho_lote: Notas por lote (padrão: NFE_LOTE_TAMANHO)
+        aguardar: Consulta o recibo até o processamento; False só envia
+
+    Returns:
+        dict: {
+            'lotes': 3,
+            'notas': 120,
+            'autorizadas': 118,
+            'denegadas': 1,
+            'pendentes': 1,
+            'contingencia': 0,    # notas enviadas à SVC
+            'recibos': 0,         # lotes aguardando o agendador de recibos
+            'tempo_total': 2.31,
+            'resultados': [...]
+        }
+    """
+    from invoices.models import Invoice
+
+    if queryset is None:
+        queryset = (
+            Invoice.objects.filter(status='pending').exclude(xml_file='').exclude(xml_file__isnull=True)
+            .exclude(receipt__status='waiting')
+        )
+
+    inicio = time.perf_counter()
+    lotes = _rotear(agrupar_lotes(queryset.order_by('pk'), tamanho_lote))
+    envios = _transmitir_lotes(lotes, aguardar)
+
+    # Lotes normais recusados antes de chegar à SEFAZ: nova rota com o circuito atualizado
+    recusados = [
+        indice for indice, ((chave, _), (_, envio)) in enumerate(zip(lotes, envios))
+        if chave[3] == '1' and _nao_entregue(envio)
+    ]
+    if recusados:
+        novos = _rotear([lotes[indice] for indice in recusados])
+        desviados = [(indice, lote) for indice, lote in zip(recusados, novos) if lote[0][3] != '1']
+        for (indice, lote), reenvio in zip(desviados, _transmitir_lotes([lote for _, lote in desviados], aguardar)):
+            lotes[indice] = lote
+            envios[indice] = reenvio
+
+    resultados = []
+    recibos = 0
+    for (chave_lote, invoices), (id_lote, envio) in zip(lotes, envios):
+        uf = chave_lote[1]
+        if isinstance(envio, Exception):
+            logger.error(f"Erro ao enviar lote de {len(invoices)} NF-e ({uf}): {str(envio)}")
+            resultados.extend({
+                'invoice_id': inv.pk, 'chave_acesso': inv.access_key, 'status': inv.status,
+                'codigo': None, 'mensagem': f'Erro ao enviar lote: {str(envio)}', 'protocolo': None,
+                'respondida': False,
+            } for inv in invoices)
+        else:
+            resultados.extend(_resultado_lote(invoices, id_lote, envio, chave_lote)['resultados'])
+            recibos += bool(_aguardando_recibo(envio))
+
+    contagem = defaultdict(int)
+    for resultado in resultados:
+        contagem[resultado['status']] += 1
+
+    return {
+        'lotes': len(lotes),
+        'notas': len(resultados),
+        'autorizadas': contagem['authorized'],
+        'denegadas': contagem['denied'],
+        'pendentes': len(resultados) - contagem['authorized'] - contagem['denied'],
+        'recibos': recibos,
+        'contingencia': sum(len(invoices) for (_, _, _, tp_emis), invoices in lotes if tp_emis != '1'),
+        'tempo_total': round(time.perf_counter() - inicio, 4),
+        'resultados': resultados,
+    }
@@ -0,0 +1,348 @@
+"""
+Servidor SOAP local que imita os web services da SEFAZ
+Usado em testes e benchmarks no lugar de NFeAutorizacao4/NFeRetAutorizacao4,
+NFeStatusServico4, NFeConsultaProtocolo4, NFeRecepcaoEvento4 e
+NFeDistribuicaoDFe, sem rede externa. Fala HTTP/1.1 keep-alive e, opcionalmente, TLS com certificado
+de cliente obrigatório (como a SEFAZ).
+"""
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from collections import Counter
+from datetime import datetime
+import xml.etree.ElementTree as ET
+import threading
+import base64
+import gzip
+import itertools
+import time
+import ssl
+
+from .sefaz_integration import NFE_NAMESPACE, SOAP12_NAMESPACE, SERVICOS_WSDL, OPERACOES_SOAP
+
+LIMITE_NOTAS_LOTE = 50
+
+# Eventos por envEvento
+LIMITE_EVENTOS_LOTE = 20
+
+# docZip por resposta da distribuição de DF-e
+LIMITE_DOCUMENTOS_DFE = 50
+
+# Elemento raiz da mensagem -> serviço atendido
+MENSAGENS = {
+    'enviNFe': 'autorizacao',
+    'consReciNFe': 'retorno_autorizacao',
+    'consStatServ': 'status_servico',
+    'consSitNFe': 'consulta_protocolo',
+    'envEvento': 'evento',
+    'distDFeInt': 'distribuicao_dfe',
+}
+
+# Serviço -> retorno enviado quando a SEFAZ está paralisada
+RETORNOS_PARALISADO = {
+    'autorizacao': 'retEnviNFe',
+    'status_servico': 'retConsStatServ',
+}
+
+
+class _Servidor(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def handle_error(self, request, client_address):
+        # Clientes que desistem por timeout não são falha do servidor de testes
+        pass
+
+
+class SefazMockServer:
+    """
+    SEFAZ de mentira em 127.0.0.1 (porta livre escolhida pelo sistema)
+
+    Uso:
+        with SefazMockServer() as sefaz:
+            settings.NFE_SEFAZ_WEBSERVICES = sefaz.webservices()
+            ...
+            sefaz.requisicoes['autorizacao']  # chamadas recebidas
+
+    Args:
+        rejeitar: {chave: (cStat, xMotivo)} para notas que não devem ser autorizadas
+        consultas_pendentes: Quantas consultas de recibo respondem 105
+                             (lote em processamento) antes do resultado
+        cuf: Código da UF usado nos protocolos
+        latencia: Segundos de espera antes de cada resposta (tempo de processamento)
+        tls: CertificadoA1 (nfe_signer) do servidor para atender em HTTPS
+        ca_clientes: CertificadoA1 do cliente aceito (TLS mútuo)
+        paralisado: Responde 108 (serviço paralisado) à autorização e ao
+                    status do serviço; pode ser alterado com o servidor no ar
+        documentos_dfe: [(schema, xml)] servidos pela distribuição de DF-e,
+                        com NSU 1, 2, 3... (a lista pode crescer com o servidor no ar)
+    """
+
+    def __init__(self, rejeitar=None, consultas_pendentes=0, cuf='41', latencia=0, tls=None, ca_clientes=None,
+                 paralisado=False, documentos_dfe=None):
+        self.rejeitar = dict(rejeitar or {})
+        self.consultas_pendentes = consultas_pendentes
+        self.cuf = cuf
+        self.latencia = latencia
+        self.tls = tls
+        self.ca_clientes = ca_clientes
+        self.paralisado = paralisado
+        self.documentos_dfe = list(documentos_dfe or [])
+        self.nsus_consultados = []
+        self.requisicoes = Counter()
+        self.conexoes = 0
+        self.notas_recebidas = 0
+        self.eventos_recebidos = 0
+        self._autorizadas = {}
+        self._eventos = set()
+        self._recibos = {}
+        self._sequencia = itertools.count(1)
+        self._lock = threading.Lock()
+        self._server = None
+        self._thread = None
+
+    # ========== Ciclo de vida ==========
+
+    def start(self):
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def setup(self):
+                super().setup()
+                with mock._lock:
+                    mock.conexoes += 1
+
+            def do_POST(self):
+                corpo = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                status, resposta = mock.responder(corpo)
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/soap+xml; charset=utf-8')
+                self.send_header('Content-Length', str(len(resposta)))
+                self.end_headers()
+                self.wfile.write(resposta)
+
+            def log_message(self, *args):
+                pass
+
+        self._server = _Servidor(('127.0.0.1', 0), Handler)
+        if self.tls:
+            contexto = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            self.tls.carregar_em(contexto)
+            if self.ca_clientes:
+                contexto.verify_mode = ssl.CERT_REQUIRED
+                contexto.load_verify_locations(cadata=self.ca_clientes.pem)
+            self._server.socket = contexto.wrap_socket(self._server.socket, server_side=True)
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        if self._server:
+            self._server.shutdown()
+            self._server.server_close()
+            self._server = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    @property
+    def url(self):
+        host, porta = self._server.server_address[:2]
+        return f'{"https" if self.tls else "http"}://{host}:{porta}'
+
+    def webservices(self):
+        """Mapa serviço -> URL no formato de settings.NFE_SEFAZ_WEBSERVICES"""
+        return {servico: f'{self.url}/{wsdl.rsplit("/", 1)[-1]}' for servico, wsdl in SERVICOS_WSDL.items()}
+
+    # ========== Protocolo ==========
+
+    def responder(self, conteudo):
+        """Processa um envelope SOAP e retorna (status HTTP, bytes da resposta)"""
+        try:
+            body = ET.fromstring(conteudo).find(f'{{{SOAP12_NAMESPACE}}}Body')
+            mensagem = body[0][0]
+            if not mensagem.tag.startswith(f'{{{NFE_NAMESPACE}}}'):
+                # <operação><nfeDadosMsg>mensagem</nfeDadosMsg></operação>
+                mensagem = mensagem[0]
+            nome = mensagem.tag.split('}')[-1]
+            servico = MENSAGENS[nome]
+        except (ET.ParseError, IndexError, KeyError, TypeError):
+            return 500, self._fault('Mensagem SOAP não reconhecida')
+
+        with self._lock:
+            self.requisicoes[servico] += 1
+        if self.latencia:
+            time.sleep(self.latencia)
+
+        if self.paralisado and servico in RETORNOS_PARALISADO:
+            retorno = self._ret(RETORNOS_PARALISADO[servico], '108', 'Serviço Paralisado Momentaneamente (curto prazo)')
+        else:
+            retorno = getattr(self, f'_{servico}')(mensagem)
+        return 200, self._envelope(servico, retorno)
+
+    def _envelope(self, servico, retorno):
+        operacao = OPERACOES_SOAP.get(servico)
+        if operacao:
+            resultado = (
+                f'<{operacao}Response xmlns="{SERVICOS_WSDL[servico]}">'
+                f'<{operacao}Result>{retorno}</{operacao}Result></{operacao}Response>'
+            )
+        else:
+            resultado = f'<nfeResultMsg xmlns="{SERVICOS_WSDL[servico]}">{retorno}</nfeResultMsg>'
+        return (
+            '<?xml version="1.0" encoding="utf-8"?>'
+            f'<soap:Envelope xmlns:soap="{SOAP12_NAMESPACE}"><soap:Body>'
+            f'{resultado}'
+            '</soap:Body></soap:Envelope>'
+        ).encode('utf-8')
+
+    def _fault(self, motivo):
+        return (
+            f'<soap:Envelope xmlns:soap="{SOAP12_NAMESPACE}"><soap:Body><soap:Fault>'
+            f'<soap:Reason><soap:Text>{motivo}</soap:Text></soap:Reason>'
+            '</soap:Fault></soap:Body></soap:Envelope>'
+        ).encode('utf-8')
+
+    def _agora(self):
+        return datetime.now().astimezone().isoformat(timespec='seconds')
+
+    def _ret(self, tag, c_stat, x_motivo, extra=''):
+        return (
+            f'<{tag} xmlns="{NFE_NAMESPACE}" versao="4.00"><tpAmb>2</tpAmb><verAplic>MOCK-4.00</verAplic>'
+            f'<cStat>{c_stat}</cStat><xMotivo>{x_motivo}</xMotivo><cUF>{self.cuf}</cUF>'
+            f'<dhRecbto>{self._agora()}</dhRecbto>{extra}</{tag}>'
+        )
+
+    def _prot_nfe(self, chave):
+        c_stat, x_motivo = self.rejeitar.get(chave, ('100', 'Autorizado o uso da NF-e'))
+        n_prot = f'{self.cuf}1{datetime.now():%y}{next(self._sequencia):010d}' if c_stat in ('100', '110', '301', '302') else ''
+        if n_prot:
+            self._autorizadas[chave] = (c_stat, x_motivo, n_prot)
+        return self._montar_prot_nfe(chave, c_stat, x_motivo, n_prot)
+
+    def _montar_prot_nfe(self, chave, c_stat, x_motivo, n_prot):
+        return (
+            '<protNFe versao="4.00"><infProt>'
+            f'<tpAmb>2</tpAmb><verAplic>MOCK-4.00</verAplic><chNFe>{chave}</chNFe>'
+            f'<dhRecbto>{self._agora()}</dhRecbto>'
+            + (f'<nProt>{n_prot}</nProt>' if n_prot else '')
+            + f'<cStat>{c_stat}</cStat><xMotivo>{x_motivo}</xMotivo>'
+            '</infProt></protNFe>'
+        )
+
+    def _autorizacao(self, envi_nfe):
+        chaves = [
+            inf.get('Id', '')[3:]
+            for inf in envi_nfe.iter(f'{{{NFE_NAMESPACE}}}infNFe')
+        ]
+        sincrono = envi_nfe.findtext(f'{{{NFE_NAMESPACE}}}indSinc') == '1'
+
+        with self._lock:
+            self.notas_recebidas += len(chaves)
+
+        if not chaves:
+            return self._ret('retEnviNFe', '225', 'Rejeição: Falha no Schema XML do lote de NF-e')
+        if len(chaves) > LIMITE_NOTAS_LOTE:
+            return self._ret('retEnviNFe', '776', 'Rejeição: Lote com mais de 50 NF-e')
+        if sincrono and len(chaves) > 1:
+            return self._ret('retEnviNFe', '452', 'Rejeição: Solicitada resposta síncrona para lote com mais de uma NF-e')
+
+        protocolos = ''.join(self._prot_nfe(chave) for chave in chaves)
+        if sincrono:
+            return self._ret('retEnviNFe', '104', 'Lote processado', protocolos)
+
+        with self._lock:
+            recibo = f'{self.cuf}{next(self._sequencia):013d}'
+            self._recibos[recibo] = [self.consultas_pendentes, protocolos]
+        return self._ret(
+            'retEnviNFe', '103', 'Lote recebido com sucesso',
+            f'<infRec><nRec>{recibo}</nRec><tMed>1</tMed></infRec>'
+        )
+
+    def _retorno_autorizacao(self, cons_reci):
+        recibo = cons_reci.findtext(f'{{{NFE_NAMESPACE}}}nRec')
+        with self._lock:
+            entrada = self._recibos.get(recibo)
+            if entrada and entrada[0] > 0:
+                entrada[0] -= 1
+                return self._ret('retConsReciNFe', '105', 'Lote em processamento', f'<nRec>{recibo}</nRec>')
+        if entrada is None:
+            return self._ret('retConsReciNFe', '106', 'Lote não localizado', f'<nRec>{recibo}</nRec>')
+        return self._ret('retConsReciNFe', '104', 'Lote processado', f'<nRec>{recibo}</nRec>{entrada[1]}')
+
+    def _status_servico(self, mensagem):
+        return self._ret('retConsStatServ', '107', 'Serviço em Operação', '<tMed>1</tMed>')
+
+    def _consulta_protocolo(self, cons_sit):
+        chave = cons_sit.findtext(f'{{{NFE_NAMESPACE}}}chNFe')
+        with self._lock:
+            autorizada = self._autorizadas.get(chave)
+        if autorizada is None:
+            return self._ret('retConsSitNFe', '217', 'Rejeição: NF-e não consta na base de dados da SEFAZ')
+        return self._ret('retConsSitNFe', autorizada[0], autorizada[1], self._montar_prot_nfe(chave, *autorizada))
+
+    def _evento(self, env_evento):
+        infs = list(env_evento.iter(f'{{{NFE_NAMESPACE}}}infEvento'))
+        with self._lock:
+            self.eventos_recebidos += len(infs)
+        if len(infs) > LIMITE_EVENTOS_LOTE:
+            return self._ret('retEnvEvento', '225', 'Rejeição: Falha no Schema XML do lote de eventos')
+
+        retornos = []
+        for inf in infs:
+            chave = inf.findtext(f'{{{NFE_NAMESPACE}}}chNFe')
+            tipo = inf.findtext(f'{{{NFE_NAMESPACE}}}tpEvento')
+            sequencia = inf.findtext(f'{{{NFE_NAMESPACE}}}nSeqEvento')
+            with self._lock:
+                registrada = chave in self._autorizadas
+                duplicado = (chave, tipo, sequencia) in self._eventos
+                if not duplicado:
+                    self._eventos.add((chave, tipo, sequencia))
+                n_prot = '' if duplicado else f'{self.cuf}1{datetime.now():%y}{next(self._sequencia):010d}'
+            c_stat, x_motivo = (
+                ('573', 'Rejeição: Duplicidade de Evento') if duplicado
+                else ('135', 'Evento registrado e vinculado a NF-e') if registrada
+                else ('136', 'Evento registrado, mas não vinculado a NF-e')
+            )
+            retornos.append(
+                '<retEvento versao="1.00"><infEvento>'
+                f'<tpAmb>2</tpAmb><verAplic>MOCK-4.00</verAplic><cOrgao>{self.cuf}</cOrgao>'
+                f'<cStat>{c_stat}</cStat><xMotivo>{x_motivo}</xMotivo><chNFe>{chave}</chNFe>'
+                f'<tpEvento>{tipo}</tpEvento><nSeqEvento>{sequencia}</nSeqEvento>'
+                f'<dhRegEvento>{self._agora()}</dhRegEvento>' + (f'<nProt>{n_prot}</nProt>' if n_prot else '')
+                + '</infEvento></retEvento>'
+            )
+        id_lote = env_evento.findtext(f'{{{NFE_NAMESPACE}}}idLote')
+        return (
+            f'<retEnvEvento xmlns="{NFE_NAMESPACE}" versao="1.00"><idLote>{id_lote}</idLote>'
+            f'<tpAmb>2</tpAmb><verAplic>MOCK-4.00</verAplic><cOrgao>{self.cuf}</cOrgao>'
+            f'<cStat>128</cStat><xMotivo>Lote de Evento Processado</xMotivo>{"".join(retornos)}</retEnvEvento>'
+        )
+
+    def _distribuicao_dfe(self, dist):
+        ult_nsu = int(dist.findtext(f'{{{NFE_NAMESPACE}}}distNSU/{{{NFE_NAMESPACE}}}ultNSU') or 0)
+        with self._lock:
+            self.nsus_consultados.append(ult_nsu)
+            documentos = list(enumerate(self.documentos_dfe, 1))
+        max_nsu = len(documentos)
+        pagina = [(nsu, doc) for nsu, doc in documentos if nsu > ult_nsu][:LIMITE_DOCUMENTOS_DFE]
+        if not pagina:
+            return self._ret_dist('137', 'Nenhum documento localizado', ult_nsu, max_nsu)
+
+        doc_zips = ''.join(
+            f'<docZip NSU="{nsu:015d}" schema="{schema}">'
+            f'{base64.b64encode(gzip.compress(xml.encode("utf-8"))).decode("ascii")}</docZip>'
+            for nsu, (schema, xml) in pagina
+        )
+        return self._ret_dist('138', 'Documento localizado', pagina[-1][0], max_nsu,
+                              f'<loteDistDFeInt>{doc_zips}</loteDistDFeInt>')
+
+    def _ret_dist(self, c_stat, x_motivo, ult_nsu, max_nsu, lote=''):
+        return (
+            f'<retDistDFeInt xmlns="{NFE_NAMESPACE}" versao="1.01"><tpAmb>2</tpAmb><verAplic>MOCK-1.01</verAplic>'
+            f'<cStat>{c_stat}</cStat><xMotivo>{x_motivo}</xMotivo><dhResp>{self._agora()}</dhResp>'
+            f'<ultNSU>{ult_nsu:015d}</ultNSU><maxNSU>{max_nsu:015d}</maxNSU>{lote}</retDistDFeInt>'
+        )
@@ -0,0 +1,259 @@
+"""
+Agendador de consulta de recibos (NFeRetAutorizacao4)
+Lotes enviados em modo assíncrono deixam um SefazReceipt aguardando. O
+agendador consulta os recibos vencidos agrupados por endpoint, todos em
+paralelo pelo transporte assíncrono, reagenda os que seguem em
+processamento (cStat 105) com backoff exponencial e aplica os protNFe nas
+Invoices com um único bulk_update. Recibos que esgotam as consultas têm a
+situação de cada nota consultada pela chave (consSitNFe), já que reenviar
+a nota só traria a rejeição de duplicidade.
+"""
+from collections import defaultdict
+from datetime import timedelta
+from django.conf import settings
+from django.utils import timezone
+from .sefaz_integration import SefazIntegration, CONTINGENCIA_POR_TP_EMIS
+from .sefaz_async import executar
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+# Intervalos entre consultas de um recibo (segundos) e limite de consultas
+DEFAULT_INTERVALO_INICIAL = 1.0
+DEFAULT_INTERVALO_MAXIMO = 60.0
+DEFAULT_MAX_CONSULTAS = 20
+
+# Espera máxima do agendador sem recibos pendentes (segundos)
+DEFAULT_INTERVALO_OCIOSO = 5.0
+
+
+def get_intervalo_inicial():
+    """Espera antes da primeira consulta (settings.NFE_RECIBO_INTERVALO_INICIAL)"""
+    return float(getattr(settings, 'NFE_RECIBO_INTERVALO_INICIAL', DEFAULT_INTERVALO_INICIAL))
+
+
+def get_intervalo_maximo():
+    """Teto do backoff (settings.NFE_RECIBO_INTERVALO_MAXIMO)"""
+    return float(getattr(settings, 'NFE_RECIBO_INTERVALO_MAXIMO', DEFAULT_INTERVALO_MAXIMO))
+
+
+def get_max_consultas():
+    """Consultas sem resultado até o recibo expirar (settings.NFE_RECIBO_MAX_CONSULTAS)"""
+    return int(getattr(settings, 'NFE_RECIBO_MAX_CONSULTAS', DEFAULT_MAX_CONSULTAS))
+
+
+def intervalo_consulta(tentativas):
+    """Backoff exponencial: inicial * 2^tentativas, limitado ao máximo"""
+    return min(get_intervalo_inicial() * 2 ** tentativas, get_intervalo_maximo())
+
+
+def registrar_recibo(invoices, recibo, id_lote, uf, ambiente='homologacao', tp_emis='1'):
+    """
+    Registra o recibo de um lote assíncrono e vincula as notas a ele
+
+    Args:
+        invoices: Notas enviadas no lote
+        recibo: nRec devolvido pela SEFAZ
+        id_lote: idLote do enviNFe
+        uf: UF do emitente
+        ambiente: 'homologacao' ou 'producao'
+        tp_emis: Tipo de emissão do lote (define o autorizador: UF ou SVC)
+
+    Returns:
+        SefazReceipt: Recibo aguardando consulta
+    """
+    from invoices.models import SefazReceipt
+
+    registro = SefazReceipt.objects.create(
+        number=recibo,
+        lot_id=id_lote,
+        state=uf,
+        environment='2' if ambiente == 'homologacao' else '1',
+        emission_type=tp_emis or '1',
+        next_poll_at=timezone.now() + timedelta(seconds=intervalo_consulta(0)),
+    )
+    for invoice in invoices:
+        invoice.receipt = registro
+    if invoices:
+        type(invoices[0]).objects.bulk_update(invoices, ['receipt'])
+    return registro
+
+
+def _endpoint(registro):
+    """(uf, ambiente, contingência): recibos do mesmo autorizador compartilham o pool"""
+    ambiente = 'homologacao' if registro.environment == '2' else 'producao'
+    return registro.state, ambiente, CONTINGENCIA_POR_TP_EMIS.get(registro.emission_type)
+
+
+def _consultar(grupos):
+    """Consulta todos os recibos em paralelo; retorna {recibo: retorno ou Exception}"""
+
+    async def todos():
+        tarefas = []
+        for (uf, ambiente, contingencia), registros in grupos.items():
+            sefaz = SefazIntegration(uf=uf, ambiente=ambiente, contingencia=contingencia)
+            tarefas.extend((registro.number, sefaz.aconsultar_recibo(registro.number)) for registro in registros)
+        retornos = await asyncio.gather(*(tarefa for _, tarefa in tarefas), return_exceptions=True)
+        return {numero: retorno for (numero, _), retorno in zip(tarefas, retornos)}
+
+    return executar(todos())
+
+
+def _consultar_situacoes(grupos):
+    """Consulta a situação das notas pela chave em paralelo; retorna {chave: retorno ou Exception}"""
+
+    async def todos():
+        tarefas = []
+        for (uf, ambiente, contingencia), chaves in grupos.items():
+            sefaz = SefazIntegration(uf=uf, ambiente=ambiente, contingencia=contingencia)
+            tarefas.extend((chave, sefaz.aconsultar_protocolo(chave)) for chave in chaves)
+        retornos = await asyncio.gather(*(tarefa for _, tarefa in tarefas), return_exceptions=True)
+        return {chave: retorno for (chave, _), retorno in zip(tarefas, retornos)}
+
+    return executar(todos())
+
+
+def _conclusivo(retorno):
+    """Situação definitiva: com protNFe ou não consta na base (217, nota livre para reenvio)"""
+    return not isinstance(retorno, Exception) and (retorno['protocolos'] or retorno['codigo'] == '217')
+
+
+def consultar_recibos(limite=None, agora=None):
+    """
+    Consulta os recibos cuja próxima consulta já venceu
+
+    Args:
+        limite: Máximo de recibos consultados nesta rodada
+        agora: Instante de referência (padrão: timezone.now())
+
+    Returns:
+        dict: {
+            'consultados': 4,
+            'processados': 3,
+            'aguardando': 1,    # ainda em processamento (105) ou com erro de comunicação
+            'expirados': 0,     # esgotados com a situação das notas já consultada pela chave
+            'erros': 0,
+            'autorizadas': 148,
+            'denegadas': 1,
+            'resultados': [...]  # ver sefaz_lote.aplicar_protocolos()
+        }
+    """
+    from invoices.models import Invoice, SefazReceipt
+    from .sefaz_lote import aplicar_protocolos
+
+    agora = agora or timezone.now()
+    vencidos = SefazReceipt.objects.filter(status='waiting', next_poll_at__lte=agora).order_by('next_poll_at')
+    registros = list(vencidos[:limite] if limite else vencidos)
+
+    grupos = defaultdict(list)
+    for registro in registros:
+        grupos[_endpoint(registro)].append(registro)
+    retornos = _consultar(grupos) if registros else {}
+
+    processados = []
+    esgotados = []
+    protocolos = []
+    erros = 0
+    for registro in registros:
+        retorno = retornos[registro.number]
+        registro.attempts += 1
+        registro.updated_at = agora
+
+        if isinstance(retorno, Exception):
+            erros += 1
+            registro.last_code, registro.last_message = None, str(retorno)[:255]
+            logger.error(f"Erro ao consultar recibo {registro.number}: {str(retorno)}")
+        else:
+            registro.last_code, registro.last_message = retorno['codigo'], (retorno['mensagem'] or '')[:255]
+            if retorno['codigo'] != '105':
+                # Processado: com protNFe ou rejeitado por inteiro (notas voltam a ficar livres para reenvio)
+                registro.status = 'processed'
+                processados.append(registro)
+                protocolos.extend(retorno['protocolos'])
+                continue
+
+        registro.next_poll_at = agora + timedelta(seconds=intervalo_consulta(registro.attempts))
+        if registro.attempts >= get_max_consultas():
+            esgotados.append(registro)
+
+    invoices = list(Invoice.objects.filter(receipt__in=processados)) if processados else []
+    if esgotados:
+        # Sem resultado pelo recibo: a situação de cada nota é consultada pela chave; o recibo só
+        # expira (liberando as notas que não constam na base) com resposta definitiva para todas
+        notas = defaultdict(list)
+        for invoice in Invoice.objects.filter(receipt__in=esgotados).exclude(access_key=None).exclude(access_key=''):
+            notas[invoice.receipt_id].append(invoice)
+        grupos = defaultdict(list)
+        for registro in esgotados:
+            grupos[_endpoint(registro)].extend(invoice.access_key for invoice in notas[registro.pk])
+        situacoes = _consultar_situacoes(grupos) if any(grupos.values()) else {}
+
+        for registro in esgotados:
+            retornos_notas = [situacoes[invoice.access_key] for invoice in notas[registro.pk]]
+            if not all(_conclusivo(retorno) for retorno in retornos_notas):
+                logger.warning(f"Recibo {registro.number} sem resultado após {registro.attempts} consultas; "
+                               f"situação das notas ainda indefinida")
+                continue
+            registro.status = 'expired'
+            logger.warning(f"Recibo {registro.number} expirado; situação das notas consultada pela chave")
+            invoices.extend(notas[registro.pk])
+            protocolos.extend(p for retorno in retornos_notas for p in retorno['protocolos'])
+
+    resultados = aplicar_protocolos(invoices, protocolos) if invoices else []
+
+    if registros:
+        SefazReceipt.objects.bulk_update(
+            registros, ['status', 'attempts', 'next_poll_at', 'last_code', 'last_message', 'updated_at']
+        )
+
+    return {
+        'consultados': len(registros),
+        'processados': len(processados),
+        'aguardando': sum(1 for r in registros if r.status == 'waiting'),
+        'expirados': sum(1 for r in registros if r.status == 'expired'),
+        'erros': erros,
+        'autorizadas': sum(1 for r in resultados if r['status'] == 'authorized'),
+        'denegadas': sum(1 for r in resultados if r['status'] == 'denied'),
+        'resultados': resultados,
+    }
+
+
+def proxima_consulta():
+    """Segundos até o próximo recibo vencer (None se não houver recibos aguardando)"""
+    from invoices.models import SefazReceipt
+
+    proximo = (
+        SefazReceipt.objects.filter(status='waiting').order_by('next_poll_at')
+        .values_list('next_poll_at', flat=True).first()
+    )
+    if proximo is None:
+        return None
+    return max((proximo - timezone.now()).total_seconds(), 0)
+
+
+def executar_agendador(intervalo_ocioso=None, parar=None, limite=None):
+    """
+    Laço do agendador: consulta os recibos vencidos e dorme até o próximo
+
+    Args:
+        intervalo_ocioso: Espera máxima entre rodadas (padrão: 5s)
+        parar: threading.Event opcional para encerrar o laço
+        limite: Recibos por rodada
+    """
+    intervalo_ocioso = DEFAULT_INTERVALO_OCIOSO if intervalo_ocioso is None else intervalo_ocioso
+    while parar is None or not parar.is_set():
+        resultado = consultar_recibos(limite=limite)
+        if resultado['consultados']:
+            logger.info(
+                f"{resultado['consultados']} recibo(s) consultados: {resultado['processados']} processados, "
+                f"{resultado['autorizadas']} NF-e autorizadas"
+            )
+
+        espera = proxima_consulta()
+        espera = intervalo_ocioso if espera is None else min(espera, intervalo_ocioso)
+        if parar is not None:
+            parar.wait(espera)
+        else:
+            time.sleep(espera)
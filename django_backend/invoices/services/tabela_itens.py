@@ -0,0 +1,210 @@
+"""
+Tabela de itens paginada para os DANFEs em reportlab
+Substitui a platypus Table de todos os itens, cujo split/layout cresce mais
+que linearmente com o número de linhas. As linhas são guardadas só como
+texto já quebrado, com a altura de cada uma calculada uma única vez (soma
+acumulada); cada página recebe um pedaço da mesma lista, com o cabeçalho
+repetido e, a partir da segunda, a faixa de continuação do quadro de
+produtos do layout oficial.
+"""
+from reportlab.lib import colors
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.platypus import Flowable
+from bisect import bisect_right
+from itertools import accumulate
+
+# Espaçamento interno das células (pt)
+PADDING_H = 1.5
+PADDING_V = 1.5
+
+
+def _quebrar(texto, largura, fonte, tamanho):
+    """
+    Quebra o texto em linhas que cabem na largura (palavras maiores são cortadas)
+
+    Returns:
+        tuple: ((linha, largura da linha), ...)
+    """
+    texto = str(texto)
+    if '\n' not in texto:
+        medida = stringWidth(texto, fonte, tamanho)
+        if medida <= largura:
+            return ((texto, medida),)
+
+    linhas = []
+    for paragrafo in texto.split('\n'):
+        atual = ''
+        for palavra in paragrafo.split(' '):
+            candidata = f'{atual} {palavra}' if atual else palavra
+            if stringWidth(candidata, fonte, tamanho) <= largura:
+                atual = candidata
+                continue
+            if atual:
+                linhas.append(atual)
+            while stringWidth(palavra, fonte, tamanho) > largura and len(palavra) > 1:
+                corte = len(palavra) - 1
+                while corte > 1 and stringWidth(palavra[:corte], fonte, tamanho) > largura:
+                    corte -= 1
+                linhas.append(palavra[:corte])
+                palavra = palavra[corte:]
+            atual = palavra
+        linhas.append(atual)
+    return tuple((linha, stringWidth(linha, fonte, tamanho)) for linha in linhas)
+
+
+class _Dados:
+    """Linhas quebradas e alturas, compartilhadas por todos os pedaços da tabela"""
+
+    def __init__(self, cabecalho, linhas, larguras, fonte, fonte_cabecalho, tamanho, tamanho_cabecalho):
+        self.larguras = larguras
+        self.fonte = fonte
+        self.fonte_cabecalho = fonte_cabecalho
+        self.tamanho = tamanho
+        self.tamanho_cabecalho = tamanho_cabecalho
+        self.entrelinha = tamanho * 1.2
+        self.entrelinha_cabecalho = tamanho_cabecalho * 1.2
+
+        uteis = [largura - 2 * PADDING_H for largura in larguras]
+        self.cabecalho = tuple(
+            _quebrar(texto, util, fonte_cabecalho, tamanho_cabecalho) for texto, util in zip(cabecalho, uteis)
+        )
+        self.altura_cabecalho = max(map(len, self.cabecalho)) * self.entrelinha_cabecalho + 2 * PADDING_V
+
+        self.linhas = []
+        alturas = []
+        for linha in linhas:
+            celulas = tuple(_quebrar(texto, util, fonte, tamanho) for texto, util in zip(linha, uteis))
+            self.linhas.append(celulas)
+            alturas.append(max(map(len, celulas)) * self.entrelinha + 2 * PADDING_V)
+        # acumuladas[i] = altura das i primeiras linhas
+        self.acumuladas = [0.0, *accumulate(alturas)]
+
+    def altura(self, inicio, fim):
+        return self.acumuladas[fim] - self.acumuladas[inicio]
+
+    def cabem(self, inicio, altura):
+        """Índice final do maior pedaço a partir de inicio com até `altura` pt de linhas"""
+        return bisect_right(self.acumuladas, self.acumuladas[inicio] + altura, lo=inicio) - 1
+
+
+class TabelaItens(Flowable):
+    """
+    Tabela de itens que se divide por página em tempo linear
+
+    Args:
+        cabecalho: Textos do cabeçalho ('\\n' quebra a linha)
+        linhas: Iterável de sequências de textos, uma por item
+        larguras: Largura de cada coluna (pt)
+        alinhamentos: 'L', 'C' ou 'R' por coluna (padrão: 'L')
+        titulo_continuacao: Faixa desenhada acima do cabeçalho nas páginas seguintes
+    """
+
+    def __init__(self, cabecalho, linhas, larguras, alinhamentos=None, fonte='Helvetica', fonte_cabecalho='Helvetica-Bold',
+                 tamanho=6, tamanho_cabecalho=6, borda=1, grade=0.5, titulo_continuacao=None, _dados=None, _inicio=0, _fim=None):
+        super().__init__()
+        self.dados = _dados or _Dados(cabecalho, linhas, larguras, fonte, fonte_cabecalho, tamanho, tamanho_cabecalho)
+        self.alinhamentos = alinhamentos or ['L'] * len(larguras)
+        self.borda = borda
+        self.grade = grade
+        self.titulo_continuacao = titulo_continuacao
+        self.inicio = _inicio
+        self.fim = len(self.dados.linhas) if _fim is None else _fim
+        self.largura = sum(larguras)
+
+    @property
+    def continuacao(self):
+        return self.inicio > 0 and bool(self.titulo_continuacao)
+
+    def _altura_fixa(self):
+        faixa = self.dados.altura_cabecalho if self.continuacao else 0
+        return faixa + self.dados.altura_cabecalho
+
+    def _pedaco(self, inicio, fim):
+        return TabelaItens(
+            None, None, self.dados.larguras, self.alinhamentos, borda=self.borda, grade=self.grade,
+            titulo_continuacao=self.titulo_continuacao, _dados=self.dados, _inicio=inicio, _fim=fim,
+        )
+
+    def wrap(self, availWidth, availHeight):
+        self.width = self.largura
+        self.height = self._altura_fixa() + self.dados.altura(self.inicio, self.fim)
+        return self.width, self.height
+
+    def split(self, availWidth, availHeight):
+        fim = self.dados.cabem(self.inicio, availHeight - self._altura_fixa())
+        if fim <= self.inicio:
+            return []
+        if fim >= self.fim:
+            return [self]
+        return [self._pedaco(self.inicio, fim), self._pedaco(fim, self.fim)]
+
+    def _texto(self, texto, linhas, x, topo, largura, alinhamento, tamanho, entrelinha):
+        y = topo - PADDING_V - tamanho
+        for linha, medida in linhas:
+            if alinhamento == 'C':
+                inicio = x + (largura - medida) / 2
+            elif alinhamento == 'R':
+                inicio = x + largura - PADDING_H - medida
+            else:
+                inicio = x + PADDING_H
+            texto.setTextOrigin(inicio, y)
+            texto.textOut(linha)
+            y -= entrelinha
+
+    def draw(self):
+        canv = self.canv
+        dados = self.dados
+        topo = self.height
+
+        if self.continuacao:
+            canv.setFillColor(colors.lightgrey)
+            canv.rect(0, topo - dados.altura_cabecalho, self.largura, dados.altura_cabecalho, stroke=0, fill=1)
+            canv.setFillColor(colors.black)
+            titulo = f'{self.titulo_continuacao} - FOLHA {canv.getPageNumber()}'
+            texto = canv.beginText()
+            texto.setFont(dados.fonte_cabecalho, dados.tamanho_cabecalho)
+            self._texto(texto, [(titulo, 0)], 0, topo, self.largura, 'L', dados.tamanho_cabecalho, dados.entrelinha_cabecalho)
+            canv.drawText(texto)
+            canv.setLineWidth(self.borda)
+            canv.rect(0, topo - dados.altura_cabecalho, self.largura, dados.altura_cabecalho, stroke=1, fill=0)
+            topo -= dados.altura_cabecalho
+
+        # Cabeçalho
+        canv.setFillColor(colors.lightgrey)
+        canv.rect(0, topo - dados.altura_cabecalho, self.largura, dados.altura_cabecalho, stroke=0, fill=1)
+        canv.setFillColor(colors.black)
+        texto = canv.beginText()
+        texto.setFont(dados.fonte_cabecalho, dados.tamanho_cabecalho)
+        x = 0
+        for linhas, largura in zip(dados.cabecalho, dados.larguras):
+            self._texto(texto, linhas, x, topo, largura, 'C', dados.tamanho_cabecalho, dados.entrelinha_cabecalho)
+            x += largura
+        topo_grade = topo
+        topo -= dados.altura_cabecalho
+
+        # Linhas (um único objeto de texto para o pedaço inteiro)
+        texto.setFont(dados.fonte, dados.tamanho)
+        horizontais = [topo]
+        for indice in range(self.inicio, self.fim):
+            x = 0
+            for linhas, largura, alinhamento in zip(dados.linhas[indice], dados.larguras, self.alinhamentos):
+                self._texto(texto, linhas, x, topo, largura, alinhamento, dados.tamanho, dados.entrelinha)
+                x += largura
+            topo -= dados.altura(indice, indice + 1)
+            horizontais.append(topo)
+        canv.drawText(texto)
+
+        # Grade e borda
+        canv.setLineWidth(self.grade)
+        caminho = canv.beginPath()
+        for y in horizontais[:-1]:
+            caminho.moveTo(0, y)
+            caminho.lineTo(self.largura, y)
+        x = 0
+        for largura in dados.larguras[:-1]:
+            x += largura
+            caminho.moveTo(x, topo_grade)
+            caminho.lineTo(x, topo)
+        canv.drawPath(caminho, stroke=1, fill=0)
+        canv.setLineWidth(self.borda)
+        canv.rect(0, topo, self.largura, topo_grade - topo, stroke=1, fill=0)
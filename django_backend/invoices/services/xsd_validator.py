@@ -0,0 +1,191 @@
+"""
+Validação de XML de NF-e contra os schemas XSD da SEFAZ
+Mantém um cache por processo dos schemas compilados, evitando recompilar
+o XSD (e todos os seus includes) a cada nota validada. XMLs grandes podem
+ser validados direto do arquivo, descartando cada elemento já conferido.
+"""
+from django.conf import settings
+from pathlib import Path
+import threading
+import os
+
+try:
+    from lxml import etree
+    _HAS_LXML = True
+except ImportError:
+    _HAS_LXML = False
+
+NFE_VERSAO_PADRAO = '4.00'
+DSIG_SIGNATURE_TAG = '{http://www.w3.org/2000/09/xmldsig#}Signature'
+
+# versão -> (impressão dos XSD no disco, schema, lock de validação)
+_schemas = {}
+_schemas_lock = threading.Lock()
+
+
+def get_xsd_dir():
+    """Diretório dos schemas (settings.NFE_XSD_DIR ou static/xsd)"""
+    return Path(getattr(settings, 'NFE_XSD_DIR', Path(settings.BASE_DIR) / 'static' / 'xsd'))
+
+
+def get_xsd_path(versao=NFE_VERSAO_PADRAO):
+    """Caminho do XSD principal da NF-e para a versão informada"""
+    return get_xsd_dir() / f'nfe_v{versao}.xsd'
+
+
+def _impressao(xsd_dir):
+    """Caminho, mtime e tamanho de cada .xsd do diretório (o principal e todos os includes/imports)"""
+    arquivos = []
+    for pasta, subpastas, nomes in os.walk(xsd_dir):
+        subpastas.sort()
+        for nome in sorted(nomes):
+            if nome.lower().endswith('.xsd'):
+                info = os.stat(os.path.join(pasta, nome))
+                arquivos.append((os.path.relpath(os.path.join(pasta, nome), xsd_dir), info.st_mtime_ns, info.st_size))
+    return str(xsd_dir), tuple(arquivos)
+
+
+def _carregar(versao):
+    """
+    Retorna (schema, lock) para a versão, recompilando apenas quando algum
+    XSD do diretório muda no disco. Retorna (None, None) se o XSD não existir.
+    """
+    xsd_path = get_xsd_path(versao)
+    if not xsd_path.is_file():
+        return None, None
+    impressao = _impressao(xsd_path.parent)
+
+    entrada = _schemas.get(versao)
+    if entrada and entrada[0] == impressao:
+        return entrada[1], entrada[2]
+
+    with _schemas_lock:
+        entrada = _schemas.get(versao)
+        if entrada and entrada[0] == impressao:
+            return entrada[1], entrada[2]
+
+        # Parse pelo caminho para que xs:include/xs:import relativos funcionem
+        schema = etree.XMLSchema(etree.parse(str(xsd_path)))
+        _schemas[versao] = (impressao, schema, threading.Lock())
+        return schema, _schemas[versao][2]
+
+
+def get_schema(versao=NFE_VERSAO_PADRAO):
+    """Schema compilado (etree.XMLSchema) ou None se o XSD não estiver disponível"""
+    if not _HAS_LXML:
+        return None
+    return _carregar(versao)[0]
+
+
+def limpar_cache():
+    """Descarta os schemas compilados (usado em testes e após atualizar os XSD)"""
+    with _schemas_lock:
+        _schemas.clear()
+
+
+def _erro_assinatura(erro):
+    """Indica se o erro do schema é apenas a ausência da tag Signature"""
+    return DSIG_SIGNATURE_TAG in erro.message and 'Missing child element' in erro.message
+
+
+def validar_xml(xml, versao=NFE_VERSAO_PADRAO, exigir_assinatura=True):
+    """
+    Valida um XML de NF-e contra o XSD da versão informada
+
+    Args:
+        xml: String/bytes com o XML ou elemento lxml já parseado
+        versao: Versão do leiaute (ex.: '4.00')
+        exigir_assinatura: Se False, ignora o erro de Signature ausente
+                           (XML ainda não assinado)
+
+    Returns:
+        dict: {
+            'valido': True/False,
+            'schema': True,           # False quando o XSD não está disponível
+            'erros': ['Linha 12, coluna 0: Element ...'],
+            'detalhes': [{'linha': 12, 'coluna': 0, 'mensagem': '...'}]
+        }
+    """
+    resultado = {'valido': True, 'schema': False, 'erros': [], 'detalhes': []}
+
+    if not _HAS_LXML:
+        return resultado
+
+    schema, lock = _carregar(versao)
+    if schema is None:
+        return resultado
+    resultado['schema'] = True
+
+    try:
+        if isinstance(xml, str):
+            xml = xml.encode('utf-8')
+        documento = etree.fromstring(xml) if isinstance(xml, bytes) else xml
+    except etree.XMLSyntaxError as e:
+        resultado['valido'] = False
+        resultado['erros'].append(f'Erro ao parsear XML: {str(e)}')
+        resultado['detalhes'].append({'linha': e.lineno, 'coluna': e.offset, 'mensagem': str(e)})
+        return resultado
+
+    # O error_log pertence ao objeto schema: serializa o uso entre threads
+    with lock:
+        schema.validate(documento)
+        erros = list(schema.error_log)
+
+    for erro in erros:
+        if not exigir_assinatura and _erro_assinatura(erro):
+            continue
+        resultado['detalhes'].append({'linha': erro.line, 'coluna': erro.column, 'mensagem': erro.message})
+        resultado['erros'].append(f'Linha {erro.line}, coluna {erro.column}: {erro.message}')
+
+    resultado['valido'] = not resultado['erros']
+    return resultado
+
+
+def validar_arquivo(arquivo, versao=NFE_VERSAO_PADRAO, exigir_assinatura=True):
+    """
+    Valida contra o XSD um XML lido de um arquivo, sem manter a árvore
+
+    O schema confere os elementos à medida que são lidos (iterparse) e cada
+    um é descartado em seguida, então a memória não cresce com o número de
+    itens. A validação para no primeiro erro; a linha informada é a do
+    último elemento lido.
+
+    Args:
+        arquivo: Arquivo binário aberto para leitura (lido a partir do início)
+        versao: Versão do leiaute (ex.: '4.00')
+        exigir_assinatura: Se False, ignora o erro de Signature ausente
+
+    Returns:
+        dict: mesmo formato de validar_xml()
+    """
+    resultado = {'valido': True, 'schema': False, 'erros': [], 'detalhes': []}
+
+    if not _HAS_LXML:
+        return resultado
+
+    schema, lock = _carregar(versao)
+    if schema is None:
+        return resultado
+    resultado['schema'] = True
+
+    arquivo.seek(0)
+    linha = 0
+    try:
+        with lock:
+            for evento, elemento in etree.iterparse(arquivo, events=('start', 'end'), schema=schema):
+                linha = elemento.sourceline or linha
+                if evento == 'end':
+                    elemento.clear()
+                    while elemento.getprevious() is not None:
+                        del elemento.getparent()[0]
+    except etree.XMLSyntaxError as e:
+        mensagem = e.msg
+        # Sem assinatura, o único erro possível no fechamento de <NFe> é a Signature ausente
+        if exigir_assinatura or not (DSIG_SIGNATURE_TAG in mensagem and 'Missing child element' in mensagem):
+            coluna = e.offset if e.lineno else 0
+            linha = e.lineno or linha
+            resultado['detalhes'].append({'linha': linha, 'coluna': coluna, 'mensagem': mensagem})
+            resultado['erros'].append(f'Linha {linha}, coluna {coluna}: {mensagem}')
+
+    resultado['valido'] = not resultado['erros']
+    return resultado
@@ -0,0 +1,30 @@
+"""
+Sinais do app de notas fiscais
+Salvar uma nota (ou um item) descarta o DANFE em cache da nota.
+"""
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from .models import Invoice, InvoiceItem
+from .services import danfe_cache
+
+# update_fields que mudam o DANFE
+_CAMPOS_DANFE = {'client' if campo == 'client_id' else campo for campo in danfe_cache.CAMPOS_NOTA}
+
+
+@receiver(post_save, sender=Invoice)
+def descartar_danfe_da_nota(sender, instance, update_fields=None, **kwargs):
+    # Gravações parciais que não tocam o DANFE (status, pdf_file...) mantêm o cache
+    if update_fields is not None and not _CAMPOS_DANFE.intersection(update_fields):
+        return
+    danfe_cache.invalidar(instance.pk)
+
+
+@receiver(post_delete, sender=Invoice)
+def descartar_danfe_da_nota_excluida(sender, instance, **kwargs):
+    danfe_cache.invalidar(instance.pk)
+
+
+@receiver(post_save, sender=InvoiceItem)
+@receiver(post_delete, sender=InvoiceItem)
+def descartar_danfe_do_item(sender, instance, **kwargs):
+    danfe_cache.invalidar(instance.invoice_id)
@@ -1,10 +1,67 @@
-from django.test import TestCase
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.db import connection, transaction
+from django.db.models import Sum
+from django.core.files.base import ContentFile
 from django.utils import timezone
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from rest_framework.test import APIClient
 from decimal import Decimal
-from datetime import datetime
-from invoices.models import Invoice, InvoiceItem
+from datetime import datetime, timedelta
+from invoices.models import Invoice, InvoiceItem, SefazReceipt, IssuanceJob, NumberSequence, NumberGap, DFeSyncState, DFePendingDocument, FiscalEvent, IdempotencyRecord
+from invoices.serializers import InvoiceCreateSerializer
 from invoices.services.xml_generator import NFeGenerator
+from invoices.services.nfe_xml_generator import NFeXMLGenerator
+from invoices.services.nfe_engine import NFeEngine
+from invoices.services.batch_issuance import emitir_lote
+from invoices.services.nfe_pipeline import emitir_nfe
+from invoices.services.sefaz_integration import SefazIntegration
+from invoices.services import xsd_validator, access_key, nfe_signer, sefaz_lote, sefaz_contingencia, sefaz_recibos, fila_emissao, idempotencia, numeracao, importacao_nfe, distribuicao_dfe, eventos_nfe, danfe_cache, danfe_sefaz_pr, danfe_recursos, code128, pacote_danfe, danfe_backends, danfe_nfce, qr_code, saida_pdf
+from invoices.services.sefaz_mock import SefazMockServer
+from invoices.services.tabela_itens import TabelaItens
+from invoices.services.danfe_pr_generator import DANFEParanaGenerator
+from invoices.services.danfe_fpdf_generator import DANFEFpdfGenerator
+from invoices.services.pdf_generator import InvoicePDFGenerator
+from invoices.services.sefaz_async import (
+    ConexaoEncerrada, PoolEndpoint, SefazTransporte, executar, fechar_conexoes, get_transporte,
+)
+from invoices.management.commands._benchmark_utils import get_benchmark_client, create_benchmark_invoice, create_self_signed_pfx, build_item
 from clients.models import Client
+from fpdf.enums import PDFResourceType
+from unittest import mock
+import threading
+import tempfile
+import zipfile
+import base64
+import gzip
+import shutil
+import asyncio
+import time
+import io
+import re
+import ssl
+import os
+
+
+class ArquivosTemporariosMixin:
+    """Pastas temporárias da classe (settings em PASTAS) e cache do DANFE limpo a cada teste"""
+    
+    PASTAS = ('MEDIA_ROOT',)
+    
+    @classmethod
+    def setUpClass(cls):
+        cls.pastas = {nome: tempfile.mkdtemp() for nome in cls.PASTAS}
+        for pasta in cls.pastas.values():
+            cls.addClassCleanup(shutil.rmtree, pasta, True)
+        ajuste = override_settings(**cls.pastas)
+        ajuste.enable()
+        cls.addClassCleanup(ajuste.disable)
+        super().setUpClass()
+    
+    def setUp(self):
+        super().setUp()
+        danfe_cache.get_cache().clear()
+        self.addCleanup(danfe_cache.get_cache().clear)
 
 
 class NFeGeneratorTestCase(TestCase):
@@ -255,3 +312,2154 @@ class InvoiceModelTestCase(TestCase):
         
         for field in expected_fields:
             self.assertIn(field, columns, f"Campo {field} não encontrado no banco")
+
+
+class BatchIssuanceTestCase(ArquivosTemporariosMixin, TestCase):
+    """Testes para emissão de NF-e em lote"""
+    
+    PASTAS = ('MEDIA_ROOT', 'BACKUP_DIR')
+    
+    def setUp(self):
+        super().setUp()
+        self.client_obj = get_benchmark_client()
+        self.invoices = [create_benchmark_invoice(self.client_obj, seq) for seq in range(1, 4)]
+        self.user = get_user_model().objects.create_user(username='lote', email='lote@contabiliza.ia', password='lote123')
+    
+    def test_emitir_lote_inline(self):
+        """Test batch issuance running in the current process"""
+        ids = [inv.pk for inv in self.invoices]
+        lote = emitir_lote(ids + [ids[0]], workers=1)
+        
+        self.assertEqual(lote['total'], 3)
+        self.assertEqual(lote['sucesso'], 3)
+        self.assertEqual(lote['workers'], 1)
+        for resultado in lote['resultados']:
+            self.assertEqual(len(resultado['chave_acesso']), 44)
+            self.assertEqual(resultado['status'], 'pending')
+        
+        invoice = Invoice.objects.get(pk=ids[0])
+        self.assertIn(f'{invoice.access_key}-nfe', invoice.xml_file.name)
+        self.assertIn(f'{invoice.access_key}-danfe', invoice.pdf_file.name)
+    
+    def test_emitir_lote_unknown_invoice(self):
+        """Test missing invoices are reported without aborting the batch"""
+        lote = emitir_lote([self.invoices[0].pk, 999999], workers=1)
+        
+        self.assertEqual(lote['sucesso'], 1)
+        self.assertEqual(lote['falhas'], 1)
+    
+    @override_settings(NFE_BATCH_MAX_SIZE=2)
+    def test_batch_endpoint_limit(self):
+        """Test batch endpoint rejects invalid payloads and oversized batches"""
+        api = APIClient()
+        api.force_authenticate(self.user)
+        
+        response = api.post('/api/invoices/generate_nfe_batch/', {'invoice_ids': []}, format='json')
+        self.assertEqual(response.status_code, 400)
+        
+        ids = [inv.pk for inv in self.invoices]
+        response = api.post('/api/invoices/generate_nfe_batch/', {'invoice_ids': ids}, format='json')
+        self.assertEqual(response.status_code, 400)
+        
+        response = api.post('/api/invoices/generate_nfe_batch/', {'invoice_ids': [ids[0], 999999]}, format='json')
+        self.assertEqual(response.status_code, 404)
+        
+        # Só enfileira: a emissão roda nos workers da fila
+        response = api.post('/api/invoices/generate_nfe_batch/', {'invoice_ids': ids[:2]}, format='json')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual([job['status'] for job in response.data['jobs']], ['queued', 'queued'])
+        self.assertFalse(Invoice.objects.get(pk=ids[0]).xml_file)
+        
+        self.assertEqual(fila_emissao.executar_worker('w1', intervalo_ocioso=None)['done'], 2)
+        job = api.get(response.data['jobs'][0]['job_url']).data
+        self.assertEqual(job['status'], 'done')
+        self.assertTrue(job['xml_file'].startswith('http'))
+
+
+TEST_DSIG_XSD = '''<?xml version="1.0" encoding="UTF-8"?>
+<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema"
+           targetNamespace="http://www.w3.org/2000/09/xmldsig#" elementFormDefault="qualified">
+  <xs:element name="Signature" type="xs:string"/>
+</xs:schema>
+'''
+
+TEST_NFE_XSD = '''<?xml version="1.0" encoding="UTF-8"?>
+<xs:schema xmlns:xs="http://www.w3.org/2001/XMLSchema" xmlns:ds="http://www.w3.org/2000/09/xmldsig#"
+           targetNamespace="http://www.portalfiscal.inf.br/nfe" xmlns="http://www.portalfiscal.inf.br/nfe"
+           elementFormDefault="qualified">
+  <xs:import namespace="http://www.w3.org/2000/09/xmldsig#" schemaLocation="xmldsig.xsd"/>
+  <xs:element name="NFe">
+    <xs:complexType>
+      <xs:sequence>
+        <xs:element name="infNFe">
+          <xs:complexType>
+            <xs:sequence><xs:any processContents="skip" minOccurs="0" maxOccurs="unbounded"/></xs:sequence>
+            <xs:attribute name="versao" type="xs:string" use="required"/>
+            <xs:attribute name="Id" type="xs:ID" use="required"/>
+          </xs:complexType>
+        </xs:element>
+        <xs:element ref="ds:Signature"/>
+      </xs:sequence>
+    </xs:complexType>
+  </xs:element>
+</xs:schema>
+'''
+
+
+class XSDValidatorTestCase(ArquivosTemporariosMixin, TestCase):
+    """Testes para validação XSD com cache de schemas compilados"""
+    
+    def setUp(self):
+        super().setUp()
+        self.invoice = create_benchmark_invoice(get_benchmark_client(), 1)
+        self.xsd_dir = tempfile.mkdtemp()
+        with open(os.path.join(self.xsd_dir, 'xmldsig.xsd'), 'w') as f:
+            f.write(TEST_DSIG_XSD)
+        with open(os.path.join(self.xsd_dir, 'nfe_v4.00.xsd'), 'w') as f:
+            f.write(TEST_NFE_XSD)
+        xsd_validator.limpar_cache()
+        self.addCleanup(xsd_validator.limpar_cache)
+    
+    def test_schema_is_cached_until_file_changes(self):
+        """Test compiled schema reuse keyed by version and mtime"""
+        with self.settings(NFE_XSD_DIR=self.xsd_dir):
+            schema = xsd_validator.get_schema('4.00')
+            self.assertIsNotNone(schema)
+            self.assertIs(xsd_validator.get_schema('4.00'), schema)
+            
+            xsd_path = os.path.join(self.xsd_dir, 'nfe_v4.00.xsd')
+            stat = os.stat(xsd_path)
+            os.utime(xsd_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+            self.assertIsNot(xsd_validator.get_schema('4.00'), schema)
+            
+            # Include alterado (o XSD principal não muda)
+            schema = xsd_validator.get_schema('4.00')
+            dsig_path = os.path.join(self.xsd_dir, 'xmldsig.xsd')
+            stat = os.stat(dsig_path)
+            os.utime(dsig_path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+            self.assertIsNot(xsd_validator.get_schema('4.00'), schema)
+
+    def test_missing_xsd_skips_validation(self):
+        """Test validation is skipped when the XSD is not available"""
+        with self.settings(NFE_XSD_DIR=os.path.join(self.xsd_dir, 'missing')):
+            resultado = xsd_validator.validar_xml('<NFe/>')
+        
+        self.assertTrue(resultado['valido'])
+        self.assertFalse(resultado['schema'])
+    
+    def test_unsigned_xml_structured_errors(self):
+        """Test generated XML validates unsigned and reports structured errors"""
+        xml_string = NFeGenerator(self.invoice).generate_xml()
+        
+        with self.settings(NFE_XSD_DIR=self.xsd_dir):
+            self.assertTrue(xsd_validator.validar_xml(xml_string, exigir_assinatura=False)['valido'])
+            
+            resultado = xsd_validator.validar_xml(xml_string)
+            self.assertFalse(resultado['valido'])
+            self.assertIn('Signature', resultado['detalhes'][0]['mensagem'])
+            self.assertGreater(resultado['detalhes'][0]['linha'], 0)
+            
+            sefaz = SefazIntegration(uf='PR', ambiente='homologacao')
+            broken = xml_string.replace('<infNFe ', '<infNFX ', 1).replace('</infNFe>', '</infNFX>', 1)
+            resultado = sefaz.validar_xml_nfe(broken)
+            self.assertFalse(resultado['valido'])
+            self.assertTrue(any('infNFX' in d['mensagem'] for d in resultado['detalhes']))
+    
+    def test_file_validation_matches_in_memory(self):
+        """Test validating from a file gives the same verdicts as validating the loaded XML"""
+        xml_string = NFeGenerator(self.invoice).generate_xml()
+        broken = xml_string.replace('<infNFe ', '<infNFX ', 1).replace('</infNFe>', '</infNFX>', 1)
+        
+        with self.settings(NFE_XSD_DIR=self.xsd_dir):
+            arquivo = io.BytesIO(xml_string.encode('utf-8'))
+            self.assertTrue(xsd_validator.validar_arquivo(arquivo, exigir_assinatura=False)['valido'])
+            resultado = xsd_validator.validar_arquivo(arquivo)
+            self.assertFalse(resultado['valido'])
+            self.assertIn('Signature', resultado['detalhes'][0]['mensagem'])
+            
+            resultado = SefazIntegration(uf='PR', ambiente='homologacao').validar_arquivo_nfe(io.BytesIO(broken.encode('utf-8')))
+            self.assertFalse(resultado['valido'])
+            self.assertIn('Tag infNFe não encontrada', resultado['erros'])
+            self.assertTrue(any('infNFX' in d['mensagem'] for d in resultado['detalhes']))
+
+
+class NFeXMLStreamingTestCase(ArquivosTemporariosMixin, TestCase):
+    """Testes para a geração de XML em modo streaming"""
+    
+    def setUp(self):
+        super().setUp()
+        self.invoice = create_benchmark_invoice(get_benchmark_client(), 1, items=25)
+        self.invoice.additional_info = 'LOTE 2025/26 & CIA <SAFRA>'
+        self.invoice.save()
+    
+    def test_streaming_matches_tree(self):
+        """Test streaming writer produces the same bytes as the tree builder"""
+        generator = NFeXMLGenerator(self.invoice)
+        output = io.BytesIO()
+        chave = generator.generate_to_file(output)
+        
+        self.assertEqual(output.getvalue(), generator.generate().encode('utf-8'))
+        self.assertEqual(chave, generator.chave_acesso)
+    
+    def test_save_streaming_to_storage(self):
+        """Test streaming writer saves straight into the invoice file field"""
+        generator = NFeXMLGenerator(self.invoice)
+        chave = generator.save_streaming(self.invoice.xml_file, 'streaming-nfe.xml')
+        
+        self.assertTrue(self.invoice.xml_file.name.startswith('invoices/xml/'))
+        with self.invoice.xml_file.open('rb') as xml_file:
+            self.assertEqual(xml_file.read(), generator.generate().encode('utf-8'))
+        self.assertIn(chave, generator.generate())
+    
+    def test_streaming_file_signed_and_verified_in_place(self):
+        """Test the streamed file is signed and checked from disk with the same bytes as the in-memory signer"""
+        pasta = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, pasta, True)
+        pfx = create_self_signed_pfx(os.path.join(pasta, 'streaming.pfx'), 'senha123')
+        self.addCleanup(nfe_signer.limpar_cache)
+        generator = NFeXMLGenerator(self.invoice)
+        with override_settings(NFE_CERTIFICADO_PATH=pfx, NFE_CERTIFICADO_SENHA='senha123'):
+            generator.save_streaming(self.invoice.xml_file, 'assinada-nfe.xml', assinar=True)
+            esperado = nfe_signer.assinar_xml(generator.generate())
+        
+        sefaz = SefazIntegration(uf='PR', ambiente='producao')
+        with self.invoice.xml_file.open('rb') as xml_file:
+            self.assertEqual(xml_file.read(), esperado.encode('utf-8'))
+            self.assertTrue(nfe_signer.verificar_assinatura_arquivo(xml_file)['valida'])
+            self.assertTrue(sefaz.validar_arquivo_nfe(xml_file)['valido'])
+        
+        adulterado = io.BytesIO(esperado.replace('SOJA EM GRAO LOTE 1', 'SOJA EM GRAO LOTE 9').encode('utf-8'))
+        self.assertIn('DigestValue', nfe_signer.verificar_assinatura_arquivo(adulterado)['erros'][0])
+        with self.assertRaises(ValueError):
+            nfe_signer.assinar_arquivo(io.BytesIO(esperado.encode('utf-8')), nfe_signer.carregar_certificado(pfx, 'senha123'))
+    
+    @override_settings(NFE_XML_STREAMING_MIN_ITEMS=10, BACKUP_DIR=tempfile.mkdtemp())
+    def test_pipeline_uses_streaming_for_large_invoices(self):
+        """Test issuance pipeline switches to the streaming writer"""
+        emissao = emitir_nfe(self.invoice)
+        
+        self.assertTrue(emissao['sucesso'])
+        self.assertIn(emissao['chave_acesso'], self.invoice.xml_file.name)
+        with self.invoice.xml_file.open('rb') as xml_file:
+            self.assertEqual(xml_file.read(), NFeXMLGenerator(self.invoice).generate().encode('utf-8'))
+
+
+class NFeEngineTestCase(ArquivosTemporariosMixin, TestCase):
+    """Testes para o motor único de serialização de NF-e"""
+    
+    def setUp(self):
+        super().setUp()
+        self.invoice = create_benchmark_invoice(get_benchmark_client(), 1, items=3)
+    
+    def test_both_generators_share_engine_output(self):
+        """Test both view entry points produce the same document"""
+        xml_string = NFeGenerator(self.invoice).generate_xml()
+        
+        self.assertEqual(NFeXMLGenerator(self.invoice).generate(), xml_string)
+        self.assertEqual(xml_string.count('<det nItem='), 3)
+    
+    def test_stale_access_key_is_regenerated(self):
+        """Test saved access key is reused until the invoice data changes"""
+        NFeGenerator(self.invoice).generate_xml()
+        chave = self.invoice.access_key
+        
+        self.assertEqual(NFeEngine(self.invoice).chave_acesso, chave)
+        
+        self.invoice.number = '900000099'
+        nova_chave = NFeEngine(self.invoice).chave_acesso
+        self.assertNotEqual(nova_chave, chave)
+        self.assertEqual(nova_chave[25:34], '900000099')
+    
+    def test_prefetched_items_match_database_rows(self):
+        """Test prefetched items render the same as the direct query"""
+        NFeGenerator(self.invoice).generate_xml()
+        prefetched = Invoice.objects.prefetch_related('items').get(pk=self.invoice.pk)
+        
+        self.assertEqual(NFeEngine(prefetched).gerar(), NFeEngine(self.invoice).gerar())
+
+
+class AccessKeyServiceTestCase(TestCase):
+    """Testes para o serviço de chaves de acesso em lote"""
+    
+    def setUp(self):
+        self.invoices = [create_benchmark_invoice(get_benchmark_client(), seq) for seq in range(1, 6)]
+    
+    def test_vectorised_check_digits_match_scalar(self):
+        """Test bulk check digits agree with the digit-by-digit algorithm"""
+        prefixos = [access_key.prefixo_chave(inv) for inv in self.invoices]
+        chaves = access_key.montar_chaves(prefixos * 200)
+        
+        dvs = access_key.calcular_dvs([chave[:43] for chave in chaves])
+        self.assertEqual(dvs, [access_key.calcular_dv(chave[:43]) for chave in chaves])
+        self.assertEqual(dvs, [int(chave[43]) for chave in chaves])
+    
+    def test_alocar_chaves_keeps_matching_keys(self):
+        """Test bulk allocation persists new keys and reuses valid ones"""
+        chaves = access_key.alocar_chaves(Invoice.objects.filter(pk__in=[inv.pk for inv in self.invoices]))
+        
+        self.assertEqual(len(set(chaves.values())), 5)
+        for inv in self.invoices:
+            inv.refresh_from_db()
+            self.assertEqual(inv.access_key, chaves[inv.pk])
+        
+        self.assertEqual(access_key.alocar_chaves(Invoice.objects.filter(pk=self.invoices[0].pk)),
+                         {self.invoices[0].pk: chaves[self.invoices[0].pk]})
+    
+    def test_validate_keys_endpoint(self):
+        """Test bulk key validation and reconciliation endpoint"""
+        chave = access_key.alocar_chaves([self.invoices[0]])[self.invoices[0].pk]
+        outra = access_key.gerar_chave(self.invoices[1])
+        dv_errado = chave[:43] + str((int(chave[43]) + 1) % 10)
+        
+        api = APIClient()
+        api.force_authenticate(get_user_model().objects.create_user(
+            username='chaves', email='chaves@contabiliza.ia', password='chaves123'))
+        response = api.post('/api/invoices/validate-keys/', {
+            'keys': [chave, outra, dv_errado, '123', '99' + chave[2:]],
+            'reconcile': True,
+        }, format='json')
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['validas'], 2)
+        resultados = response.data['resultados']
+        self.assertTrue(resultados[0]['registrada'])
+        self.assertFalse(resultados[1]['registrada'])
+        self.assertIn('Dígito verificador', resultados[2]['erro'])
+        self.assertIn('44 dígitos', resultados[3]['erro'])
+        self.assertIn('UF', resultados[4]['erro'])
+    
+    def test_non_ascii_digits_rejected(self):
+        """Test Unicode digits (superscripts, Arabic-Indic) never pass as key digits"""
+        chave = access_key.alocar_chaves([self.invoices[0]])[self.invoices[0].pk]
+        for digito in ('²', '٣'):
+            adulterada = chave[:10] + digito + chave[11:]
+            resultado = access_key.validar_chaves([adulterada])[0]
+            self.assertFalse(resultado['valida'])
+            self.assertIn(f'Caractere inválido na chave: {digito}', resultado['erro'])
+            self.assertFalse(access_key.formato_valido(adulterada))
+            self.assertFalse(access_key.chave_confere(adulterada, self.invoices[0]))
+        self.assertTrue(access_key.chave_confere(chave, self.invoices[0]))
+    
+    def test_only_formatting_characters_ignored(self):
+        """Test spaces, dots, dashes and slashes are stripped while other characters reject the key"""
+        chave = access_key.alocar_chaves([self.invoices[0]])[self.invoices[0].pk]
+        formatada = ' '.join(chave[i:i + 4] for i in range(0, 44, 4)).replace(' ', '.', 2) + '\t'
+        
+        valida, prefixada, letra = access_key.validar_chaves([formatada, 'NFe' + chave, chave[:20] + 'x' + chave[21:]])
+        
+        self.assertEqual((valida['chave'], valida['valida']), (chave, True))
+        self.assertFalse(prefixada['valida'])
+        self.assertEqual(prefixada['erro'], 'Caractere inválido na chave: NFe')
+        self.assertEqual(letra['erro'], 'Caractere inválido na chave: x')
+
+
+class NFeSignerTestCase(TestCase):
+    """Testes para a assinatura XMLDSig com certificado A1"""
+    
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.tmpdir = tempfile.mkdtemp()
+        cls.pfx = create_self_signed_pfx(os.path.join(cls.tmpdir, 'teste.pfx'), 'senha123')
+    
+    @classmethod
+    def tearDownClass(cls):
+        nfe_signer.limpar_cache()
+        shutil.rmtree(cls.tmpdir, ignore_errors=True)
+        super().tearDownClass()
+    
+    def setUp(self):
+        self.invoice = create_benchmark_invoice(get_benchmark_client(), 1, items=2)
+        generator = NFeXMLGenerator(self.invoice)
+        self.xml = generator.generate()
+        self.chave = generator.chave_acesso
+        self.certificado = nfe_signer.carregar_certificado(self.pfx, 'senha123')
+    
+    def test_signature_verifies_and_detects_tampering(self):
+        """Test enveloped signature over infNFe validates and breaks on changes"""
+        assinado = nfe_signer.assinar_xml(self.xml, self.certificado)
+        
+        self.assertTrue(assinado.startswith(self.xml[:self.xml.rindex('</NFe>')]))
+        self.assertIn(f'<Reference URI="#NFe{self.chave}">', assinado)
+        resultado = nfe_signer.verificar_assinatura(assinado)
+        self.assertTrue(resultado['valida'], resultado['erros'])
+        self.assertEqual(resultado['titular'], 'PRODUTOR RURAL BENCHMARK:53213467987')
+        
+        adulterado = assinado.replace('SOJA EM GRAO LOTE 1', 'SOJA EM GRAO LOTE 9')
+        self.assertIn('DigestValue', nfe_signer.verificar_assinatura(adulterado)['erros'][0])
+        
+        sefaz = SefazIntegration(uf='PR', ambiente='producao')
+        self.assertNotIn('XML não assinado digitalmente', sefaz.validar_xml_nfe(assinado)['erros'])
+        self.assertIn('XML não assinado digitalmente', sefaz.validar_xml_nfe(self.xml)['erros'])
+        self.assertFalse(sefaz.validar_xml_nfe(adulterado)['valido'])
+        
+        with self.assertRaises(ValueError):
+            nfe_signer.assinar_xml(assinado, self.certificado)
+    
+    def test_digest_keeps_inherited_namespace(self):
+        """Test the infNFe digest is the plain C14N of the subset, without xmlns="" on nested elements"""
+        import hashlib
+        from xml.etree import ElementTree
+        inf_nfe = self.xml[self.xml.index('<infNFe '):self.xml.index('</infNFe>') + len('</infNFe>')]
+        canonico = ElementTree.canonicalize(inf_nfe.replace('<infNFe ', f'<infNFe xmlns="{nfe_signer.NFE_NAMESPACE}" ', 1))
+        
+        assinado = nfe_signer.assinar_xml(self.xml, self.certificado)
+        
+        digest = base64.b64encode(hashlib.sha1(canonico.encode('utf-8')).digest()).decode('ascii')
+        self.assertIn(f'<DigestValue>{digest}</DigestValue>', assinado)
+    
+    def test_certificate_decrypted_once_per_process(self):
+        """Test PFX is cached until the file changes or the cache is cleared"""
+        self.assertIs(nfe_signer.carregar_certificado(self.pfx, 'senha123'), self.certificado)
+        
+        nfe_signer.limpar_cache()
+        self.assertIsNot(nfe_signer.carregar_certificado(self.pfx, 'senha123'), self.certificado)
+        
+        nfe_signer.limpar_cache()
+        with self.assertRaises(ValueError):
+            nfe_signer.carregar_certificado(self.pfx, 'senha-errada')
+    
+    def test_wrong_password_not_served_from_cache(self):
+        """Test the password is part of the cache key and the private key never stays on disk"""
+        self.assertIs(nfe_signer.carregar_certificado(self.pfx, 'senha123'), self.certificado)
+        with self.assertRaises(ValueError):
+            nfe_signer.carregar_certificado(self.pfx, 'senha-errada')
+        
+        with self.certificado.arquivos_pem() as (certificado_pem, chave_pem):
+            self.assertEqual(os.stat(chave_pem).st_mode & 0o777, 0o600)
+            self.assertEqual(os.stat(os.path.dirname(chave_pem)).st_mode & 0o777, 0o700)
+        self.assertFalse(os.path.exists(os.path.dirname(chave_pem)))
+        
+        mkdtemp = tempfile.mkdtemp
+        criados = []
+        with mock.patch.object(tempfile, 'mkdtemp', side_effect=lambda **kw: criados.append(mkdtemp(**kw)) or criados[-1]):
+            self.certificado.carregar_em(ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT))
+        self.assertEqual(len(criados), 1)
+        self.assertFalse(os.path.exists(criados[0]))
+    
+    def test_batch_signing_with_worker_pool(self):
+        """Test batch signing keeps order and produces valid signatures"""
+        outro = NFeXMLGenerator(create_benchmark_invoice(get_benchmark_client(), 2)).generate()
+        
+        with override_settings(NFE_SIGNER_MAX_WORKERS=2):
+            assinados = nfe_signer.assinar_lote([self.xml, outro, self.xml], workers=2,
+                                                caminho=self.pfx, senha='senha123')
+        
+        self.assertEqual(len(assinados), 3)
+        self.assertTrue(assinados[1].startswith(outro[:outro.rindex('</NFe>')]))
+        for assinado in assinados:
+            self.assertTrue(nfe_signer.verificar_assinatura(assinado)['valida'])
+    
+    def test_pipeline_signs_when_certificate_configured(self):
+        """Test issuance stores a signed XML when an A1 certificate is set"""
+        with override_settings(NFE_CERTIFICADO_PATH=self.pfx, NFE_CERTIFICADO_SENHA='senha123'):
+            resultado = emitir_nfe(self.invoice)
+        
+        self.assertTrue(resultado['sucesso'], resultado['validacao'])
+        with self.invoice.xml_file.open('rb') as xml_file:
+            self.assertTrue(nfe_signer.verificar_assinatura(xml_file.read())['valida'])
+
+
+class SefazLoteTestCase(ArquivosTemporariosMixin, TestCase):
+    """Testes para a autorização em lotes enviNFe contra o SEFAZ local"""
+    
+    def setUp(self):
+        super().setUp()
+        self.sefaz = SefazMockServer().start()
+        self.addCleanup(self.sefaz.stop)
+        self.addCleanup(fechar_conexoes)
+        sefaz_contingencia.limpar()
+        self.addCleanup(sefaz_contingencia.limpar)
+        settings_sefaz = override_settings(NFE_SEFAZ_WEBSERVICES=self.sefaz.webservices(), NFE_LOTE_INTERVALO_CONSULTA=0)
+        settings_sefaz.enable()
+        self.addCleanup(settings_sefaz.disable)
+        
+        client = get_benchmark_client()
+        self.invoices = [self._pendente(create_benchmark_invoice(client, seq)) for seq in range(1, 61)]
+    
+    def _pendente(self, invoice):
+        generator = NFeXMLGenerator(invoice)
+        xml = generator.generate()
+        invoice.access_key = generator.chave_acesso
+        invoice.status = 'pending'
+        invoice.xml_file.save(f'{invoice.access_key}-nfe.xml', ContentFile(xml.encode('utf-8')))
+        return invoice
+    
+    def test_lots_cut_round_trips_per_note(self):
+        """Test 60 notes go out in 2 lots and every protNFe reaches its invoice"""
+        negada, rejeitada = self.invoices[3], self.invoices[55]
+        self.sefaz.rejeitar = {
+            negada.access_key: ('302', 'Uso Denegado: Irregularidade fiscal do destinatário'),
+            rejeitada.access_key: ('539', 'Rejeição: Duplicidade de NF-e com diferença na Chave de Acesso'),
+        }
+        
+        resultado = sefaz_lote.autorizar_pendentes()
+        
+        self.assertEqual(resultado['lotes'], 2)
+        self.assertEqual((resultado['autorizadas'], resultado['denegadas'], resultado['pendentes']), (58, 1, 1))
+        self.assertEqual(self.sefaz.requisicoes['autorizacao'], 2)
+        self.assertEqual(self.sefaz.requisicoes['retorno_autorizacao'], 2)
+        self.assertEqual(self.sefaz.notas_recebidas, 60)
+        
+        autorizada = Invoice.objects.get(pk=self.invoices[0].pk)
+        self.assertEqual(autorizada.status, 'authorized')
+        self.assertEqual(len(autorizada.protocol), 15)
+        self.assertIsNotNone(autorizada.authorization_date)
+        self.assertEqual(Invoice.objects.get(pk=negada.pk).status, 'denied')
+        self.assertEqual(Invoice.objects.get(pk=rejeitada.pk).status, 'pending')
+    
+    def test_grouping_by_issuer_and_single_note_lot(self):
+        """Test lots never mix issuers and one-note lots are synchronous"""
+        outro = self.invoices[-1]
+        Invoice.objects.filter(pk=outro.pk).update(issuer_tax_id='111.444.777-35')
+        lotes = sefaz_lote.agrupar_lotes(Invoice.objects.filter(status='pending').order_by('pk'))
+        
+        self.assertEqual([len(notas) for _, notas in lotes], [50, 9, 1])
+        
+        resultado = sefaz_lote.enviar_lote(lotes[-1][1])
+        self.assertEqual(resultado['codigo'], '104')
+        self.assertIsNone(resultado['recibo'])
+        self.assertEqual(resultado['resultados'][0]['status'], 'authorized')
+        self.assertEqual(self.sefaz.requisicoes['retorno_autorizacao'], 0)
+    
+    def test_receipt_polled_while_lot_is_processing(self):
+        """Test receipt is polled again while SEFAZ answers 105"""
+        self.sefaz.consultas_pendentes = 2
+        
+        resultado = sefaz_lote.enviar_lote(self.invoices[:10])
+        
+        self.assertEqual(resultado['codigo'], '104')
+        self.assertEqual(self.sefaz.requisicoes['retorno_autorizacao'], 3)
+        self.assertTrue(all(r['status'] == 'authorized' for r in resultado['resultados']))
+    
+    def test_async_lots_leave_receipts_for_scheduler(self):
+        """Test async lots register receipts and the scheduler applies the protocols with backoff"""
+        negada = self.invoices[3]
+        self.sefaz.rejeitar = {negada.access_key: ('302', 'Uso Denegado: Irregularidade fiscal do destinatário')}
+        self.sefaz.consultas_pendentes = 1
+        
+        resultado = sefaz_lote.autorizar_pendentes(aguardar=False)
+        
+        self.assertEqual((resultado['recibos'], resultado['pendentes']), (2, 60))
+        self.assertEqual(self.sefaz.requisicoes['retorno_autorizacao'], 0)
+        self.assertEqual(Invoice.objects.filter(receipt__status='waiting').count(), 60)
+        # Notas com recibo aguardando não são reenviadas
+        self.assertEqual(sefaz_lote.autorizar_pendentes()['notas'], 0)
+        
+        self.assertEqual(sefaz_recibos.consultar_recibos()['consultados'], 0)
+        agora = timezone.now() + timedelta(seconds=5)
+        rodada = sefaz_recibos.consultar_recibos(agora=agora)
+        self.assertEqual((rodada['consultados'], rodada['aguardando']), (2, 2))
+        recibo = SefazReceipt.objects.first()
+        self.assertEqual((recibo.attempts, recibo.last_code), (1, '105'))
+        self.assertEqual(recibo.next_poll_at, agora + timedelta(seconds=2))
+        
+        rodada = sefaz_recibos.consultar_recibos(agora=agora + timedelta(seconds=2))
+        self.assertEqual((rodada['processados'], rodada['autorizadas'], rodada['denegadas']), (2, 59, 1))
+        self.assertEqual(self.sefaz.requisicoes['retorno_autorizacao'], 4)
+        self.assertEqual(Invoice.objects.filter(status='authorized').exclude(protocol=None).count(), 59)
+        self.assertEqual(Invoice.objects.get(pk=negada.pk).status, 'denied')
+        self.assertFalse(SefazReceipt.objects.filter(status='waiting').exists())
+    
+    def test_receipt_backoff_and_expiry(self):
+        """Test polling interval doubles up to the cap and expired receipts look each note up by access key"""
+        with override_settings(NFE_RECIBO_INTERVALO_INICIAL=1, NFE_RECIBO_INTERVALO_MAXIMO=60, NFE_RECIBO_MAX_CONSULTAS=2):
+            self.assertEqual([sefaz_recibos.intervalo_consulta(n) for n in (0, 1, 3, 10)], [1, 2, 8, 60])
+            
+            self.sefaz.consultas_pendentes = 5
+            sefaz_lote.enviar_lote(self.invoices[:2], aguardar=False)
+            # A segunda nota não chegou à base da SEFAZ (consSitNFe responde 217)
+            self.sefaz._autorizadas.pop(self.invoices[1].access_key)
+            agora = timezone.now() + timedelta(seconds=120)
+            sefaz_recibos.consultar_recibos(agora=agora)
+            with mock.patch.object(SefazIntegration, 'aconsultar_protocolo', side_effect=ConnectionError('timeout')):
+                rodada = sefaz_recibos.consultar_recibos(agora=agora + timedelta(seconds=120))
+            # Sem resposta definitiva o recibo continua aguardando
+            self.assertEqual((rodada['expirados'], rodada['aguardando']), (0, 1))
+            rodada = sefaz_recibos.consultar_recibos(agora=agora + timedelta(seconds=240))
+        
+        self.assertEqual((rodada['expirados'], rodada['autorizadas']), (1, 1))
+        self.assertEqual(self.sefaz.requisicoes['consulta_protocolo'], 2)
+        autorizada = Invoice.objects.get(pk=self.invoices[0].pk)
+        self.assertEqual(autorizada.status, 'authorized')
+        self.assertEqual(len(autorizada.protocol), 15)
+        # Só a nota que não consta na base fica livre para reenvio
+        self.assertEqual(Invoice.objects.get(pk=self.invoices[1].pk).status, 'pending')
+    
+    def test_single_note_helpers_call_sefaz(self):
+        """Test autorizar_nfe/consultar_nfe go to the web services instead of faking an authorization"""
+        sefaz = SefazIntegration(uf='PR', ambiente='homologacao')
+        autorizada, rejeitada = self.invoices[0], self.invoices[1]
+        self.sefaz.rejeitar = {rejeitada.access_key: ('539', 'Rejeição: Duplicidade de NF-e')}
+        
+        resultado = sefaz.autorizar_nfe(sefaz_lote._ler_xml(autorizada))
+        self.assertTrue(resultado['sucesso'], resultado)
+        self.assertEqual((resultado['codigo'], resultado['chave_acesso']), ('100', autorizada.access_key))
+        self.assertEqual(len(resultado['protocolo']), 15)
+        resultado_rejeitada = sefaz.autorizar_nfe(sefaz_lote._ler_xml(rejeitada))
+        self.assertEqual((resultado_rejeitada['sucesso'], resultado_rejeitada['codigo']), (False, '539'))
+        self.assertEqual(self.sefaz.requisicoes['autorizacao'], 2)
+        
+        consulta = sefaz.consultar_nfe(autorizada.access_key)
+        self.assertEqual((consulta['sucesso'], consulta['codigo'], consulta['protocolo']), (True, '100', resultado['protocolo']))
+        consulta = sefaz.consultar_nfe(rejeitada.access_key)
+        self.assertEqual((consulta['sucesso'], consulta['codigo']), (False, '217'))
+        self.assertEqual(self.sefaz.requisicoes['consulta_protocolo'], 2)
+    
+    def test_authorize_endpoint_returns_receipt_without_waiting(self):
+        """Test authorize_sefaz answers 202 with the receipt and the scheduler authorizes later"""
+        api = APIClient()
+        api.force_authenticate(get_user_model().objects.create_user(
+            username='recibo', email='recibo@contabiliza.ia', password='recibo123'))
+        invoice = self.invoices[0]
+        
+        response = api.post(f'/api/invoices/{invoice.pk}/authorize_sefaz/')
+        self.assertEqual(response.status_code, 202, response.data)
+        self.assertEqual(response.data['codigo'], '103')
+        self.assertEqual(self.sefaz.requisicoes['retorno_autorizacao'], 0)
+        recibo = response.data['recibo']
+        
+        # Repetição: o mesmo recibo, sem novo envio (resposta intermediária não é gravada)
+        response = api.post(f'/api/invoices/{invoice.pk}/authorize_sefaz/')
+        self.assertEqual((response.status_code, response.data['recibo']), (202, recibo))
+        self.assertNotIn('Idempotent-Replayed', response)
+        self.assertEqual(self.sefaz.requisicoes['autorizacao'], 1)
+        
+        sefaz_recibos.consultar_recibos(agora=timezone.now() + timedelta(seconds=5))
+        invoice.refresh_from_db()
+        self.assertEqual(invoice.status, 'authorized')
+        self.assertEqual(invoice.receipt.number, recibo)
+    
+    def test_authorize_idempotency_key(self):
+        """Test Idempotency-Key replays, blocks concurrent duplicates and is bound to one invoice"""
+        api = APIClient()
+        api.force_authenticate(get_user_model().objects.create_user(
+            username='idem', email='idem@contabiliza.ia', password='idem123'))
+        invoice, outra = self.invoices[0], self.invoices[1]
+        
+        # Outra requisição com a mesma chave ainda em execução
+        with invoice.xml_file.open('rb') as xml_file:
+            digest = idempotencia.impressao(xml_file.read())
+        situacao, registro = idempotencia.iniciar('authorize_sefaz', 'pedido-1', digest, invoice)
+        self.assertEqual(situacao, idempotencia.NOVA)
+        response = api.post(f'/api/invoices/{invoice.pk}/authorize_sefaz/', HTTP_IDEMPOTENCY_KEY='pedido-1')
+        self.assertEqual(response.status_code, 409)
+        self.assertEqual(self.sefaz.requisicoes['autorizacao'], 0)
+        response = api.post(f'/api/invoices/{outra.pk}/authorize_sefaz/', HTTP_IDEMPOTENCY_KEY='pedido-1')
+        self.assertEqual(response.status_code, 422)
+        
+        # Execução abandonada (tempo esgotado) é assumida pela próxima tentativa
+        with override_settings(NFE_IDEMPOTENCIA_TEMPO_EXECUCAO=0):
+            idempotencia.liberar(registro)
+            idempotencia.iniciar('authorize_sefaz', 'pedido-1', digest, invoice)
+            primeira = api.post(f'/api/invoices/{invoice.pk}/authorize_sefaz/', HTTP_IDEMPOTENCY_KEY='pedido-1')
+        self.assertEqual(primeira.status_code, 202)
+        
+        for _ in range(3):
+            repetida = api.post(f'/api/invoices/{invoice.pk}/authorize_sefaz/', HTTP_IDEMPOTENCY_KEY='pedido-1')
+            self.assertEqual((repetida.status_code, repetida.data['recibo']), (202, primeira.data['recibo']))
+        self.assertEqual(self.sefaz.requisicoes['autorizacao'], 1)
+    
+    def test_authorize_replays_only_final_answers(self):
+        """Test refused lots run again on retry while SEFAZ rejections are replayed"""
+        api = APIClient()
+        api.force_authenticate(get_user_model().objects.create_user(
+            username='final', email='final@contabiliza.ia', password='final123'))
+        invoice = self.invoices[0]
+        url = f'/api/invoices/{invoice.pk}/authorize_sefaz/'
+        
+        # Lote sem resposta da SEFAZ: nada gravado, a repetição envia de novo
+        with mock.patch.object(SefazIntegration, 'aautorizar_lote', side_effect=ConnectionResetError('reset')):
+            response = api.post(url, HTTP_IDEMPOTENCY_KEY='pedido-2')
+        self.assertEqual((response.status_code, response.data['codigo']), (400, None))
+        self.assertFalse(IdempotencyRecord.objects.filter(key='pedido-2').exists())
+        
+        # Rejeição da nota (protNFe com cStat de rejeição) é a resposta final
+        self.sefaz.rejeitar = {invoice.access_key: ('539', 'Rejeição: Duplicidade de NF-e com diferença na Chave de Acesso')}
+        with mock.patch('invoices.views.autorizar_pendentes',
+                        lambda queryset, aguardar: sefaz_lote.autorizar_pendentes(queryset)):
+            rejeitada = api.post(url, HTTP_IDEMPOTENCY_KEY='pedido-2')
+            self.assertEqual((rejeitada.status_code, rejeitada.data['codigo']), (400, '539'))
+            repetida = api.post(url, HTTP_IDEMPOTENCY_KEY='pedido-2')
+        self.assertEqual(repetida.data, rejeitada.data)
+        self.assertEqual(repetida['Idempotent-Replayed'], 'true')
+        self.assertEqual(self.sefaz.requisicoes['autorizacao'], 1)
+    
+    def _svc(self):
+        svc = SefazMockServer().start()
+        self.addCleanup(svc.stop)
+        settings_svc = override_settings(NFE_SEFAZ_WEBSERVICES_SVC=svc.webservices())
+        settings_svc.enable()
+        self.addCleanup(settings_svc.disable)
+        return svc
+    
+    def _assert_contingencia(self, invoice, tp_emis):
+        invoice = Invoice.objects.get(pk=invoice.pk)
+        self.assertEqual(invoice.status, 'authorized')
+        self.assertEqual(invoice.emission_type, tp_emis)
+        self.assertEqual(invoice.access_key[34], tp_emis)
+        self.assertTrue(access_key.validar_chaves([invoice.access_key])[0]['valida'])
+        xml = sefaz_lote._ler_xml(invoice)
+        self.assertIn(f'<tpEmis>{tp_emis}</tpEmis>', xml)
+        self.assertIn('<dhCont>', xml)
+        self.assertIn('<xJust>SEFAZ PR', xml)
+    
+    def test_paralysed_status_routes_lots_to_svc(self):
+        """Test SEFAZ answering 108 sends re-issued notes to SVC-RS"""
+        self.sefaz.paralisado = True
+        svc = self._svc()
+        
+        resultado = sefaz_lote.autorizar_pendentes()
+        
+        self.assertEqual((resultado['autorizadas'], resultado['contingencia']), (60, 60))
+        self.assertEqual(self.sefaz.requisicoes['autorizacao'], 0)
+        self.assertEqual(svc.requisicoes['autorizacao'], 2)
+        self._assert_contingencia(self.invoices[0], '7')
+    
+    def test_unreachable_sefaz_opens_circuit_and_falls_back(self):
+        """Test refused connections open the circuit and the lots go to SVC"""
+        webservices = self.sefaz.webservices()
+        self.sefaz.stop()
+        svc = self._svc()
+        
+        with override_settings(NFE_SEFAZ_WEBSERVICES=webservices, NFE_SEFAZ_CB_FALHAS=2, NFE_SEFAZ_STATUS_TTL=0):
+            resultado = sefaz_lote.autorizar_pendentes()
+            
+            self.assertEqual((resultado['autorizadas'], resultado['contingencia']), (60, 60))
+            self.assertEqual(svc.requisicoes['autorizacao'], 2)
+            self._assert_contingencia(self.invoices[-1], '7')
+            self.assertEqual(sefaz_contingencia.get_circuito('PR').resumo()['estado'], 'aberto')
+            
+            # Circuito aberto: falha imediata, sem tentar a conexão
+            inicio = time.perf_counter()
+            with self.assertRaises(sefaz_contingencia.CircuitoAberto):
+                SefazIntegration(uf='PR').autorizar_lote(['<NFe/>'], '1')
+            self.assertLess(time.perf_counter() - inicio, 0.5)
+    
+    def test_service_status_cached_and_refreshed_in_background(self):
+        """Test status is served from cache and stale entries refresh asynchronously"""
+        with override_settings(NFE_SEFAZ_STATUS_TTL=60):
+            for _ in range(5):
+                self.assertEqual(sefaz_contingencia.status_servico('PR')['codigo'], '107')
+        self.assertEqual(self.sefaz.requisicoes['status_servico'], 1)
+        
+        self.sefaz.paralisado = True
+        with override_settings(NFE_SEFAZ_STATUS_TTL=0.01):
+            time.sleep(0.02)
+            # Vencido: devolve o anterior e renova em segundo plano
+            self.assertEqual(sefaz_contingencia.status_servico('PR')['codigo'], '107')
+            for _ in range(100):
+                if sefaz_contingencia.status_servico('PR')['codigo'] == '108':
+                    break
+                time.sleep(0.01)
+        self.assertEqual(sefaz_contingencia.status_servico('PR')['codigo'], '108')
+
+
+class CircuitBreakerTestCase(TestCase):
+    """Testes para o circuit breaker dos autorizadores"""
+    
+    def test_opens_after_failures_and_half_opens_after_wait(self):
+        """Test circuit fails fast when open and lets one probe through after the wait"""
+        circuito = sefaz_contingencia.CircuitBreaker('SEFAZ PR', limite_falhas=2, espera=0.05)
+        circuito.verificar()
+        circuito.registrar_falha()
+        self.assertTrue(circuito.disponivel())
+        circuito.registrar_falha()
+        
+        self.assertFalse(circuito.disponivel())
+        with self.assertRaises(sefaz_contingencia.CircuitoAberto):
+            circuito.verificar()
+        
+        time.sleep(0.06)
+        circuito.verificar()
+        with self.assertRaises(sefaz_contingencia.CircuitoAberto):
+            circuito.verificar()
+        circuito.registrar_falha()
+        self.assertEqual(circuito.resumo()['estado'], 'aberto')
+        
+        time.sleep(0.06)
+        circuito.verificar()
+        circuito.registrar_sucesso()
+        self.assertEqual(circuito.resumo(), {'estado': 'fechado', 'falhas': 0})
+    
+    def test_normal_notes_keep_original_xml(self):
+        """Test contingency fields only appear for tpEmis 6/7"""
+        invoice = create_benchmark_invoice(get_benchmark_client(), 1)
+        self.assertNotIn('dhCont', NFeXMLGenerator(invoice).generate())
+        
+        invoice.emission_type = '6'
+        invoice.contingency_reason = 'SEFAZ PR indisponivel para autorizacao'
+        xml = NFeXMLGenerator(invoice).generate()
+        self.assertIn('<tpEmis>6</tpEmis>', xml)
+        self.assertIn('<xJust>SEFAZ PR indisponivel para autorizacao</xJust>', xml)
+        self.assertEqual(access_key.prefixo_chave(invoice)[-1], '6')
+
+
+class SefazAsyncTransportTestCase(TestCase):
+    """Testes para o transporte assíncrono com conexões keep-alive"""
+    
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.tmpdir = tempfile.mkdtemp()
+        cls.cliente_pfx = create_self_signed_pfx(os.path.join(cls.tmpdir, 'cliente.pfx'), 'senha123')
+        servidor_pfx = create_self_signed_pfx(os.path.join(cls.tmpdir, 'servidor.pfx'), 'senha123', 'SEFAZ MOCK')
+        cls.servidor_a1 = nfe_signer.carregar_certificado(servidor_pfx, 'senha123')
+        cls.cliente_a1 = nfe_signer.carregar_certificado(cls.cliente_pfx, 'senha123')
+    
+    @classmethod
+    def tearDownClass(cls):
+        nfe_signer.limpar_cache()
+        shutil.rmtree(cls.tmpdir, ignore_errors=True)
+        super().tearDownClass()
+    
+    def _mock(self, **kwargs):
+        sefaz = SefazMockServer(**kwargs).start()
+        self.addCleanup(sefaz.stop)
+        self.addCleanup(fechar_conexoes)
+        return sefaz
+    
+    def test_keep_alive_reuses_connection(self):
+        """Test sequential calls share a single connection per endpoint"""
+        sefaz = self._mock()
+        with override_settings(NFE_SEFAZ_WEBSERVICES=sefaz.webservices()):
+            resultados = [SefazIntegration(uf='PR').consultar_status_servico() for _ in range(20)]
+        
+        self.assertTrue(all(r['codigo'] == '107' for r in resultados))
+        self.assertEqual(sefaz.requisicoes['status_servico'], 20)
+        self.assertEqual(sefaz.conexoes, 1)
+    
+    def test_mutual_tls_handshake_paid_once(self):
+        """Test client certificate is presented and the TLS session is pooled"""
+        sefaz = self._mock(tls=self.servidor_a1, ca_clientes=self.cliente_a1)
+        configuracao = dict(NFE_SEFAZ_WEBSERVICES=sefaz.webservices(), NFE_SEFAZ_CA_BUNDLE=False)
+        
+        with override_settings(**configuracao):
+            sem_certificado = SefazIntegration(uf='PR').consultar_status_servico()
+        self.assertEqual(sem_certificado['status'], 'error')
+        
+        with override_settings(NFE_CERTIFICADO_PATH=self.cliente_pfx, NFE_CERTIFICADO_SENHA='senha123', **configuracao):
+            conexoes = sefaz.conexoes
+            resultados = [SefazIntegration(uf='PR').consultar_status_servico() for _ in range(10)]
+        
+        self.assertTrue(all(r['status'] == 'online' for r in resultados))
+        self.assertEqual(sefaz.conexoes - conexoes, 1)
+    
+    def test_different_calls_run_concurrently(self):
+        """Test status, authorization, query and event calls overlap in time"""
+        sefaz = self._mock(latencia=0.3)
+        invoice = create_benchmark_invoice(get_benchmark_client(), 1)
+        generator = NFeXMLGenerator(invoice)
+        xml, chave = generator.generate(), generator.chave_acesso
+        evento = (
+            f'<envEvento xmlns="http://www.portalfiscal.inf.br/nfe" versao="1.00"><idLote>1</idLote>'
+            f'<evento versao="1.00"><infEvento><chNFe>{chave}</chNFe><tpEvento>110110</tpEvento>'
+            f'<nSeqEvento>1</nSeqEvento></infEvento></evento></envEvento>'
+        )
+        
+        async def chamadas():
+            sefaz_pr = SefazIntegration(uf='PR')
+            return await asyncio.gather(
+                sefaz_pr.aconsultar_status_servico(),
+                sefaz_pr.aautorizar_lote([xml], '1', sincrono=True),
+                sefaz_pr.aconsultar_protocolo(chave),
+                sefaz_pr.aenviar_evento(evento),
+            )
+        
+        with override_settings(NFE_SEFAZ_WEBSERVICES=sefaz.webservices(), NFE_SEFAZ_MAX_CONEXOES=4):
+            inicio = time.perf_counter()
+            status, autorizacao, consulta, eventos = executar(chamadas())
+            decorrido = time.perf_counter() - inicio
+        
+        self.assertLess(decorrido, 0.9)
+        self.assertEqual(status['status'], 'online')
+        self.assertEqual(autorizacao['protocolos'][0]['codigo'], '100')
+        self.assertIn(consulta['codigo'], ('100', '217'))
+        self.assertEqual(eventos['codigo'], '128')
+        self.assertEqual(len(eventos['eventos']), 1)
+    
+    def test_per_endpoint_limit_and_timeout(self):
+        """Test concurrency limit per endpoint and call timeout"""
+        sefaz = self._mock(latencia=0.2)
+        
+        async def quatro_status():
+            return await asyncio.gather(*(SefazIntegration(uf='PR').aconsultar_status_servico() for _ in range(4)))
+        
+        with override_settings(NFE_SEFAZ_WEBSERVICES=sefaz.webservices(), NFE_SEFAZ_MAX_CONEXOES=1):
+            inicio = time.perf_counter()
+            executar(quatro_status())
+            self.assertGreaterEqual(time.perf_counter() - inicio, 0.8)
+            self.assertEqual(list(get_transporte().estatisticas().values())[0]['conexoes_abertas'], 1)
+        
+        fechar_conexoes()
+        with override_settings(NFE_SEFAZ_WEBSERVICES=sefaz.webservices(), NFE_SEFAZ_TIMEOUT=0.05):
+            resultado = SefazIntegration(uf='PR').consultar_status_servico()
+        self.assertEqual(resultado['status'], 'error')
+        self.assertIn('não respondeu', resultado['mensagem'])
+    
+    def test_reloaded_certificate_reuses_tls_context(self):
+        """Test TLS contexts and pools are keyed by certificate fingerprint, not object identity"""
+        transporte = SefazTransporte()
+        with override_settings(NFE_CERTIFICADO_PATH=self.cliente_pfx, NFE_CERTIFICADO_SENHA='senha123',
+                               NFE_SEFAZ_CA_BUNDLE=False):
+            certificado = nfe_signer.carregar_certificado()
+            pool = transporte.pool('https://sefaz.test/ws')
+            nfe_signer.limpar_cache()
+            self.assertIsNot(nfe_signer.carregar_certificado(), certificado)
+            self.assertIs(transporte.pool('https://sefaz.test/ws'), pool)
+        
+        self.assertEqual(len(transporte._contextos), 1)
+    
+    def test_sent_request_is_not_retried(self):
+        """Test a reused connection is retried only when it closed before the request was sent"""
+        def conexao(eof=False):
+            return mock.Mock(at_eof=mock.Mock(return_value=eof)), mock.Mock(is_closing=mock.Mock(return_value=False))
+        
+        async def cenario(enviada):
+            pool = PoolEndpoint('sefaz.test', 443, keepalive=30)
+            pool._ociosas.append((conexao(), time.monotonic()))
+            pool._abrir = mock.AsyncMock(return_value=conexao())
+            pool._trocar = mock.AsyncMock(side_effect=[ConexaoEncerrada('reset', enviada=enviada), (200, b'ok', False)])
+            try:
+                return await pool.post('/ws', b'<xml/>', timeout=1), pool._trocar.await_count
+            except ConexaoEncerrada:
+                return None, pool._trocar.await_count
+        
+        self.assertEqual(asyncio.run(cenario(enviada=False)), ((200, b'ok'), 2))
+        self.assertEqual(asyncio.run(cenario(enviada=True)), (None, 1))
+        
+        # An idle connection already closed by the server is never picked
+        pool = PoolEndpoint('sefaz.test', 443, keepalive=30)
+        pool._ociosas.append((conexao(eof=True), time.monotonic()))
+        self.assertIsNone(pool._pegar_ociosa())
+
+
+class IssuanceQueueTestCase(ArquivosTemporariosMixin, TestCase):
+    """Testes para a fila persistente de emissão"""
+    
+    PASTAS = ('MEDIA_ROOT', 'BACKUP_DIR')
+    
+    def setUp(self):
+        super().setUp()
+        client = get_benchmark_client()
+        self.invoices = [create_benchmark_invoice(client, seq) for seq in range(1, 4)]
+        self.user = get_user_model().objects.create_user(username='fila', email='fila@contabiliza.ia', password='fila123')
+    
+    def test_api_enqueues_and_worker_runs_pipeline(self):
+        """Test generate_nfe_complete only enqueues and a worker runs every stage"""
+        api = APIClient()
+        api.force_authenticate(self.user)
+        invoice = self.invoices[0]
+        
+        response = api.post(f'/api/invoices/{invoice.pk}/generate_nfe_complete/', {}, format='json')
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual((response.data['status'], response.data['stage']), ('queued', 'xml'))
+        self.assertFalse(Invoice.objects.get(pk=invoice.pk).xml_file)
+        # Pedido repetido reaproveita o job ativo
+        self.assertEqual(api.post(f'/api/invoices/{invoice.pk}/generate_nfe_complete/').data['job_id'], response.data['job_id'])
+        
+        contagem = fila_emissao.executar_worker('w1', intervalo_ocioso=None)
+        self.assertEqual(contagem['done'], 1)
+        
+        response = api.get(f'/api/invoices/jobs/{response.data["job_id"]}/')
+        self.assertEqual((response.data['status'], response.data['stage']), ('done', 'done'))
+        self.assertTrue(response.data['pdf_file'].startswith('http'))
+        invoice.refresh_from_db()
+        self.assertEqual(invoice.status, 'pending')
+        self.assertEqual(response.data['result']['chave_acesso'], invoice.access_key)
+        self.assertTrue(response.data['result']['validacao']['valido'])
+    
+    def test_concurrent_enqueue_returns_the_active_job(self):
+        """Test a request that loses the insert race gets the job the other request created"""
+        from django.db import IntegrityError
+        
+        primeiro = fila_emissao.enfileirar(self.invoices[0])
+        buscar = fila_emissao._job_ativo
+        # A consulta do segundo pedido acontece antes do INSERT do primeiro
+        with mock.patch.object(fila_emissao, '_job_ativo', side_effect=[None, buscar(self.invoices[0])]):
+            segundo = fila_emissao.enfileirar(self.invoices[0], autorizar=True)
+        
+        self.assertEqual(segundo.pk, primeiro.pk)
+        self.assertTrue(IssuanceJob.objects.get(pk=primeiro.pk).authorize)
+        self.assertEqual(IssuanceJob.objects.filter(invoice=self.invoices[0]).count(), 1)
+        with transaction.atomic(), self.assertRaises(IntegrityError):
+            IssuanceJob.objects.create(invoice=self.invoices[0], run_after=timezone.now(), status='running')
+    
+    def test_leases_are_exclusive(self):
+        """Test two workers never lease the same job"""
+        for invoice in self.invoices:
+            fila_emissao.enfileirar(invoice)
+        
+        primeiro = fila_emissao.reservar('w1', 2)
+        segundo = fila_emissao.reservar('w2', 2)
+        
+        self.assertEqual((len(primeiro), len(segundo)), (2, 1))
+        self.assertFalse({j.pk for j in primeiro} & {j.pk for j in segundo})
+        self.assertEqual(fila_emissao.reservar('w3', 2), [])
+    
+    def test_crashed_worker_resumes_mid_pipeline(self):
+        """Test an expired lease is taken over and resumes at the stage where it stopped"""
+        job = fila_emissao.enfileirar(self.invoices[0])
+        
+        with override_settings(NFE_FILA_LEASE=0):
+            job = fila_emissao.reservar('w1')[0]
+            saida = fila_emissao.EXECUTORES['xml'](job, job.invoice)
+            fila_emissao._avancar(job, 'w1', stage='validation', result=saida)
+            # w1 cai aqui; a concessão (0s) vence e w2 assume
+            time.sleep(0.01)
+            retomado = fila_emissao.reservar('w2')[0]
+        
+        self.assertEqual((retomado.pk, retomado.stage, retomado.attempts), (job.pk, 'validation', 1))
+        with mock.patch.dict(fila_emissao.EXECUTORES, xml=mock.Mock(side_effect=AssertionError('xml gerado de novo'))):
+            self.assertEqual(fila_emissao.processar(retomado, 'w2'), 'done')
+        
+        with self.assertRaises(fila_emissao.ReservaPerdida):
+            fila_emissao._avancar(job, 'w1', stage='danfe')
+        self.assertEqual(IssuanceJob.objects.get(pk=job.pk).result['chave_acesso'], saida['chave_acesso'])
+    
+    def test_failed_stage_retried_with_backoff(self):
+        """Test failures go back to the queue with backoff and fail after the attempt limit"""
+        job = fila_emissao.enfileirar(self.invoices[0])
+        falha = mock.Mock(side_effect=OSError('disco cheio'))
+        
+        with override_settings(NFE_FILA_MAX_TENTATIVAS=2, NFE_FILA_ESPERA_RETENTATIVA=30), \
+                mock.patch.dict(fila_emissao.EXECUTORES, backup=falha):
+            self.assertEqual(fila_emissao.processar(fila_emissao.reservar('w1')[0], 'w1'), 'queued')
+            job.refresh_from_db()
+            self.assertEqual((job.stage, job.attempts), ('backup', 1))
+            self.assertGreater(job.run_after, timezone.now() + timedelta(seconds=25))
+            self.assertEqual(fila_emissao.reservar('w1'), [])
+            
+            IssuanceJob.objects.filter(pk=job.pk).update(run_after=timezone.now())
+            self.assertEqual(fila_emissao.processar(fila_emissao.reservar('w1')[0], 'w1'), 'failed')
+        
+        job.refresh_from_db()
+        self.assertEqual(job.attempts, 2)
+        self.assertIn('disco cheio', job.last_error)
+    
+    def test_job_that_keeps_crashing_the_worker_fails(self):
+        """Test an expired lease is not taken over again once the attempt limit is reached"""
+        job = fila_emissao.enfileirar(self.invoices[0])
+        
+        with override_settings(NFE_FILA_LEASE=0, NFE_FILA_MAX_TENTATIVAS=2):
+            fila_emissao.reservar('w1')
+            time.sleep(0.01)
+            self.assertEqual(fila_emissao.reservar('w2')[0].attempts, 1)
+            time.sleep(0.01)
+            self.assertEqual(fila_emissao.reservar('w3'), [])
+        
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.attempts, job.leased_by), ('failed', 2, None))
+        self.assertIn('Concessão vencida', job.last_error)
+
+
+
+class NumberAllocatorTestCase(TestCase):
+    """Testes para a numeração por emitente, modelo e série"""
+    
+    CNPJ = '12.345.678/0001-95'
+    
+    def test_sequence_seeded_from_existing_invoices(self):
+        """Test the first block starts after the highest number already issued for the key"""
+        client = get_benchmark_client()
+        invoice = create_benchmark_invoice(client, 1)
+        
+        inicio, fim = numeracao.reservar_bloco(invoice.issuer_tax_id, '55', invoice.series, tamanho=10)
+        self.assertEqual((inicio, fim), (int(invoice.number) + 1, int(invoice.number) + 10))
+        # Outra série começa do 1
+        self.assertEqual(numeracao.reservar_bloco(invoice.issuer_tax_id, '55', '2', tamanho=10), (1, 10))
+        self.assertEqual(numeracao.reservar_bloco(invoice.issuer_tax_id, '65', invoice.series, tamanho=10), (1, 10))
+    
+    def test_seed_compares_numbers_as_integers(self):
+        """Test the seed aggregates numerically in SQL, skipping non-numeric numbers and other issuers"""
+        client = get_benchmark_client()
+        invoice = create_benchmark_invoice(client, 1)
+        emitente, serie = invoice.issuer_tax_id, invoice.series
+        Invoice.objects.filter(pk=invoice.pk).update(number='9')
+        for numero in ('10', 'S/N'):
+            invoice.pk, invoice.number = None, numero
+            invoice.save()
+        invoice.pk, invoice.number, invoice.issuer_tax_id = None, '500', '11222333000181'
+        invoice.save()
+        
+        self.assertEqual(numeracao.reservar_bloco(emitente, '55', serie, tamanho=1), (11, 11))
+        self.assertEqual(numeracao.reservar_bloco('11222333000181', '55', serie, tamanho=1), (501, 501))
+    
+    def test_blocks_released_and_gaps_recorded(self):
+        """Test leftovers return to the sequence when possible and become gaps otherwise"""
+        primeiro = numeracao.AlocadorNumeracao(tamanho_bloco=10)
+        segundo = numeracao.AlocadorNumeracao(tamanho_bloco=10)
+        
+        self.assertEqual([primeiro.proximo(self.CNPJ) for _ in range(3)], [1, 2, 3])
+        self.assertEqual(segundo.proximo(self.CNPJ), 11)
+        
+        # 4-10 não voltam para a sequência (já existe bloco depois deles)
+        lacuna, = primeiro.liberar()
+        self.assertEqual((lacuna.issuer_tax_id, lacuna.start_number, lacuna.end_number), ('12345678000195', 4, 10))
+        # 12-20 voltam: nenhum bloco foi reservado depois
+        self.assertEqual(segundo.liberar(), [])
+        self.assertEqual(NumberSequence.objects.get().next_number, 12)
+        
+        segundo.descartar(self.CNPJ, '55', '1', 3, 'Falha ao gravar')
+        self.assertEqual(NumberGap.objects.count(), 2)
+    
+    def test_apurar_lacunas(self):
+        """Test numbers reserved without an invoice (crashed worker) are recorded once"""
+        client = get_benchmark_client()
+        invoice = create_benchmark_invoice(client, 1)
+        numero = int(invoice.number)
+        alocador = numeracao.AlocadorNumeracao(tamanho_bloco=5)
+        Invoice.objects.filter(pk=invoice.pk).update(number=str(alocador.proximo(invoice.issuer_tax_id, '55', invoice.series)))
+        alocador.descartar(invoice.issuer_tax_id, '55', invoice.series, numero + 3)
+        
+        lacunas = numeracao.apurar_lacunas(invoice.issuer_tax_id, '55', invoice.series)
+        
+        self.assertEqual([(l.start_number, l.end_number) for l in lacunas], [(numero + 2, numero + 2), (numero + 4, numero + 5)])
+        self.assertEqual(numeracao.apurar_lacunas(invoice.issuer_tax_id, '55', invoice.series), [])
+    
+    def test_serializer_number_optional(self):
+        """Test the create serializer accepts a payload without number (allocated on create)"""
+        client = get_benchmark_client()
+        payload = {
+            'series': '1', 'operation_nature': 'venda_soja', 'cfop': '5101', 'client': client.pk,
+            'issuer_name': 'EMITENTE', 'issuer_tax_id': self.CNPJ, 'issuer_state': 'PR',
+            'receiver_name': client.name, 'receiver_tax_id': client.tax_id, 'receiver_state': 'PR',
+            'issue_date': timezone.now().isoformat(),
+            'items': [{'code': '1', 'description': 'Soja', 'ncm': '12019000', 'cfop': '5101', 'unit': 'KG',
+                       'quantity': '10', 'unit_value': '2.50'}],
+        }
+        
+        numeracao.limpar()
+        self.addCleanup(numeracao.limpar)
+        serializer = InvoiceCreateSerializer(data=payload)
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        self.assertNotIn('number', serializer.validated_data)
+        self.assertEqual(numeracao.alocar_numero(self.CNPJ), 1)
+        
+        # Falha ao gravar a nota: o número alocado vira lacuna
+        with mock.patch.object(Invoice.objects, 'create', side_effect=ValueError('falha')), self.assertRaises(ValueError):
+            serializer.save()
+        lacuna = NumberGap.objects.get()
+        self.assertEqual((lacuna.issuer_tax_id, lacuna.start_number, lacuna.end_number), ('12345678000195', 2, 2))
+    
+    def test_issuer_tax_id_normalized(self):
+        """Test formatted and clean CNPJ share the number constraint, as the sequences do"""
+        from django.db import IntegrityError
+        
+        invoice = create_benchmark_invoice(get_benchmark_client(), 1)
+        self.assertEqual(Invoice.objects.get(pk=invoice.pk).issuer_tax_id, '53213467987')
+        invoice.pk = None
+        invoice.issuer_tax_id = '532.134.679-87'
+        with transaction.atomic(), self.assertRaises(IntegrityError):
+            invoice.save()
+    
+    def test_migration_keeps_colliding_rows_saveable(self):
+        """Test migration 0013 cleans with clean_digits and leaves rows repeating a number saveable"""
+        import importlib
+        from django.apps import apps
+        migracao = importlib.import_module('invoices.migrations.0013_normalize_invoice_issuer_tax_id')
+        client = get_benchmark_client()
+        limpa = create_benchmark_invoice(client, 1)
+        colidente = create_benchmark_invoice(client, 2)
+        avulsa = create_benchmark_invoice(client, 3)
+        # Dados anteriores à migração: mesmo número gravado com o CNPJ/CPF formatado
+        Invoice.objects.filter(pk=colidente.pk).update(issuer_tax_id='532.134.679-87', number=limpa.number)
+        Invoice.objects.filter(pk=avulsa.pk).update(issuer_tax_id=' 532.134.679-87 ')
+        
+        with self.assertLogs(migracao.logger, 'WARNING'):
+            migracao.normalizar_emitente(apps, None)
+        
+        self.assertEqual(Invoice.objects.get(pk=avulsa.pk).issuer_tax_id, '53213467987')
+        colidente = Invoice.objects.get(pk=colidente.pk)
+        self.assertEqual(colidente.issuer_tax_id, '532.134.679-87')
+        colidente.status = 'pending'
+        colidente.save()
+        self.assertEqual(Invoice.objects.get(pk=colidente.pk).status, 'pending')
+    
+    def test_leftovers_released_at_exit(self):
+        """Test the process allocator hands its leftovers back when the process exits"""
+        numeracao.limpar()
+        self.addCleanup(numeracao.limpar)
+        self.assertEqual(numeracao.alocar_numero(self.CNPJ), 1)
+        numeracao.AlocadorNumeracao(tamanho_bloco=5).proximo(self.CNPJ)
+        
+        numeracao._liberar_ao_sair()
+        
+        lacuna = NumberGap.objects.get()
+        self.assertEqual((lacuna.start_number, lacuna.end_number), (2, numeracao.get_tamanho_bloco()))
+
+
+class NumberAllocatorStressTestCase(TransactionTestCase):
+    """Testes de concorrência do alocador (threads com conexões próprias)"""
+    
+    def test_concurrent_allocation_without_duplicates(self):
+        """Test 8 workers allocating 100k numbers get each number exactly once"""
+        workers, por_worker = 8, 12500
+        resultados = [None] * workers
+        erros = []
+        inicio = threading.Barrier(workers)
+        
+        def worker(indice):
+            try:
+                alocador = numeracao.AlocadorNumeracao(tamanho_bloco=250)
+                inicio.wait()
+                resultados[indice] = [alocador.proximo('12345678000195', '55', '1') for _ in range(por_worker)]
+            except Exception as e:
+                erros.append(e)
+            finally:
+                connection.close()
+        
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(workers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        
+        self.assertEqual(erros, [])
+        numeros = [numero for lista in resultados for numero in lista]
+        self.assertEqual(len(numeros), 100000)
+        self.assertEqual(sorted(numeros), list(range(1, 100001)))
+        self.assertEqual(NumberSequence.objects.get().next_number, 100001)
+
+
+def _nfe_procs(client, quantidade):
+    """{chave: XML nfeProc autorizado} de notas de benchmark (as notas são apagadas)"""
+    xmls = {}
+    for seq in range(1, quantidade + 1):
+        invoice = create_benchmark_invoice(client, seq, items=seq % 3 or 3)
+        engine = NFeEngine(invoice)
+        nfe = engine.gerar().split('?>', 1)[1]
+        xmls[engine.chave_acesso] = (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            f'<nfeProc xmlns="http://www.portalfiscal.inf.br/nfe" versao="4.00">{nfe}'
+            '<protNFe versao="4.00"><infProt><tpAmb>2</tpAmb><verAplic>SVRS</verAplic>'
+            f'<chNFe>{engine.chave_acesso}</chNFe><dhRecbto>2024-05-10T10:00:00-03:00</dhRecbto>'
+            f'<nProt>14124000000000{seq}</nProt><cStat>100</cStat><xMotivo>Autorizado o uso da NF-e</xMotivo>'
+            '</infProt></protNFe></nfeProc>'
+        )
+    # Notas de outro sistema: só os XMLs ficam
+    Invoice.objects.all().delete()
+    return xmls
+
+
+class NFeImportTestCase(TestCase):
+    """Testes para a importação em massa de NF-e recebidas"""
+    
+    def setUp(self):
+        self.pasta = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.pasta, True)
+        self.client_obj = get_benchmark_client()
+        self.xmls = _nfe_procs(self.client_obj, 3)
+    
+    def _gravar(self, nome, conteudo):
+        caminho = os.path.join(self.pasta, nome)
+        os.makedirs(os.path.dirname(caminho), exist_ok=True)
+        with open(caminho, 'w', encoding='utf-8') as arquivo:
+            arquivo.write(conteudo)
+        return caminho
+    
+    def test_import_directory_and_zip(self):
+        """Test XMLs from a directory and a nested ZIP are imported once with items and protocol"""
+        chaves = list(self.xmls)
+        self._gravar('a/1.xml', self.xmls[chaves[0]])
+        self._gravar('a/b/2.xml', self.xmls[chaves[1]])
+        with zipfile.ZipFile(os.path.join(self.pasta, 'lote.zip'), 'w') as pacote:
+            pacote.writestr('3.xml', self.xmls[chaves[2]])
+            pacote.writestr('repetida.xml', self.xmls[chaves[0]])
+            pacote.writestr('leia-me.txt', 'ignorado')
+        
+        with self.assertNumQueries(6):
+            # clientes + (chaves existentes, savepoint, notas, itens, release) por lote
+            resultado = importacao_nfe.importar_nfes(self.pasta, tamanho_lote=10)
+        
+        self.assertEqual(
+            {k: resultado[k] for k in ('arquivos', 'importadas', 'itens', 'duplicadas', 'sem_cliente', 'erros')},
+            {'arquivos': 4, 'importadas': 3, 'itens': 6, 'duplicadas': 1, 'sem_cliente': 0, 'erros': 0},
+        )
+        invoice = Invoice.objects.get(access_key=chaves[2])
+        self.assertEqual((invoice.client_id, invoice.operation_type, invoice.status), (self.client_obj.pk, 'entrada', 'authorized'))
+        self.assertEqual((invoice.number, invoice.series, invoice.issuer_tax_id), ('900000003', '999', '53213467987'))
+        self.assertEqual(invoice.protocol, '141240000000003')
+        self.assertEqual(invoice.total_value, invoice.items.aggregate(total=Sum('total_value'))['total'])
+        item = invoice.items.order_by('code').first()
+        self.assertEqual((item.code, item.ncm, item.cfop, item.quantity), ('0115.0001.00', '12019000', '5101', Decimal('1001.0000')))
+        
+        # Segunda importação: tudo já cadastrado
+        self.assertEqual(importacao_nfe.importar_nfes(self.pasta)['duplicadas'], 4)
+        self.assertEqual(Invoice.objects.count(), 3)
+    
+    def test_unknown_receiver_and_bad_files(self):
+        """Test invoices without a matching client and unreadable files are reported, not imported"""
+        chave = next(iter(self.xmls))
+        self._gravar('outro.xml', self.xmls[chave].replace('00000000000191', '11222333000181'))
+        self._gravar('quebrado.xml', '<nfeProc><NFe>')
+        self._gravar('vazio.xml', '<?xml version="1.0"?><resNFe/>')
+        
+        resultado = importacao_nfe.importar_nfes(self.pasta)
+        
+        self.assertEqual((resultado['importadas'], resultado['sem_cliente'], resultado['erros']), (0, 1, 2))
+        self.assertEqual({e['arquivo'] for e in resultado['detalhes_erros']},
+                         {os.path.join(self.pasta, 'quebrado.xml'), os.path.join(self.pasta, 'vazio.xml')})
+        # Com o cliente informado a nota entra
+        self.assertEqual(importacao_nfe.importar_nfes(self.pasta, cliente=self.client_obj)['importadas'], 1)
+    
+    def test_numbering_conflict_and_missing_number(self):
+        """Test a note refused by the database or without nNF is reported and the rest of the lot is kept"""
+        chaves = list(self.xmls)
+        caminhos = [self._gravar(f'{n}.xml', self.xmls[chave]) for n, chave in enumerate(chaves)]
+        self._gravar('sem_numero.xml', re.sub(r'<nNF>\d+</nNF>', '', self.xmls[chaves[0]]).replace(chaves[0][:40], '9' * 40))
+        # Mesma numeração já cadastrada com outra chave de acesso
+        importacao_nfe.importar_nfes(caminhos[1])
+        Invoice.objects.filter(access_key=chaves[1]).update(access_key='1' * 44)
+    
+        resultado = importacao_nfe.importar_nfes(self.pasta)
+    
+        self.assertEqual((resultado['importadas'], resultado['itens'], resultado['erros']), (2, 4, 2))
+        erros = {e['arquivo']: e['erro'] for e in resultado['detalhes_erros']}
+        self.assertIn('nNF', erros[os.path.join(self.pasta, 'sem_numero.xml')])
+        self.assertIn('recusada pelo banco', erros[caminhos[1]])
+        self.assertEqual(set(Invoice.objects.values_list('access_key', flat=True)), {chaves[0], chaves[2], '1' * 44})
+    
+    def test_import_endpoint(self):
+        """Test the upload endpoint imports a ZIP of XMLs"""
+        api = APIClient()
+        api.force_authenticate(get_user_model().objects.create_user(username='imp', email='imp@contabiliza.ia', password='imp123'))
+        pacote = io.BytesIO()
+        with zipfile.ZipFile(pacote, 'w') as zip_file:
+            for n, xml in enumerate(self.xmls.values()):
+                zip_file.writestr(f'{n}.xml', xml)
+        pacote.name = 'notas.zip'
+        pacote.seek(0)
+        
+        response = api.post('/api/invoices/import-xml/', {'files': [pacote]}, format='multipart')
+        
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual((response.data['importadas'], response.data['itens']), (3, 6))
+        self.assertEqual(api.post('/api/invoices/import-xml/', {}, format='multipart').status_code, 400)
+
+
+class DFeDistributionTestCase(TestCase):
+    """Testes para a sincronização por NSU com a distribuição de DF-e"""
+    
+    CNPJ = '00000000000191'
+    
+    def setUp(self):
+        self.client_obj = get_benchmark_client()
+        self.xmls = list(_nfe_procs(self.client_obj, 63).values())
+        documentos = [('procNFe_v4.00.xsd', xml) for xml in self.xmls[:60]]
+        documentos.insert(10, ('resNFe_v1.01.xsd', '<resNFe xmlns="http://www.portalfiscal.inf.br/nfe"/>'))
+        documentos.append(('resEvento_v1.01.xsd', '<resEvento xmlns="http://www.portalfiscal.inf.br/nfe"/>'))
+        
+        self.sefaz = SefazMockServer(documentos_dfe=documentos).start()
+        self.addCleanup(self.sefaz.stop)
+        self.addCleanup(fechar_conexoes)
+        ajuste = override_settings(NFE_SEFAZ_WEBSERVICES=self.sefaz.webservices())
+        ajuste.enable()
+        self.addCleanup(ajuste.disable)
+    
+    def test_incremental_sync(self):
+        """Test only documents after the stored NSU are pulled and imported"""
+        resultado = distribuicao_dfe.sincronizar(self.CNPJ)
+        
+        self.assertEqual(self.sefaz.nsus_consultados, [0, 50])
+        self.assertEqual((resultado['documentos'], resultado['nfe'], resultado['resumos'], resultado['eventos']), (62, 60, 1, 1))
+        self.assertEqual((resultado['importacao']['importadas'], resultado['ult_nsu'], resultado['codigo']), (60, 62, '138'))
+        self.assertEqual(Invoice.objects.filter(operation_type='entrada', status='authorized').count(), 60)
+        estado = DFeSyncState.objects.get(tax_id=self.CNPJ)
+        self.assertEqual((estado.last_nsu, estado.max_nsu, estado.documents_received), (62, 62, 62))
+        self.assertIsNotNone(estado.next_sync_at)
+        
+        # Em dia: nada é consultado antes do intervalo mínimo
+        self.assertEqual(distribuicao_dfe.sincronizar(self.CNPJ)['consultas'], 0)
+        
+        self.sefaz.documentos_dfe += [('procNFe_v4.00.xsd', xml) for xml in self.xmls[60:]]
+        resultado = distribuicao_dfe.sincronizar(self.CNPJ, forcar=True)
+        
+        self.assertEqual(self.sefaz.nsus_consultados, [0, 50, 62])
+        self.assertEqual((resultado['documentos'], resultado['importacao']['importadas'], resultado['ult_nsu']), (3, 3, 65))
+        self.assertEqual(Invoice.objects.count(), 63)
+        
+        resultado = distribuicao_dfe.sincronizar(self.CNPJ, forcar=True)
+        self.assertEqual((resultado['consultas'], resultado['documentos'], resultado['codigo']), (1, 0, '137'))
+    
+    def test_skipped_documents_retried(self):
+        """Test procNFe not stored while the NSU moves past them are kept and imported on the next sync"""
+        with mock.patch.object(importacao_nfe, '_mapa_clientes', return_value={}):
+            resultado = distribuicao_dfe.sincronizar(self.CNPJ)
+        
+        self.assertEqual((resultado['importacao']['sem_cliente'], resultado['pendentes'], resultado['ult_nsu']), (60, 60, 62))
+        self.assertEqual(Invoice.objects.count(), 0)
+        pendente = DFePendingDocument.objects.first()
+        self.assertEqual((pendente.nsu, pendente.reason), (1, 'Destinatário sem cliente cadastrado'))
+        
+        # Durante a espera a SEFAZ não é consultada, mas as pendentes são importadas
+        resultado = distribuicao_dfe.sincronizar(self.CNPJ)
+        
+        self.assertEqual(self.sefaz.nsus_consultados, [0, 50])
+        self.assertEqual((resultado['reprocessadas'], resultado['importacao']['importadas'], resultado['pendentes']), (60, 60, 0))
+        self.assertEqual(Invoice.objects.count(), 60)
+        self.assertFalse(DFePendingDocument.objects.exists())
+    
+    def test_doc_zip_streaming(self):
+        """Test docZip payloads larger than one base64 block decompress intact and bad ones are rejected"""
+        xml = ('<a>' + ''.join(f'<b>{n:08x}</b>' for n in range(40000)) + '</a>').encode('utf-8')
+        conteudo = base64.b64encode(gzip.compress(xml)).decode('ascii')
+        self.assertGreater(len(conteudo), distribuicao_dfe.BLOCO_BASE64)
+        
+        arquivo = distribuicao_dfe.abrir_doc_zip(conteudo)
+        partes = iter(lambda: arquivo.read(1000), b'')
+        self.assertEqual(b''.join(partes), xml)
+        
+        with self.assertRaises(importacao_nfe.XMLNaoSuportado):
+            distribuicao_dfe.abrir_doc_zip('não é base64').read()
+
+
+class FiscalEventTestCase(ArquivosTemporariosMixin, TestCase):
+    """Testes para cancelamento e carta de correção em lotes envEvento"""
+    
+    JUSTIFICATIVA = 'Pedido cancelado pelo cliente antes da saida'
+    
+    def setUp(self):
+        super().setUp()
+        self.sefaz = SefazMockServer().start()
+        self.addCleanup(self.sefaz.stop)
+        self.addCleanup(fechar_conexoes)
+        sefaz_contingencia.limpar()
+        self.addCleanup(sefaz_contingencia.limpar)
+        ajuste = override_settings(NFE_SEFAZ_WEBSERVICES=self.sefaz.webservices(), NFE_LOTE_INTERVALO_CONSULTA=0)
+        ajuste.enable()
+        self.addCleanup(ajuste.disable)
+        
+        client = get_benchmark_client()
+        for seq in range(1, 26):
+            invoice = create_benchmark_invoice(client, seq)
+            generator = NFeXMLGenerator(invoice)
+            invoice.access_key = generator.chave_acesso
+            invoice.status = 'pending'
+            invoice.xml_file.save(f'{invoice.access_key}-nfe.xml', ContentFile(generator.generate().encode('utf-8')))
+        sefaz_lote.autorizar_pendentes()
+        self.invoices = list(Invoice.objects.order_by('pk'))
+    
+    def test_bulk_cancel_one_call_per_lot(self):
+        """Test 25 cancellations go out in 2 envEvento lots and every protocol is recorded"""
+        self.assertTrue(all(invoice.status == 'authorized' for invoice in self.invoices))
+        
+        resultado = eventos_nfe.cancelar_notas(self.invoices, self.JUSTIFICATIVA)
+        
+        self.assertEqual((resultado['lotes'], resultado['eventos'], resultado['registrados']), (2, 25, 25))
+        self.assertEqual(self.sefaz.requisicoes['evento'], 2)
+        self.assertEqual(self.sefaz.eventos_recebidos, 25)
+        self.assertEqual(Invoice.objects.filter(status='cancelled').count(), 25)
+        evento = FiscalEvent.objects.get(invoice=self.invoices[0])
+        self.assertEqual((evento.status, evento.last_code, evento.sequence), ('registered', '135', 1))
+        self.assertEqual(len(evento.protocol), 15)
+        self.assertIsNotNone(evento.registered_at)
+        self.assertIn(f'Id="ID110111{self.invoices[0].access_key}01"', evento.xml)
+        self.assertIn(f'<nProt>{self.invoices[0].protocol}</nProt>', evento.xml)
+        
+        # Já canceladas ou sem justificativa válida: recusadas sem ir à SEFAZ
+        self.invoices[0].refresh_from_db()
+        resultado = eventos_nfe.cancelar_notas([self.invoices[0]], self.JUSTIFICATIVA)
+        self.assertEqual((resultado['lotes'], resultado['rejeitados']), (0, 1))
+        self.assertEqual(resultado['resultados'][0]['mensagem'], 'NF-e já cancelada')
+        self.assertEqual(eventos_nfe.cancelar_notas(self.invoices[1:2], 'curta')['lotes'], 0)
+        self.assertEqual(self.sefaz.requisicoes['evento'], 2)
+    
+    def test_correction_letters_and_rejected_event(self):
+        """Test CC-e sequence grows per note and a SEFAZ rejection keeps the note authorized"""
+        notas = self.invoices[:3]
+        eventos_nfe.corrigir_notas(notas, 'Corrigir endereco de entrega para Rua B, 100')
+        resultado = eventos_nfe.corrigir_notas(notas, 'Corrigir endereco de entrega para Rua C, 200')
+        
+        self.assertEqual([r['sequencia'] for r in resultado['resultados']], [2, 2, 2])
+        self.assertEqual(resultado['registrados'], 3)
+        self.assertEqual(FiscalEvent.objects.filter(event_type='110110', status='registered').count(), 6)
+        self.assertEqual(self.sefaz.requisicoes['evento'], 2)
+        
+        # Cancelada por fora (envEvento avulso): o lote recebe duplicidade de evento
+        nota = self.invoices[3]
+        avulso = SefazIntegration(uf='PR').cancelar_nfe(nota.access_key, nota.protocol, self.JUSTIFICATIVA)
+        self.assertTrue(avulso['sucesso'], avulso)
+        self.assertEqual(len(avulso['protocolo_cancelamento']), 15)
+        
+        resultado = eventos_nfe.cancelar_notas([nota, self.invoices[4]], self.JUSTIFICATIVA)
+        self.assertEqual([r['codigo'] for r in resultado['resultados']], ['573', '135'])
+        self.assertEqual(Invoice.objects.get(pk=nota.pk).status, 'authorized')
+        self.assertEqual(FiscalEvent.objects.get(invoice=nota).status, 'rejected')
+    
+    def test_sequence_counts_unconfirmed_events(self):
+        """Test CC-e numbering skips pending/error events and a failed cancellation is resent in place"""
+        from django.db import IntegrityError
+        
+        nota, outra = self.invoices[:2]
+        FiscalEvent.objects.create(invoice=nota, event_type='110110', sequence=1, text='x' * 15, status='error')
+        FiscalEvent.objects.create(invoice=nota, event_type='110110', sequence=2, text='x' * 15, status='rejected')
+        resultado = eventos_nfe.corrigir_notas([nota], 'Corrigir endereco de entrega para Rua B, 100')
+        self.assertEqual((resultado['resultados'][0]['sequencia'], resultado['registrados']), (2, 1))
+        with transaction.atomic(), self.assertRaises(IntegrityError):
+            FiscalEvent.objects.create(invoice=nota, event_type='110110', sequence=2, text='x' * 15)
+        
+        falho = FiscalEvent.objects.create(invoice=nota, event_type='110111', sequence=1, text='x' * 15, status='error')
+        FiscalEvent.objects.create(invoice=outra, event_type='110111', sequence=1, text='x' * 15)
+        resultado = eventos_nfe.cancelar_notas([nota, outra], self.JUSTIFICATIVA)
+        
+        self.assertEqual([r['status'] for r in resultado['resultados']], ['registered', 'rejected'])
+        self.assertEqual(resultado['resultados'][1]['mensagem'], 'Cancelamento da NF-e já em envio')
+        falho.refresh_from_db()
+        self.assertEqual((falho.status, falho.text), ('registered', self.JUSTIFICATIVA))
+        self.assertEqual(FiscalEvent.objects.filter(invoice=nota, event_type='110111').count(), 1)
+    
+    def test_events_signed_with_configured_certificate(self):
+        """Test every evento in the lot carries its own valid signature over infEvento"""
+        pfx = create_self_signed_pfx(os.path.join(self.pastas['MEDIA_ROOT'], 'teste.pfx'), 'senha123')
+        self.addCleanup(nfe_signer.limpar_cache)
+        
+        with override_settings(NFE_CERTIFICADO_PATH=pfx, NFE_CERTIFICADO_SENHA='senha123'):
+            resultado = eventos_nfe.corrigir_notas(self.invoices[:2], 'Corrigir endereco de entrega para Rua B, 100')
+        
+        self.assertEqual(resultado['registrados'], 2)
+        for evento in FiscalEvent.objects.filter(event_type='110110'):
+            self.assertIn(f'<Reference URI="#ID110110{evento.invoice.access_key}01">', evento.xml)
+            self.assertTrue(nfe_signer.verificar_assinatura(evento.xml)['valida'])
+    
+    def test_bulk_endpoints(self):
+        """Test bulk-cancel and bulk-correction answer with per-note results"""
+        api = APIClient()
+        api.force_authenticate(get_user_model().objects.create_user(
+            username='eventos', email='eventos@contabiliza.ia', password='eventos123'))
+        ids = [invoice.pk for invoice in self.invoices[:5]]
+        
+        response = api.post('/api/invoices/bulk-correction/', {'invoice_ids': ids, 'correction': 'Corrigir o CFOP informado nos dados adicionais'}, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual((response.data['lotes'], response.data['registrados']), (1, 5))
+        
+        response = api.post('/api/invoices/bulk-cancel/', {'invoice_ids': ids + [0], 'justification': self.JUSTIFICATIVA}, format='json')
+        self.assertEqual(response.status_code, 404)
+        
+        response = api.post('/api/invoices/bulk-cancel/', {'invoice_ids': ids, 'justification': self.JUSTIFICATIVA}, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(response.data['registrados'], 5)
+        self.assertEqual(self.sefaz.requisicoes['evento'], 2)
+        
+        response = api.post(f'/api/invoices/{self.invoices[5].pk}/cancel/', {'justification': 'curta'}, format='json')
+        self.assertEqual(response.status_code, 400)
+        response = api.post(f'/api/invoices/{self.invoices[5].pk}/cancel/', {'justification': self.JUSTIFICATIVA}, format='json')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(len(response.data['protocolo']), 15)
+        self.assertEqual(api.get(f'/api/invoices/{self.invoices[5].pk}/').data['events'][0]['event_type'], '110111')
+        # Campos dos clientes antigos do frontend
+        for indice, campo in ((6, 'motivo'), (7, 'reason')):
+            response = api.post(f'/api/invoices/{self.invoices[indice].pk}/cancel/', {campo: self.JUSTIFICATIVA}, format='json')
+            self.assertEqual(response.status_code, 200, response.data)
+
+
+class DANFECacheTestCase(ArquivosTemporariosMixin, TestCase):
+    """Testes para o cache do DANFE renderizado por hash do conteúdo"""
+    
+    def setUp(self):
+        super().setUp()
+        self.invoice = create_benchmark_invoice(get_benchmark_client(), 1, items=3)
+        renderizar = mock.patch.object(danfe_cache, '_renderizar', wraps=danfe_cache._renderizar)
+        self.renderizar = renderizar.start()
+        self.addCleanup(renderizar.stop)
+    
+    def test_unchanged_invoice_rendered_once(self):
+        """Test cache, then stored file, serve the PDF until a DANFE field changes"""
+        pdf, digest = danfe_cache.obter_danfe(self.invoice)
+        self.assertTrue(pdf.startswith(b'%PDF'))
+        self.assertEqual(danfe_cache.obter_danfe(self.invoice), (pdf, digest))
+        danfe_cache.gravar_danfe(self.invoice)
+        self.assertEqual(self.renderizar.call_count, 1)
+        self.assertEqual(Invoice.objects.get(pk=self.invoice.pk).danfe_hash, digest)
+        
+        # Sem o cache (outro processo): o arquivo gravado é reaproveitado
+        danfe_cache.get_cache().clear()
+        invoice = Invoice.objects.get(pk=self.invoice.pk)
+        self.assertEqual(danfe_cache.obter_danfe(invoice), (pdf, digest))
+        self.assertEqual(self.renderizar.call_count, 1)
+        
+        # Gravação que não toca o DANFE mantém o cache
+        invoice.status = 'pending'
+        invoice.save(update_fields=['status'])
+        self.assertIsNotNone(danfe_cache.get_cache().get(f'danfe:{invoice.pk}:pr'))
+        
+        item = invoice.items.first()
+        item.quantity += 1
+        item.save()
+        self.assertIsNone(danfe_cache.get_cache().get(f'danfe:{invoice.pk}:pr'))
+        self.assertNotEqual(danfe_cache.obter_danfe(invoice)[1], digest)
+        self.assertEqual(self.renderizar.call_count, 2)
+        
+        # Outro layout é outra entrada
+        invoice.issuer_state = 'SP'
+        invoice.save()
+        self.assertNotEqual(danfe_cache.impressao(invoice), danfe_cache.impressao(invoice, 'pr'))
+    
+    def test_every_printed_field_changes_hash(self):
+        """Test fields only some backends print still take part in the hash"""
+        digest = danfe_cache.impressao(self.invoice)
+        for campo, valor in [('issuer_phone', '4133334444'), ('receiver_number', '99'), ('receiver_phone', '41999990000'),
+                             ('receiver_zip_code', '80000000'), ('operation_nature', 'devolucao'), ('freight_mode', '0'),
+                             ('total_services', Decimal('10.00')), ('iss_value', Decimal('0.50'))]:
+            invoice = Invoice.objects.get(pk=self.invoice.pk)
+            setattr(invoice, campo, valor)
+            self.assertNotEqual(danfe_cache.impressao(invoice), digest, campo)
+    
+        item = self.invoice.items.first()
+        item.icms_rate += 1
+        item.save()
+        self.assertNotEqual(danfe_cache.impressao(self.invoice), digest)
+    
+    def test_download_renders_lazily(self):
+        """Test download_pdf renders on first access and serves cached bytes afterwards"""
+        api = APIClient()
+        api.force_authenticate(get_user_model().objects.create_user(
+            username='danfe', email='danfe@contabiliza.ia', password='danfe123'))
+        self.assertFalse(self.invoice.pdf_file)
+        
+        primeiro = api.get(f'/api/invoices/{self.invoice.pk}/download_pdf/')
+        segundo = api.get(f'/api/invoices/{self.invoice.pk}/download_pdf/')
+        self.assertEqual((primeiro.status_code, segundo.status_code), (200, 200))
+        self.assertEqual(b''.join(primeiro.streaming_content), b''.join(segundo.streaming_content))
+        
+        response = api.post(f'/api/invoices/{self.invoice.pk}/generate_pdf/')
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertEqual(self.renderizar.call_count, 1)
+    
+    def test_pipeline_reissue_reuses_pdf(self):
+        """Test issuing an unchanged note again keeps the stored DANFE"""
+        emitir_nfe(self.invoice)
+        arquivo = self.invoice.pdf_file.name
+        emitir_nfe(Invoice.objects.get(pk=self.invoice.pk))
+        
+        self.assertEqual(self.renderizar.call_count, 1)
+        self.assertEqual(Invoice.objects.get(pk=self.invoice.pk).pdf_file.name, arquivo)
+
+
+class DANFETemplateTestCase(TestCase):
+    """Testes para o fundo pré-renderizado do DANFE-PR"""
+    
+    def setUp(self):
+        self.invoice = create_benchmark_invoice(get_benchmark_client(), 1, items=2)
+        danfe_recursos.limpar()
+        self.addCleanup(danfe_recursos.limpar)
+    
+    def test_background_rendered_once(self):
+        """Test the static layout is drawn once and replayed on every note"""
+        with mock.patch.object(danfe_sefaz_pr, '_desenhar_fundo', wraps=danfe_sefaz_pr._desenhar_fundo) as desenhar:
+            for _ in range(3):
+                pdf = danfe_sefaz_pr.DANFESefazGenerator(self.invoice).generate()
+                self.assertTrue(pdf.startswith(b'%PDF'))
+        self.assertEqual(desenhar.call_count, 1)
+    
+    def test_overlay_on_background(self):
+        """Test each page carries the background stream, its fonts and the note fields"""
+        conteudo, fontes = danfe_sefaz_pr.fundo_pagina()
+        gerador = danfe_sefaz_pr.DANFESefazGenerator(self.invoice)
+        gerador.pdf.set_compression(False)
+        pagina = gerador.generate()
+        
+        self.assertIn(b'q\n' + conteudo + b'Q', pagina)
+        self.assertIn(b'(' + str(self.invoice.number).encode() + b')', pagina.split(conteudo)[1])
+        # Fontes do fundo registradas na página com os mesmos índices
+        usadas = gerador.pdf._resource_catalog.get_resources_per_page(1, PDFResourceType.FONT)
+        self.assertTrue(set(range(1, len(fontes) + 1)) <= set(usadas))
+        self.assertNotIn(b'DANFE', pagina.split(conteudo)[1])
+
+
+class DANFEAssetRegistryTestCase(TestCase):
+    """Testes para o registro de recursos compartilhados dos geradores de DANFE"""
+    
+    def setUp(self):
+        self.invoice = create_benchmark_invoice(get_benchmark_client(), 1, items=2)
+        danfe_recursos.limpar()
+        self.addCleanup(danfe_recursos.limpar)
+    
+    def test_resources_loaded_once(self):
+        """Test styles, fonts and barcodes are built once and their reuse is measured"""
+        with mock.patch.object(danfe_recursos, '_folha_estilos', wraps=danfe_recursos._folha_estilos) as folha:
+            danfe_recursos.registrar('folha_estilos', folha)
+            self.addCleanup(danfe_recursos.registrar, 'folha_estilos', danfe_recursos._folha_estilos)
+            danfe_recursos.precarregar()
+            for _ in range(3):
+                DANFEParanaGenerator(self.invoice).generate()
+                InvoicePDFGenerator(self.invoice).generate()
+                danfe_sefaz_pr.DANFESefazGenerator(self.invoice).generate()
+        self.assertEqual(folha.call_count, 1)
+        
+        estatisticas = danfe_recursos.estatisticas()
+        self.assertGreaterEqual(estatisticas['recursos']['folha_estilos']['reaproveitamentos'], 6)
+        self.assertEqual(estatisticas['recursos']['estilos_danfe_pr']['usos'], 3)
+        # Mesma chave de acesso: cada formato de código de barras é gerado uma vez
+        self.assertEqual(estatisticas['codigos_barras']['reaproveitados'], estatisticas['codigos_barras']['gerados'] * 2)
+        self.assertGreater(estatisticas['economia_ms'], 0)
+    
+    def test_preload_only_in_rendering_processes(self):
+        """Test app startup loads nothing while the issuance worker preloads when configured"""
+        from django.apps import apps
+        
+        with mock.patch.object(danfe_recursos, 'precarregar') as precarregar:
+            apps.get_app_config('invoices').ready()
+            precarregar.assert_not_called()
+            
+            call_command('processar_fila_nfe', once=True, stdout=io.StringIO())
+            self.assertEqual(precarregar.call_count, 1)
+            with override_settings(NFE_DANFE_PRECARREGAR=False):
+                call_command('processar_fila_nfe', once=True, stdout=io.StringIO())
+            self.assertEqual(precarregar.call_count, 1)
+    
+    def test_all_generators_render(self):
+        """Test every DANFE generator still produces a PDF from the shared resources"""
+        sem_itens = create_benchmark_invoice(get_benchmark_client(), 2, items=0)
+        pdfs = [
+            danfe_sefaz_pr.DANFESefazGenerator(self.invoice).generate(),
+            InvoicePDFGenerator(self.invoice).generate(),
+            DANFEParanaGenerator(self.invoice).generate(),
+            DANFEFpdfGenerator(sem_itens).generate(),
+        ]
+        for pdf in pdfs:
+            self.assertTrue(bytes(pdf).startswith(b'%PDF'))
+        self.assertEqual(danfe_recursos.fonte_fpdf('Arial'), 'helvetica')
+
+
+class Code128TestCase(TestCase):
+    """Testes para o Code128-C vetorial da chave de acesso"""
+    
+    CHAVE = '41251178393592000146558900034818141671768595'
+    
+    def setUp(self):
+        danfe_recursos.limpar()
+        self.addCleanup(danfe_recursos.limpar)
+    
+    def test_encoding(self):
+        """Test symbols, check digit, bar widths and invalid input"""
+        self.assertEqual(code128.codificar('00'), [105, 0, 2, 106])
+        barras, total = code128.padrao('00')
+        # Início C (211232), 00 (212222), verificador 2 (222221), parada (2331112)
+        self.assertEqual(barras[:3], ((10, 2), (13, 1), (16, 3)))
+        self.assertEqual(total, 10 + 11 * 3 + 13 + 10)
+        
+        barras, total = code128.padrao(self.CHAVE)
+        self.assertEqual((len(barras), total), (3 * 24 + 4, 297))
+        self.assertIs(code128.padrao(self.CHAVE)[0], barras)
+        for invalida in ('', '123', '12a4'):
+            with self.assertRaises(ValueError):
+                code128.codificar(invalida)
+    
+    def test_vector_bars_in_pdfs(self):
+        """Test the fpdf and reportlab DANFEs draw the bars as rectangles, without images"""
+        invoice = create_benchmark_invoice(get_benchmark_client(), 1, items=1)
+        invoice.access_key = self.CHAVE
+        barras, _ = code128.padrao(self.CHAVE)
+        
+        gerador = danfe_sefaz_pr.DANFESefazGenerator(invoice)
+        gerador.pdf.set_compression(False)
+        pdf = gerador.generate()
+        self.assertNotIn(b'/Subtype /Image', pdf)
+        self.assertIn(b'q 0 g ', pdf)
+        self.assertEqual(pdf.split(b'q 0 g ')[1].split(b' f Q')[0].count(b' re'), len(barras))
+        
+        drawing = danfe_recursos.codigo_barras_reportlab(self.CHAVE, 180, 15, 12, 0.28)
+        self.assertEqual(len(drawing.contents), len(barras))
+        self.assertNotIn(b'/Subtype /Image', InvoicePDFGenerator(invoice).generate())
+
+
+class DANFEBundleTestCase(ArquivosTemporariosMixin, TestCase):
+    """Testes para o pacote de DANFEs e XMLs em streaming"""
+    
+    def setUp(self):
+        super().setUp()
+        self.client_obj = get_benchmark_client()
+        self.invoices = [create_benchmark_invoice(self.client_obj, i, items=1) for i in range(1, 4)]
+        # Uma nota no layout padrão (reportlab) para misturar geradores
+        Invoice.objects.filter(pk=self.invoices[2].pk).update(issuer_state='SP')
+        for invoice in self.invoices:
+            invoice.xml_file.save(pacote_danfe.nome_xml(invoice), ContentFile(f'<NFe><nNF>{invoice.number}</nNF></NFe>'.encode()))
+        danfe_cache.gravar_danfe(Invoice.objects.get(pk=self.invoices[0].pk))
+        
+        renderizar = mock.patch.object(danfe_cache, '_renderizar', wraps=danfe_cache._renderizar)
+        self.renderizar = renderizar.start()
+        self.addCleanup(renderizar.stop)
+        
+        self.api = APIClient()
+        self.api.force_authenticate(get_user_model().objects.create_user(
+            username='pacote', email='pacote@contabiliza.ia', password='pacote123'))
+        self.url = f'/api/invoices/bundle/?client_id={self.client_obj.pk}'
+    
+    def test_zip_bundle(self):
+        """Test the ZIP streams an XML + PDF pair per invoice, reusing the stored DANFE"""
+        response = self.api.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        partes = [parte for parte in response.streaming_content if parte]
+        self.assertGreaterEqual(len(partes), len(self.invoices) * 2)
+        
+        with zipfile.ZipFile(io.BytesIO(b''.join(partes))) as arquivo:
+            nomes = arquivo.namelist()
+            for invoice in self.invoices:
+                self.assertEqual(arquivo.read(pacote_danfe.nome_xml(invoice)), f'<NFe><nNF>{invoice.number}</nNF></NFe>'.encode())
+                self.assertTrue(arquivo.read(pacote_danfe.nome_pdf(invoice)).startswith(b'%PDF'))
+        self.assertEqual(len(nomes), 6)
+        self.assertEqual(self.renderizar.call_count, 2)
+    
+    def test_merged_pdf(self):
+        """Test the merged PDF holds every page of every DANFE and is built lazily"""
+        from pdfminer.high_level import extract_text
+        from pdfminer.pdfpage import PDFPage
+        
+        response = self.api.get(self.url + '&output=pdf')
+        self.assertEqual((response.status_code, response['Content-Type']), (200, 'application/pdf'))
+        conteudo = iter(response.streaming_content)
+        cabecalho = next(conteudo)
+        self.assertTrue(cabecalho.startswith(b'%PDF'))
+        self.assertEqual(self.renderizar.call_count, 0)
+        pdf = cabecalho + b''.join(conteudo)
+        
+        esperadas = sum(
+            len(list(PDFPage.get_pages(io.BytesIO(danfe_cache.obter_danfe(invoice)[0])))) for invoice in self.invoices
+        )
+        self.assertEqual(len(list(PDFPage.get_pages(io.BytesIO(pdf)))), esperadas)
+        # Cada entrada da xref aponta para o início do seu objeto
+        inicio_xref = int(pdf.rsplit(b'startxref', 1)[1].split()[0])
+        entradas = pdf[inicio_xref:].split(b'trailer')[0].splitlines()[3:]
+        for numero, entrada in enumerate(entradas, 1):
+            self.assertTrue(pdf[int(entrada[:10]):].startswith(b'%d 0 obj' % numero))
+        texto = extract_text(io.BytesIO(pdf))
+        self.assertIn('DANFE', texto)
+        self.assertIn('CHAVE DE ACESSO', texto.upper())
+    
+    def test_filters(self):
+        """Test a filter is required and unknown outputs or empty results are rejected"""
+        self.assertEqual(self.api.get('/api/invoices/bundle/').status_code, 400)
+        self.assertEqual(self.api.get(self.url + '&output=rar').status_code, 400)
+        self.assertEqual(self.api.get('/api/invoices/bundle/?status=cancelled').status_code, 404)
+
+
+class DANFEBackendRegistryTestCase(ArquivosTemporariosMixin, TestCase):
+    """Testes para o registro de backends de DANFE e o benchmark_danfe"""
+    
+    def setUp(self):
+        super().setUp()
+        self.invoice = create_benchmark_invoice(get_benchmark_client(), 1, items=3)
+    
+    def test_backend_per_layout_from_settings(self):
+        """Test layout and backend come from settings and the choice is part of the DANFE hash"""
+        self.assertEqual(danfe_backends.escolher_layout(self.invoice), 'pr')
+        self.assertEqual(danfe_backends.backend_do_layout('pr'), 'sefaz_pr')
+        self.assertEqual(danfe_backends.escolher_layout(self.invoice, 'padrao'), 'padrao')
+        digest = danfe_cache.impressao(self.invoice)
+        
+        with override_settings(NFE_DANFE_BACKEND_POR_LAYOUT={'pr': 'fpdf'}):
+            with mock.patch.object(DANFEFpdfGenerator, 'generate', autospec=True, return_value=bytearray(b'%PDF-fpdf')) as generate:
+                pdf, novo = danfe_cache.obter_danfe(self.invoice)
+            self.assertEqual((pdf, generate.call_count), (b'%PDF-fpdf', 1))
+            self.assertNotEqual(novo, digest)
+        
+        with override_settings(NFE_DANFE_LAYOUT_POR_UF={}):
+            self.assertEqual(danfe_backends.escolher_layout(self.invoice), 'padrao')
+    
+    def test_registry(self):
+        """Test built-in backends load and unknown names are rejected"""
+        self.assertTrue({'sefaz_pr', 'parana', 'reportlab', 'fpdf'} <= set(danfe_backends.disponiveis()))
+        self.assertIs(danfe_backends.carregar('reportlab'), InvoicePDFGenerator)
+        with self.assertRaises(KeyError):
+            danfe_backends.carregar('inexistente')
+        with override_settings(NFE_DANFE_BACKENDS={'inexistente': 'invoices.services.nao_existe.Gerador'}):
+            self.assertNotIn('inexistente', danfe_backends.disponiveis())
+    
+    def test_benchmark_command(self):
+        """Test the benchmark renders the corpus through each backend and reports size and memory"""
+        self.invoice.delete()  # o corpus do comando usa a mesma numeração
+        saida = io.StringIO()
+        call_command('benchmark_danfe', items=[1, 10], iterations=1, backends=['fpdf', 'reportlab'], stdout=saida)
+        linhas = [linha.split() for linha in saida.getvalue().splitlines()[1:] if linha.split()[0] in ('fpdf', 'reportlab')]
+        self.assertEqual([(linha[0], linha[1]) for linha in linhas], [('fpdf', '1'), ('fpdf', '10'), ('reportlab', '1'), ('reportlab', '10')])
+        for linha in linhas:
+            self.assertGreater(int(linha[4]), 0)
+            self.assertTrue(linha[3].endswith('KB'))
+
+
+class PaginatedItemsTableTestCase(TestCase):
+    """Testes para a tabela de itens paginada dos DANFEs em reportlab"""
+    
+    def test_split_covers_rows_once(self):
+        """Test each page chunk takes the next rows that fit and never repeats or drops one"""
+        tabela = TabelaItens(['A', 'B\nC'], [(str(i), 'x ' * (i % 7)) for i in range(500)], [40, 30])
+        pedacos = []
+        while True:
+            partes = tabela.split(400, 300)
+            self.assertTrue(partes)
+            pedacos.append(partes[0])
+            if len(partes) == 1:
+                break
+            tabela = partes[1]
+        
+        self.assertEqual([p.inicio for p in pedacos[1:]], [p.fim for p in pedacos[:-1]])
+        self.assertEqual((pedacos[0].inicio, pedacos[-1].fim), (0, 500))
+        for pedaco in pedacos:
+            self.assertLessEqual(pedaco.wrap(400, 300)[1], 300)
+        self.assertEqual(tabela.split(400, 5), [])
+    
+    def test_generators_paginate_items(self):
+        """Test both reportlab DANFEs list every item once, repeating header and continuation band"""
+        from pdfminer.high_level import extract_text
+        from pdfminer.pdfpage import PDFPage
+        import re
+        
+        invoice = create_benchmark_invoice(get_benchmark_client(), 1, items=150)
+        for gerador, coluna in ((DANFEParanaGenerator, 'QUANT.'), (InvoicePDFGenerator, 'vUnCom')):
+            pdf = io.BytesIO(gerador(invoice).generate())
+            paginas = len(list(PDFPage.get_pages(pdf)))
+            self.assertGreater(paginas, 1)
+            
+            lotes = []
+            for numero in range(paginas):
+                texto = extract_text(pdf, page_numbers=[numero])
+                lotes += [int(lote) for lote in re.findall(r'LOTE (\d+)', texto)]
+                if numero and re.search(r'LOTE \d+', texto):
+                    self.assertIn('(CONTINUAÇÃO)', texto)
+                    self.assertIn(f'FOLHA {numero + 1}', texto)
+                    self.assertIn(coluna, texto)
+            self.assertEqual(lotes, list(range(1, 151)))
+
+
+@override_settings(NFE_NFCE_CSC='0123456789ABCDEF0123456789ABCDEF', NFE_NFCE_CSC_ID='000001')
+class NFCeReceiptTestCase(ArquivosTemporariosMixin, TestCase):
+    """Testes para o DANFE NFC-e (cupom de 80 mm) e o codificador de QR Code"""
+    
+    def setUp(self):
+        super().setUp()
+        self.invoice = create_benchmark_invoice(get_benchmark_client(), 1, items=3)
+        self.invoice.model_code = '65'
+        self.invoice.access_key = access_key.gerar_chave(self.invoice, cnf='12345678')
+        self.invoice.save()
+    
+    def test_qr_matches_reference_encoder(self):
+        """Test the cached encoder produces the same matrix as reportlab's encoder for every version and mask"""
+        from reportlab.graphics.barcode import qrencoder
+        
+        for versao in (1, 2, 7, 10, 14, 27, 40):
+            dados = bytes((versao * 37 + i) % 256 for i in range(qr_code._capacidade(versao) - 3))
+            for mascara in range(8) if versao <= 10 else (versao % 8,):
+                referencia = qrencoder.QRCode(versao, qrencoder.QRErrorCorrectLevel.M)
+                referencia.dataList.append(qrencoder.QR8bitByte(dados))
+                referencia.makeImpl(False, mascara)
+                
+                linhas, usada = qr_code.codificar(dados, mascara=mascara)
+                self.assertEqual(usada, versao)
+                self.assertEqual([list(linha) for linha in linhas], [[int(m) for m in linha] for linha in referencia.modules])
+        
+        with self.assertRaises(ValueError):
+            qr_code.escolher_versao(qr_code._capacidade(40))
+    
+    def test_qr_mask_has_lowest_penalty(self):
+        """Test the encoder picks the mask with the lowest ISO 18004 penalty"""
+        # All light 11x11: N1 22 lines x 9, N2 100 blocks x 3, N4 50% off x 10
+        self.assertEqual(qr_code.penalidade(tuple(bytes(11) for _ in range(11))), 22 * 9 + 300 + 100)
+        
+        conteudo = danfe_nfce.conteudo_qrcode(self.invoice, self.invoice.access_key)
+        candidatas = [qr_code.codificar(conteudo, mascara=mascara)[0] for mascara in range(8)]
+        penalidades = [qr_code.penalidade(linhas) for linhas in candidatas]
+        self.assertEqual(qr_code.codificar(conteudo)[0], candidatas[penalidades.index(min(penalidades))])
+    
+    def test_qr_content(self):
+        """Test the consultation URL carries key, version, environment, token id and the CSC hash"""
+        import hashlib
+        
+        chave = self.invoice.access_key
+        conteudo = danfe_nfce.conteudo_qrcode(self.invoice, chave)
+        parametros = f'{chave}|2|2|1'
+        esperado = hashlib.sha1((parametros + '0123456789ABCDEF0123456789ABCDEF').encode()).hexdigest().upper()
+        self.assertEqual(conteudo, f'http://www.fazenda.pr.gov.br/nfce/qrcode?p={parametros}|{esperado}')
+        
+        with override_settings(NFE_NFCE_CSC=''), self.assertRaises(ValueError):
+            danfe_nfce.conteudo_qrcode(self.invoice, chave)
+        self.invoice.issuer_state = 'SP'
+        with self.assertRaises(ValueError):
+            danfe_nfce.conteudo_qrcode(self.invoice, chave)
+    
+    def test_model_65_uses_receipt_layout(self):
+        """Test NFC-e invoices render the 80 mm receipt with items, key, consultation URL and QR code"""
+        from pdfminer.high_level import extract_pages, extract_text
+        from pdfminer.layout import LTRect
+        
+        self.assertEqual(danfe_backends.escolher_layout(self.invoice), 'nfce')
+        self.assertEqual(danfe_backends.escolher_layout(self.invoice, 'padrao'), 'padrao')
+        pdf, _ = danfe_cache.obter_danfe(self.invoice)
+        
+        pagina = next(extract_pages(io.BytesIO(pdf)))
+        self.assertAlmostEqual(pagina.width, 80 * 72 / 25.4, places=1)
+        self.assertTrue(any(isinstance(objeto, LTRect) for objeto in pagina))
+        texto = extract_text(io.BytesIO(pdf))
+        chave = self.invoice.access_key
+        self.assertIn(' '.join(chave[i:i + 4] for i in range(0, 24, 4)), texto)
+        self.assertIn('http://www.fazenda.pr.gov.br/nfce/consulta', texto)
+        self.assertIn('SEM VALOR FISCAL', texto)
+        self.assertEqual(texto.count('SOJA EM GRAO'), 3)
+        self.assertIn('QTD. TOTAL DE ITENS', texto)
+    
+    def test_qr_drawing_is_cached(self):
+        """Test the QR drawing is reused across receipts of the same invoice"""
+        danfe_recursos.codigos_barras.limpar()
+        self.addCleanup(danfe_recursos.codigos_barras.limpar)
+        danfe_nfce.DANFENFCeGenerator(self.invoice).generate()
+        danfe_nfce.DANFENFCeGenerator(self.invoice).generate()
+        self.assertEqual((danfe_recursos.codigos_barras.gerados, danfe_recursos.codigos_barras.reaproveitados), (1, 1))
+
+
+@override_settings(NFE_NFCE_CSC='0123456789ABCDEF0123456789ABCDEF', NFE_NFCE_CSC_ID='000001')
+class DANFEOutputStageTestCase(ArquivosTemporariosMixin, TestCase):
+    """Testes para o estágio de saída dos PDFs (compactação e PDF/A-2b)"""
+    
+    def setUp(self):
+        import reportlab
+        
+        super().setUp()
+        # Número fora da faixa criada pelo benchmark_danfe_size
+        self.invoice = create_benchmark_invoice(get_benchmark_client(), 500, items=10)
+        # Fontes Vera do reportlab no lugar das Liberation, que podem não estar instaladas
+        self.fontes = {
+            'NFE_PDFA_DIRETORIOS_FONTES': [os.path.join(os.path.dirname(reportlab.__file__), 'fonts')],
+            'NFE_PDFA_FONTES': {
+                'Helvetica': 'Vera.ttf', 'Helvetica-Bold': 'VeraBd.ttf', 'Times-Roman': 'Vera.ttf',
+                'Courier': 'Vera.ttf', 'Courier-Bold': 'VeraBd.ttf',
+            },
+        }
+    
+    def _gerar(self, backend):
+        with mock.patch('sys.stdout', new_callable=io.StringIO):
+            return bytes(danfe_backends.carregar(backend)(self.invoice).generate())
+    
+    def _texto(self, pdf):
+        from pdfminer.high_level import extract_text
+        return extract_text(io.BytesIO(pdf))
+    
+    def test_compact_output(self):
+        """Test every layout backend gets smaller while keeping pages and text"""
+        from pdfminer.pdfpage import PDFPage
+        
+        for backend in ('sefaz_pr', 'reportlab', 'nfce'):
+            original = self._gerar(backend)
+            compacto = saida_pdf.otimizar(original)
+            self.assertLess(len(compacto), len(original), backend)
+            self.assertIn(b'/ObjStm', compacto)
+            self.assertNotIn(b'ASCII85', compacto)
+            self.assertEqual(
+                len(list(PDFPage.get_pages(io.BytesIO(compacto)))), len(list(PDFPage.get_pages(io.BytesIO(original))))
+            )
+            self.assertEqual(self._texto(compacto), self._texto(original), backend)
+    
+    def test_multi_page_output_keeps_every_stream(self):
+        """Test long notes keep every page's content, including small streams the stage cannot shrink"""
+        from pdfminer.high_level import extract_text
+        from pdfminer.pdfpage import PDFPage
+        from pdfminer.pdftypes import resolve1
+        
+        def conteudos(pdf):
+            paginas = []
+            for pagina in PDFPage.get_pages(io.BytesIO(pdf)):
+                fluxos = resolve1(pagina.attrs['Contents'])
+                paginas.append(b''.join(resolve1(fluxo).get_data() for fluxo in (fluxos if isinstance(fluxos, list) else [fluxos])))
+            return paginas
+        
+        InvoiceItem.objects.bulk_create(build_item(self.invoice, indice) for indice in range(11, 301))
+        for backend in ('parana', 'fpdf'):
+            original = self._gerar(backend)
+            compacto = saida_pdf.otimizar(original)
+            paginas = conteudos(original)
+            self.assertGreater(len(paginas), 1, backend)
+            self.assertEqual(conteudos(compacto), paginas, backend)
+        # Rodapé da última página do fpdf: stream pequeno demais para ganhar com a recompressão
+        texto = extract_text(io.BytesIO(compacto), page_numbers=[len(paginas) - 1])
+        self.assertIn('Documento gerado eletronicamente', texto)
+    
+    def test_render_follows_settings(self):
+        """Test renderizar applies the stage only when enabled and the mode is part of the DANFE hash"""
+        self.assertNotIn(b'/ObjStm', danfe_backends.renderizar(self.invoice))
+        original = danfe_cache.impressao(self.invoice)
+        with override_settings(NFE_DANFE_OTIMIZAR=True):
+            self.assertIn(b'/ObjStm', danfe_backends.renderizar(self.invoice))
+            self.assertNotEqual(danfe_cache.impressao(self.invoice), original)
+            self.assertEqual(saida_pdf.processar(b'%PDF-1.4 truncado'), b'%PDF-1.4 truncado')
+    
+    def test_compact_output_passes_second_parser(self):
+        """Test the compact PDF is also accepted by a second parser (pypdf in strict mode or qpdf --check)"""
+        import importlib.util
+        import subprocess
+        qpdf = shutil.which('qpdf')
+        if importlib.util.find_spec('pypdf') is None and qpdf is None:
+            self.skipTest('pypdf e qpdf indisponíveis')
+        
+        for backend in ('sefaz_pr', 'reportlab', 'nfce'):
+            original = self._gerar(backend)
+            compacto = saida_pdf.otimizar(original)
+            if qpdf:
+                with tempfile.NamedTemporaryFile(suffix='.pdf') as arquivo:
+                    arquivo.write(compacto)
+                    arquivo.flush()
+                    verificacao = subprocess.run([qpdf, '--check', arquivo.name], capture_output=True, text=True)
+                self.assertEqual(verificacao.returncode, 0, verificacao.stdout + verificacao.stderr)
+            if importlib.util.find_spec('pypdf') is not None:
+                from pypdf import PdfReader
+                leitor, referencia = PdfReader(io.BytesIO(compacto), strict=True), PdfReader(io.BytesIO(original))
+                self.assertEqual(len(leitor.pages), len(referencia.pages), backend)
+                for pagina, esperada in zip(leitor.pages, referencia.pages):
+                    self.assertEqual(pagina.get_contents().get_data(), esperada.get_contents().get_data(), backend)
+                    self.assertEqual(pagina.extract_text(), esperada.extract_text(), backend)
+    
+    def test_archive_mode(self):
+        """Test PDF/A mode embeds font subsets and adds XMP metadata, sRGB output intent and file ID"""
+        from pdfminer.pdfparser import PDFParser
+        from pdfminer.pdfdocument import PDFDocument
+        from pdfminer.pdfpage import PDFPage
+        from pdfminer.pdftypes import resolve1
+        
+        with override_settings(NFE_DANFE_PDFA=True, **self.fontes):
+            self.assertEqual(saida_pdf.modo(), 'pdfa')
+            pdf = danfe_backends.renderizar(self.invoice, backend='sefaz_pr')
+        self.assertTrue(pdf.startswith(b'%PDF-1.7'))
+        
+        documento = PDFDocument(PDFParser(io.BytesIO(pdf)))
+        self.assertEqual(len(resolve1(documento.xrefs[0].trailer['ID'])), 2)
+        metadados = resolve1(documento.catalog['Metadata']).get_data()
+        self.assertIn(b'<pdfaid:part>2</pdfaid:part><pdfaid:conformance>B</pdfaid:conformance>', metadados)
+        self.assertIn(b'DANFE ' + self.invoice.number.encode(), metadados)
+        intencao = resolve1(documento.catalog['OutputIntents'])[0]
+        self.assertEqual(resolve1(intencao['S']).name, 'GTS_PDFA1')
+        self.assertEqual(resolve1(intencao['DestOutputProfile']).get_data()[36:40], b'acsp')
+        
+        for pagina in PDFPage.create_pages(documento):
+            for fonte in resolve1(pagina.resources['Font']).values():
+                fonte = resolve1(fonte)
+                self.assertEqual(resolve1(fonte['Subtype']).name, 'TrueType')
+                self.assertRegex(resolve1(fonte['BaseFont']).name, r'^[A-Z]{6}\+')
+                self.assertEqual(len(fonte['Widths']), fonte['LastChar'] - fonte['FirstChar'] + 1)
+                self.assertIn('FontFile2', resolve1(fonte['FontDescriptor']))
+        # As métricas da Vera mudam o agrupamento das palavras, não os caracteres
+        original = self._texto(self._gerar('sefaz_pr'))
+        self.assertEqual(sorted(''.join(self._texto(pdf).split())), sorted(''.join(original.split())))
+        
+        with override_settings(NFE_DANFE_PDFA=True, NFE_PDFA_DIRETORIOS_FONTES=[]), self.assertRaises(ValueError):
+            danfe_backends.renderizar(self.invoice, backend='nfce')
+    
+    def test_bundle_writes_shared_objects_once(self):
+        """Test the merged PDF reuses objects already written for a previous invoice"""
+        pdf = self._gerar('reportlab')
+        escritor = pacote_danfe.PdfUnico()
+        escritor.cabecalho()
+        primeira = len(list(escritor.anexar(pdf)))
+        segunda = len(list(escritor.anexar(pdf)))
+        self.assertLess(segunda, primeira)
+        self.assertEqual(len(escritor.paginas), 2)
+        
+        antes = dict(escritor._unicos)
+        with self.assertRaises(Exception):
+            list(escritor.anexar(b'%PDF-1.4 truncado'))
+        self.assertEqual(escritor._unicos, antes)
+    
+    def test_size_benchmark_command(self):
+        """Test the size benchmark reports bytes per note before and after the stage"""
+        saida = io.StringIO()
+        call_command('benchmark_danfe_size', invoices=3, backends=['sefaz_pr'], stdout=saida)
+        self.assertIn('Average reduction across backends', saida.getvalue())
+        self.assertFalse(Invoice.objects.filter(number=str(900000000 + 3)).exists())
@@ -2,18 +2,26 @@ from rest_framework import viewsets, status
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
-from django.http import FileResponse
+from django.http import FileResponse, StreamingHttpResponse
 from django.db.models import Q, Sum, Count
-from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.conf import settings
 from datetime import datetime, timedelta
-from .models import Invoice, InvoiceItem
+from .models import Invoice, InvoiceItem, IssuanceJob
+from clients.models import Client
 from .serializers import InvoiceSerializer, InvoiceListSerializer, InvoiceCreateSerializer, InvoiceItemSerializer
 from .services.xml_generator import NFeGenerator
-from .services.pdf_generator import InvoicePDFGenerator
-from .services.danfe_sefaz_pr import DANFESefazGenerator
-from .services.nfe_xml_generator import NFeXMLGenerator
-from .services.sefaz_integration import SefazIntegration
+from .services.danfe_cache import obter_danfe, gravar_danfe
 from .services.backup_service import backup_invoice_files
+from .services.fila_emissao import enfileirar
+from .services.batch_issuance import get_max_batch_size
+from .services.access_key import validar_chaves, conciliar_chaves
+from .services.sefaz_lote import autorizar_pendentes
+from .services.importacao_nfe import importar_nfes
+from .services.eventos_nfe import cancelar_notas, corrigir_notas, TIPO_CANCELAMENTO, TIPO_CARTA_CORRECAO
+from .services import idempotencia
+from .services.pacote_danfe import pdf_unico, zip_notas
+import io
 import os
 
 
@@ -58,69 +66,176 @@ class InvoiceViewSet(viewsets.ModelViewSet):
                 Q(access_key__icontains=search)
             )
         
-        return queryset.select_related('client', 'created_by').prefetch_related('items')
+        return queryset.select_related('client', 'created_by').prefetch_related('items', 'events')
     
     def perform_create(self, serializer):
         serializer.save(created_by=self.request.user)
     
     @action(detail=True, methods=['post'])
     def generate_nfe_complete(self, request, pk=None):
-        """Generate XML and PDF of NF-e in SEFAZ standard and save to storage"""
+        """
+        Queue generation of XML and PDF of NF-e in SEFAZ standard
+        
+        The pipeline runs in the issuance workers (processar_fila_nfe); the
+        request only enqueues and returns the job id (202). Send
+        {"authorize": true} to also send the note to SEFAZ at the end.
+        """
         invoice = self.get_object()
         
         try:
-            xml_generator = NFeXMLGenerator(invoice)
-            xml_content = xml_generator.generate()
-            chave_acesso = xml_generator._generate_chave_acesso()
-            
-            xml_filename = f"{chave_acesso}-nfe.xml"
-            xml_path = f"invoices/xml/{datetime.now().year}/{datetime.now().month:02d}/{xml_filename}"
-            invoice.xml_file.save(xml_filename, ContentFile(xml_content.encode('utf-8')), save=False)
-            
-            invoice.access_key = chave_acesso
-            
-            sefaz = SefazIntegration(uf=invoice.issuer_state or 'PR', ambiente='homologacao')
-            validacao = sefaz.validar_xml_nfe(xml_content)
-            
-            if not validacao['valido']:
-                return Response({
-                    'error': 'Invalid XML',
-                    'erros': validacao['erros']
-                }, status=status.HTTP_400_BAD_REQUEST)
-            
-            if invoice.issuer_state == 'PR':
-                pdf_generator = DANFESefazGenerator(invoice)
-            else:
-                pdf_generator = InvoicePDFGenerator(invoice)
-            
-            pdf_content = pdf_generator.generate()
-            
-            pdf_filename = f"{chave_acesso}-danfe.pdf"
-            pdf_path = f"invoices/pdf/{datetime.now().year}/{datetime.now().month:02d}/{pdf_filename}"
-            invoice.pdf_file.save(pdf_filename, ContentFile(pdf_content), save=False)
-            
-            invoice.status = 'pending'
-            invoice.save()
-            
-            backup_invoice_files(invoice)
-            
+            job = enfileirar(invoice, autorizar=bool(request.data.get('authorize')), usuario=request.user)
+        except Exception as e:
             return Response({
-                'message': 'NF-e generated successfully',
-                'chave_acesso': chave_acesso,
-                'xml_file': request.build_absolute_uri(invoice.xml_file.url) if invoice.xml_file else None,
-                'pdf_file': request.build_absolute_uri(invoice.pdf_file.url) if invoice.pdf_file else None,
-                'validacao': validacao,
-                'status': invoice.status
-            })
-            
+                'error': f'Error queuing NF-e: {str(e)}'
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        
+        return Response(self._job_data(request, job), status=status.HTTP_202_ACCEPTED)
+    
+    @action(detail=False, methods=['get'], url_path=r'jobs/(?P<job_id>[0-9]+)')
+    def issuance_job(self, request, job_id=None):
+        """Status of a queued NF-e issuance"""
+        job = IssuanceJob.objects.filter(pk=job_id, invoice__in=self.get_queryset()).select_related('invoice').first()
+        if job is None:
+            return Response({'error': 'Job not found'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(self._job_data(request, job))
+    
+    def _job_data(self, request, job):
+        invoice = job.invoice
+        return {
+            'job_id': job.pk,
+            'invoice_id': invoice.pk,
+            'status': job.status,
+            'stage': job.stage,
+            'attempts': job.attempts,
+            'authorize': job.authorize,
+            'last_error': job.last_error.splitlines()[0] if job.last_error else None,
+            'result': job.result,
+            'xml_file': request.build_absolute_uri(invoice.xml_file.url) if job.status == 'done' and invoice.xml_file else None,
+            'pdf_file': request.build_absolute_uri(invoice.pdf_file.url) if job.status == 'done' and invoice.pdf_file else None,
+            'job_url': request.build_absolute_uri(f'/api/invoices/jobs/{job.pk}/'),
+        }
+    
+    @action(detail=False, methods=['post'])
+    def generate_nfe_batch(self, request):
+        """
+        Queue XML, DANFE and backup generation for several invoices
+        
+        Each invoice becomes an issuance job run by the workers
+        (processar_fila_nfe); the request only enqueues and returns the jobs
+        (202). Send {"authorize": true} to also send the notes to SEFAZ.
+        """
+        invoice_ids = request.data.get('invoice_ids') or []
+        
+        if not isinstance(invoice_ids, list) or not invoice_ids:
+            return Response({
+                'error': 'Provide a non-empty list in invoice_ids'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            invoice_ids = list(dict.fromkeys(int(invoice_id) for invoice_id in invoice_ids))
+        except (TypeError, ValueError):
+            return Response({
+                'error': 'invoice_ids must be integers'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        if len(invoice_ids) > get_max_batch_size():
+            return Response({
+                'error': f'Batch size limit is {get_max_batch_size()} invoices'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        invoices = self.get_queryset().in_bulk(invoice_ids)
+        faltando = [invoice_id for invoice_id in invoice_ids if invoice_id not in invoices]
+        if faltando:
+            return Response({
+                'error': f'Invoices not found: {faltando}'
+            }, status=status.HTTP_404_NOT_FOUND)
+        
+        autorizar = bool(request.data.get('authorize'))
+        try:
+            jobs = [enfileirar(invoices[invoice_id], autorizar=autorizar, usuario=request.user) for invoice_id in invoice_ids]
+        except Exception as e:
+            return Response({
+                'error': f'Error queuing NF-e batch: {str(e)}'
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        
+        return Response({
+            'total': len(jobs),
+            'jobs': [self._job_data(request, job) for job in jobs],
+        }, status=status.HTTP_202_ACCEPTED)
+    
+    @action(detail=False, methods=['post'], url_path='validate-keys')
+    def validate_keys(self, request):
+        """Validate many access keys at once (format, UF, month, model and check digit)"""
+        keys = request.data.get('keys')
+        
+        if not isinstance(keys, list) or not keys:
+            return Response({
+                'error': 'Provide a non-empty list in keys'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        max_keys = int(getattr(settings, 'NFE_VALIDATE_KEYS_MAX', 50000))
+        if len(keys) > max_keys:
+            return Response({
+                'error': f'Key limit is {max_keys} per request'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        resultados = validar_chaves(keys)
+        if request.data.get('reconcile'):
+            conciliar_chaves(resultados, Invoice.objects.all())
+        
+        validas = sum(1 for r in resultados if r['valida'])
+        return Response({
+            'total': len(resultados),
+            'validas': validas,
+            'invalidas': len(resultados) - validas,
+            'resultados': resultados
+        })
+    
+    @action(detail=False, methods=['post'], url_path='import-xml')
+    def import_xml(self, request):
+        """
+        Import received supplier NF-e XMLs (nfeProc)
+        
+        Send one or more "files" (XML or ZIP of XMLs) as multipart. Invoices
+        are linked to the client whose CPF/CNPJ is the receiver, or to
+        "client_id" when given; access keys already imported are skipped.
+        """
+        arquivos = request.FILES.getlist('files') or request.FILES.getlist('file')
+        if not arquivos:
+            return Response({
+                'error': 'Send the XML or ZIP files in files'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        cliente = None
+        if request.data.get('client_id'):
+            cliente = Client.objects.filter(pk=request.data.get('client_id')).first()
+            if cliente is None:
+                return Response({'error': 'Client not found'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            resultado = importar_nfes(arquivos, cliente=cliente, usuario=request.user)
         except Exception as e:
             return Response({
-                'error': f'Error generating NF-e: {str(e)}'
+                'error': f'Error importing NF-e XMLs: {str(e)}'
             }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        
+        return Response(resultado)
     
     @action(detail=True, methods=['post'])
     def authorize_sefaz(self, request, pk=None):
-        """Send NF-e for authorization in SEFAZ"""
+        """
+        Send NF-e for authorization in SEFAZ
+        
+        The lot is sent in asynchronous mode and the request returns as soon
+        as SEFAZ issues the receipt (202); the receipt scheduler
+        (consultar_recibos_nfe) applies the protocol when the lot is processed.
+        
+        Requests are idempotent per Idempotency-Key header (default: the
+        access key): once SEFAZ authorizes, denies or rejects the NF-e,
+        retries get the stored response without a new SEFAZ call, and
+        concurrent duplicates get 409 while the first one runs. Retries while
+        the receipt is being processed get the receipt again (202).
+        """
         invoice = self.get_object()
         
         if not invoice.xml_file:
@@ -128,53 +243,90 @@ class InvoiceViewSet(viewsets.ModelViewSet):
                 'error': 'XML not generated. Use generate_nfe_complete first'
             }, status=status.HTTP_400_BAD_REQUEST)
         
+        with invoice.xml_file.open('rb') as xml_file:
+            digest = idempotencia.impressao(xml_file.read())
+        chave = request.headers.get('Idempotency-Key') or invoice.access_key or f'invoice-{invoice.pk}'
+        situacao, registro = idempotencia.iniciar('authorize_sefaz', chave, digest, invoice)
+        
+        if situacao == idempotencia.REPETIDA:
+            response = Response(registro.response_body, status=registro.response_status)
+            response['Idempotent-Replayed'] = 'true'
+            return response
+        if situacao == idempotencia.EM_ANDAMENTO:
+            return Response({
+                'error': 'Authorization of this NF-e is already in progress',
+                'idempotency_key': chave
+            }, status=status.HTTP_409_CONFLICT)
+        if situacao == idempotencia.CONFLITO:
+            return Response({
+                'error': 'Idempotency-Key already used for another invoice'
+            }, status=status.HTTP_422_UNPROCESSABLE_ENTITY)
+        
+        try:
+            response, final = self._authorize(invoice)
+        except BaseException:
+            idempotencia.liberar(registro)
+            raise
+        
+        # Only SEFAZ's final answer is replayed; anything else runs again next time
+        if final:
+            idempotencia.concluir(registro, response.status_code, response.data)
+        else:
+            idempotencia.liberar(registro)
+        return response
+    
+    def _authorize(self, invoice):
+        """Returns (response, final), final being True for SEFAZ's authorization, denial or rejection"""
         if invoice.status not in ['pending', 'draft']:
             return Response({
                 'error': f'Invoice with status {invoice.status} cannot be authorized'
-            }, status=status.HTTP_400_BAD_REQUEST)
+            }, status=status.HTTP_400_BAD_REQUEST), False
+        
+        if invoice.receipt_id and invoice.receipt.status == 'waiting':
+            return self._receipt_waiting(invoice, invoice.receipt.last_code, invoice.receipt.last_message), False
         
         try:
-            invoice.xml_file.open('r')
-            xml_content = invoice.xml_file.read()
-            if isinstance(xml_content, bytes):
-                xml_content = xml_content.decode('utf-8')
-            invoice.xml_file.close()
-            
-            ambiente = invoice.environment or '2'
-            sefaz = SefazIntegration(
-                uf=invoice.issuer_state or 'PR',
-                ambiente='homologacao' if ambiente == '2' else 'producao'
-            )
-            
-            resultado = sefaz.autorizar_nfe(xml_content)
-            
-            if resultado['sucesso']:
-                invoice.status = 'authorized'
-                invoice.protocol = resultado.get('protocolo')
-                invoice.authorization_date = datetime.now()
-                invoice.save()
-                
-                return Response({
-                    'message': 'NF-e authorized successfully',
-                    'codigo': resultado.get('codigo'),
-                    'protocolo': resultado.get('protocolo'),
-                    'chave_acesso': resultado.get('chave_acesso'),
-                    'observacao': resultado.get('observacao')
-                })
-            else:
-                invoice.status = 'denied'
-                invoice.save()
-                
-                return Response({
-                    'error': 'Authorization denied by SEFAZ',
-                    'codigo': resultado.get('codigo'),
-                    'mensagem': resultado.get('mensagem')
-                }, status=status.HTTP_400_BAD_REQUEST)
-                
+            resultado = autorizar_pendentes(Invoice.objects.filter(pk=invoice.pk), aguardar=False)['resultados'][0]
         except Exception as e:
             return Response({
                 'error': f'Error authorizing NF-e: {str(e)}'
-            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR), False
+        
+        invoice.refresh_from_db()
+        
+        if invoice.receipt_id and invoice.receipt.status == 'waiting':
+            return self._receipt_waiting(invoice, resultado['codigo'], resultado['mensagem']), False
+        
+        if invoice.status == 'authorized':
+            return Response({
+                'message': 'NF-e authorized successfully',
+                'codigo': resultado['codigo'],
+                'protocolo': invoice.protocol,
+                'chave_acesso': invoice.access_key
+            }), True
+        
+        if resultado['respondida']:
+            return Response({
+                'error': 'Authorization denied by SEFAZ' if invoice.status == 'denied' else 'NF-e rejected by SEFAZ',
+                'codigo': resultado['codigo'],
+                'mensagem': resultado['mensagem']
+            }, status=status.HTTP_400_BAD_REQUEST), True
+        
+        # Lot refused or not delivered (no protNFe for the note): the next attempt sends it again
+        return Response({
+            'error': 'NF-e not processed by SEFAZ; try again',
+            'codigo': resultado['codigo'],
+            'mensagem': resultado['mensagem']
+        }, status=status.HTTP_400_BAD_REQUEST), False
+    
+    def _receipt_waiting(self, invoice, codigo, mensagem):
+        return Response({
+            'message': 'NF-e sent to SEFAZ; the authorization will be applied when the receipt is processed',
+            'recibo': invoice.receipt.number,
+            'codigo': codigo,
+            'mensagem': mensagem,
+            'chave_acesso': invoice.access_key
+        }, status=status.HTTP_202_ACCEPTED)
     
     @action(detail=True, methods=['post'])
     def generate_xml(self, request, pk=None):
@@ -203,16 +355,18 @@ class InvoiceViewSet(viewsets.ModelViewSet):
     
     @action(detail=True, methods=['post'])
     def generate_pdf(self, request, pk=None):
-        """Generate DANFE PDF"""
+        """
+        Generate DANFE PDF
+        
+        The PDF is only rendered again when something shown on the DANFE
+        changed; otherwise the stored file is kept.
+        """
         invoice = self.get_object()
         
         try:
-            if invoice.issuer_state == 'PR' or request.query_params.get('layout') == 'pr':
-                generator = DANFESefazGenerator(invoice)
-            else:
-                generator = InvoicePDFGenerator(invoice)
-            
-            generator.generate_pdf()
+            gravar_danfe(
+                invoice, f"DANFE_{invoice.number}_{invoice.series}.pdf", layout=request.query_params.get('layout')
+            )
             backup_invoice_files(invoice)
             return Response({
                 'message': 'PDF generated successfully',
@@ -243,21 +397,66 @@ class InvoiceViewSet(viewsets.ModelViewSet):
     
     @action(detail=True, methods=['get'])
     def download_pdf(self, request, pk=None):
-        """Download PDF"""
+        """
+        Download PDF
+        
+        The DANFE is rendered on first access and served from the render
+        cache afterwards, until the invoice or its items change.
+        """
         invoice = self.get_object()
         
-        if not invoice.pdf_file:
+        try:
+            pdf, _ = obter_danfe(invoice, request.query_params.get('layout'))
+        except Exception as e:
             return Response(
-                {'error': 'PDF not generated. Use generate_pdf action first'},
-                status=status.HTTP_404_NOT_FOUND
+                {'error': f'Error generating PDF: {str(e)}'},
+                status=status.HTTP_500_INTERNAL_SERVER_ERROR
             )
         
         return FileResponse(
-            invoice.pdf_file.open('rb'),
+            io.BytesIO(pdf),
             as_attachment=True,
-            filename=f"DANFE_{invoice.number}_{invoice.series}.pdf"
+            filename=f"DANFE_{invoice.number}_{invoice.series}.pdf",
+            content_type='application/pdf'
         )
     
+    @action(detail=False, methods=['get'])
+    def bundle(self, request):
+        """
+        Stream the DANFEs (and XMLs) of every invoice matching a filter
+        
+        Filter with client_id, start_date, end_date and/or status; output=pdf
+        returns one merged PDF, output=zip (default) a ZIP with the XML and PDF
+        of each invoice. Stored and cached files are reused, and each file is
+        written to the response as soon as it is ready.
+        """
+        params = request.query_params
+        if not any(params.get(campo) for campo in ('client_id', 'start_date', 'end_date', 'status')):
+            return Response({
+                'error': 'Provide at least one filter: client_id, start_date, end_date or status'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        output = params.get('output', 'zip')
+        if output not in ('pdf', 'zip'):
+            return Response({
+                'error': 'output must be pdf or zip'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        invoices = self.get_queryset().prefetch_related(None).order_by('issue_date', 'pk')
+        if not invoices.exists():
+            return Response({
+                'error': 'No invoices match the filter'
+            }, status=status.HTTP_404_NOT_FOUND)
+        
+        if output == 'pdf':
+            response = StreamingHttpResponse(pdf_unico(invoices), content_type='application/pdf')
+            filename = 'DANFE_bundle.pdf'
+        else:
+            response = StreamingHttpResponse(zip_notas(invoices), content_type='application/zip')
+            filename = 'NFe_bundle.zip'
+        response['Content-Disposition'] = f'attachment; filename="{filename}"'
+        return response
+    
     @action(detail=True, methods=['patch'])
     def change_status(self, request, pk=None):
         """Change invoice status"""
@@ -284,7 +483,12 @@ class InvoiceViewSet(viewsets.ModelViewSet):
     
     @action(detail=True, methods=['post'])
     def cancel(self, request, pk=None):
-        """Cancel invoice"""
+        """
+        Cancel invoice in SEFAZ (event 110111)
+        
+        Send {"justification": "..."} with 15 to 255 characters
+        ("motivo" and "reason" are accepted for older clients).
+        """
         invoice = self.get_object()
         
         if invoice.status == 'cancelled':
@@ -299,10 +503,90 @@ class InvoiceViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        invoice.status = 'cancelled'
-        invoice.save()
+        try:
+            justificativa = next(
+                (request.data.get(campo) for campo in ('justification', 'motivo', 'reason') if request.data.get(campo)), ''
+            )
+            resultado = cancelar_notas([invoice], justificativa, usuario=request.user)
+        except Exception as e:
+            return Response({
+                'error': f'Error cancelling NF-e: {str(e)}'
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
+        
+        evento = resultado['resultados'][0]
+        if evento['status'] != 'registered':
+            return Response({
+                'error': evento['mensagem'],
+                'codigo': evento['codigo']
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        return Response({
+            'message': 'Invoice successfully cancelled',
+            'codigo': evento['codigo'],
+            'protocolo': evento['protocolo']
+        })
+    
+    @action(detail=False, methods=['post'], url_path='bulk-cancel')
+    def bulk_cancel(self, request):
+        """
+        Cancel many authorized invoices with one SEFAZ call per lot of 20 events
+        
+        Send {"invoice_ids": [...], "justification": "..."}.
+        """
+        return self._bulk_events(request, TIPO_CANCELAMENTO, 'justification')
+    
+    @action(detail=False, methods=['post'], url_path='bulk-correction')
+    def bulk_correction(self, request):
+        """
+        Send the same correction letter (CC-e, event 110110) to many invoices
+        
+        Send {"invoice_ids": [...], "correction": "..."}.
+        """
+        return self._bulk_events(request, TIPO_CARTA_CORRECAO, 'correction')
+    
+    def _bulk_events(self, request, tipo, campo_texto):
+        invoice_ids = request.data.get('invoice_ids') or []
+        
+        if not isinstance(invoice_ids, list) or not invoice_ids:
+            return Response({
+                'error': 'Provide a non-empty list in invoice_ids'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        try:
+            invoice_ids = [int(invoice_id) for invoice_id in invoice_ids]
+        except (TypeError, ValueError):
+            return Response({
+                'error': 'invoice_ids must be integers'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        if len(invoice_ids) > get_max_batch_size():
+            return Response({
+                'error': f'Batch size limit is {get_max_batch_size()} invoices'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        texto = request.data.get(campo_texto)
+        if not isinstance(texto, str) or not texto.strip():
+            return Response({
+                'error': f'Provide the {campo_texto} text'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        
+        invoices = list(Invoice.objects.filter(pk__in=invoice_ids).order_by('pk'))
+        encontradas = {invoice.pk for invoice in invoices}
+        faltando = [invoice_id for invoice_id in invoice_ids if invoice_id not in encontradas]
+        if faltando:
+            return Response({
+                'error': f'Invoices not found: {faltando}'
+            }, status=status.HTTP_404_NOT_FOUND)
+        
+        enviar = cancelar_notas if tipo == TIPO_CANCELAMENTO else corrigir_notas
+        try:
+            resultado = enviar(invoices, texto.strip(), usuario=request.user)
+        except Exception as e:
+            return Response({
+                'error': f'Error sending NF-e events: {str(e)}'
+            }, status=status.HTTP_500_INTERNAL_SERVER_ERROR)
         
-        return Response({'message': 'Invoice successfully cancelled'})
+        return Response(resultado)
     
     @action(detail=False, methods=['get'])
     def statistics(self, request):
@@ -272,7 +272,7 @@ class ApiService {
     // DRF action cancel (POST)
     return this.request(`${CONFIG.ENDPOINTS.NOTAS_FISCAIS}/${id}/cancel/`, {
       method: 'POST',
-      body: { motivo: motivo || 'Cancelamento solicitado' }
+      body: { justification: motivo || 'Cancelamento solicitado pelo emitente' }
     });
   }
 
@@ -157,7 +157,7 @@ class API {
   async cancelInvoice(id, reason) {
     return this.request(`${CONFIG.ENDPOINTS.NOTAS_FISCAIS}/${id}/cancel/`, {
       method: 'POST',
-      body: JSON.stringify({ reason })
+      body: JSON.stringify({ justification: reason })
     });
   }
 
@@ -1,13 +1,18 @@
 import sys
+import json
 from pathlib import Path
 from pdfminer.high_level import extract_pages
-from pdfminer.layout import LTTextBoxHorizontal, LTChar, LTRect, LTLine
+from pdfminer.layout import LTTextBoxHorizontal, LTTextLineHorizontal, LTChar, LTRect, LTLine
 
 """
 Usage:
   python tools/extract_header_coords.py <path_to_reference_pdf>
+  python tools/extract_header_coords.py <path_to_reference_pdf> --spec <layout.json>
 Outputs:
   Prints header-related rectangles and text boxes with exact coordinates (points) and sizes.
+  With --spec, rewrites the DANFE coordinate spec
+  (django_backend/invoices/services/danfe_pr_layout.json): every borderless
+  'celula' label found in the reference PDF gets its measured position.
 Notes:
   - PDF coordinates are in points (1 pt = 1/72 inch). For mm, use: mm = pts * 25.4 / 72
   - This script looks for the top band and header grid elements: labels like
@@ -73,8 +78,69 @@ def main(pdf_path: Path):
         # Only first page needed
         break
 
+def measure_labels(pdf_path: Path):
+    """Text lines of the first page as {text: (x_mm, y_from_top_mm)}"""
+    labels = {}
+    for page_layout in extract_pages(str(pdf_path)):
+        page_height = page_layout.height
+
+        def walk(element):
+            if isinstance(element, LTTextLineHorizontal):
+                txt = element.get_text().strip()
+                if txt and txt not in labels:
+                    labels[txt] = (round(to_mm(element.x0), 2), round(to_mm(page_height - element.y1), 2))
+            elif hasattr(element, "__iter__"):
+                for child in element:
+                    walk(child)
+
+        walk(page_layout)
+        break
+    return labels
+
+
+def dump_spec(layout):
+    """Spec JSON with one operation / field per line"""
+    def line(value):
+        return json.dumps(value, ensure_ascii=False)
+
+    parts = []
+    for key, value in layout.items():
+        if isinstance(value, list):
+            items = ",\n".join(f"    {line(item)}" for item in value)
+            parts.append(f'  {line(key)}: [\n{items}\n  ]')
+        else:
+            parts.append(f"  {line(key)}: {line(value)}")
+    return "{\n" + ",\n".join(parts) + "\n}\n"
+
+
+def update_spec(pdf_path: Path, spec_path: Path):
+    if not pdf_path.exists():
+        print(f"File not found: {pdf_path}")
+        sys.exit(1)
+
+    layout = json.loads(spec_path.read_text(encoding="utf-8"))
+    labels = measure_labels(pdf_path)
+    updated = missing = 0
+    for op in layout["fundo"]:
+        if op["op"] != "celula" or op.get("borda", 0):
+            continue
+        if op["texto"] in labels:
+            op["xy"] = list(labels[op["texto"]])
+            updated += 1
+        else:
+            missing += 1
+            print(f"not found in reference: '{op['texto']}'")
+
+    spec_path.write_text(dump_spec(layout), encoding="utf-8")
+    print(f"=== {spec_path}: {updated} labels updated, {missing} not found ===")
+    print("Bump VERSAO_LAYOUT['pr'] in invoices/services/danfe_cache.py so cached DANFEs are re-rendered.")
+
+
 if __name__ == "__main__":
     if len(sys.argv) < 2:
-        print("Usage: python tools/extract_header_coords.py <path_to_reference_pdf>")
+        print("Usage: python tools/extract_header_coords.py <path_to_reference_pdf> [--spec <layout.json>]")
         sys.exit(1)
-    main(Path(sys.argv[1]))
+    if "--spec" in sys.argv:
+        update_spec(Path(sys.argv[1]), Path(sys.argv[sys.argv.index("--spec") + 1]))
+    else:
+        main(Path(sys.argv[1]))